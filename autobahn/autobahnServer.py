@@ -1,13 +1,17 @@
+import hashlib
+import hmac
 import json
 import logging
+import os
 import sys
-from threading import Lock, Thread
+from collections import OrderedDict
 import urllib2
 import time
 from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory, listenWS
 from twisted.web.client import Agent
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
 from twisted.python import log
+from twisted.python.threadpool import ThreadPool
 from twisted.web.server import Site
 from twisted.web.static import File
 
@@ -17,13 +21,41 @@ POLL_INTERVAL = 5
 MAX_POLL_INTERVAL = 30
 POLL_INTERVAL_STEP = 5
 MAX_ERRORS = 5
-updateLock = Lock()
+# URLs waiting for push data are fetched at most once per PUSH_INTERVAL
+# seconds, however many pushes concern them
+PUSH_INTERVAL = 1
+# the most URLs fetched at once
+MAX_POLL_THREADS = 10
+# the versions of each URL kept to patch from, and the number of versions
+# after which the clients receiving patches get the whole JSON again
+MAX_VERSIONS = 8
+SNAPSHOT_INTERVAL = 50
 
 #Server Messages
 KRT_JSON_DATA = "krtJSONData"
 KRT_URL_DROPPED = "krtURLDropped"
 KRT_REGISTER_URL = "krtRegisterURL"
 KRT_PUSH_DATA = "krtPushData"
+# with "deltas" in KRT_REGISTER_URL, clients receive KRT_JSON_DATA with a
+# "seq" number, then KRT_JSON_PATCH against the last seq they acknowledged
+# with KRT_JSON_ACK; they ask for KRT_JSON_DATA again with KRT_JSON_RESYNC
+KRT_JSON_PATCH = "krtJSONPatch"
+KRT_JSON_ACK = "krtJSONAck"
+KRT_JSON_RESYNC = "krtJSONResync"
+# the masters sharing the push secret of the relay push the JSON of their
+# URLs instead of it being fetched: a master sends KRT_SERVER_HELLO with its
+# URL, answers the KRT_AUTH_CHALLENGE nonce with KRT_AUTH_RESPONSE (see
+# pushAuthResponse), then receives KRT_SUBSCRIBE_RESOURCES and
+# KRT_UNSUBSCRIBE_RESOURCES for the URLs registered on it; it sends
+# KRT_PUSH_RESOURCES when their JSON changes, and KRT_REFUSE_RESOURCES for
+# the URLs it does not push, which are fetched
+KRT_SERVER_HELLO = "krtServerHello"
+KRT_AUTH_CHALLENGE = "krtAuthChallenge"
+KRT_AUTH_RESPONSE = "krtAuthResponse"
+KRT_SUBSCRIBE_RESOURCES = "krtSubscribeResources"
+KRT_UNSUBSCRIBE_RESOURCES = "krtUnsubscribeResources"
+KRT_PUSH_RESOURCES = "krtPushResources"
+KRT_REFUSE_RESOURCES = "krtRefuseResources"
 
 agent = Agent(reactor)
 
@@ -39,6 +71,237 @@ def dict_compare(d1, d2):
     return added, removed, modified, same
 
 
+def escape_pointer(key):
+    return unicode(key).replace("~", "~0").replace("/", "~1")
+
+
+def json_equal(a, b):
+    # unlike ==, tells true from 1, as the clients do
+    if type(a) != type(b):
+        return False
+    if isinstance(a, dict):
+        return len(a) == len(b) and all(k in b and json_equal(v, b[k]) for k, v in a.iteritems())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(json_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def json_diff(old, new, path=""):
+    """
+    @returns: the JSON patch (RFC 6902) operations turning old into new,
+        with add, remove and replace only
+    """
+    if type(old) != type(new):
+        return [{"op": "replace", "path": path, "value": new}]
+
+    if isinstance(old, dict):
+        ops = []
+        for key, value in old.iteritems():
+            keyPath = path + "/" + escape_pointer(key)
+            if key not in new:
+                ops.append({"op": "remove", "path": keyPath})
+            elif not json_equal(value, new[key]):
+                ops.extend(json_diff(value, new[key], keyPath))
+        for key, value in new.iteritems():
+            if key not in old:
+                ops.append({"op": "add", "path": path + "/" + escape_pointer(key),
+                            "value": value})
+        return ops
+
+    if isinstance(old, list):
+        # only diff what lies between the common beginning and end, so that
+        # the items added or removed at either end are single operations
+        common = min(len(old), len(new))
+        start = 0
+        while start < common and json_equal(old[start], new[start]):
+            start += 1
+        end = 0
+        while end < common - start and json_equal(old[-1 - end], new[-1 - end]):
+            end += 1
+        oldMiddle = old[start:len(old) - end]
+        newMiddle = new[start:len(new) - end]
+        paired = min(len(oldMiddle), len(newMiddle))
+
+        ops = []
+        for i in xrange(paired):
+            ops.extend(json_diff(oldMiddle[i], newMiddle[i],
+                                 "{0}/{1}".format(path, start + i)))
+        for i in xrange(paired, len(oldMiddle)):
+            ops.append({"op": "remove", "path": "{0}/{1}".format(path, start + paired)})
+        for i in xrange(paired, len(newMiddle)):
+            ops.append({"op": "add", "path": "{0}/{1}".format(path, start + i),
+                        "value": newMiddle[i]})
+        return ops
+
+    if not json_equal(old, new):
+        return [{"op": "replace", "path": path, "value": new}]
+    return []
+
+
+def pushAuthResponse(secret, nonce, server):
+    """
+    @returns: the answer of the master at server to the challenge nonce
+    """
+    msg = u"{0} {1}".format(nonce, server).encode("utf-8")
+    return hmac.new(secret, msg, hashlib.sha256).hexdigest()
+
+
+def fetchURL(url, etag=None):
+    """
+    Fetch and parse the JSON at url, in a thread of the poll pool. The
+    master answers 304 from its JSON response cache when the JSON still
+    has the given etag.
+
+    @returns: (etag, JSON), with None for the JSON if it did not change
+    """
+    request = urllib2.Request(url)
+    if etag:
+        request.add_header("If-None-Match", etag)
+    try:
+        response = urllib2.urlopen(request, timeout=MAX_POLL_INTERVAL)
+    except urllib2.HTTPError as e:
+        if e.code == 304:
+            return etag, None
+        raise
+    try:
+        return response.info().getheader("ETag"), json.load(response)
+    finally:
+        response.close()
+
+
+class PushFilterIndex(object):
+    """
+    Indexes the push filters of the URLs by event name, then by the value of
+    one of their conditions, e.g. the builder name, so that each pushed event
+    is only checked against the filters which may match it.
+
+    A filter maps event names to conditions on the payload of the events,
+    e.g. {"buildStarted": {"builderName": "b1", "sources": {"cb": "master"}}}.
+    A condition holds when the payload does not have its key. URLs without
+    a filter match every event.
+    """
+
+    # the keys indexed first, being the most selective
+    indexedKeys = ("builderName", "slavename", "name", "project")
+
+    MISSING = object()
+    UNHASHABLE = object()
+
+    def __init__(self):
+        self.matchAll = set()
+        # event name -> URLs without conditions for it
+        self.unconditional = {}
+        # event name -> path -> value -> url -> conditions
+        self.conditional = {}
+        # url -> [(event name, path, value)]
+        self.entries = {}
+
+    @staticmethod
+    def compile(filters):
+        """
+        @returns: event name -> [(path, value)]
+        """
+        compiled = {}
+        for eventName, filter_dict in filters.iteritems():
+            conditions = []
+            for filterName, f in filter_dict.iteritems():
+                if isinstance(f, dict):
+                    conditions.extend(((filterName, n), v) for n, v in f.iteritems())
+                else:
+                    conditions.append(((filterName,), f))
+            compiled[eventName] = conditions
+        return compiled
+
+    @classmethod
+    def indexKey(cls, value):
+        try:
+            hash(value)
+            return value
+        except TypeError:
+            # apart from the strings with the same JSON
+            return cls.UNHASHABLE, json.dumps(value, sort_keys=True)
+
+    @classmethod
+    def lookup(cls, payload, path):
+        for key in path:
+            if not isinstance(payload, dict) or key not in payload:
+                return cls.MISSING
+            payload = payload[key]
+        return payload
+
+    @classmethod
+    def holds(cls, payload, conditions):
+        for path, value in conditions:
+            v = cls.lookup(payload, path)
+            if v is not cls.MISSING and v != value:
+                return False
+        return True
+
+    def add(self, url, filters):
+        self.remove(url)
+        if not filters:
+            self.matchAll.add(url)
+            return
+        entries = self.entries[url] = []
+        for eventName, conditions in self.compile(filters).iteritems():
+            if not conditions:
+                self.unconditional.setdefault(eventName, set()).add(url)
+                entries.append((eventName, None, None))
+                continue
+            conditions.sort(key=lambda (path, value): (path[0] not in self.indexedKeys, path))
+            path, value = conditions[0]
+            key = self.indexKey(value)
+            byValue = self.conditional.setdefault(eventName, {}).setdefault(path, {})
+            byValue.setdefault(key, {})[url] = conditions[1:]
+            entries.append((eventName, path, key))
+
+    def remove(self, url):
+        self.matchAll.discard(url)
+        for eventName, path, key in self.entries.pop(url, ()):
+            if path is None:
+                urls = self.unconditional[eventName]
+                urls.discard(url)
+                if not urls:
+                    del self.unconditional[eventName]
+                continue
+            paths = self.conditional[eventName]
+            byValue = paths[path]
+            del byValue[key][url]
+            if not byValue[key]:
+                del byValue[key]
+                if not byValue:
+                    del paths[path]
+                    if not paths:
+                        del self.conditional[eventName]
+
+    def match(self, events):
+        """
+        @returns: the URLs with a filter matching one of the events
+        """
+        matched = set(self.matchAll)
+        for event in events:
+            if "event" not in event:
+                continue
+            eventName = event["event"]
+            matched.update(self.unconditional.get(eventName, ()))
+            paths = self.conditional.get(eventName)
+            if not paths:
+                continue
+            payload = event.get("payload", {})
+            for path, byValue in paths.iteritems():
+                value = self.lookup(payload, path)
+                if value is self.MISSING:
+                    # the indexed condition holds for all of them
+                    candidates = [(url, conditions) for urls in byValue.itervalues()
+                                  for url, conditions in urls.iteritems()]
+                else:
+                    candidates = byValue.get(self.indexKey(value), {}).iteritems()
+                for url, conditions in candidates:
+                    if url not in matched and self.holds(payload, conditions):
+                        matched.add(url)
+        return matched
+
+
 class CachedURL():
     """
     Caches the data found on a URL for future references
@@ -51,25 +314,75 @@ class CachedURL():
         self.errorCount = 0
         self.pollInterval = POLL_INTERVAL
         self.currentPollInterval = POLL_INTERVAL
+        self.etag = None
         self.locked = False
         self.waitForPush = False
         self.pushFilters = {}
         self.newData = False
-
-    def pollNeeded(self):
-        past_interval = (time.time() - self.lastChecked) > self.currentPollInterval
+        # the DelayedCall of the next poll
+        self.pollCall = None
+        # the clients receiving patches, and the last seq they acknowledged
+        self.deltaClients = set()
+        self.acked = {}
+        self.seq = 0
+        # seq -> JSON, oldest first
+        self.versions = OrderedDict()
+        # the master pushing the JSON, instead of it being fetched
+        self.pushedBy = None
+
+    def addVersion(self, jsonObj):
+        self.seq += 1
+        self.versions[self.seq] = jsonObj
+        self.pruneVersions()
+        return self.seq
+
+    def pruneVersions(self):
+        """
+        Forget the versions no client will be patched from
+        """
+        oldest = min([self.acked.get(c, self.seq) for c in self.deltaClients] + [self.seq])
+        while len(self.versions) > 1:
+            seq = next(iter(self.versions))
+            if seq >= oldest and len(self.versions) <= MAX_VERSIONS:
+                break
+            del self.versions[seq]
+
+    def acknowledge(self, client, seq):
+        if client in self.deltaClients and seq <= self.seq:
+            self.acked[client] = max(seq, self.acked.get(client, 0))
+            self.pruneVersions()
+
+    def removeClient(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        self.deltaClients.discard(client)
+        self.acked.pop(client, None)
+
+    def nextPollDelay(self):
+        """
+        Seconds before the URL is polled next, or None if it waits for push
+        data, or if its master pushes it
+        """
+        if self.pushedBy is not None:
+            return None
         if self.waitForPush:
-            if self.newData:
-                return past_interval
-            return False
+            if not self.newData:
+                return None
+            # back off while the fetches fail
+            interval = self.currentPollInterval if self.errorCount else PUSH_INTERVAL
+        else:
+            interval = self.currentPollInterval
+        return max(0, self.lastChecked + interval - time.time())
 
-        return past_interval
+    def cancelPoll(self):
+        if self.pollCall is not None and self.pollCall.active():
+            self.pollCall.cancel()
+        self.pollCall = None
 
     def pollSuccess(self):
         self.lastChecked = time.time()
         self.locked = False
         self.errorCount = 0
-        self.newData = False
 
         if self.currentPollInterval > self.pollInterval:
             self.currentPollInterval -= POLL_INTERVAL_STEP
@@ -109,18 +422,28 @@ class BroadcastServerFactory(WebSocketServerFactory):
     """
     Checks given JSON URLs by clients and broadcasts back to them
     if the JSON has changed
+
+    The masters knowing pushSecret push the JSON of their URLs when it
+    changes. Without a master pushing them, the URLs waiting for push data
+    are fetched when the master pushes events matching their filters, and
+    the other URLs are polled, in a pool of at most MAX_POLL_THREADS
+    threads.
     """
 
-    def __init__(self, url, debug=False, debugCodePaths=False):
+    def __init__(self, url, debug=False, debugCodePaths=False, pushSecret=None):
         WebSocketServerFactory.__init__(self, url)
         self.urlCacheDict = {}
         self.clients = []
         self.clients_urls = {}
-        self.tick()
-
-    def tick(self):
-        self.checkURLs()
-        reactor.callLater(0.1, self.tick)
+        self.pushSecret = pushSecret
+        # the authenticated masters, and the URL they serve
+        self.pushers = {}
+        # the masters being authenticated, and (their URL, nonce)
+        self.challenges = {}
+        self.pushIndex = PushFilterIndex()
+        self.pollPool = ThreadPool(0, MAX_POLL_THREADS, "poll")
+        self.pollPool.start()
+        reactor.addSystemEventTrigger("during", "shutdown", self.pollPool.stop)
 
     def sendClientCommand(self, clients, command, data):
         msg = {"cmd": command, "data": data}
@@ -129,6 +452,37 @@ class BroadcastServerFactory(WebSocketServerFactory):
         for client in clients:
             client.sendMessage(msg)
 
+    def makeSnapshot(self, urlCache):
+        return json.dumps({"cmd": KRT_JSON_DATA,
+                           "data": {"url": urlCache.url, "seq": urlCache.seq,
+                                    "data": urlCache.cachedJSON}})
+
+    def sendDeltas(self, urlCache):
+        """
+        Send the clients receiving patches the patch from the version they
+        acknowledged, or the whole JSON every SNAPSHOT_INTERVAL versions,
+        when their version is forgotten, or when it is smaller
+        """
+        bases = {}
+        for client in urlCache.deltaClients:
+            base = urlCache.acked.get(client)
+            if urlCache.seq % SNAPSHOT_INTERVAL == 0 or base not in urlCache.versions:
+                base = None
+            bases.setdefault(base, []).append(client)
+
+        snapshot = self.makeSnapshot(urlCache)
+        for base, clients in bases.iteritems():
+            msg = snapshot
+            if base is not None:
+                patch = json_diff(urlCache.versions[base], urlCache.cachedJSON)
+                patchMsg = json.dumps({"cmd": KRT_JSON_PATCH,
+                                       "data": {"url": urlCache.url, "seq": urlCache.seq,
+                                                "base": base, "patch": patch}})
+                if len(patchMsg) < len(snapshot):
+                    msg = patchMsg
+            for client in clients:
+                client.sendMessage(msg)
+
     def jsonChanged(self, json, cachedJSON):
         if cachedJSON is None:
             return True
@@ -142,53 +496,78 @@ class BroadcastServerFactory(WebSocketServerFactory):
 
         return False
 
-    def checkURLs(self):
-        for urlCache in self.urlCacheDict.values():
-            #Thread each of these
-            try:
-                if urlCache.locked is False and urlCache.pollNeeded():
-                    urlCache.locked = True
-
-                    p = Thread(target=self.checkURL, args=(urlCache, ))
-                    p.start()
-            except Exception as e:
-                logging.error("{0}".format(e))
+    def schedulePoll(self, urlCache):
+        """
+        Poll the URL when it needs it next, if it is not being polled
+        """
+        urlCache.cancelPoll()
+        if urlCache.locked:
+            # scheduled again once polled
+            return
+        delay = urlCache.nextPollDelay()
+        if delay is not None:
+            urlCache.pollCall = reactor.callLater(delay, self.checkURL, urlCache)
+
+    def dropURL(self, url):
+        urlCache = self.urlCacheDict.pop(url, None)
+        if urlCache is not None:
+            urlCache.cancelPoll()
+            self.pushIndex.remove(url)
+            if urlCache.pushedBy is not None:
+                self.sendClientCommand([urlCache.pushedBy], KRT_UNSUBSCRIBE_RESOURCES,
+                                       {"urls": [url]})
 
     def checkURL(self, urlCache):
+        urlCache.pollCall = None
         url = urlCache.url
-        cachedURL = self.urlCacheDict[url]
-        if cachedURL.errorCount > MAX_ERRORS:
+        if self.urlCacheDict.get(url) is not urlCache:
+            # dropped meanwhile
+            return
+        if urlCache.errorCount > MAX_ERRORS:
             logging.info("Removing cached URL as it has too many errors {0}".format(url))
-            self.sendClientCommand(cachedURL.clients, KRT_URL_DROPPED, url)
-            updateLock.acquire()
-            del self.urlCacheDict[url]
-            updateLock.release()
+            self.sendClientCommand(urlCache.clients, KRT_URL_DROPPED, url)
+            self.dropURL(url)
             return
-        if urlCache.pollNeeded():
-            try:
-                #logging.info("Polling: {0}".format(url))
-                response = urllib2.urlopen(url, timeout=MAX_POLL_INTERVAL)
-                updateLock.acquire()
-                cachedURL.pollSuccess()
-                jsonObj = json.load(response)
-                if self.jsonChanged(jsonObj, cachedURL.cachedJSON):
-                    cachedURL.cachedJSON = jsonObj
-                    clients = cachedURL.clients
-                    logging.info("JSON at {1} Changed, informing {0} client(s)".format(len(clients), url))
-                    data = {"url": url, "data": jsonObj}
-                    self.sendClientCommand(clients, KRT_JSON_DATA, data)
-
-                #Reset error count to reduce cutting of many users
-                #in busy times
-                cachedURL.errorCount = 0
-            except Exception as e:
-                logging.error("{0}: {1}".format(e, url))
-                cachedURL.pollFailure()
-            finally:
-                cachedURL.locked = False
-
-                if updateLock.locked():
-                    updateLock.release()
+
+        urlCache.locked = True
+        urlCache.newData = False
+        d = threads.deferToThreadPool(reactor, self.pollPool, fetchURL, url, urlCache.etag)
+
+        def polled((etag, jsonObj)):
+            urlCache.pollSuccess()
+            urlCache.etag = etag
+            # unless its master pushes it since
+            if jsonObj is not None and urlCache.pushedBy is None:
+                self.updateURL(urlCache, jsonObj)
+
+        def failed(f):
+            logging.error("{0}: {1}".format(f.getErrorMessage(), url))
+            urlCache.pollFailure()
+            # the pushed data is still to fetch
+            urlCache.newData = urlCache.waitForPush
+
+        d.addCallbacks(polled, failed)
+
+        def done(_):
+            urlCache.locked = False
+            if self.urlCacheDict.get(url) is urlCache:
+                self.schedulePoll(urlCache)
+        d.addBoth(done)
+        return d
+
+    def updateURL(self, urlCache, jsonObj):
+        """
+        Broadcast the JSON of the URL to its clients if it changed
+        """
+        if self.jsonChanged(jsonObj, urlCache.cachedJSON):
+            urlCache.cachedJSON = jsonObj
+            urlCache.addVersion(jsonObj)
+            clients = urlCache.clients
+            logging.info("JSON at {1} Changed, informing {0} client(s)".format(len(clients), urlCache.url))
+            data = {"url": urlCache.url, "data": jsonObj}
+            self.sendClientCommand([c for c in clients if c not in urlCache.deltaClients],
+                                   KRT_JSON_DATA, data)
+            self.sendDeltas(urlCache)
 
     def register(self, client):
         if not client in self.clients:
@@ -196,17 +575,18 @@ class BroadcastServerFactory(WebSocketServerFactory):
             self.clients.append(client)
 
     def unregister(self, client):
+        self.challenges.pop(client, None)
+        self.stopPushing(client)
         if client in self.clients:
             logging.info("unregistered client " + client.peerstr)
             self.clients.remove(client)
             for items in self.urlCacheDict.items():
                 url = items[0]
                 urlCache = items[1]
-                if client in urlCache.clients:
-                    urlCache.clients.remove(client)
+                urlCache.removeClient(client)
 
                 if len(urlCache.clients) == 0:
-                    del self.urlCacheDict[url]
+                    self.dropURL(url)
                     logging.info("Removed stale cached URL {0}".format(url))
 
 
@@ -222,6 +602,9 @@ class BroadcastServerFactory(WebSocketServerFactory):
                     logging.info("Created new url {0} for {1}".format(url, client.peer))
                     self.urlCacheDict[url] = CachedURL(url)
                     self.urlCacheDict[url].clients = [client, ]
+                    pusher = self.pusherOf(url)
+                    if pusher is not None:
+                        self.subscribe(pusher, [self.urlCacheDict[url]])
                 else:
                     logging.info("Added {1} to url {0}".format(url, client.peer))
                     self.urlCacheDict[url].clients.append(client)
@@ -235,68 +618,129 @@ class BroadcastServerFactory(WebSocketServerFactory):
                             self.urlCacheDict[url].pushFilters = json.loads(filters)
                         else:
                             self.urlCacheDict[url].pushFilters = filters
+                    self.pushIndex.add(url, self.urlCacheDict[url].pushFilters)
                     logging.info("URL {0} is waiting for push data with these filters {1}".format(url, self.urlCacheDict[url].pushFilters))
+                if not isinstance(data["data"], basestring) and data["data"].get("deltas"):
+                    self.urlCacheDict[url].deltaClients.add(client)
+                self.schedulePoll(self.urlCacheDict[url])
+            elif data["cmd"] == KRT_JSON_ACK:
+                urlCache = self.urlCacheDict.get(data["data"]["url"])
+                if urlCache is not None:
+                    urlCache.acknowledge(client, data["data"]["seq"])
+            elif data["cmd"] == KRT_JSON_RESYNC:
+                urlCache = self.urlCacheDict.get(data["data"]["url"])
+                if urlCache is not None and urlCache.cachedJSON is not None:
+                    client.sendMessage(self.makeSnapshot(urlCache))
             elif data["cmd"] == KRT_PUSH_DATA:
                 self.update_push_urls(data)
+            elif data["cmd"] == KRT_SERVER_HELLO:
+                self.serverHello(client, data["data"])
+            elif data["cmd"] == KRT_AUTH_RESPONSE:
+                self.authenticate(client, data["data"])
+            elif data["cmd"] == KRT_PUSH_RESOURCES:
+                self.pushResources(client, data["data"])
+            elif data["cmd"] == KRT_REFUSE_RESOURCES:
+                self.refuseResources(client, data["data"])
 
         except AttributeError as e:
             pass
         except ValueError as e:
             pass
 
-    def update_push_urls(self, data):
-
-        def filter_dict_compare(f_dict, v_dict):
-            for n, f in f_dict.iteritems():
-                if n in v_dict and v_dict[n] != f:
-                    return False
+    def serverHello(self, client, data):
+        if not self.pushSecret:
+            logging.info("Not letting {0} push {1}, without a push secret".format(
+                client.peer, data["server"]))
+            return
+        nonce = os.urandom(16).encode("hex")
+        self.challenges[client] = (data["server"], nonce)
+        self.sendClientCommand([client], KRT_AUTH_CHALLENGE, {"nonce": nonce})
 
-            return True
+    def authenticate(self, client, data):
+        challenge = self.challenges.pop(client, None)
+        if challenge is None:
+            return
+        server, nonce = challenge
+        expected = pushAuthResponse(self.pushSecret, nonce, server)
+        if not hmac.compare_digest(expected, str(data["response"])):
+            logging.warning("Failed push authentication of {0} from {1}".format(
+                server, client.peer))
+            return
+        logging.info("{0} pushes the URLs of {1}".format(client.peer, server))
+        self.pushers[client] = server
+        self.subscribe(client, [urlCache for url, urlCache in self.urlCacheDict.iteritems()
+                                if urlCache.pushedBy is None and url.startswith(server)])
+
+    def pusherOf(self, url):
+        for client, server in self.pushers.iteritems():
+            if url.startswith(server):
+                return client
+        return None
+
+    def subscribe(self, client, urlCaches):
+        """
+        Have the master client push the URLs instead of them being fetched
+        """
+        for urlCache in urlCaches:
+            urlCache.pushedBy = client
+            urlCache.cancelPoll()
+        if urlCaches:
+            self.sendClientCommand([client], KRT_SUBSCRIBE_RESOURCES,
+                                   {"urls": [urlCache.url for urlCache in urlCaches]})
+
+    def fetchAgain(self, urlCache):
+        urlCache.pushedBy = None
+        # what changed since the last push is still to fetch
+        urlCache.newData = urlCache.waitForPush
+        self.schedulePoll(urlCache)
+
+    def stopPushing(self, client):
+        if self.pushers.pop(client, None) is None:
+            return
+        for urlCache in self.urlCacheDict.values():
+            if urlCache.pushedBy is client:
+                self.fetchAgain(urlCache)
 
-        def matches_filter(urlCache, events):
-            if len(urlCache.pushFilters) == 0:
-                # We don't have any filters so it matches
-                return True
-
-            for event in events:
-                if "event" in event and event["event"] in urlCache.pushFilters:
-                    event_name = event["event"]
-                    filter_dict = urlCache.pushFilters[event_name]
-                    if len(filter_dict) == 0:
-                        # Exit because we found an event and there were no filters
-                        # to check
-                        return True
-
-                    payload = event["payload"]
-
-                    all_filters_matched = True
-                    for filterName, f in filter_dict.iteritems():
-                        if filterName in payload:
-                            v = payload[filterName]
-                            if (isinstance(f, dict) and not filter_dict_compare(f, v)) or \
-                                    (not isinstance(f, dict) and f != v):
-                                # This event doesn't match the filters
-                                all_filters_matched = False
-                                break
-
-                    # Exit because we found one matching event
-                    if all_filters_matched:
-                        return True
-
-            # We didn't find a matching event or an event that had matching filters
-            return False
+    def pushResources(self, client, data):
+        if client not in self.pushers:
+            logging.warning("Ignoring the resources pushed by unauthenticated {0}".format(
+                client.peer))
+            return
+        for resource in data:
+            urlCache = self.urlCacheDict.get(resource["url"])
+            if urlCache is None or urlCache.pushedBy is not client:
+                continue
+            urlCache.lastChecked = time.time()
+            urlCache.errorCount = 0
+            urlCache.etag = resource["etag"]
+            urlCache.newData = False
+            self.updateURL(urlCache, resource["data"])
+
+    def refuseResources(self, client, data):
+        for url in data["urls"]:
+            urlCache = self.urlCacheDict.get(url)
+            if urlCache is not None and urlCache.pushedBy is client:
+                logging.info("{0} does not push {1}".format(client.peer, url))
+                self.fetchAgain(urlCache)
 
+    def update_push_urls(self, data):
         events = data["data"]
         event_str = ""
         for e in events:
             event_str += "{0}, ".format(e["event"])
-        logging.info("Data pushed from server {0} with events {1}".format(data["server"], event_str))
 
-        for url, obj in self.urlCacheDict.iteritems():
-            if obj.waitForPush:
+        started = time.time()
+        urls = self.pushIndex.match(events)
+        elapsed = time.time() - started
+        logging.info("Data pushed from server {0} with events {1}matched {2} URL(s) in {3:.3f} ms per event".format(
+            data["server"], event_str, len(urls), elapsed * 1000 / max(len(events), 1)))
+
+        for url in urls:
+            obj = self.urlCacheDict.get(url)
+            if obj is not None and obj.waitForPush:
                 if "server" in data and data["server"] in url:
-                    if matches_filter(obj, events):
-                        obj.newData = True
+                    obj.newData = True
+                    self.schedulePoll(obj)
 
 def createDeamon():
     import os, sys
@@ -333,7 +777,8 @@ if __name__ == '__main__':
 
     factory = ServerFactory("ws://localhost:{0}".format(PORT),
                             debug=debug,
-                            debugCodePaths=debug)
+                            debugCodePaths=debug,
+                            pushSecret=os.environ.get("AUTOBAHN_PUSH_SECRET"))
 
     factory.protocol = BroadcastServerProtocol
     factory.setProtocolOptions()
@@ -0,0 +1,777 @@
+import copy
+import json
+import logging
+import random
+import urllib2
+from StringIO import StringIO
+
+from twisted.internet import defer, task, threads
+from twisted.trial import unittest
+
+try:
+    import autobahnServer
+except ImportError:
+    # autobahn is not installed
+    autobahnServer = None
+
+URL = "http://katana/json/builders/b1?as_text=1"
+
+
+class FakeReactor(task.Clock):
+
+    def addSystemEventTrigger(self, *args, **kwargs):
+        pass
+
+
+class FakeTime(object):
+
+    def __init__(self, clock):
+        self.time = clock.seconds
+
+
+class FakeClient(object):
+
+    def __init__(self, peer="client"):
+        self.peer = self.peerstr = peer
+        self.messages = []
+
+    def sendMessage(self, msg):
+        self.messages.append(json.loads(msg))
+
+
+class RelayTestCase(unittest.TestCase):
+
+    if autobahnServer is None:
+        skip = "autobahn is not installed"
+
+    def setUp(self):
+        self.clock = FakeReactor()
+        self.clock.advance(1000)
+        self.patch(autobahnServer, "reactor", self.clock)
+        self.patch(autobahnServer, "time", FakeTime(self.clock))
+        # fetch in the reactor, from self.fetches
+        self.fetched = []
+        self.fetches = {}
+        self.patch(autobahnServer, "fetchURL", self.fetchURL)
+        self.patch(threads, "deferToThreadPool",
+                   lambda reactor, pool, f, *args: defer.maybeDeferred(f, *args))
+
+        self.factory = autobahnServer.BroadcastServerFactory("ws://localhost:8010")
+        self.addCleanup(self.factory.pollPool.stop)
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def fetchURL(self, url, etag=None):
+        self.fetched.append((url, etag))
+        result = self.fetches[url]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def register(self, client, url=URL, **data):
+        data["url"] = url
+        self.factory.clientMessage(json.dumps({"cmd": autobahnServer.KRT_REGISTER_URL,
+                                               "data": data}), client)
+        return self.factory.urlCacheDict[url]
+
+    def pushEvents(self, *events):
+        self.factory.clientMessage(json.dumps({"cmd": autobahnServer.KRT_PUSH_DATA,
+                                               "server": "http://katana/",
+                                               "data": list(events)}), None)
+
+
+class TestPolling(RelayTestCase):
+
+    def test_schedulePoll_polled_url(self):
+        self.fetches[URL] = ("etag1", {"state": "idle"})
+        client = FakeClient()
+        urlCache = self.register(client)
+        self.assertTrue(urlCache.pollCall.active())
+
+        self.clock.advance(0)
+        self.assertEqual(self.fetched, [(URL, None)])
+        self.assertEqual(client.messages, [
+            {"cmd": autobahnServer.KRT_JSON_DATA,
+             "data": {"url": URL, "data": {"state": "idle"}}}])
+
+        # polled again after the poll interval only
+        self.clock.advance(autobahnServer.POLL_INTERVAL - 1)
+        self.assertEqual(len(self.fetched), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_schedulePoll_waiting_for_push(self):
+        self.fetches[URL] = ("etag1", {})
+        urlCache = self.register(FakeClient(), waitForPush="true")
+        self.clock.advance(autobahnServer.MAX_POLL_INTERVAL)
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(urlCache.pollCall, None)
+
+    def test_schedulePoll_locked(self):
+        urlCache = self.register(FakeClient())
+        urlCache.cancelPoll()
+        urlCache.locked = True
+        self.factory.schedulePoll(urlCache)
+        self.assertEqual(urlCache.pollCall, None)
+
+    def test_checkURL_etag(self):
+        self.fetches[URL] = ("etag1", {"state": "idle"})
+        client = FakeClient()
+        urlCache = self.register(client)
+        self.clock.advance(0)
+
+        # the master answers 304 for the same etag
+        self.fetches[URL] = ("etag1", None)
+        self.clock.advance(autobahnServer.POLL_INTERVAL)
+        self.assertEqual(self.fetched, [(URL, None), (URL, "etag1")])
+        self.assertEqual(len(client.messages), 1)
+        self.assertEqual(urlCache.etag, "etag1")
+
+        self.fetches[URL] = ("etag2", {"state": "building"})
+        self.clock.advance(autobahnServer.POLL_INTERVAL)
+        self.assertEqual(self.fetched[-1], (URL, "etag1"))
+        self.assertEqual(client.messages[-1]["data"]["data"], {"state": "building"})
+        self.assertEqual(urlCache.etag, "etag2")
+
+    def test_checkURL_failures(self):
+        self.fetches[URL] = IOError("connection refused")
+        client = FakeClient()
+        urlCache = self.register(client)
+        for i in range(autobahnServer.MAX_ERRORS + 1):
+            self.clock.advance(urlCache.nextPollDelay())
+            self.assertEqual(urlCache.errorCount, i + 1)
+            self.assertFalse(urlCache.locked)
+        self.assertEqual(urlCache.currentPollInterval, autobahnServer.MAX_POLL_INTERVAL)
+
+        self.clock.advance(urlCache.nextPollDelay())
+        self.assertEqual(client.messages, [
+            {"cmd": autobahnServer.KRT_URL_DROPPED, "data": URL}])
+        self.assertNotIn(URL, self.factory.urlCacheDict)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_checkURL_dropped(self):
+        urlCache = self.register(FakeClient())
+        self.factory.dropURL(URL)
+        self.assertEqual(self.factory.checkURL(urlCache), None)
+        self.assertEqual(self.fetched, [])
+
+
+class TestPush(RelayTestCase):
+
+    def setUp(self):
+        RelayTestCase.setUp(self)
+        self.fetches[URL] = ("etag1", {})
+        self.urlCache = self.register(
+            FakeClient(), waitForPush="true",
+            pushFilters={"buildStarted": {"builderName": "b1"}})
+
+    def test_push_matching(self):
+        self.pushEvents({"event": "buildStarted", "payload": {"builderName": "b2"}})
+        self.clock.advance(autobahnServer.MAX_POLL_INTERVAL)
+        self.assertEqual(self.fetched, [])
+
+        self.pushEvents({"event": "buildStarted", "payload": {"builderName": "b1"}})
+        self.clock.advance(0)
+        self.assertEqual(self.fetched, [(URL, None)])
+
+    def test_push_coalesced(self):
+        event = {"event": "buildStarted", "payload": {"builderName": "b1"}}
+        self.pushEvents(event)
+        self.clock.advance(0)
+        # the pushes while the URL was just fetched make one fetch
+        for i in range(5):
+            self.pushEvents(event)
+            self.clock.advance(0.1)
+        self.assertEqual(len(self.fetched), 1)
+        self.clock.pump([autobahnServer.PUSH_INTERVAL] * 3)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_push_while_fetching(self):
+        d = defer.Deferred()
+        self.fetches[URL] = d
+        event = {"event": "buildStarted", "payload": {"builderName": "b1"}}
+        self.pushEvents(event)
+        self.clock.advance(0)
+        self.pushEvents(event)
+        self.pushEvents(event)
+        self.assertTrue(self.urlCache.locked)
+        self.assertEqual(self.urlCache.pollCall, None)
+
+        # fetched once more, for the pushes made meanwhile
+        self.fetches[URL] = ("etag1", {})
+        d.callback(("etag1", {}))
+        self.clock.pump([autobahnServer.PUSH_INTERVAL] * 3)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_push_resources_ignored(self):
+        # from a client which did not authenticate as the master
+        client = FakeClient()
+        self.factory.clientMessage(json.dumps(
+            {"cmd": autobahnServer.KRT_PUSH_RESOURCES,
+             "data": [{"url": URL, "etag": "etag1", "data": {"injected": True}}]}), client)
+        self.assertEqual(self.urlCache.cachedJSON, None)
+        self.assertEqual(self.fetched, [])
+
+
+class TestResourcePush(RelayTestCase):
+
+    def setUp(self):
+        RelayTestCase.setUp(self)
+        self.factory.pushSecret = "secret"
+        self.fetches[URL] = ("etag1", {"state": "idle"})
+        self.master = FakeClient("master")
+        self.factory.register(self.master)
+
+    def send(self, client, cmd, data):
+        self.factory.clientMessage(json.dumps({"cmd": cmd, "data": data}), client)
+
+    def authenticate(self, master=None, server="http://katana/", secret="secret"):
+        master = master or self.master
+        self.send(master, autobahnServer.KRT_SERVER_HELLO, {"server": server})
+        if not master.messages:
+            return
+        nonce = master.messages[-1]["data"]["nonce"]
+        self.send(master, autobahnServer.KRT_AUTH_RESPONSE,
+                  {"response": autobahnServer.pushAuthResponse(secret, nonce, server)})
+
+    def pushResources(self, master=None, url=URL, data={"state": "building"}):
+        self.send(master or self.master, autobahnServer.KRT_PUSH_RESOURCES,
+                  [{"url": url, "etag": "etag2", "data": data}])
+
+    def assertSubscribed(self, urls):
+        self.assertEqual(self.master.messages[-1], {
+            "cmd": autobahnServer.KRT_SUBSCRIBE_RESOURCES, "data": {"urls": urls}})
+
+    def test_pushed_instead_of_polled(self):
+        client = FakeClient()
+        urlCache = self.register(client)
+        self.authenticate()
+        self.assertSubscribed([URL])
+        self.assertIdentical(urlCache.pushedBy, self.master)
+
+        self.clock.advance(autobahnServer.MAX_POLL_INTERVAL)
+        self.assertEqual(self.fetched, [])
+        self.pushResources()
+        self.assertEqual(client.messages, [
+            {"cmd": autobahnServer.KRT_JSON_DATA,
+             "data": {"url": URL, "data": {"state": "building"}}}])
+        self.assertEqual(urlCache.etag, "etag2")
+
+    def test_url_registered_later(self):
+        self.authenticate()
+        self.assertEqual(self.master.messages[-1]["cmd"], autobahnServer.KRT_AUTH_CHALLENGE)
+        urlCache = self.register(FakeClient(), waitForPush="true")
+        self.assertSubscribed([URL])
+
+        # the pushed events are not fetched either
+        self.pushEvents({"event": "buildStarted", "payload": {"builderName": "b1"}})
+        self.clock.advance(autobahnServer.MAX_POLL_INTERVAL)
+        self.assertEqual(self.fetched, [])
+        self.assertIdentical(urlCache.pushedBy, self.master)
+
+    def test_urls_of_other_masters(self):
+        urlCache = self.register(FakeClient())
+        self.authenticate(server="http://other/")
+        self.assertEqual(urlCache.pushedBy, None)
+        self.pushResources()
+        self.assertEqual(urlCache.cachedJSON, None)
+        self.clock.advance(0)
+        self.assertEqual(self.fetched, [(URL, None)])
+
+    def test_wrong_secret(self):
+        urlCache = self.register(FakeClient())
+        self.authenticate(secret="guessed")
+        self.assertEqual(urlCache.pushedBy, None)
+        self.pushResources()
+        self.assertEqual(urlCache.cachedJSON, None)
+        self.clock.advance(0)
+        self.assertEqual(self.fetched, [(URL, None)])
+
+    def test_no_push_secret(self):
+        self.factory.pushSecret = None
+        self.register(FakeClient())
+        self.authenticate()
+        self.assertEqual(self.master.messages, [])
+        self.clock.advance(0)
+        self.assertEqual(self.fetched, [(URL, None)])
+
+    def test_response_to_another_challenge(self):
+        urlCache = self.register(FakeClient())
+        self.authenticate(server="http://other/")
+        nonce = self.master.messages[-1]["data"]["nonce"]
+        self.send(self.master, autobahnServer.KRT_SERVER_HELLO, {"server": "http://katana/"})
+        self.send(self.master, autobahnServer.KRT_AUTH_RESPONSE,
+                  {"response": autobahnServer.pushAuthResponse("secret", nonce, "http://katana/")})
+        self.assertEqual(urlCache.pushedBy, None)
+
+    def test_master_disconnected(self):
+        urlCache = self.register(FakeClient(), waitForPush="true")
+        self.authenticate()
+        self.factory.unregister(self.master)
+        self.assertEqual(urlCache.pushedBy, None)
+        self.assertEqual(self.factory.pushers, {})
+        # fetched once, for the changes made since the last push
+        self.clock.advance(autobahnServer.PUSH_INTERVAL)
+        self.assertEqual(self.fetched, [(URL, None)])
+
+    def test_refused(self):
+        urlCache = self.register(FakeClient())
+        self.authenticate()
+        self.send(self.master, autobahnServer.KRT_REFUSE_RESOURCES, {"urls": [URL]})
+        self.assertEqual(urlCache.pushedBy, None)
+        self.clock.advance(0)
+        self.assertEqual(self.fetched, [(URL, None)])
+
+    def test_dropped_url_unsubscribed(self):
+        client = FakeClient()
+        self.factory.register(client)
+        self.register(client)
+        self.authenticate()
+        self.factory.unregister(client)
+        self.assertEqual(self.master.messages[-1], {
+            "cmd": autobahnServer.KRT_UNSUBSCRIBE_RESOURCES, "data": {"urls": [URL]}})
+
+    def test_push_after_fetch(self):
+        d = defer.Deferred()
+        self.fetches[URL] = d
+        urlCache = self.register(FakeClient())
+        self.clock.advance(0)
+        self.authenticate()
+        self.pushResources()
+        # the older fetched JSON does not replace the pushed one
+        d.callback(("etag1", {"state": "idle"}))
+        self.assertEqual(urlCache.cachedJSON, {"state": "building"})
+        self.assertEqual(urlCache.pollCall, None)
+
+
+class FakeHeaders(object):
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class TestFetchURL(unittest.TestCase):
+
+    if autobahnServer is None:
+        skip = "autobahn is not installed"
+
+    def setUp(self):
+        self.requests = []
+        self.patch(urllib2, "urlopen", self.urlopen)
+
+    def urlopen(self, request, timeout=None):
+        self.requests.append(request)
+        if request.get_header("If-none-match") == "etag1":
+            raise urllib2.HTTPError(request.get_full_url(), 304, "Not Modified", {}, None)
+        return urllib2.addinfourl(StringIO('{"state": "idle"}'),
+                                  FakeHeaders({"ETag": "etag2"}), URL, 200)
+
+    def test_fetch(self):
+        self.assertEqual(autobahnServer.fetchURL(URL), ("etag2", {"state": "idle"}))
+        self.assertEqual(self.requests[0].get_header("If-none-match"), None)
+
+    def test_fetch_not_modified(self):
+        self.assertEqual(autobahnServer.fetchURL(URL, "etag1"), ("etag1", None))
+
+    def test_fetch_modified(self):
+        self.assertEqual(autobahnServer.fetchURL(URL, "etag0"),
+                         ("etag2", {"state": "idle"}))
+
+
+def apply_patch(doc, patch):
+    """
+    Apply the add, remove and replace operations of a JSON patch, as the
+    clients do
+    """
+    for op in patch:
+        if op["path"] == "":
+            assert op["op"] == "replace"
+            doc = copy.deepcopy(op["value"])
+            continue
+        keys = [k.replace("~1", "/").replace("~0", "~")
+                for k in op["path"].split("/")[1:]]
+        parent = doc
+        for key in keys[:-1]:
+            parent = parent[int(key) if isinstance(parent, list) else key]
+        key = keys[-1]
+        if isinstance(parent, list):
+            key = int(key)
+        if op["op"] == "remove":
+            del parent[key]
+        elif op["op"] == "add" and isinstance(parent, list):
+            parent.insert(key, copy.deepcopy(op["value"]))
+        else:
+            assert op["op"] in ("add", "replace")
+            parent[key] = copy.deepcopy(op["value"])
+    return doc
+
+
+class TestJsonDiff(unittest.TestCase):
+
+    if autobahnServer is None:
+        skip = "autobahn is not installed"
+
+    def assertRoundTrip(self, old, new):
+        # as parsed by the relay
+        old, new = json.loads(json.dumps(old)), json.loads(json.dumps(new))
+        patch = autobahnServer.json_diff(old, new)
+        # the patch goes through JSON to the clients
+        patch = json.loads(json.dumps(patch))
+        patched = apply_patch(copy.deepcopy(old), patch)
+        self.assertTrue(autobahnServer.json_equal(patched, new),
+                        "%r patched with %r is %r, not %r" % (old, patch, patched, new))
+        return patch
+
+    def test_equal(self):
+        self.assertEqual(self.assertRoundTrip({"a": [1, {"b": None}]},
+                                              {"a": [1, {"b": None}]}), [])
+
+    def test_dict(self):
+        patch = self.assertRoundTrip({"a": 1, "b": 2, "c": {"d": 3}},
+                                     {"a": 1, "c": {"d": 4}, "e": 5})
+        self.assertEqual(sorted((op["op"], op["path"]) for op in patch),
+                         [("add", "/e"), ("remove", "/b"), ("replace", "/c/d")])
+
+    def test_list_ends(self):
+        self.assertEqual(self.assertRoundTrip([1, 2, 3], [0, 1, 2, 3]),
+                         [{"op": "add", "path": "/0", "value": 0}])
+        self.assertEqual(self.assertRoundTrip([1, 2, 3], [1, 2, 3, 4]),
+                         [{"op": "add", "path": "/3", "value": 4}])
+        self.assertEqual(self.assertRoundTrip([0, 1, 2, 3], [1, 2, 3]),
+                         [{"op": "remove", "path": "/0"}])
+        self.assertRoundTrip([0, 1, 2, 3, 4], [1, 2, 3])
+
+    def test_list_middle(self):
+        self.assertEqual(self.assertRoundTrip([1, 2, 3, 4], [1, 5, 4]),
+                         [{"op": "replace", "path": "/1", "value": 5},
+                          {"op": "remove", "path": "/2"}])
+        self.assertEqual(self.assertRoundTrip([1, 4], [1, 2, 3, 4]),
+                         [{"op": "add", "path": "/1", "value": 2},
+                          {"op": "add", "path": "/2", "value": 3}])
+        self.assertRoundTrip([{"n": 1}, {"n": 2}, {"n": 3}],
+                             [{"n": 1}, {"n": 2, "m": 0}, {"n": 3}])
+        self.assertRoundTrip([1, [2, 3], 4], [1, [2, 5, 3], 4])
+
+    def test_key_escaping(self):
+        patch = self.assertRoundTrip({"a/b": 1, "c~d": {"~1": 2}},
+                                     {"a/b": 2, "c~d": {"~1": 3}, "e/~f": 4})
+        self.assertEqual(sorted(op["path"] for op in patch),
+                         ["/a~1b", "/c~0d/~01", "/e~1~0f"])
+
+    def test_root_replaced(self):
+        self.assertEqual(self.assertRoundTrip({"a": 1}, [1]),
+                         [{"op": "replace", "path": "", "value": [1]}])
+        self.assertRoundTrip(1, "1")
+        self.assertRoundTrip(None, {"a": 1})
+        self.assertRoundTrip([1], [])
+
+    def test_types(self):
+        # true is not 1 for the clients
+        self.assertRoundTrip({"a": 1, "b": [0]}, {"a": True, "b": [False]})
+        self.assertRoundTrip({"a": 1}, {"a": 1.5})
+
+    def randomJSON(self, rnd, depth=0):
+        kind = rnd.randint(0, 5 if depth < 3 else 3)
+        if kind == 0:
+            return rnd.choice([None, True, False])
+        if kind == 1:
+            return rnd.randint(0, 3)
+        if kind == 2:
+            return rnd.choice(["a", "b", u"\xe9"])
+        if kind == 3:
+            return rnd.random()
+        if kind == 4:
+            return [self.randomJSON(rnd, depth + 1) for i in xrange(rnd.randint(0, 4))]
+        return dict((rnd.choice(["a", "b/c", "~d", ""]), self.randomJSON(rnd, depth + 1))
+                    for i in xrange(rnd.randint(0, 4)))
+
+    def mutate(self, rnd, obj):
+        if rnd.random() < 0.2:
+            return self.randomJSON(rnd)
+        if isinstance(obj, list):
+            obj = [self.mutate(rnd, x) if rnd.random() < 0.3 else x for x in obj]
+            for i in xrange(rnd.randint(0, 2)):
+                if obj and rnd.random() < 0.5:
+                    del obj[rnd.randint(0, len(obj) - 1)]
+                else:
+                    obj.insert(rnd.randint(0, len(obj)), self.randomJSON(rnd))
+            return obj
+        if isinstance(obj, dict):
+            obj = dict((k, self.mutate(rnd, v) if rnd.random() < 0.3 else v)
+                       for k, v in obj.iteritems() if rnd.random() < 0.8)
+            if rnd.random() < 0.5:
+                obj[rnd.choice(["a", "e/f", "~g"])] = self.randomJSON(rnd)
+            return obj
+        return obj
+
+    def test_random(self):
+        rnd = random.Random(42)
+        for i in xrange(500):
+            old = self.randomJSON(rnd)
+            self.assertRoundTrip(old, self.mutate(rnd, copy.deepcopy(old)))
+
+
+class TestDeltas(RelayTestCase):
+
+    def setUp(self):
+        RelayTestCase.setUp(self)
+        self.fetches[URL] = ("etag1", self.builders(0))
+        self.client = FakeClient("deltas")
+        self.urlCache = self.register(self.client, deltas=True)
+        self.clock.advance(0)
+        self.urlCache.cancelPoll()
+
+    def builders(self, version):
+        # large enough for the patches to be smaller than the whole JSON
+        builders = dict(("builder%d" % i, {"state": "idle", "pendingBuilds": 0})
+                        for i in range(20))
+        builders["builder0"]["pendingBuilds"] = version
+        return builders
+
+    def update(self, version):
+        self.factory.updateURL(self.urlCache, self.builders(version))
+        return self.client.messages[-1]
+
+    def ack(self, client, seq):
+        self.factory.clientMessage(json.dumps(
+            {"cmd": autobahnServer.KRT_JSON_ACK, "data": {"url": URL, "seq": seq}}),
+            client)
+
+    def test_snapshot_then_patches(self):
+        self.assertEqual(self.client.messages, [
+            {"cmd": autobahnServer.KRT_JSON_DATA,
+             "data": {"url": URL, "seq": 1, "data": self.builders(0)}}])
+        self.ack(self.client, 1)
+
+        msg = self.update(1)
+        self.assertEqual(msg["cmd"], autobahnServer.KRT_JSON_PATCH)
+        self.assertEqual((msg["data"]["seq"], msg["data"]["base"]), (2, 1))
+        self.assertEqual(apply_patch(self.builders(0), msg["data"]["patch"]),
+                         self.builders(1))
+
+        # patched from the last acknowledged version
+        msg = self.update(2)
+        self.assertEqual((msg["data"]["seq"], msg["data"]["base"]), (3, 1))
+        self.assertEqual(apply_patch(self.builders(0), msg["data"]["patch"]),
+                         self.builders(2))
+
+    def test_snapshot_interval(self):
+        cmds = {}
+        for version in range(1, 2 * autobahnServer.SNAPSHOT_INTERVAL):
+            self.ack(self.client, self.urlCache.seq)
+            msg = self.update(version)
+            cmds[msg["data"]["seq"]] = msg["cmd"]
+        snapshots = [seq for seq, cmd in sorted(cmds.items())
+                     if cmd == autobahnServer.KRT_JSON_DATA]
+        self.assertEqual(snapshots, [autobahnServer.SNAPSHOT_INTERVAL,
+                                     2 * autobahnServer.SNAPSHOT_INTERVAL])
+
+    def test_forgotten_base(self):
+        self.ack(self.client, 1)
+        for version in range(1, autobahnServer.MAX_VERSIONS):
+            self.assertEqual(self.update(version)["cmd"], autobahnServer.KRT_JSON_PATCH)
+        # the version the client acknowledged is too old to be kept
+        msg = self.update(autobahnServer.MAX_VERSIONS)
+        self.assertNotIn(1, self.urlCache.versions)
+        self.assertEqual(msg, {"cmd": autobahnServer.KRT_JSON_DATA,
+                               "data": {"url": URL, "seq": self.urlCache.seq,
+                                        "data": self.builders(autobahnServer.MAX_VERSIONS)}})
+
+    def test_resync(self):
+        self.update(1)
+        self.factory.clientMessage(json.dumps(
+            {"cmd": autobahnServer.KRT_JSON_RESYNC, "data": {"url": URL}}), self.client)
+        self.assertEqual(self.client.messages[-1]["cmd"], autobahnServer.KRT_JSON_DATA)
+        self.assertEqual(self.client.messages[-1]["data"]["seq"], 2)
+
+    def test_prune_without_acks(self):
+        # neither client acknowledges: only the last version is kept
+        other = FakeClient("other")
+        self.register(other, deltas=True)
+        for version in range(1, 3 * autobahnServer.MAX_VERSIONS):
+            msg = self.update(version)
+            self.assertEqual(msg["cmd"], autobahnServer.KRT_JSON_DATA)
+            self.assertEqual(self.urlCache.versions.keys(), [self.urlCache.seq])
+
+    def test_prune_lagging_client(self):
+        # the versions since the oldest acknowledgement are kept, up to
+        # MAX_VERSIONS of them
+        other = FakeClient("other")
+        self.register(other, deltas=True)
+        self.ack(other, 1)
+        for version in range(1, 3 * autobahnServer.MAX_VERSIONS):
+            self.ack(self.client, self.urlCache.seq)
+            self.update(version)
+            self.assertTrue(len(self.urlCache.versions) <= autobahnServer.MAX_VERSIONS)
+        self.assertEqual(self.urlCache.versions.keys()[0],
+                         self.urlCache.seq - autobahnServer.MAX_VERSIONS + 1)
+
+        # and forgotten once the clients acknowledge the last version
+        self.ack(other, self.urlCache.seq)
+        self.ack(self.client, self.urlCache.seq)
+        self.assertEqual(self.urlCache.versions.keys(), [self.urlCache.seq])
+
+    def test_removed_client(self):
+        self.factory.register(self.client)
+        self.ack(self.client, 1)
+        self.update(1)
+        self.factory.unregister(self.client)
+        self.assertNotIn(URL, self.factory.urlCacheDict)
+        self.assertEqual(self.urlCache.acked, {})
+        self.assertEqual(self.urlCache.deltaClients, set())
+
+
+def matches_filter(pushFilters, events):
+    # how the relay matched the events before the filters were indexed
+    if len(pushFilters) == 0:
+        return True
+    for event in events:
+        if "event" in event and event["event"] in pushFilters:
+            filter_dict = pushFilters[event["event"]]
+            if len(filter_dict) == 0:
+                return True
+            payload = event["payload"]
+            all_filters_matched = True
+            for filterName, f in filter_dict.iteritems():
+                if filterName in payload:
+                    v = payload[filterName]
+                    if isinstance(f, dict):
+                        matched = all(n not in v or v[n] == fv for n, fv in f.iteritems())
+                    else:
+                        matched = f == v
+                    if not matched:
+                        all_filters_matched = False
+                        break
+            if all_filters_matched:
+                return True
+    return False
+
+
+class TestPushFilterIndex(unittest.TestCase):
+
+    if autobahnServer is None:
+        skip = "autobahn is not installed"
+
+    filters = {
+        "all": {},
+        "started": {"buildStarted": {}},
+        "b1": {"buildStarted": {"builderName": "b1"},
+               "buildFinished": {"builderName": "b1"}},
+        "b1-slave": {"buildStarted": {"builderName": "b1", "slavename": "s1"}},
+        "b2": {"buildStarted": {"builderName": "b2"}},
+        "branch": {"buildStarted": {"sources": {"cb": "master"}}},
+        "b1-branch": {"buildFinished": {"builderName": "b1",
+                                        "sources": {"cb": "master", "repo": "r"}}},
+        "results": {"buildFinished": {"results": [0, 1]}},
+        "text": {"buildFinished": {"results": "[0, 1]"}},
+        "number": {"buildFinished": {"number": 3, "builderName": "b3"}},
+    }
+
+    events = [
+        {"event": "buildStarted", "payload": {"builderName": "b1"}},
+        {"event": "buildStarted", "payload": {"builderName": "b1", "slavename": "s2"}},
+        {"event": "buildStarted", "payload": {"builderName": "b2", "slavename": "s1"}},
+        {"event": "buildStarted", "payload": {}},
+        {"event": "buildStarted", "payload": {"sources": {"cb": "master"}}},
+        {"event": "buildStarted", "payload": {"builderName": "b3",
+                                              "sources": {"cb": "stable"}}},
+        {"event": "buildStarted", "payload": {"sources": {"other": 1}}},
+        {"event": "buildFinished", "payload": {"builderName": "b1",
+                                               "sources": {"cb": "master"}}},
+        {"event": "buildFinished", "payload": {"builderName": "b1",
+                                               "sources": {"cb": "master", "repo": "x"}}},
+        {"event": "buildFinished", "payload": {"results": [0, 1]}},
+        {"event": "buildFinished", "payload": {"results": "[0, 1]"}},
+        {"event": "buildFinished", "payload": {"results": [1]}},
+        {"event": "buildFinished", "payload": {"number": 3}},
+        {"event": "buildFinished", "payload": {"number": 3, "builderName": "b3"}},
+        {"event": "buildFinished", "payload": {"number": 4, "builderName": "b3"}},
+        {"event": "stepStarted", "payload": {"builderName": "b1"}},
+        {"payload": {"builderName": "b1"}},
+    ]
+
+    def makeIndex(self, filters=None):
+        index = autobahnServer.PushFilterIndex()
+        if filters is None:
+            filters = self.filters
+        for url, f in filters.iteritems():
+            index.add(url, json.loads(json.dumps(f)))
+        return index
+
+    def expected(self, events, filters=None):
+        if filters is None:
+            filters = self.filters
+        return set(url for url, f in filters.iteritems()
+                   if matches_filter(f, events))
+
+    def test_match_each_event(self):
+        index = self.makeIndex()
+        for event in self.events:
+            event = json.loads(json.dumps(event))
+            self.assertEqual(index.match([event]), self.expected([event]),
+                             "matching %r" % (event,))
+
+    def test_match_events(self):
+        index = self.makeIndex()
+        events = json.loads(json.dumps(self.events))
+        for i in xrange(len(events)):
+            self.assertEqual(index.match(events[i:i + 3]), self.expected(events[i:i + 3]))
+
+    def test_match_missing_key(self):
+        index = self.makeIndex()
+        self.assertEqual(index.match([{"event": "buildStarted", "payload": {}}]),
+                         set(["all", "started", "b1", "b1-slave", "b2", "branch"]))
+
+    def test_match_unhashable(self):
+        index = self.makeIndex()
+        self.assertEqual(index.match([{"event": "buildFinished",
+                                       "payload": {"results": [0, 1], "builderName": "b2"}}]),
+                         set(["all", "results"]))
+        self.assertEqual(index.match([{"event": "buildFinished",
+                                       "payload": {"results": "[0, 1]", "builderName": "b2"}}]),
+                         set(["all", "text"]))
+
+    def test_match_nested(self):
+        index = self.makeIndex()
+        matched = index.match([{"event": "buildFinished",
+                                "payload": {"builderName": "b1",
+                                            "sources": {"cb": "master", "repo": "r"}}}])
+        self.assertIn("b1-branch", matched)
+        matched = index.match([{"event": "buildFinished",
+                                "payload": {"builderName": "b1",
+                                            "sources": {"cb": "stable", "repo": "r"}}}])
+        self.assertNotIn("b1-branch", matched)
+
+    def test_add_replaces(self):
+        index = self.makeIndex()
+        index.add("b2", {"buildStarted": {"builderName": "b3"}})
+        self.assertNotIn("b2", index.match([{"event": "buildStarted",
+                                             "payload": {"builderName": "b2"}}]))
+        self.assertIn("b2", index.match([{"event": "buildStarted",
+                                          "payload": {"builderName": "b3"}}]))
+
+    def test_remove(self):
+        index = self.makeIndex()
+        filters = dict(self.filters)
+        for url in sorted(self.filters):
+            index.remove(url)
+            del filters[url]
+            for event in self.events:
+                self.assertEqual(index.match([event]), self.expected([event], filters))
+        # no empty buckets left
+        self.assertEqual((index.matchAll, index.unconditional, index.conditional,
+                          index.entries), (set(), {}, {}, {}))
+        index.remove("unknown")
+
+    def test_remove_shared_bucket(self):
+        index = self.makeIndex({"u1": {"buildStarted": {"builderName": "b1"}},
+                                "u2": {"buildStarted": {"builderName": "b1",
+                                                        "slavename": "s1"}}})
+        index.remove("u1")
+        self.assertEqual(index.conditional,
+                         {"buildStarted": {("builderName",): {"b1": {"u2": [(("slavename",), "s1")]}}}})
+        index.remove("u2")
+        self.assertEqual(index.conditional, {})
@@ -49,6 +49,8 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
     implements(IBuildSlave)
     keepalive_timer = None
     keepalive_interval = None
+    compress_output = False
+    update_window = None
 
     # reconfig slaves after builders
     reconfig_priority = 64
@@ -56,7 +58,8 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
     def __init__(self, name, password, max_builds=None,
                  notify_on_missing=[], missing_timeout=3600,
                  properties={}, locks=None, keepalive_interval=3600,
-                 friendlyName=None, os=None, eid=-1, fqdn=None):
+                 friendlyName=None, os=None, eid=-1, fqdn=None,
+                 compress_output=False, update_window=None):
         """
         @param name: botname this machine will supply when it connects
         @param password: password this machine will supply when
@@ -72,6 +75,11 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         @type locks: dictionary
         @param fqdn: The fully qualified domain name (eg: slave1.unity.com) of the agent
         @type fqdn: string
+        @param compress_output: compress the output the slave sends, for the
+                                slaves which support it
+        @param update_window: the most output updates the slave sends before
+                              it waits for the master to acknowledge them
+                              (the default is None for no limit)
         """
         service.MultiService.__init__(self)
         self.slavename = name
@@ -120,6 +128,13 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.missing_timeout = missing_timeout
         self.missing_timer = None
         self.keepalive_interval = keepalive_interval
+        self.compress_output = compress_output
+        if update_window is not None and (not isinstance(update_window, int)
+                                          or update_window < 1):
+            config.error(
+                'update_window arg %r is not a positive integer'
+                % (update_window,))
+        self.update_window = update_window
 
         self.detached_subs = None
 
@@ -225,6 +240,8 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.access = new.access
         self.notify_on_missing = new.notify_on_missing
         self.keepalive_interval = new.keepalive_interval
+        self.compress_output = new.compress_output
+        self.update_window = new.update_window
 
         if self.missing_timeout != new.missing_timeout:
             running_missing_timer = self.missing_timer
@@ -86,14 +86,18 @@ class MasterConfig(object):
         self.buildHorizon = None
         self.logCompressionLimit = 4*1024
         self.logCompressionMethod = 'bz2'
+        self.logCompressionLevel = 9
+        self.logCompressionWorkers = 2
         self.logMaxTailSize = None
         self.logMaxSize = None
+        self.buildStatusStorage = 'pickle'
         self.properties = properties.Properties()
         self.mergeRequests = None
         self.codebaseGenerator = None
         self.prioritizeBuilders = None
         self.slavePortnum = None
         self.remoteCallTimeout = 5 # timeout in seconds
+        self.buildStartConcurrency = None
         self.multiMaster = False
         self.debugPassword = None
         self.manhole = None
@@ -118,9 +122,16 @@ class MasterConfig(object):
             db_url='sqlite:///state.sqlite',
             db_poll_interval=None,
         )
+        self.notifications = dict(
+            type=None,
+            connect=None,
+            listen=None,
+            poll_interval=300,
+        )
         self.metrics = None
         self.caches = dict(
             Builds=15,
+            BuildSummaries=5000,
             Changes=10,
         )
         self.schedulers = {}
@@ -141,12 +152,14 @@ class MasterConfig(object):
         'db', "db_poll_interval", "db_url", "debugPassword", "eventHorizon",
         "logCompressionLimit", "logCompressionMethod", "logHorizon",
         "logMaxSize", "logMaxTailSize", "manhole", "mergeRequests", "metrics",
-        "multiMaster", "prioritizeBuilders", "projects", "projectName", "projectURL",
+        "multiMaster", "notifications", "prioritizeBuilders", "projects", "projectName", "projectURL",
         "properties", "revlink", "schedulers", "slavePortnum", "slaves",
         "status", "title", "titleURL", "user_managers", "validation", "realTimeServer",
         "analytics_code", "gzip", "autobahn_push", "lastBuildCacheDays",
         "requireLogin", "globalFactory", "slave_debug_url", "slaveManagerUrl",
         "cleanUpPeriod", "buildRequestsDays", "remoteCallTimeout", "myBuildDayCount",
+        "buildStartConcurrency", "logCompressionLevel", "logCompressionWorkers",
+        "buildStatusStorage",
     ])
 
     @classmethod
@@ -228,6 +241,7 @@ class MasterConfig(object):
             config.load_global(filename, config_dict)
             config.load_validation(filename, config_dict)
             config.load_db(filename, config_dict)
+            config.load_notifications(filename, config_dict)
             config.load_metrics(filename, config_dict)
             config.load_caches(filename, config_dict)
             config.load_projects(filename, config_dict)
@@ -306,9 +320,23 @@ class MasterConfig(object):
                 error("c['logCompressionMethod'] must be 'bz2' or 'gz'")
             self.logCompressionMethod = logCompressionMethod
 
+        copy_int_param('logCompressionLevel')
+        if not 1 <= self.logCompressionLevel <= 9:
+            error("c['logCompressionLevel'] must be between 1 and 9")
+
+        copy_int_param('logCompressionWorkers')
+        if self.logCompressionWorkers < 1:
+            error("c['logCompressionWorkers'] must be at least 1")
+
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
 
+        if 'buildStatusStorage' in config_dict:
+            buildStatusStorage = config_dict.get('buildStatusStorage')
+            if buildStatusStorage not in ('pickle', 'sqlite'):
+                error("c['buildStatusStorage'] must be 'pickle' or 'sqlite'")
+            self.buildStatusStorage = buildStatusStorage
+
         properties = config_dict.get('properties', {})
         if not isinstance(properties, dict):
             error("c['properties'] must be a dictionary")
@@ -344,6 +372,10 @@ class MasterConfig(object):
 
         copy_int_param('remoteCallTimeout')
 
+        copy_int_param('buildStartConcurrency')
+        if self.buildStartConcurrency is not None and self.buildStartConcurrency < 1:
+            error("c['buildStartConcurrency'] must be at least 1")
+
         if 'multiMaster' in config_dict:
             self.multiMaster = config_dict["multiMaster"]
 
@@ -412,6 +444,31 @@ class MasterConfig(object):
         else:
             self.db['db_poll_interval'] = db_poll_interval
 
+    def load_notifications(self, filename, config_dict):
+        if 'notifications' not in config_dict:
+            return
+
+        notifications = config_dict['notifications']
+        if not isinstance(notifications, dict):
+            error("c['notifications'] must be a dictionary")
+            return
+
+        if set(notifications.keys()) - set(self.notifications.keys()):
+            error("unrecognized keys in c['notifications']")
+            return
+
+        typ = notifications.get('type')
+        if typ not in (None, 'broker'):
+            error("c['notifications']['type'] must be 'broker'")
+        elif typ == 'broker' and not notifications.get('connect'):
+            error("c['notifications']['connect'] is required by the broker notifications")
+
+        poll_interval = notifications.get('poll_interval', self.notifications['poll_interval'])
+        if not isinstance(poll_interval, int):
+            error("c['notifications']['poll_interval'] must be an int")
+
+        self.notifications.update(notifications)
+
     def load_metrics(self, filename, config_dict):
         # we don't try to validate metrics keys
         if 'metrics' in config_dict:
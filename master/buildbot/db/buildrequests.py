@@ -21,7 +21,6 @@ from datetime import datetime, timedelta
 from twisted.internet import reactor, defer
 from twisted.python import log
 from buildbot.db import base
-from buildbot.util import json
 from buildbot.util import epoch2datetime, datetime2epoch
 from buildbot.status.results import RESUME, CANCELED
 from twisted.python.failure import Failure
@@ -57,6 +56,31 @@ def mkdt(epoch):
         return epoch2datetime(epoch)
 
 
+def orderByQueue(query, buildrequests_tbl):
+    """
+    Order C{query} by the queue order: higher priority first, then oldest
+    submitted time, then lowest id (so the order is total and can be used
+    to page through the queue).
+    """
+    return query.order_by(sa.desc(buildrequests_tbl.c.priority),
+                          sa.asc(buildrequests_tbl.c.submitted_at),
+                          sa.asc(buildrequests_tbl.c.id))
+
+
+def afterInQueue(after, buildrequests_tbl):
+    """
+    Keyset condition selecting the requests that come after the brdict
+    C{after} in the queue order (see L{orderByQueue}).
+    """
+    priority = after['priority']
+    submitted_at = datetime2epoch(after['submitted_at'])
+    return ((buildrequests_tbl.c.priority < priority)
+            | ((buildrequests_tbl.c.priority == priority)
+               & ((buildrequests_tbl.c.submitted_at > submitted_at)
+                  | ((buildrequests_tbl.c.submitted_at == submitted_at)
+                     & (buildrequests_tbl.c.id > after['brid'])))))
+
+
 # Utility function that returns the query
 # Adding the filters that excludes requests that doesnt match all the selected codebases
 def maybeFilterBuildRequestsBySourceStamps(query, sourcestamps, buildrequests_tbl,
@@ -247,7 +271,25 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
     @with_master_objectid
     def getBuildRequestInQueue(self, brids=None, buildername=None, sourcestamps=None,
-                               _master_objectid=None, sorted=False, limit=False):
+                               _master_objectid=None, sorted=False, limit=False, after=None):
+        """
+        Finds the unclaimed buildrequests and the buildrequests claimed by this
+        master waiting to be resumed.
+
+        @param sorted: order the results by the queue order, the unclaimed
+        requests first
+        @param limit: if True, return at most 200 requests; an integer sets
+        another limit.  The page is ordered by the queue order, whatever the
+        queue of the requests
+        @param after: only return the requests that come after this brdict in
+        the queue order; used with C{sorted} and C{limit} to page through the
+        queue
+
+        @returns: list of brdicts
+        """
+        if limit is True:
+            limit = 200
+
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
@@ -262,11 +304,14 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                 if brids:
                     query = query.where(reqs_tbl.c.id.in_(brids))
 
+                if after is not None:
+                    query = query.where(afterInQueue(after, reqs_tbl))
+
                 if limit:
-                    query = query.limit(200)
+                    query = query.limit(limit)
 
                 if sorted:
-                    query = query.order_by(sa.desc(reqs_tbl.c.priority), sa.asc(reqs_tbl.c.submitted_at))
+                    query = orderByQueue(query, reqs_tbl)
 
                 query = maybeFilterBuildRequestsBySourceStamps(query=query,
                                                                sourcestamps=sourcestamps,
@@ -308,14 +353,20 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
             result = getResults(buildqueue)
 
+            # each part of the union is sorted and limited on its own, merge
+            # them to return a single page
+            if limit:
+                result.sort(key=lambda br: (-br['priority'], br['submitted_at'], br['brid']))
+                result = result[:limit]
+
             return result
 
         return self.db.pool.do(thd)
 
     @with_master_objectid
     def getBuildRequestsInQueue(self, queue, buildername=None, sourcestamps=None,
-                                mergebrids=None, startbrid=None,
-                                order=True, _master_objectid=None):
+                                mergebrids=None, startbrid=None, brids=None,
+                                order=True, limit=None, after=None, _master_objectid=None):
         """
         Finds the buildrequests that are in queue waiting to be process
         it will return empty list if there are no pending request.
@@ -326,43 +377,37 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         @param sourcestamps: filter the results by sourcestamps
         @param mergebrids: fetch buildrequest that has been merged with brids
         @param startbrid: filter pending builds that belong to same build chain
+        @param brids: only return the given buildrequests, if they are in queue
         @param order: order the resutls by higher priority and oldest submitted time
         this can be skipped when applying filters to check request that can be merged.
+        @param limit: return at most this number of requests
+        @param after: only return the requests that come after this brdict in
+        the queue order; pass the last brdict of the previous call, together
+        with C{limit}, to page through the queue
 
         @returns: a build request dictionary or empty list
         """
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
-            buildset_properties_tbl = self.db.model.buildset_properties
             sourcestamps_tbl = self.db.model.sourcestamps
             sourcestampsets_tbl = self.db.model.sourcestampsets
             buildsets_tbl = self.db.model.buildsets
 
-            pending = sa.select([reqs_tbl.c.id, reqs_tbl.c.buildername, reqs_tbl.c.priority,
-                                 reqs_tbl.c.submitted_at, reqs_tbl.c.results,
-                                 reqs_tbl.c.buildsetid,
-                                 buildset_properties_tbl.c.property_value,
-                                 reqs_tbl.c.slavepool, reqs_tbl.c.startbrid],
-                                from_obj=reqs_tbl.outerjoin(claims_tbl, (reqs_tbl.c.id == claims_tbl.c.brid))
-                                .outerjoin(buildset_properties_tbl,
-                                           (buildset_properties_tbl.c.buildsetid == reqs_tbl.c.buildsetid)
-                                           & (buildset_properties_tbl.c.property_name == 'selected_slave')),
+            columns = [reqs_tbl.c.id, reqs_tbl.c.buildername, reqs_tbl.c.priority,
+                       reqs_tbl.c.submitted_at, reqs_tbl.c.results,
+                       reqs_tbl.c.buildsetid, reqs_tbl.c.selected_slave,
+                       reqs_tbl.c.slavepool, reqs_tbl.c.startbrid]
+
+            pending = sa.select(columns,
+                                from_obj=reqs_tbl.outerjoin(claims_tbl, (reqs_tbl.c.id == claims_tbl.c.brid)),
                                 whereclause=((claims_tbl.c.claimed_at == None) &
                                              (reqs_tbl.c.complete == 0)))
 
-            resumebuilds = sa.select([reqs_tbl.c.id,
-                                      reqs_tbl.c.buildername, reqs_tbl.c.priority,
-                                      reqs_tbl.c.submitted_at, reqs_tbl.c.results,
-                                      reqs_tbl.c.buildsetid,
-                                      buildset_properties_tbl.c.property_value,
-                                      reqs_tbl.c.slavepool, reqs_tbl.c.startbrid],
+            resumebuilds = sa.select(columns,
                                      from_obj=reqs_tbl.join(claims_tbl,
                                                             (reqs_tbl.c.id == claims_tbl.c.brid)
-                                                            & (claims_tbl.c.objectid == _master_objectid))
-                                     .outerjoin(buildset_properties_tbl,
-                                                (buildset_properties_tbl.c.buildsetid == reqs_tbl.c.buildsetid)
-                                                & (buildset_properties_tbl.c.property_name == 'selected_slave'))) \
+                                                            & (claims_tbl.c.objectid == _master_objectid))) \
                 .where(reqs_tbl.c.complete == 0) \
                 .where(reqs_tbl.c.results == RESUME)
 
@@ -394,31 +439,46 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             if startbrid:
                 buildersqueue = buildersqueue.where(reqs_tbl.c.startbrid == startbrid)
 
+            if after is not None:
+                buildersqueue = buildersqueue.where(afterInQueue(after, reqs_tbl))
+
             if order:
-                buildersqueue = buildersqueue.order_by(sa.desc(reqs_tbl.c.priority), sa.asc(reqs_tbl.c.submitted_at))
+                buildersqueue = orderByQueue(buildersqueue, reqs_tbl)
+            else:
+                # keep the results stable whichever index the database uses
+                buildersqueue = buildersqueue.order_by(reqs_tbl.c.id)
 
-            # TODO: for performance we may need to limit the result
-            res = conn.execute(buildersqueue)
+            if limit:
+                buildersqueue = buildersqueue.limit(limit)
 
-            rows = res.fetchall()
             rv = []
 
-            def getSelectedSlave(row):
-                return json.loads(row.property_value)[0] if row.property_value and len(row.property_value) > 0 else None
+            def fetchRows(stmt):
+                res = conn.execute(stmt)
+                rows = res.fetchall()
+                for row in rows:
+                    if row:
+                        rv.append(dict(brid=row.id,
+                                       buildername=row.buildername,
+                                       priority=row.priority,
+                                       submitted_at=mkdt(row.submitted_at),
+                                       results=row.results,
+                                       buildsetid=row.buildsetid,
+                                       selected_slave=row.selected_slave,
+                                       slavepool=row.slavepool,
+                                       startbrid=row.startbrid))
+                res.close()
 
-            for row in rows:
-                if row:
-                    rv.append(dict(brid=row.id,
-                                   buildername=row.buildername,
-                                   priority=row.priority,
-                                   submitted_at=mkdt(row.submitted_at),
-                                   results=row.results,
-                                   buildsetid=row.buildsetid,
-                                   selected_slave=getSelectedSlave(row),
-                                   slavepool=row.slavepool,
-                                   startbrid=row.startbrid))
+            if brids is not None:
+                # query in batches to avoid hitting the DBAPI parameter limits
+                iterator = iter(brids)
+                batch = list(itertools.islice(iterator, 100))
+                while len(batch) > 0:
+                    fetchRows(buildersqueue.where(reqs_tbl.c.id.in_(batch)))
+                    batch = list(itertools.islice(iterator, 100))
+                return rv
 
-            res.close()
+            fetchRows(buildersqueue)
             return rv
 
         return self.db.pool.do(thd)
@@ -56,6 +56,7 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
 
         def thd(conn):
             priority = Priority.Default
+            selected_slave = None
             buildsets_tbl = self.db.model.buildsets
             submitted_at = _reactor.seconds()
 
@@ -80,6 +81,9 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                     priority_property = properties.get('priority')[0]
                     priority = priority_property if priority_property \
                                                     and int(priority_property) > 0 else Priority.Default
+                if 'selected_slave' in properties:
+                    # copied to the build requests, to be read by the queue queries
+                    selected_slave = properties.get('selected_slave')[0] or None
 
                 inserts = [
                     dict(buildsetid=bsid, property_name=k,
@@ -130,7 +134,8 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                                         complete=0, results=-1,
                                         submitted_at=submitted_at, complete_at=None,
                                         triggeredbybrid=triggeredbybrid, startbrid=startbrid,
-                                        mergebrid=mergebrid, artifactbrid=artifactbrid))
+                                        mergebrid=mergebrid, artifactbrid=artifactbrid,
+                                        selected_slave=selected_slave))
                 brids[buildername] = res.inserted_primary_key[0]
 
             # Do the rest of the merge process for merged builds
@@ -0,0 +1,48 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+from buildbot.util import json
+
+def upgrade(migrate_engine):
+
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    buildrequests = sa.Table('buildrequests', metadata, autoload=True)
+    buildset_properties = sa.Table('buildset_properties', metadata, autoload=True)
+
+    selected_slave = sa.Column('selected_slave', sa.String(255), nullable=True)
+    selected_slave.create(buildrequests)
+    sa.Index('buildrequests_selected_slave', buildrequests.c.selected_slave).create()
+
+    # copy the 'selected_slave' buildset property to the build requests
+    q = sa.select([buildset_properties.c.buildsetid,
+                   buildset_properties.c.property_value],
+                  whereclause=(buildset_properties.c.property_name == 'selected_slave'))
+    updates = []
+    for row in migrate_engine.execute(q).fetchall():
+        try:
+            value = json.loads(row.property_value)[0]
+        except (ValueError, TypeError, IndexError):
+            continue
+        if value and isinstance(value, basestring):
+            updates.append(dict(b_buildsetid=row.buildsetid, b_selected_slave=value[:255]))
+
+    if updates:
+        u = buildrequests.update() \
+            .where(buildrequests.c.buildsetid == sa.bindparam('b_buildsetid')) \
+            .values(selected_slave=sa.bindparam('b_selected_slave'))
+        migrate_engine.execute(u, updates)
@@ -77,7 +77,9 @@ class Model(base.DBConnectorComponent):
         sa.Column('triggeredbybrid', sa.Integer, sa.ForeignKey('buildrequests.id'), nullable=True),
         sa.Column('mergebrid', sa.Integer, sa.ForeignKey('buildrequests.id'), nullable=True),
         sa.Column('startbrid', sa.Integer, sa.ForeignKey('buildrequests.id'), nullable=True),
-        sa.Column('slavepool', sa.Text, nullable=True)
+        sa.Column('slavepool', sa.Text, nullable=True),
+        # the slave selected in the 'selected_slave' buildset property, if any
+        sa.Column('selected_slave', sa.String(255), nullable=True)
     )
 
     # Each row in this table represents a claimed build request, where the
@@ -432,6 +434,9 @@ class Model(base.DBConnectorComponent):
     sa.Index('buildrequests_triggeredbybrid', buildrequests.c.triggeredbybrid, unique=False)
     sa.Index('buildrequests_mergebrid', buildrequests.c.mergebrid, unique=False)
     sa.Index('buildrequests_startbrid', buildrequests.c.startbrid, unique=False)
+    sa.Index('buildrequests_selected_slave', buildrequests.c.selected_slave, unique=False)
+    sa.Index('buildrequests_queue', buildrequests.c.complete, buildrequests.c.mergebrid,
+            buildrequests.c.priority, buildrequests.c.submitted_at, buildrequests.c.id)
     sa.Index('builds_slavename', builds.c.slavename, unique=False)
     sa.Index('user_properties_uid', user_props.c.uid, unique=False)
     sa.Index('user_props_attrs', user_props.c.prop_type, user_props.c.prop_data)
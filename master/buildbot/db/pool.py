@@ -21,8 +21,8 @@ import os
 import sqlalchemy as sa
 import tempfile
 from buildbot.process import metrics
-from twisted.internet import reactor, threads
-from twisted.python import threadpool, log
+from twisted.internet import defer, reactor, threads
+from twisted.python import context, threadpool, log
 
 # set this to True for *very* verbose query debugging output; this can
 # be monkey-patched from master.cfg, too:
@@ -78,10 +78,57 @@ def timed_do_fn(f):
     wrap.__doc__ = f.__doc__
     return wrap
 
+class QueryCounter(object):
+    """
+    Counts the queries sent to the pool by an operation, however many times
+    it waits for them: the callbacks of the queries run with the counter of
+    their caller, so that the next queries of the operation are counted too,
+    and not the queries of the code running meanwhile.
+    """
+
+    def __init__(self):
+        self.queries = 0
+
+    def run(self, f, *args, **kwargs):
+        """
+        Call C{f}, counting its queries.
+
+        @returns: the result of C{f}, via Deferred
+        """
+        return self._run(self, f, *args, **kwargs)
+
+    @classmethod
+    def runUncounted(cls, f, *args, **kwargs):
+        """
+        Call C{f} without counting its queries, e.g. for the work an operation
+        starts but does not wait for.
+
+        @returns: the result of C{f}, via Deferred
+        """
+        return cls._run(None, f, *args, **kwargs)
+
+    @staticmethod
+    def _run(counter, f, *args, **kwargs):
+        # the result is fired with the counter of the caller
+        outer = QueryCounter.current()
+        d = defer.maybeDeferred(context.call, {QueryCounter: counter}, f, *args, **kwargs)
+        done = defer.Deferred()
+        d.addBoth(lambda result: context.call({QueryCounter: outer}, done.callback, result))
+        return done
+
+    @staticmethod
+    def current():
+        return context.get(QueryCounter)
+
+
 class DBThreadPool(threadpool.ThreadPool):
 
     running = False
 
+    # number of queries sent to the pool, used to measure the database round
+    # trips done by a given operation
+    round_trips = 0
+
     # Some versions of SQLite incorrectly cache metadata about which tables are
     # and are not present on a per-connection basis.  This cache can be flushed
     # by querying the sqlite_master table.  We currently assume all versions of
@@ -216,12 +263,24 @@ class DBThreadPool(threadpool.ThreadPool):
         return rv
 
     def do(self, callable, *args, **kwargs):
-        return threads.deferToThreadPool(reactor, self,
-                self.__thd, False, callable, args, kwargs)
+        return self._defer(False, callable, args, kwargs)
 
     def do_with_engine(self, callable, *args, **kwargs):
-        return threads.deferToThreadPool(reactor, self,
-                self.__thd, True, callable, args, kwargs)
+        return self._defer(True, callable, args, kwargs)
+
+    def _defer(self, with_engine, callable, args, kwargs):
+        self.round_trips += 1
+        d = threads.deferToThreadPool(reactor, self,
+                self.__thd, with_engine, callable, args, kwargs)
+        counter = QueryCounter.current()
+        if counter is None:
+            return d
+        counter.queries += 1
+        # fire the result with the counter of the caller
+        counted = defer.Deferred()
+        d.addBoth(lambda result: context.call({QueryCounter: counter},
+                                              counted.callback, result))
+        return counted
 
     def detect_bug1810(self):
         # detect buggy SQLite implementations; call only for a known-sqlite
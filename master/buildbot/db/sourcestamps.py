@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import base64
+import itertools
 import sqlalchemy as sa
 from twisted.internet import defer
 from twisted.python import log
@@ -111,6 +112,76 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
             sslist.append(sourcestamp)
         defer.returnValue(sslist)
 
+    def getSourceStampsForSets(self, sourcestampsetids):
+        """
+        Bulk version of L{getSourceStamps}: fetch the sourcestamps of several
+        sourcestampsets, with their patches and change ids, using a few
+        C{IN (...)} queries instead of a set of queries per sourcestamp.
+
+        @returns: dict mapping sourcestampsetid to an L{SsList}, via Deferred
+        """
+        def thd(conn):
+            ss_tbl = self.db.model.sourcestamps
+            patches_tbl = self.db.model.patches
+            changes_tbl = self.db.model.sourcestamp_changes
+
+            rv = {}
+            for setid in sourcestampsetids:
+                rv[setid] = SsList()
+
+            # query in batches to avoid hitting the DBAPI parameter limits
+            iterator = iter(set(sourcestampsetids))
+            batch = list(itertools.islice(iterator, 100))
+            while len(batch) > 0:
+                ssdicts = {}
+                patchids = {}
+                q = ss_tbl.select(whereclause=(ss_tbl.c.sourcestampsetid.in_(batch)))
+                q = q.order_by(ss_tbl.c.id)
+                res = conn.execute(q)
+                for row in res.fetchall():
+                    ssdict = SsDict(ssid=row.id, branch=row.branch, sourcestampsetid=row.sourcestampsetid,
+                            revision=row.revision, patch_body=None, patch_level=None,
+                            patch_author=None, patch_comment=None, patch_subdir=None,
+                            repository=row.repository, codebase=row.codebase,
+                            project=row.project,
+                            changeids=set([]))
+                    ssdicts[row.id] = ssdict
+                    if row.patchid is not None:
+                        patchids.setdefault(row.patchid, []).append(ssdict)
+                    rv[row.sourcestampsetid].append(ssdict)
+                res.close()
+
+                # fetch the patches, if necessary
+                if patchids:
+                    q = patches_tbl.select(whereclause=(patches_tbl.c.id.in_(patchids.keys())))
+                    res = conn.execute(q)
+                    for row in res.fetchall():
+                        for ssdict in patchids.pop(row.id):
+                            # note the subtle renaming here
+                            ssdict['patch_level'] = row.patchlevel
+                            ssdict['patch_subdir'] = row.subdir
+                            ssdict['patch_author'] = row.patch_author
+                            ssdict['patch_comment'] = row.patch_comment
+                            ssdict['patch_body'] = base64.b64decode(row.patch_base64)
+                    res.close()
+                    for patchid, missing in patchids.iteritems():
+                        for ssdict in missing:
+                            log.msg('patchid %d, referenced from ssid %d, not found'
+                                    % (patchid, ssdict['ssid']))
+
+                # fetch change ids
+                if ssdicts:
+                    q = changes_tbl.select(whereclause=(changes_tbl.c.sourcestampid.in_(ssdicts.keys())))
+                    res = conn.execute(q)
+                    for row in res.fetchall():
+                        ssdicts[row.sourcestampid]['changeids'].add(row.changeid)
+                    res.close()
+
+                batch = list(itertools.islice(iterator, 100))
+
+            return rv
+        return self.db.pool.do(thd)
+
     def getSimpleSourceStamps(self, sourcestampsetid):
         """
         :param sourcestampsetid:
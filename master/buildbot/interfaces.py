@@ -805,10 +805,29 @@ class IStatusLog(Interface):
         """Return one big string with the contents of the Log. This merges
         all chunks (including headers) together."""
 
-    def getChunks():
+    def getChunks(channels=[], onlyText=False, offset=0):
         """Generate a list of (channel, text) tuples. 'channel' is a number,
         0 for stdout, 1 for stderr, 2 for header. (note that stderr is merged
-        into stdout if PTYs are in use)."""
+        into stdout if PTYs are in use). 'offset' is where to start in the
+        on-disk encoding of the log, and must be a chunk boundary."""
+
+    def getLines(start=0, stop=None, channels=[0, 1, 2]):
+        """Return the lines start to stop of the text of the given channels,
+        as a list of strings like getTextWithHeaders().splitlines(True)[start:stop]
+        does, without reading the whole log."""
+
+    def generateLines(start=0, stop=None, channels=[0, 1, 2]):
+        """Generate the text of the lines start to stop of the given
+        channels."""
+
+    def generateText(start=0, stop=None, channels=[0, 1, 2]):
+        """Generate the text of the given channels from byte start to stop."""
+
+    def getLineCount(channels=[0, 1, 2]):
+        """Return the number of lines of the text of the given channels."""
+
+    def getTextLength(channels=[0, 1, 2]):
+        """Return the length of the text of the given channels."""
 
 class IStatusLogConsumer(Interface):
     """I am an object which can be passed to IStatusLog.subscribeConsumer().
@@ -29,6 +29,7 @@ import buildbot.pbmanager
 from buildbot.process.buildrequestmerger import BuildRequestMerger
 from buildbot.util import subscription, epoch2datetime
 from buildbot.status.master import Status
+from buildbot.status.logcompressor import LogCompressor
 from buildbot.changes import changes
 from buildbot.changes.manager import ChangeManager
 from buildbot import interfaces
@@ -37,6 +38,7 @@ from buildbot.db import connector
 from buildbot.schedulers.manager import SchedulerManager
 from buildbot.process.botmaster import BotMaster
 from buildbot.process import debug
+from buildbot.process.notifications import NotificationBus
 from buildbot.process import metrics
 from buildbot.process import cache
 from buildbot.process.users import users
@@ -118,6 +120,10 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # local cache for this master's object ID
         self._object_id = None
 
+        # changes already delivered to the subscribers, which should not be
+        # delivered again by the database poll
+        self._notified_changeids = set()
+
 
     def create_child_services(self):
         # note that these are order-dependent.  If you get the order wrong,
@@ -126,6 +132,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self.metrics = metrics.MetricLogObserver()
         self.metrics.setServiceParent(self)
 
+        self.log_compressor = LogCompressor()
+        self.log_compressor.setServiceParent(self)
+
         self.caches = cache.CacheManager()
         self.caches.setServiceParent(self)
 
@@ -147,6 +156,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self.db = connector.DBConnector(self, self.basedir)
         self.db.setServiceParent(self)
 
+        self.notifications = NotificationBus(self)
+        self.notifications.setServiceParent(self)
+
         self.debug = debug.DebugServices(self)
         self.debug.setServiceParent(self)
 
@@ -350,9 +362,14 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # try to start the builds after all the services are configured
         self.botmaster.maybeStartBuildsForAllBuilders()
 
-        # adjust the db poller
-        if self.configured_poll_interval != new_config.db['db_poll_interval']:
-            self.configured_poll_interval = new_config.db['db_poll_interval']
+        # adjust the db poller; when the other masters push their events, the
+        # poll only reconciles the events missed while disconnected
+        poll_interval = new_config.db['db_poll_interval']
+        if poll_interval and new_config.notifications['type']:
+            poll_interval = max(poll_interval, new_config.notifications['poll_interval'])
+
+        if self.configured_poll_interval != poll_interval:
+            self.configured_poll_interval = poll_interval
 
         # resume the db poller
         if self.configured_poll_interval:
@@ -552,6 +569,15 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                                           repository=repository, codebase=codebase,
                                           project=project, uid=uid))
 
+        # claim the change before anything yields, so that a poll running
+        # meanwhile does not deliver it as well
+        claimed = []
+        def claim(changeid):
+            if self._deliversImmediately() and self._claimChange(changeid):
+                claimed.append(changeid)
+            return changeid
+        d.addCallback(claim)
+
         # convert the changeid to a Change instance
         d.addCallback(lambda changeid :
             self.db.changes.getChange(changeid))
@@ -561,13 +587,53 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         def notify(change):
             msg = u"added change %s to database" % change
             log.msg(msg.encode('utf-8', 'replace'))
-            # only deliver messages immediately if we're not polling
-            if not self.config.db['db_poll_interval']:
+            if claimed:
                 self._change_subs.deliver(change)
+            if self._deliversImmediately():
+                self.notifications.publish('change_added', changeid=change.number)
             return change
-        d.addCallback(notify)
+        def unclaim(failure):
+            for changeid in claimed:
+                self._notified_changeids.discard(changeid)
+            return failure
+        d.addCallbacks(notify, unclaim)
         return d
 
+    def _deliversImmediately(self):
+        # events are delivered as they happen unless the other masters only
+        # learn about them by polling the database
+        return not self.config.db['db_poll_interval'] or self.notifications.isEnabled()
+
+    def _claimChange(self, changeid):
+        # returns False if the change was delivered already, or is being
+        # delivered; otherwise marks it as delivered, before the delivery
+        # yields, so that the poll and the notifications deliver it once
+        if changeid in self._notified_changeids or \
+                (self._last_processed_change is not None and changeid <= self._last_processed_change):
+            return False
+        if self.configured_poll_interval:
+            self._notified_changeids.add(changeid)
+        return True
+
+    @defer.inlineCallbacks
+    def _deliverChangeById(self, changeid):
+        # a change added on another master
+        if not self._claimChange(changeid):
+            return
+        try:
+            chdict = yield self.db.changes.getChange(changeid)
+            change = None
+            if chdict is not None:
+                change = yield changes.Change.fromChdict(self, chdict)
+        except Exception:
+            self._notified_changeids.discard(changeid)
+            raise
+        if change is None:
+            # not there yet, the poll will deliver it
+            self._notified_changeids.discard(changeid)
+            return
+        self._change_subs.deliver(change)
+
     def subscribeToChanges(self, callback):
         """
         Request that C{callback} be called with each Change object added to the
@@ -590,8 +656,7 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             log.msg("added buildset %d to database" % bsid)
             # note that buildset additions are only reported on this master
             self._new_buildset_subs.deliver(bsid=bsid, **kwargs)
-            # only deliver messages immediately if we're not polling
-            if not self.config.db['db_poll_interval']:
+            if self._deliversImmediately():
                 for bn, brid in brids.iteritems():
                     self.buildRequestAdded(bsid=bsid, brid=brid,
                                            buildername=bn)
@@ -646,6 +711,10 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self._buildsetComplete(bsid, cumulative_results)
 
     def _buildsetComplete(self, bsid, results):
+        self._deliverBuildsetComplete(bsid, results)
+        self.notifications.publish('buildset_complete', bsid=bsid, results=results)
+
+    def _deliverBuildsetComplete(self, bsid, results):
         self._complete_buildset_subs.deliver(bsid, results)
 
     def subscribeToBuildsetCompletions(self, callback):
@@ -667,6 +736,11 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         @param brid: buildrequest ID
         @param buildername: builder named by the build request
         """
+        self._deliverBuildRequestAdded(bsid, brid, buildername)
+        self.notifications.publish('buildrequest_added',
+                bsid=bsid, brid=brid, buildername=buildername)
+
+    def _deliverBuildRequestAdded(self, bsid, brid, buildername):
         self._new_buildrequest_subs.deliver(
                 dict(bsid=bsid, brid=brid, buildername=buildername))
 
@@ -680,6 +754,11 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         @param brid: buildrequest ID
         @param buildername: builder named by the build request
         """
+        self._deliverBuildRequestRemoved(bsid, brid, buildername)
+        self.notifications.publish('buildrequest_removed',
+                bsid=bsid, brid=brid, buildername=buildername)
+
+    def _deliverBuildRequestRemoved(self, bsid, brid, buildername):
         self._cancelled_buildrequest_subs.deliver(
                 dict(bsid=bsid, brid=brid, buildername=buildername))
 
@@ -762,10 +841,19 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         chdicts = yield self.db.changes.getChangesGreaterThan(self._last_processed_change)
         if chdicts:
             for chdict in chdicts:
-                change = yield changes.Change.fromChdict(self, chdict)
+                # claimed before yielding, see _claimChange
+                if not self._claimChange(chdict['changeid']):
+                    continue
+                try:
+                    change = yield changes.Change.fromChdict(self, chdict)
+                except Exception:
+                    self._notified_changeids.discard(chdict['changeid'])
+                    raise
                 self._change_subs.deliver(change)
 
             self._last_processed_change = chdicts[-1]['changeid']
+            self._notified_changeids = set(changeid for changeid in self._notified_changeids
+                                           if changeid > self._last_processed_change)
             need_setState = True
 
         # write back the updated state, if it's changed
@@ -818,8 +906,8 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             brdicts = dict((brd['brid'], brd) for brd in now_unclaimed_brdicts)
             for brid in new_unclaimed:
                 brd = brdicts[brid]
-                self.buildRequestAdded(brd['buildsetid'], brd['brid'],
-                                       brd['buildername'])
+                self._deliverBuildRequestAdded(brd['buildsetid'], brd['brid'],
+                                               brd['buildername'])
         timer.stop()
 
     ## state maintenance (private)
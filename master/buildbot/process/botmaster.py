@@ -25,6 +25,7 @@ from buildbot import interfaces, locks, config, util
 from buildbot.process import metrics
 from buildbot.process.buildrequest import BuildRequest, BuildRequestControl
 from buildbot.process.buildrequestdistributor import KatanaBuildRequestDistributor
+from buildbot.process.slaveavailability import SlaveAvailabilityIndex
 import klog
 
 
@@ -68,6 +69,9 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # subscription to new build requests
         self.buildrequest_sub = None
 
+        # idle slavebuilders, kept up to date by the builders
+        self.slaveAvailability = SlaveAvailabilityIndex()
+
         # a distributor for incoming build requests; see below
         self.brd = KatanaBuildRequestDistributor(self)
         self.brd.setServiceParent(self)
@@ -272,6 +276,7 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 builder = old_by_name[n]
 
                 del self.builders[n]
+                self.slaveAvailability.removeBuilder(n)
                 builder.master = None
                 builder.botmaster = None
 
@@ -77,6 +77,7 @@ class Builder(config.ReconfigurableServiceMixin,
 
         self.config = None
         self.builder_status = None
+        self.botmaster = None
 
         if _addServices:
             self.reclaim_svc = internet.TimerService(10*60,
@@ -191,11 +192,32 @@ class Builder(config.ReconfigurableServiceMixin,
         if sb in self.slaves:
             self.slaves.remove(sb)
 
+        slaveAvailability = self.getSlaveAvailabilityIndex()
+        if slaveAvailability is not None:
+            slaveAvailability.removeSlaveBuilder(self.name, sb)
+
     def addSlaveBuilder(self, sb):
         if self.isStartSlave(sb):
             self.startSlaves.append(sb)
+            slavepool = Slavepool.startSlavenames
         else:
             self.slaves.append(sb)
+            slavepool = Slavepool.slavenames
+
+        slaveAvailability = self.getSlaveAvailabilityIndex()
+        if slaveAvailability is not None:
+            slaveAvailability.addSlaveBuilder(self.name, slavepool, sb, idle=not sb.isBusy())
+
+    def getSlaveAvailabilityIndex(self):
+        if self.botmaster is None:
+            return None
+        return self.botmaster.slaveAvailability
+
+    def slaveBuilderStateChanged(self, sb):
+        # called by the slavebuilder when it starts or finishes a build
+        slaveAvailability = self.getSlaveAvailabilityIndex()
+        if slaveAvailability is not None:
+            slaveAvailability.setIdle(self.name, sb, not sb.isBusy())
 
     def addLatentSlave(self, slave):
         assert interfaces.ILatentBuildSlave.providedBy(slave)
@@ -322,8 +344,18 @@ class Builder(config.ReconfigurableServiceMixin,
         return [sb for sb in self.slaves
                 if sb.isAvailable()]
 
+    def getSlavepoolToProcessBuildRequests(self, slavepool):
+        """
+        Returns the slavepool whose slaves are used to process buildrequests
+        from C{slavepool}, builders without startSlavenames use 'slavenames'
+        """
+        if self.config.startSlavenames and slavepool == Slavepool.startSlavenames:
+            return Slavepool.startSlavenames
+        return Slavepool.slavenames
+
     def getAvailableSlavesToProcessBuildRequests(self, slavepool):
-        slavelist = self.startSlaves if (self.config.startSlavenames and slavepool == Slavepool.startSlavenames) \
+        slavelist = self.startSlaves \
+            if self.getSlavepoolToProcessBuildRequests(slavepool) == Slavepool.startSlavenames \
             else self.slaves
 
         return [sb for sb in slavelist if sb.isAvailable()]
@@ -660,6 +692,8 @@ class Builder(config.ReconfigurableServiceMixin,
     def _resubmit_buildreqs(self, out=None, requests=None):
         brids = [br.id for br in requests]
         yield self.master.db.buildrequests.unclaimBuildRequests(brids, results=BEGINNING)
+        for br in requests:
+            self.master.buildRequestAdded(br.bsid, br.id, self.name)
         defer.returnValue(out)
 
     def setExpectations(self, progress):
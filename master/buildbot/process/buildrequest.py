@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import calendar
+import itertools
 import klog
 from zope.interface import implements
 from twisted.python import log
@@ -119,6 +120,40 @@ class BuildRequest(object):
         d.addCallback(updateRequest)
         return d
 
+    @classmethod
+    @defer.inlineCallbacks
+    def fromBrdicts(cls, master, brdicts):
+        """
+        Bulk version of L{fromBrdict}: the buildsets, buildset properties and
+        sourcestamps of the requests missing from the cache are fetched with a
+        few queries per batch of requests, instead of a few queries per request.
+
+        @param master: current build master
+        @param brdicts: list of build request dictionaries
+
+        @returns: list of L{BuildRequest}, in the order of C{brdicts}, via
+        Deferred
+        """
+        cache = master.caches.get_cache("BuildRequests", cls._make_br)
+
+        loaded = {}
+        iterator = (brdict for brdict in brdicts if brdict['brid'] not in cache)
+        batch = list(itertools.islice(iterator, 100))
+        while len(batch) > 0:
+            breqs = yield cls._make_brs(master, batch)
+            for breq in breqs:
+                cache.put_new(breq.id, breq)
+                loaded[breq.id] = breq
+            batch = list(itertools.islice(iterator, 100))
+
+        rv = []
+        for brdict in brdicts:
+            breq = loaded.get(brdict['brid'])
+            if breq is None:
+                breq = yield cls.fromBrdict(master, brdict)
+            rv.append(breq)
+        defer.returnValue(rv)
+
     @classmethod
     def makeBuildRequest(cls, master, brdict, buildset, props, sources):
         buildrequest = cls()
@@ -176,6 +211,35 @@ class BuildRequest(object):
         buildrequest = cls.makeBuildRequest(master, brdict, buildset, props, sources)
         defer.returnValue(buildrequest)
 
+    @classmethod
+    @defer.inlineCallbacks
+    def _make_brs(cls, master, brdicts):
+        bsids = list(set(brdict['buildsetid'] for brdict in brdicts))
+        buildsets = yield master.db.buildsets.getBuildsetsByIds(bsids)
+        buildsets_properties = yield master.db.buildsets.getBuildsetsProperties(bsids)
+
+        sourcestampsetids = set(bs['sourcestampsetid'] for bs in buildsets.itervalues())
+        sslists = yield master.db.sourcestamps.getSourceStampsForSets(list(sourcestampsetids))
+
+        # turn the sourcestamp dictionaries into SourceStamps, once per set
+        setsources = {}
+        for sourcestampsetid, sslist in sslists.iteritems():
+            assert len(sslist) > 0, "Empty sourcestampset: db schema enforces set to exist but cannot enforce a non empty set"
+            ss_list = yield defer.gatherResults([sourcestamp.SourceStamp.fromSsdict(master, ssdict)
+                                                 for ssdict in sslist])
+            setsources[sourcestampsetid] = ss_list
+
+        breqs = []
+        for brdict in brdicts:
+            buildset = buildsets.get(brdict['buildsetid'])
+            assert buildset # schema should guarantee this
+            props = properties.Properties.fromDict(buildsets_properties.get(brdict['buildsetid'], {}))
+            sources = {}
+            for source in setsources[buildset['sourcestampsetid']]:
+                sources[source.codebase] = source
+            breqs.append(cls.makeBuildRequest(master, brdict, buildset, props, sources))
+        defer.returnValue(breqs)
+
     def requestsHaveSameCodebases(self, other):
         self_codebases = set(self.sources.iterkeys())
         other_codebases = set(other.sources.iterkeys())      
@@ -17,13 +17,15 @@ import json
 
 from twisted.python import log
 from twisted.python.failure import Failure
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.application import service
 
 from buildbot.process import metrics
 from buildbot.process.buildrequest import BuildRequest
+from buildbot.process.buildrequestqueue import BuildRequestQueue, queueKey
 from buildbot.status.results import RESUME, BEGINNING
 from buildbot.db.buildrequests import AlreadyClaimedError, UnsupportedQueueError, Queue
+from buildbot.db.pool import QueryCounter
 from buildbot.process.builder import Slavepool
 from buildbot import util
 from buildbot.util import lru
@@ -374,17 +376,66 @@ class BasicBuildChooser(BuildChooserBase):
 
 class KatanaBuildChooser(BasicBuildChooser):
 
-    def __init__(self, builders, master):
+    # the queues are kept up to date using the buildrequest notifications,
+    # they are reloaded from the db at most every RECONCILE_INTERVAL seconds
+    # to pick up the changes made by other masters
+    RECONCILE_INTERVAL = 60
+    # number of requests fetched per query when reloading a queue
+    QUEUE_PAGE_SIZE = 1000
+
+    def __init__(self, builders, master, slaveAvailability=None, _reactor=reactor):
         # By default katana  merges Requests
         self.bldr = None
         self.master = master
+        self.slaveAvailability = slaveAvailability
+        self._reactor = _reactor
         self.initializeBreqCache()
         self.builders = builders
+        self.unclaimedQueue = BuildRequestQueue(Queue.unclaimed)
+        self.resumeQueue = BuildRequestQueue(Queue.resume)
+        self.buildRequestQueues = {Queue.unclaimed: self.unclaimedQueue,
+                                   Queue.resume: self.resumeQueue}
+        self.postponedBrids = set()
+        # number of failed build start-ups per brid, see buildStartFailed
+        self.failedStarts = {}
         self.initializeBuildRequestQueue()
 
     def initializeBuildRequestQueue(self):
-        self.unclaimedBrdicts = None
-        self.resumeBrdicts = None
+        # force a full reload of the queues
+        for brQueue in self.buildRequestQueues.itervalues():
+            brQueue.invalidate()
+
+    def refreshBuildRequestQueue(self):
+        """
+        Called before processing the queues: requeues the postponed
+        buildrequests and reloads the queues if they need to be reconciled
+        with the db.
+        """
+        self.markBuildRequestsPending(self.postponedBrids)
+        self.postponedBrids = set()
+
+        now = util.now(self._reactor)
+        for brQueue in self.buildRequestQueues.itervalues():
+            if brQueue.needsReconcile(now, self.RECONCILE_INTERVAL):
+                brQueue.invalidate()
+
+    def markBuildRequestsPending(self, brids):
+        # the queue membership of these buildrequests will be checked
+        # the next time the queues are used
+        for brQueue in self.buildRequestQueues.itervalues():
+            for brid in brids:
+                brQueue.markPending(brid)
+
+    def buildRequestAdded(self, notif):
+        self.markBuildRequestsPending([notif['brid']])
+
+    def buildRequestRemoved(self, notif):
+        brid = notif['brid']
+        self.failedStarts.pop(brid, None)
+        for brQueue in self.buildRequestQueues.itervalues():
+            brQueue.remove(brid)
+        # re-check in case the notification raced with a queue reload
+        self.markBuildRequestsPending([brid])
 
     def setupNextBuildRequest(self, bldr, breq):
         self.bldr = bldr
@@ -422,7 +473,7 @@ class KatanaBuildChooser(BasicBuildChooser):
 
     def removeBuildRequest(self, buildrequest):
         """
-        Remove buildrequest.brdict from self.unclaimedBrdicts and self.resumeBrdicts.
+        Remove buildrequest.brdict from self.unclaimedQueue and self.resumeQueue.
         If function removed anything clear buildrequest data about merges too
         otherwise log error.
         @param buildrequest: BuildRequest object
@@ -434,11 +485,8 @@ class KatanaBuildChooser(BasicBuildChooser):
 
         is_removed = False
 
-        if self.unclaimedBrdicts:
-            is_removed |= self.__remove_brdict_by_brid(self.unclaimedBrdicts, buildrequest)
-
-        if self.resumeBrdicts:
-            is_removed |= self.__remove_brdict_by_brid(self.resumeBrdicts, buildrequest)
+        for brQueue in (self.unclaimedQueue, self.resumeQueue):
+            is_removed |= brQueue.remove(buildrequest.brdict['brid']) is not None
 
         if is_removed:
             buildrequest.checkMerges = True
@@ -458,15 +506,40 @@ class KatanaBuildChooser(BasicBuildChooser):
         for breq in breqs:
             self.removeBuildRequest(breq)
 
-    def retryBuildRequest(self):
-        msg = "Katana failed to process buildrequest.id %s, Katana will retry again" % self.nextBreq.id
-        self.nextBreq.retries += 1
-        if self.nextBreq.retries > 4:
+    def retryBuildRequest(self, breq=None):
+        if breq is None:
+            breq = self.nextBreq
+        msg = "Katana failed to process buildrequest.id %s, Katana will retry again" % breq.id
+        breq.retries += 1
+        if breq.retries > 4:
             msg = "Katana failed to process buildrequest.id %s after %d retries, " \
-                  "Katana will retry after the queue is proccessed " % (self.nextBreq.id, self.nextBreq.retries)
-            self.removeBuildRequest(self.nextBreq)
+                  "Katana will retry after the queue is proccessed " % (breq.id, breq.retries)
+            if any(breq.id in brQueue for brQueue in self.buildRequestQueues.itervalues()):
+                self.removeBuildRequest(breq)
+            self.postponedBrids.add(breq.id)
         log.msg(msg)
 
+    def buildStartFailed(self, breqs):
+        """
+        Requeue C{breqs} after their build failed to start or resume on the
+        slave.  Each failure counts as a retry of the request, so a request
+        that keeps failing is postponed after the rest of the queue.
+        """
+        brids = []
+        for breq in breqs:
+            breq.retries = self.failedStarts.get(breq.id, 0)
+            self.retryBuildRequest(breq)
+            if breq.id in self.postponedBrids:
+                self.failedStarts.pop(breq.id, None)
+            else:
+                self.failedStarts[breq.id] = breq.retries
+                brids.append(breq.id)
+        self.markBuildRequestsPending(brids)
+
+    def buildStartSucceeded(self, breqs):
+        for breq in breqs:
+            self.failedStarts.pop(breq.id, None)
+
     @defer.inlineCallbacks
     def _getBuildRequestForBrdict(self, brdict):
         # Turn a brdict into a BuildRequest into a brdict. This is useful
@@ -478,20 +551,109 @@ class KatanaBuildChooser(BasicBuildChooser):
         timerLogFinished(msg="_getBuildRequestForBrdict finished", timer=timer)
         defer.returnValue(breq)
 
+    @defer.inlineCallbacks
+    def _getBuildRequestsForBrdicts(self, brdicts):
+        # Bulk version of _getBuildRequestForBrdict: the requests missing from
+        # breqCache are loaded together, with a few queries per batch
+        timer = timerLogStart("_getBuildRequestsForBrdicts starting",
+                              function_name="KatanaBuildChooser._getBuildRequestsForBrdicts")
+        missing = [brdict for brdict in brdicts if brdict['brid'] not in self.breqCache]
+        if missing:
+            loaded = yield BuildRequest.fromBrdicts(self.master, missing)
+            for breq in loaded:
+                self.breqCache.put_new(breq.id, breq)
+
+        breqs = []
+        for brdict in brdicts:
+            breq = yield self.breqCache.get(brdict['brid'], master=self.master, brdict=brdict)
+            breq.brdict = brdict
+            breqs.append(breq)
+        timerLogFinished(msg="_getBuildRequestsForBrdicts finished", timer=timer)
+        defer.returnValue(breqs)
+
+    @defer.inlineCallbacks
+    def _loadBuildRequestsQueue(self, queue):
+        # page through the queue, so each query stays small however long
+        # the queue grows
+        brdicts = []
+        after = None
+        while True:
+            page = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
+                                                                              limit=self.QUEUE_PAGE_SIZE,
+                                                                              after=after)
+            brdicts.extend(page)
+            if len(page) < self.QUEUE_PAGE_SIZE:
+                break
+            after = page[-1]
+        defer.returnValue(brdicts)
+
     @defer.inlineCallbacks
     def _getBuildRequestsQueue(self, queue):
+        if queue not in self.buildRequestQueues:
+            raise UnsupportedQueueError
+
+        brQueue = self.buildRequestQueues[queue]
+
+        if not brQueue.loaded:
+            brdicts = yield self._loadBuildRequestsQueue(queue)
+            brQueue.reset(brdicts, now=util.now(self._reactor))
+
+        elif brQueue.hasPendingBrids():
+            brids = brQueue.popPendingBrids()
+            brdicts = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
+                                                                                 brids=brids,
+                                                                                 order=False)
+            brQueue.update(brids, brdicts)
+
+        defer.returnValue(brQueue)
+
+    def _getSlavepool(self, queue, br):
         if queue == Queue.unclaimed:
-            if self.unclaimedBrdicts is None:
-                self.unclaimedBrdicts = yield self.master.db.buildrequests\
-                    .getBuildRequestsInQueue(queue=queue)
-            defer.returnValue(self.unclaimedBrdicts)
-            return
+            return Slavepool.startSlavenames
+        elif queue == Queue.resume and br['slavepool']:
+            return br['slavepool']
+        return Slavepool.slavenames
+
+    def _getBuildernamesToProcess(self, buildrequestQueue):
+        if self.slaveAvailability is None:
+            return buildrequestQueue.buildernames()
+        # builders without idle slaves can not start or resume builds
+        return buildrequestQueue.buildernames(candidates=self.slaveAvailability.getBuildersWithIdleSlaves())
+
+    def _hasIdleSlaves(self, bldr, slavepool):
+        if self.slaveAvailability is None:
+            return True
+        return self.slaveAvailability.hasIdleSlaves(bldr.name, bldr.getSlavepoolToProcessBuildRequests(slavepool))
+
+    def _selectedSlaveIsAvailable(self, bldr, slavename):
+        if self.slaveAvailability is None:
+            return bldr.slaveIsAvailable(slavename=slavename)
+
+        for sb in self.slaveAvailability.getIdleSlaveBuilders(bldr.name):
+            if sb.slave and sb.slave.slave_status.getName() == slavename:
+                return sb.isAvailable()
+        return False
+
+    def _logUnprocessableBuilders(self, buildrequestQueue):
+        for buildername in buildrequestQueue.buildernames():
+            bldr = self.builders.get(buildername)
+            brid = buildrequestQueue.peekBuilder(buildername)['brid']
+
+            if not bldr:
+                log.msg("BuildRequest %d uses unknown builder %s" % (brid, buildername))
+
+            elif not bldr.config:
+                log.msg("BuildRequest %d uses builder %s with no configuration" % (brid, buildername))
+
+    def _shouldUseSelectedSlave(self, bldr, br):
+        buildRequestShouldUseSelectedSlave = "selected_slave" in br and br["selected_slave"] \
+                                             and br['results'] == BEGINNING and bldr.shouldUseSelectedSlave()
 
-        if queue == Queue.resume:
-            if self.resumeBrdicts is None:
-                self.resumeBrdicts = yield self.master.db.buildrequests\
-                    .getBuildRequestsInQueue(queue=queue)
-            defer.returnValue(self.resumeBrdicts)
+        resumingBuildRequestShouldUseSelectedSlave = "selected_slave" in br and br["selected_slave"] \
+                                                     and br['results'] == RESUME \
+                                                     and br['slavepool'] != Slavepool.startSlavenames
+
+        return buildRequestShouldUseSelectedSlave or resumingBuildRequestShouldUseSelectedSlave
 
     # Katana's gets the next priority builder from the DB instead of keeping a local list
     @defer.inlineCallbacks
@@ -502,84 +664,89 @@ class KatanaBuildChooser(BasicBuildChooser):
 
         it will return None if there are no slaves available for the task.
 
+        The queue is walked builder by builder (ordered by their first request),
+        only visiting the builders that have idle slaves according to
+        the slave availability index, and the walk stops as soon as no
+        remaining request can beat the best candidate found so far.
+
         @param queue: None will select the higher priority overall pending buids,
         if queue is 'unclaimed' will select only the pending builds and if queue='resume'
         it will select only builds pending to be resume
         @returns: a build request dictionary or None via Deferred
         """
-        unavailableBuilderNames = []
         builderSlavepool = {}
+        nextBuildRequest = None
+        nextKey = None
+
+        # report the requests that can not be processed only once per reload
+        reloaded = queue in self.buildRequestQueues and not self.buildRequestQueues[queue].loaded
 
-        # TODO: For performance reasons we may need to limit the searches but  we need to load test it first
         buildrequestQueue = yield self._getBuildRequestsQueue(queue)
 
         log.msg("getNextPriorityBuilder found %d buildrequests in the '%s' Queue" % (len(buildrequestQueue), queue))
 
-        for br in buildrequestQueue:
-            buildername = br['buildername']
+        if reloaded:
+            self._logUnprocessableBuilders(buildrequestQueue)
 
-            bldr = self.builders.get(buildername)
+        for buildername in self._getBuildernamesToProcess(buildrequestQueue):
+            head = buildrequestQueue.peekBuilder(buildername)
 
-            if not bldr:
-                log.msg("BuildRequest %d uses unknown builder %s" % (br['brid'], buildername))
+            if head is None:
                 continue
 
-            if not bldr.config:
-                log.msg("BuildRequest %d uses builder %s with no configuration" % (br['brid'], buildername))
-                continue
-
-            if buildername in unavailableBuilderNames and not bldr.building and br['startbrid'] is None:
-                continue
-
-            breq = yield self._getBuildRequestForBrdict(br)
+            # builders are sorted by their first request, no other builder can do better
+            if nextKey is not None and queueKey(head) > nextKey:
+                break
 
-            self.setupNextBuildRequest(bldr, breq)
+            bldr = self.builders.get(buildername)
 
-            if breq.hasBeenMerged:
+            if not bldr or not bldr.config:
                 continue
 
-            def getSlavepool():
-                if queue == Queue.unclaimed:
-                    return Slavepool.startSlavenames
-                elif queue == Queue.resume and br['slavepool']:
-                    return br['slavepool']
-                return Slavepool.slavenames
+            for br in buildrequestQueue.iterBuilder(buildername):
+                if nextKey is not None and queueKey(br) > nextKey:
+                    break
 
-            slavepool = getSlavepool()
+                slavepool = self._getSlavepool(queue, br)
 
-            if buildername not in builderSlavepool:
-                builderSlavepool[buildername] = bldr.getAvailableSlavesToProcessBuildRequests(slavepool=slavepool)
+                if (buildername, slavepool) not in builderSlavepool:
+                    availableSlaves = bldr.getAvailableSlavesToProcessBuildRequests(slavepool=slavepool) \
+                        if self._hasIdleSlaves(bldr, slavepool) else []
+                    builderSlavepool[(buildername, slavepool)] = availableSlaves
 
-            if not builderSlavepool[buildername]:
-                unavailableBuilderNames.append(buildername)
-                log.msg("No idle slaves found in '%s' list to process buildrequest.id %d for builder %s"
-                        % (slavepool, br['brid'], buildername))
+                    if not availableSlaves:
+                        log.msg("No idle slaves found in '%s' list to process buildrequest.id %d for builder %s"
+                                % (slavepool, br['brid'], buildername))
 
-                continue
-
-            self.slavepool = builderSlavepool[buildername]
+                if not builderSlavepool[(buildername, slavepool)]:
+                    # unclaimed requests of a builder all use the same slavepool
+                    if queue == Queue.unclaimed:
+                        break
+                    continue
 
-            buildRequestShouldUseSelectedSlave = "selected_slave" in br and br["selected_slave"] \
-                                                 and br['results'] == BEGINNING and bldr.shouldUseSelectedSlave()
+                if self._shouldUseSelectedSlave(bldr, br) and \
+                        not self._selectedSlaveIsAvailable(bldr, br["selected_slave"]):
+                    # slave not available check next br
+                    continue
 
-            resumingBuildRequestShouldUseSelectedSlave = "selected_slave" in br and br["selected_slave"] \
-                                                         and br['results'] == RESUME \
-                                                         and br['slavepool'] != Slavepool.startSlavenames
+                breq = yield self._getBuildRequestForBrdict(br)
 
-            if buildRequestShouldUseSelectedSlave or resumingBuildRequestShouldUseSelectedSlave:
-                if bldr.slaveIsAvailable(slavename=br["selected_slave"]):
-                    defer.returnValue(breq)
-                    return
+                if breq.hasBeenMerged:
+                    continue
 
-                # slave not available check next br
-                continue
+                # the builder's requests are sorted, this is its best candidate
+                nextBuildRequest = (bldr, breq, builderSlavepool[(buildername, slavepool)])
+                nextKey = queueKey(br)
+                break
 
-            # bldr can start the build on any available slave
-            defer.returnValue(breq)
+        if nextBuildRequest is None:
+            self.cleanupNextBuildRequest()
+            defer.returnValue(None)
             return
 
-        self.cleanupNextBuildRequest()
-        defer.returnValue(None)
+        bldr, breq, self.slavepool = nextBuildRequest
+        self.setupNextBuildRequest(bldr, breq)
+        defer.returnValue(breq)
 
     def getSelectedSlaveFromBuildRequest(self, breq):
         """
@@ -632,8 +799,7 @@ class KatanaBuildChooser(BasicBuildChooser):
                                                                              buildername=self.bldr.name,
                                                                              mergebrids=brids,
                                                                              order=False)
-        merged_breqs = yield defer.gatherResults([self._getBuildRequestForBrdict(brdict)
-                                                  for brdict in brdicts])
+        merged_breqs = yield self._getBuildRequestsForBrdicts(brdicts)
 
         timerLogFinished(msg="fetchPreviouslyMergedBuildRequests finished", timer=timer)
 
@@ -666,8 +832,8 @@ class KatanaBuildChooser(BasicBuildChooser):
         mergeRequestsLog['elapsedQuery']=  time.time() - start
         mergeRequestsFnStart = time.time()
 
-        for brdict in brdicts:
-            req = yield self._getBuildRequestForBrdict(brdict)
+        reqs = yield self._getBuildRequestsForBrdicts(brdicts)
+        for req in reqs:
             canMerge = self.mergeRequestsFn(self.bldr, breq, req)
             if canMerge and req.id != breq.id:
                 mergedRequests.append(req)
@@ -903,20 +1069,6 @@ class KatanaBuildChooser(BasicBuildChooser):
 
         defer.returnValue(nextBuild)
 
-    def __remove_brdict_by_brid(self, brdicts, buildrequest):
-        """
-        Remove every brdict from brdicts by 'brid' key from buildrequest.brdict
-        @param buildrequest: BuildRequest object with brdict['brid'] which we'll use to compare
-        @param brdicts: list of buildrequest data (dicts)
-        @return: information if function removed anything
-        """
-        removed = False
-        for brdict in brdicts:
-            if brdict['brid'] == buildrequest.brdict['brid']:
-                brdicts.remove(brdict)
-                removed = True
-        return removed
-
 
 # Buildbot's default BuildRequestDistributor with the default BasicBuildChooser
 # from the eight branch
@@ -1160,6 +1312,11 @@ class KatanaBuildRequestDistributor(service.Service):
     KatanaBuildRequestDistributor is not maintaining a list but fetching the builder with highest priority
     and lowest submitted time from the db, it also process one request at a time per builder
      including processing all possible merges.
+
+    The requests are chosen and claimed one at a time under C{activity_lock},
+    but the start-up of the builds (slave ping, preparation, startBuild) runs
+    concurrently with the next decisions, at most C{buildStartConcurrency}
+    (from the master config, None for no limit) at a time.
     """
 
     # todo read from configuration if want to use buildbot's or katana build chooser
@@ -1174,12 +1331,32 @@ class KatanaBuildRequestDistributor(service.Service):
         self.activity_lock = defer.DeferredLock()
         self.active = False
         self._pendingMSBOCalls = []
+        # deferreds of the build start-ups in progress
+        self._pendingBuildStarts = []
         self.check_new_builds = True
         self.check_resume_builds = True
         self.katanaBuildChooser = self.createBuildChooser(builders=self.botmaster.builders, master=self.master)
+        self.buildrequest_sub = None
+        self.cancelled_buildrequest_sub = None
+
+    def startService(self):
+        # keep the build chooser queues up to date, notifications missed
+        # while the service was stopped are recovered by a full reload
+        self.katanaBuildChooser.initializeBuildRequestQueue()
+        self.buildrequest_sub = \
+            self.master.subscribeToBuildRequests(self.katanaBuildChooser.buildRequestAdded)
+        self.cancelled_buildrequest_sub = \
+            self.master.subscribeToCancelledBuildRequests(self.katanaBuildChooser.buildRequestRemoved)
+        service.Service.startService(self)
 
     @defer.inlineCallbacks
     def stopService(self):
+        for sub in (self.buildrequest_sub, self.cancelled_buildrequest_sub):
+            if sub:
+                sub.unsubscribe()
+        self.buildrequest_sub = None
+        self.cancelled_buildrequest_sub = None
+
         # Lots of stuff happens asynchronously here, so we need to let it all
         # quiesce.  First, let the parent stopService succeed between
         # activities; then the loop will stop calling itself, since
@@ -1192,6 +1369,10 @@ class KatanaBuildRequestDistributor(service.Service):
         if self._pendingMSBOCalls:
             yield defer.DeferredList(self._pendingMSBOCalls)
 
+        # and let the builds being started hand over to the slaves (or fail)
+        if self._pendingBuildStarts:
+            yield defer.DeferredList(list(self._pendingBuildStarts))
+
     def maybeStartBuildsOn(self, new_builders):
         """
         Try to start any builds that can be started right now.  This function
@@ -1225,14 +1406,15 @@ class KatanaBuildRequestDistributor(service.Service):
     def _checkBuildRequests(self):
         self.check_new_builds = True
         self.check_resume_builds = True
-        self.katanaBuildChooser.initializeBuildRequestQueue()
+        self.katanaBuildChooser.refreshBuildRequestQueue()
 
     @defer.inlineCallbacks
     def _selectNextBuildRequest(self, queue, asyncFunc):
         # get the actual builder object that should start running new builds
         timer = timerLogStart(msg="_selectNextBuildRequest starting _getNextPriorityBuilder queue %s" % queue,
                               function_name="KatanaBuildRequestDistributor._selectNextBuildRequest()")
-        breq = yield self.katanaBuildChooser.getNextPriorityBuilder(queue=queue)
+        counter = QueryCounter()
+        breq = yield counter.run(self.katanaBuildChooser.getNextPriorityBuilder, queue=queue)
         timerLogFinished(msg="_selectNextBuildRequest _getNextPriorityBuilder finished", timer=timer)
 
         if breq is None:
@@ -1244,7 +1426,7 @@ class KatanaBuildRequestDistributor(service.Service):
             timer = timerLogStart(msg="starting asyncFunc queue %s" % queue,
                                    function_name="KatanaBuildRequestDistributor._selectNextBuildRequest()")
 
-            if not (yield asyncFunc()):
+            if not (yield counter.run(asyncFunc)):
                 self.katanaBuildChooser.retryBuildRequest()
 
         except Exception:
@@ -1252,6 +1434,7 @@ class KatanaBuildRequestDistributor(service.Service):
             klog.err_json(Failure(), "from _selectNextBuildRequest for builder '%s' queue '%s'" % (breq.buildername, queue))
 
         timerLogFinished(msg="asyncFunc finished", timer=timer)
+        self._logDBRoundTrips("resumeBuild" if queue == Queue.resume else "startBuild", counter)
 
         defer.returnValue(breq)
 
@@ -1266,6 +1449,7 @@ class KatanaBuildRequestDistributor(service.Service):
                                    function_name="KatanaBuildRequestDistributor._procesBuildRequestsActivityLoop()")
 
         while 1:
+            yield self._waitForBuildStartSlot()
             yield self.activity_lock.acquire()
 
             self.active = (not self.master.is_changing_services and
@@ -1294,6 +1478,52 @@ class KatanaBuildRequestDistributor(service.Service):
         self.katanaBuildChooser.initializeBreqCache()
         self._quiet()
 
+    def _hasBuildStartSlot(self):
+        limit = self.master.config.buildStartConcurrency
+        return not limit or len(self._pendingBuildStarts) < limit
+
+    @defer.inlineCallbacks
+    def _waitForBuildStartSlot(self):
+        # don't claim more requests than can be started right now
+        while not self._hasBuildStartSlot():
+            yield defer.DeferredList(list(self._pendingBuildStarts), fireOnOneCallback=True)
+
+    def _trackBuildStart(self, decision, buildDeferred, breqs, requeue):
+        """
+        Follow the start-up of a build, which runs concurrently with the next
+        scheduling decisions.  If the build fails to start, or the builder
+        does not start it, the requests are given back to the queues by
+        C{requeue}.
+        """
+        builderName = self.katanaBuildChooser.bldr.name
+        started = util.now()
+        self._pendingBuildStarts.append(buildDeferred)
+        metrics.MetricCountEvent.log("KatanaBuildRequestDistributor.%s.in_progress" % decision,
+                                     len(self._pendingBuildStarts), absolute=True)
+
+        def succeeded(buildStarted):
+            if not buildStarted:
+                # the builder is stopping
+                return failed(Failure(Exception("Builder %s did not start the build" % builderName)))
+            metrics.MetricCountEvent.log("KatanaBuildRequestDistributor.%s.started" % decision, 1)
+            self.katanaBuildChooser.buildStartSucceeded(breqs)
+
+        def failed(e):
+            metrics.MetricCountEvent.log("KatanaBuildRequestDistributor.%s.failed" % decision, 1)
+            return requeue(e, breqs, builderName)
+
+        def finished(_):
+            self._pendingBuildStarts.remove(buildDeferred)
+            metrics.MetricTimeEvent.log("KatanaBuildRequestDistributor.%s.startup_time" % decision,
+                                        util.now() - started)
+            metrics.MetricCountEvent.log("KatanaBuildRequestDistributor.%s.in_progress" % decision,
+                                         len(self._pendingBuildStarts), absolute=True)
+
+        buildDeferred.addCallbacks(succeeded, failed)
+        buildDeferred.addErrback(klog.err_json, "while requeueing buildrequests %s of builder %s"
+                                 % ([br.id for br in breqs], builderName))
+        buildDeferred.addCallback(finished)
+
     def logResumeOrStartBuildStatus(self, msg, slave, breqs):
         if len(breqs) > 0:
             log.msg(" %s for buildername %s using slave %s buildrequest id %d priority %d submittedAt %s buildsetid %d" %
@@ -1301,6 +1531,15 @@ class KatanaBuildRequestDistributor(service.Service):
                      util.epoch2datetime(breqs[0].submittedAt),
                      breqs[0].bsid))
 
+    def _logDBRoundTrips(self, decision, counter):
+        # number of queries sent to the database by a scheduling decision,
+        # from choosing the request to claiming it, not counting the build it
+        # starts nor the queries of the rest of the master meanwhile
+        metrics.MetricCountEvent.log("KatanaBuildRequestDistributor.%s.decisions" % decision, 1)
+        metrics.MetricCountEvent.log("KatanaBuildRequestDistributor.%s.db_round_trips" % decision,
+                                     counter.queries)
+        return counter.queries
+
     @defer.inlineCallbacks
     def _maybeResumeBuildsOnBuilder(self):
         slave, buildnumber, breqs = yield self.katanaBuildChooser.chooseNextBuildToResume()
@@ -1312,8 +1551,9 @@ class KatanaBuildRequestDistributor(service.Service):
         brids = [br.id for br in breqs]
         yield self.master.db.buildrequests.updateBuildRequests(brids, results=BEGINNING)
           
-        buildDefered = self.katanaBuildChooser.bldr.maybeResumeBuild(slave, buildnumber, breqs)
-        buildDefered.addErrback(self._resume, breqs, self.katanaBuildChooser.bldr.name)
+        buildDefered = QueryCounter.runUncounted(self.katanaBuildChooser.bldr.maybeResumeBuild,
+                                                 slave, buildnumber, breqs)
+        self._trackBuildStart("resumeBuild", buildDefered, breqs, self._resume)
 
         self.katanaBuildChooser.removeBuildRequests(breqs)
 
@@ -1326,6 +1566,7 @@ class KatanaBuildRequestDistributor(service.Service):
         brids = [br.id for br in breqs]
         log.msg("Could not resume builds {}. Exception message: {}. Requeueing.".format(brids, e.value))
         yield self.master.db.buildrequests.updateBuildRequests(brids, results=RESUME)
+        self.katanaBuildChooser.buildStartFailed(breqs)
         self.botmaster.maybeStartBuildsForBuilder(builderName)
 
     @defer.inlineCallbacks
@@ -1339,8 +1580,9 @@ class KatanaBuildRequestDistributor(service.Service):
         # claim brid's
         yield self.katanaBuildChooser.claimBuildRequests(breqs)
 
-        buildDefered = self.katanaBuildChooser.bldr.maybeStartBuild(slave, breqs)
-        buildDefered.addErrback(self._requeue, breqs, self.katanaBuildChooser.bldr.name)
+        buildDefered = QueryCounter.runUncounted(self.katanaBuildChooser.bldr.maybeStartBuild,
+                                                 slave, breqs)
+        self._trackBuildStart("startBuild", buildDefered, breqs, self._requeue)
 
         msg = "_maybeStartNewBuildsOnBuilder is starting build"
         self.katanaBuildChooser.removeBuildRequests(breqs)
@@ -1353,12 +1595,13 @@ class KatanaBuildRequestDistributor(service.Service):
         brids = [br.id for br in breqs]
         log.msg("Could not start builds {}. Exception message: {}. Requeueing.".format(brids, e.value))
         yield self.master.db.buildrequests.unclaimBuildRequests(brids)
+        self.katanaBuildChooser.buildStartFailed(breqs)
         self.botmaster.maybeStartBuildsForBuilder(builderName)
 
     def createBuildChooser(self, builders, master):
         # just instantiate the build chooser requested
-        return self.BuildChooser(builders, master)
-            
+        return self.BuildChooser(builders, master, slaveAvailability=self.botmaster.slaveAvailability)
+
     def _quiet(self):
         # shim for tests
         pass # pragma: no cover
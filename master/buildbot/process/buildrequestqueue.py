@@ -0,0 +1,206 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import bisect
+
+
+def queueKey(brdict):
+    """
+    Sort key of a queued brdict: higher priority first, then oldest
+    submitted time, then lowest brid (the order used by the queue queries)
+    """
+    return (-brdict['priority'], brdict['submitted_at'], brdict['brid'])
+
+
+class BuildRequestQueue(object):
+    """
+    Master-resident copy of one of the katana queues ('unclaimed' or 'resume').
+
+    The queue keeps the brdicts returned by
+    L{BuildRequestsConnectorComponent.getBuildRequestsInQueue} sorted by
+    (priority desc, submitted_at asc), with secondary indexes by builder name
+    and by selected slave, so the build chooser does not need to reload the
+    whole queue from the database on every pass.
+
+    The content is maintained incrementally: requests are removed when they
+    are claimed, merged or cancelled, and brids notified as added are fetched
+    in batch the next time the queue is used (see L{markPending}).  A full
+    reload (L{reset}) reconciles the queue with changes done by other masters.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.loaded = False
+        self.lastReconciled = None
+        self._brdicts = {}
+        self._order = []
+        self._builders = {}
+        self._selectedSlaves = {}
+        self._pendingBrids = set()
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return self._iterKeys(list(self._order))
+
+    def __contains__(self, brid):
+        return brid in self._brdicts
+
+    def get(self, brid):
+        return self._brdicts.get(brid)
+
+    def reset(self, brdicts, now=None):
+        """
+        Replace the content of the queue with C{brdicts}, as returned by a
+        full queue query.
+        """
+        self._brdicts = {}
+        self._order = []
+        self._builders = {}
+        self._selectedSlaves = {}
+        for brdict in brdicts:
+            self.add(brdict)
+        self.loaded = True
+        self.lastReconciled = now
+
+    def invalidate(self):
+        """
+        Force a full reload the next time the queue is used.
+        """
+        self.loaded = False
+
+    def needsReconcile(self, now, interval):
+        if not self.loaded or self.lastReconciled is None:
+            return True
+        return now - self.lastReconciled >= interval
+
+    def add(self, brdict):
+        brid = brdict['brid']
+        if brid in self._brdicts:
+            self.remove(brid)
+
+        key = queueKey(brdict)
+        self._brdicts[brid] = brdict
+        bisect.insort(self._order, key)
+        bisect.insort(self._builders.setdefault(brdict['buildername'], []), key)
+
+        selected_slave = brdict.get('selected_slave')
+        if selected_slave:
+            self._selectedSlaves.setdefault(selected_slave, set()).add(brid)
+
+    def remove(self, brid):
+        """
+        Remove a request from the queue
+
+        @returns: the removed brdict, or None if brid was not queued
+        """
+        brdict = self._brdicts.pop(brid, None)
+        if brdict is None:
+            return None
+
+        key = queueKey(brdict)
+        self._removeKey(self._order, key)
+
+        buildername = brdict['buildername']
+        builderKeys = self._builders.get(buildername)
+        if builderKeys is not None:
+            self._removeKey(builderKeys, key)
+            if not builderKeys:
+                del self._builders[buildername]
+
+        selected_slave = brdict.get('selected_slave')
+        if selected_slave and selected_slave in self._selectedSlaves:
+            brids = self._selectedSlaves[selected_slave]
+            brids.discard(brid)
+            if not brids:
+                del self._selectedSlaves[selected_slave]
+
+        return brdict
+
+    def _iterKeys(self, keys):
+        # requests can be removed while the caller is iterating
+        for key in keys:
+            brdict = self._brdicts.get(key[2])
+            if brdict is not None:
+                yield brdict
+
+    def _removeKey(self, keys, key):
+        idx = bisect.bisect_left(keys, key)
+        if idx < len(keys) and keys[idx] == key:
+            del keys[idx]
+
+    def update(self, brids, brdicts):
+        """
+        Apply the result of a query for C{brids}: the requests found in
+        C{brdicts} are (re)inserted and the other ones are no longer part of
+        this queue.
+        """
+        for brid in brids:
+            self.remove(brid)
+        for brdict in brdicts:
+            self.add(brdict)
+
+    def buildernames(self, candidates=None):
+        """
+        Names of the builders with queued requests, ordered by the sort key of
+        their first request.
+
+        @param candidates: if given, only return builders from this collection
+        """
+        builders = self._builders
+        if candidates is None:
+            heads = [(keys[0], name) for name, keys in builders.iteritems()]
+        else:
+            heads = [(builders[name][0], name) for name in candidates if name in builders]
+        heads.sort()
+        return [name for _, name in heads]
+
+    def peekBuilder(self, buildername):
+        """
+        The first brdict queued for C{buildername}, or None
+        """
+        builderKeys = self._builders.get(buildername)
+        if not builderKeys:
+            return None
+        return self._brdicts[builderKeys[0][2]]
+
+    def iterBuilder(self, buildername):
+        """
+        Iterate over the brdicts queued for C{buildername}, in queue order.
+        """
+        return self._iterKeys(list(self._builders.get(buildername, [])))
+
+    def iterSelectedSlave(self, slavename):
+        """
+        Iterate over the brdicts that selected C{slavename}, in queue order.
+        """
+        brdicts = self._brdicts
+        brids = self._selectedSlaves.get(slavename, ())
+        return iter(sorted((brdicts[brid] for brid in brids), key=queueKey))
+
+    def markPending(self, brid):
+        """
+        Flag C{brid} as possibly added to (or changed in) this queue; it will
+        be fetched on the next call to L{popPendingBrids}.
+        """
+        self._pendingBrids.add(brid)
+
+    def hasPendingBrids(self):
+        return bool(self._pendingBrids)
+
+    def popPendingBrids(self):
+        brids, self._pendingBrids = sorted(self._pendingBrids), set()
+        return brids
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import re
+import zlib
 
 from zope.interface import implements
 from twisted.internet import defer, error
@@ -46,6 +47,13 @@ class RemoteCommand(pb.Referenceable):
     rc = None
     debug = False
 
+    # the format of the output updates asked to the slave commands which
+    # support it (>= 2.17): 2 sends 'logs' updates, and 3 (>= 2.18) sends
+    # compressed 'zlogs' updates, for the slaves with compress_output; see
+    # remoteUpdate
+    updateVersion = 2
+    compressedUpdateVersion = 3
+
     def __init__(self, remote_command, args, ignore_updates=False,
             collectStdout=False, collectStderr=False, decodeRC={0:SUCCESS}):
         self.logs = {}
@@ -58,6 +66,10 @@ class RemoteCommand(pb.Referenceable):
 
         self._startTime = None
         self._remoteElapsed = None
+        # the size of the compressed output received, before and after
+        # decompression
+        self._updateBytes = 0
+        self._updateWireBytes = 0
         self.remote_command = remote_command
         self.args = args
         self.ignore_updates = ignore_updates
@@ -116,6 +128,7 @@ class RemoteCommand(pb.Referenceable):
         # We will get a single remote_complete when it finishes.
         # We should fire self.deferred when the command is done.
         self._setManifest()
+        self._setUpdateVersion()
 
         d = self.remote.callRemote("startCommand", self, self.commandID,
                                    self.remote_command, self.args)
@@ -127,6 +140,23 @@ class RemoteCommand(pb.Referenceable):
         elif isinstance(self.args, dict):
             self.args['manifest'] = self.step.manifest
 
+    def _setUpdateVersion(self):
+        # the older slaves do not expect the arguments, and send one update
+        # per log
+        version = self.step.slaveVersion(self.remote_command)
+        if not (isinstance(self.args, dict) and isinstance(version, basestring)):
+            return
+        if self.step.slaveVersionIsOlderThan(self.remote_command, "2.17"):
+            return
+        self.args['update_version'] = self.updateVersion
+        if self.step.slaveVersionIsOlderThan(self.remote_command, "2.18"):
+            return
+        buildslave = self.step.buildslave
+        if buildslave.compress_output:
+            self.args['update_version'] = self.compressedUpdateVersion
+        if buildslave.update_window:
+            self.args['update_window'] = buildslave.update_window
+
     def _finished(self, failure=None):
         if not self.active:
             defer.succeed(None)
@@ -281,6 +311,30 @@ class RemoteCommand(pb.Referenceable):
             # 'log': (logname, data)
             logname, data = update['log']
             self.addToLog(logname, data)
+        if update.has_key('logs'):
+            # 'logs': [[logname, data, time], ...], in the order of the output
+            self.addEntries(update['logs'])
+        if update.has_key('zlogs'):
+            # 'zlogs': [compressed data, [[logname, length, time], ...]]
+            compressed, entries = update['zlogs']
+            data = zlib.decompress(compressed)
+            offset = 0
+            logs = []
+            for logname, length, time in entries:
+                logs.append((logname, data[offset:offset + length], time))
+                offset += length
+            metrics.MetricCountEvent.log("RemoteCommand.update_bytes", len(data))
+            metrics.MetricCountEvent.log("RemoteCommand.update_wire_bytes",
+                                         len(compressed))
+            self._updateBytes += len(data)
+            self._updateWireBytes += len(compressed)
+            self.addEntries(logs)
+        if update.has_key('update_stats'):
+            # the slave's figures for the updates of the command
+            stats = update['update_stats']
+            if stats.get('acks'):
+                metrics.MetricTimeEvent.log("RemoteCommand.update_ack_latency",
+                                            stats['ack_seconds'] / stats['acks'])
         if update.has_key('rc'):
             rc = self.rc = update['rc']
             log.msg("%s rc=%s" % (self, rc))
@@ -290,15 +344,31 @@ class RemoteCommand(pb.Referenceable):
 
         # TODO: these should be handled at the RemoteCommand level
         for k in update:
-            if k not in ('stdout', 'stderr', 'header', 'rc'):
+            if k not in ('stdout', 'stderr', 'header', 'rc', 'logs', 'zlogs',
+                         'update_stats'):
                 if k not in self.updates:
                     self.updates[k] = []
                 self.updates[k].append(update[k])
 
+    def addEntries(self, entries):
+        for logname, data, _ in entries:
+            if logname == 'stdout':
+                self.addStdout(data)
+            elif logname == 'stderr':
+                self.addStderr(data)
+            elif logname == 'header':
+                self.addHeader(data)
+            else:
+                # ('log', logname)
+                self.addToLog(logname[1], data)
+
     def remoteComplete(self, maybeFailure):
         if self._startTime and self._remoteElapsed:
             delta = (util.now() - self._startTime) - self._remoteElapsed
             metrics.MetricTimeEvent.log("RemoteCommand.overhead", delta)
+        if self._updateBytes:
+            metrics.MetricTimeEvent.log("RemoteCommand.update_compression_ratio",
+                                        float(self._updateWireBytes) / self._updateBytes)
 
         for name,loog in self.logs.items():
             if self._closeWhenFinished[name]:
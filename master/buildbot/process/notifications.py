@@ -0,0 +1,231 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import socket
+
+from twisted.python import log
+from twisted.internet import defer, reactor, protocol, endpoints
+from twisted.protocols import basic
+from twisted.application import service, strports, internet
+
+from buildbot import config
+from buildbot.process import metrics
+from buildbot.util import json
+import klog
+
+
+class NotificationBrokerProtocol(basic.LineReceiver):
+    delimiter = '\n'
+    MAX_LENGTH = 64 * 1024
+
+    def connectionMade(self):
+        self.factory.clients.add(self)
+
+    def connectionLost(self, reason):
+        self.factory.clients.discard(self)
+
+    def lineReceived(self, line):
+        self.factory.relay(self, line)
+
+
+class NotificationBrokerFactory(protocol.ServerFactory):
+    """
+    A minimal message broker: every line received from a master is relayed
+    to all the other connected masters.
+    """
+
+    protocol = NotificationBrokerProtocol
+
+    def __init__(self):
+        self.clients = set()
+
+    def relay(self, sender, line):
+        for client in list(self.clients):
+            if client is not sender:
+                client.sendLine(line)
+
+
+class NotificationClientProtocol(basic.LineReceiver):
+    delimiter = '\n'
+    MAX_LENGTH = 64 * 1024
+
+    def connectionMade(self):
+        self.factory.channel.connected(self)
+
+    def connectionLost(self, reason):
+        self.factory.channel.disconnected(self)
+
+    def lineReceived(self, line):
+        self.factory.channel.bus.messageReceived(line)
+
+
+class NotificationClientFactory(protocol.Factory):
+    protocol = NotificationClientProtocol
+
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class NotificationChannel(service.MultiService):
+    """
+    Transport used by L{NotificationBus} to exchange messages with the other
+    masters.  Subclasses implement L{publish} and hand the messages they
+    receive to C{self.bus.messageReceived}.
+    """
+
+    def __init__(self, bus):
+        service.MultiService.__init__(self)
+        self.bus = bus
+
+    def publish(self, message):
+        """
+        Send C{message} (a string) to the other masters.
+
+        @returns: False if the message could not be sent
+        """
+        raise NotImplementedError
+
+
+class BrokerNotificationChannel(NotificationChannel):
+    """
+    Exchange messages through a L{NotificationBrokerFactory}, over TCP or
+    a UNIX socket.  One of the masters runs the broker (C{listen} is a
+    strports description like 'tcp:9990'), and all of them, including that
+    one, connect to it (C{connect} is an endpoint description like
+    'tcp:host=master1:port=9990' or 'unix:path=/var/run/katana.sock').
+
+    Messages published while the connection is down are dropped; the masters
+    catch up with the reconciliation poll.
+    """
+
+    def __init__(self, bus, connect, listen=None, _reactor=reactor):
+        NotificationChannel.__init__(self, bus)
+        self.protocol = None
+
+        if listen:
+            self.broker = NotificationBrokerFactory()
+            strports.service(listen, self.broker).setServiceParent(self)
+
+        endpoint = endpoints.clientFromString(_reactor, connect)
+        self.client = internet.ClientService(endpoint, NotificationClientFactory(self))
+        self.client.setServiceParent(self)
+
+    def connected(self, protocol):
+        log.msg("connected to the notification broker")
+        self.protocol = protocol
+
+    def disconnected(self, protocol):
+        if self.protocol is protocol:
+            log.msg("lost connection to the notification broker")
+            self.protocol = None
+
+    def whenConnected(self):
+        return self.client.whenConnected()
+
+    def publish(self, message):
+        if self.protocol is None:
+            return False
+        self.protocol.sendLine(message)
+        return True
+
+
+class NotificationBus(config.ReconfigurableServiceMixin, service.MultiService):
+    """
+    Delivers the events of this master (build requests added and removed,
+    buildsets completed and changes added) to the other masters sharing the
+    database, as they happen, and the events of the other masters to the
+    subscribers of this one.
+
+    Without a configured channel (c['notifications']['type'] is None) nothing
+    is published, and the masters rely on the database poll.
+    """
+
+    channel_types = {
+        'broker': BrokerNotificationChannel,
+    }
+
+    def __init__(self, master):
+        service.MultiService.__init__(self)
+        self.setName('notifications')
+        self.master = master
+        self.channel = None
+        self.channel_config = None
+        # used to ignore the messages sent by this master
+        self.masterid = "%s:%d" % (socket.getfqdn(), os.getpid())
+
+    @defer.inlineCallbacks
+    def reconfigService(self, new_config):
+        channel_config = new_config.notifications
+        if channel_config != self.channel_config:
+            if self.channel:
+                yield defer.maybeDeferred(lambda :
+                        self.channel.disownServiceParent())
+                self.channel = None
+
+            if channel_config['type']:
+                self.channel = self.channel_types[channel_config['type']](self,
+                        connect=channel_config['connect'],
+                        listen=channel_config['listen'])
+                self.channel.setServiceParent(self)
+
+            self.channel_config = channel_config.copy()
+
+        # chain up
+        yield config.ReconfigurableServiceMixin.reconfigService(self,
+                                                    new_config)
+
+    def isEnabled(self):
+        return self.channel is not None
+
+    def publish(self, event, **kwargs):
+        if not self.channel:
+            return
+
+        message = json.dumps(dict(event=event, master=self.masterid, args=kwargs))
+        if self.channel.publish(message):
+            metrics.MetricCountEvent.log("NotificationBus.published")
+        else:
+            metrics.MetricCountEvent.log("NotificationBus.dropped")
+
+    def messageReceived(self, message):
+        try:
+            msg = json.loads(message)
+            event, origin, args = msg['event'], msg['master'], msg['args']
+        except (ValueError, TypeError, KeyError):
+            log.msg("ignoring invalid notification %r" % (message,))
+            return
+
+        if origin == self.masterid:
+            return
+
+        handler = self.getHandler(event)
+        if handler is None:
+            log.msg("ignoring unknown notification %r" % (event,))
+            return
+
+        metrics.MetricCountEvent.log("NotificationBus.received")
+        kwargs = dict((str(k), v) for k, v in args.iteritems())
+        d = defer.maybeDeferred(handler, **kwargs)
+        d.addErrback(klog.err_json, "while handling notification %r" % (event,))
+        return d
+
+    def getHandler(self, event):
+        return {
+            'buildrequest_added': self.master._deliverBuildRequestAdded,
+            'buildrequest_removed': self.master._deliverBuildRequestRemoved,
+            'buildset_complete': self.master._deliverBuildsetComplete,
+            'change_added': self.master._deliverChangeById,
+        }.get(event)
@@ -0,0 +1,87 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+
+class SlaveAvailabilityIndex(object):
+    """
+    Tracks which slavebuilders are idle, per builder and slavepool
+    ('slavenames' or 'startSlavenames'), so the build chooser can skip the
+    builders whose slaves are all busy without looking at their requests.
+
+    The index is updated by the builders when a slavebuilder is attached or
+    detached, and when it starts or finishes a build.  It only reflects the
+    state of the slavebuilders: an idle slavebuilder can still be unable to
+    start a build (e.g. the slave reached max_builds), so callers have to
+    confirm with C{isAvailable} before using it.
+    """
+
+    def __init__(self):
+        # (buildername, slavebuilder) -> slavepool
+        self._slavepools = {}
+        # buildername -> {slavepool: set of idle slavebuilders}
+        self._idle = {}
+
+    def addSlaveBuilder(self, buildername, slavepool, sb, idle=True):
+        self.removeSlaveBuilder(buildername, sb)
+        self._slavepools[(buildername, sb)] = slavepool
+        self.setIdle(buildername, sb, idle)
+
+    def removeSlaveBuilder(self, buildername, sb):
+        slavepool = self._slavepools.pop((buildername, sb), None)
+        if slavepool is not None:
+            self._discardIdle(buildername, slavepool, sb)
+
+    def removeBuilder(self, buildername):
+        for key in [key for key in self._slavepools if key[0] == buildername]:
+            del self._slavepools[key]
+        self._idle.pop(buildername, None)
+
+    def setIdle(self, buildername, sb, idle):
+        slavepool = self._slavepools.get((buildername, sb))
+        if slavepool is None:
+            return
+
+        if idle:
+            self._idle.setdefault(buildername, {}).setdefault(slavepool, set()).add(sb)
+        else:
+            self._discardIdle(buildername, slavepool, sb)
+
+    def _discardIdle(self, buildername, slavepool, sb):
+        slavepools = self._idle.get(buildername)
+        if not slavepools or slavepool not in slavepools:
+            return
+
+        slavepools[slavepool].discard(sb)
+        if not slavepools[slavepool]:
+            del slavepools[slavepool]
+            if not slavepools:
+                del self._idle[buildername]
+
+    def getBuildersWithIdleSlaves(self):
+        return self._idle.keys()
+
+    def hasIdleSlaves(self, buildername, slavepool=None):
+        slavepools = self._idle.get(buildername)
+        if not slavepools:
+            return False
+        if slavepool is None:
+            return True
+        return slavepool in slavepools
+
+    def getIdleSlaveBuilders(self, buildername, slavepool=None):
+        slavepools = self._idle.get(buildername, {})
+        if slavepool is not None:
+            return list(slavepools.get(slavepool, ()))
+        return [sb for sbs in slavepools.itervalues() for sb in sbs]
@@ -39,6 +39,7 @@ class AbstractSlaveBuilder(pb.Referenceable):
         self.state = None # set in subclass
         self.remote = None
         self.slave = None
+        self.builder = None
         self.builder_name = None
         self.locks = None
 
@@ -80,10 +81,12 @@ class AbstractSlaveBuilder(pb.Referenceable):
         canStart = self.state in (IDLE, LATENT)
         if canStart:
             self.state = BUILDING
+            self.stateChanged()
         return canStart
 
     def setSlaveIdle(self, slave=None):
         self.state = IDLE
+        self.stateChanged()
         slave = self.slave if slave is None else slave
         if slave:
             slave.buildFinished(self)
@@ -91,6 +94,11 @@ class AbstractSlaveBuilder(pb.Referenceable):
     def buildFinished(self, slave=None):
         self.setSlaveIdle(slave)
 
+    def stateChanged(self):
+        # let the builder keep track of its idle slaves
+        if self.builder:
+            self.builder.slaveBuilderStateChanged(self)
+
     def attached(self, slave, remote, commands):
         """
         @type  slave: L{buildbot.buildslave.BuildSlave}
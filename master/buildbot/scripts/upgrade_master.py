@@ -20,10 +20,12 @@ import sys
 import traceback
 from twisted.internet import defer
 from twisted.python import util, runtime
+from twisted.persisted import styles
 from buildbot import config as config_module
 from buildbot import monkeypatches
 from buildbot.db import connector
 from buildbot.master import BuildMaster
+from buildbot.status import buildstore
 from buildbot.util import in_reactor
 from buildbot.scripts import base
 
@@ -137,6 +139,27 @@ def upgradeDatabase(config, master_cfg):
     yield db.setup(check_version=False, verbose=not config['quiet'])
     yield db.model.upgrade()
 
+def upgradeBuildStatus(config, master_cfg):
+    # move the build pickles into the configured build store
+    if master_cfg.buildStatusStorage == buildstore.PickleBuildStore.name:
+        return
+    if not config['quiet']:
+        print "moving the build pickles into the %s build stores" \
+                % master_cfg.buildStatusStorage
+
+    for builder_config in master_cfg.builders:
+        basedir = os.path.join(config['basedir'], builder_config.builddir)
+        if not os.path.isdir(basedir):
+            continue
+        store = buildstore.getBuildStore(master_cfg.buildStatusStorage,
+                                         basedir)
+        try:
+            migrated = store.migrate(upgrade=lambda build: styles.doUpgrade())
+        finally:
+            store.close()
+        if migrated and not config['quiet']:
+            print "  %s: %d builds" % (builder_config.name, migrated)
+
 @in_reactor
 @defer.inlineCallbacks
 def upgradeMaster(config, _noMonkey=False):
@@ -157,6 +180,7 @@ def upgradeMaster(config, _noMonkey=False):
 
     upgradeFiles(config)
     try:
+        upgradeBuildStatus(config, master_cfg)
         yield upgradeDatabase(config, master_cfg)
     except Exception as e:
         print "UNEXPECTED ERROR: %s" % str(e)
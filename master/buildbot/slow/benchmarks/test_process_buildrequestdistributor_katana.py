@@ -0,0 +1,48 @@
+from twisted.trial import unittest
+from twisted.internet import defer
+from buildbot.process.buildrequest import Priority
+from buildbot.test.util.distributorbenchmark import DistributorBenchmarkMixin, Farm
+
+
+class TestKatanaBuildRequestDistributorBenchmark(unittest.TestCase, DistributorBenchmarkMixin):
+
+    # the farms are large, give them time on slow machines and databases
+    timeout = 600
+
+    def setUp(self):
+        return self.setUpBenchmark()
+
+    def tearDown(self):
+        return self.tearDownBenchmark()
+
+    @defer.inlineCallbacks
+    def test_smallFarm(self):
+        result = yield self.runBenchmark(Farm('small', builders=10, slaves=20, queueDepth=10))
+        self.assertEqual(result['claimed'], 20)
+
+    @defer.inlineCallbacks
+    def test_deepQueues(self):
+        result = yield self.runBenchmark(Farm('deep_queues', builders=20, slaves=50, queueDepth=250,
+                                              priorities=(Priority.Default, Priority.High,
+                                                          Priority.VeryHigh)))
+        self.assertEqual(result['builds'], 50)
+
+    @defer.inlineCallbacks
+    def test_manyBuilders(self):
+        result = yield self.runBenchmark(Farm('many_builders', builders=500, slaves=200, queueDepth=5))
+        self.assertEqual(result['builds'], 200)
+
+    @defer.inlineCallbacks
+    def test_selectedSlaves(self):
+        result = yield self.runBenchmark(Farm('selected_slaves', builders=50, slaves=100, queueDepth=40,
+                                              selectedSlaveRatio=0.5))
+        self.assertEqual(result['builds'], 100)
+
+    @defer.inlineCallbacks
+    def test_merges(self):
+        result = yield self.runBenchmark(Farm('merges', builders=50, slaves=100, queueDepth=40,
+                                              priorities=(Priority.Default, Priority.High),
+                                              mergeRatio=0.5))
+        self.assertEqual(result['builds'], 100)
+        # the mergeable requests are claimed together
+        self.assertTrue(result['claimed'] > result['builds'])
@@ -0,0 +1,91 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import shutil
+import time
+
+from twisted.python import log
+from twisted.trial import unittest
+
+from buildbot.status.persistent_queue import DiskQueue, SegmentDiskQueue
+from buildbot.util import json
+
+
+def generateEvents(count):
+    # about the size of the build events of the status push
+    return [{'event': 'buildFinished', 'id': i, 'started': 1400000000 + i,
+             'payload': {'build': {'builderName': 'runtests-%d' % (i % 50),
+                                   'number': i,
+                                   'text': ['build', 'successful'],
+                                   'properties': [['prop%d' % p, 'value', 'test']
+                                                  for p in range(20)]}}}
+            for i in xrange(count)]
+
+
+class TestDiskQueueBenchmark(unittest.TestCase):
+    """
+    Queues the events of a push receiver which is down, then drains them in
+    chunks, failing every tenth chunk, with the file per item of DiskQueue
+    and the segments of SegmentDiskQueue.
+    """
+
+    timeout = 600
+
+    items = 20000
+    chunkSize = 200
+
+    def run_queue(self, queueClass, events):
+        path = os.path.abspath(self.mktemp())
+        self.addCleanup(shutil.rmtree, path, True)
+        result = {}
+
+        queue = queueClass(path, maxItems=len(events))
+        start = time.time()
+        for event in events:
+            queue.pushItem(event)
+        queue.save()
+        result['push_seconds'] = time.time() - start
+
+        start = time.time()
+        queue = queueClass(path, maxItems=len(events))
+        result['load_seconds'] = time.time() - start
+        self.assertEqual(queue.nbItems(), len(events))
+
+        popped = []
+        chunks = 0
+        start = time.time()
+        while queue.nbItems():
+            chunk = queue.popChunk(self.chunkSize)
+            chunks += 1
+            if chunks % 10 == 0:
+                # the push failed
+                self.assertEqual(queue.insertBackChunk(chunk), None)
+                chunk = queue.popChunk(self.chunkSize)
+            popped.extend(chunk)
+        result['drain_seconds'] = time.time() - start
+
+        self.assertEqual(popped, events)
+        self.assertEqual(os.listdir(path), [])
+        return result
+
+    def test_queueEvents(self):
+        events = generateEvents(self.items)
+        result = {
+            'items': self.items,
+            'DiskQueue': self.run_queue(DiskQueue, events),
+            'SegmentDiskQueue': self.run_queue(SegmentDiskQueue, events),
+        }
+        log.msg("benchmark persistent_queue: %s" % (json.dumps(result, sort_keys=True),))
@@ -0,0 +1,129 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import time
+
+from twisted.python import log
+from twisted.trial import unittest
+
+from buildbot.status.logfile import LogFile
+from buildbot.steps import shell
+from buildbot.test.util import steps
+from buildbot.util import json
+
+
+def generateCompilerLog(lines, warningEvery=50, filesPerDirectory=200):
+    """
+    Generate the output of a recursive make of C sources, of about C{lines}
+    lines, with a warning every C{warningEvery} lines.
+
+    @returns: (text, number of warnings)
+    """
+    out = []
+    warnings = 0
+    directory = 0
+    while len(out) < lines:
+        path = '/build/src/module%d' % directory
+        out.append("make[2]: Entering directory '%s'" % path)
+        for f in xrange(filesPerDirectory):
+            out.append("gcc -c -O2 -Wall -Iinclude -o obj/file%d.o file%d.c" % (f, f))
+            if len(out) % warningEvery == 0:
+                kind = ('unused variable', 'deprecated declaration')[warnings % 2]
+                out.append("file%d.c:%d:5: warning: %s 'x%d' [-Wall]"
+                           % (f, 10 + f, kind, warnings))
+                warnings += 1
+        out.append("make[2]: Leaving directory '%s'" % path)
+        directory += 1
+    return "\n".join(out) + "\n", warnings
+
+
+class TestWarningCountingShellCommandBenchmark(steps.BuildStepMixin, unittest.TestCase):
+    """
+    Scans a large compiler log for warnings, as the slave sends it.  Set
+    BUILDBOT_WARNINGS_LOG to the path of a recorded log to scan it instead of
+    a generated one.
+    """
+
+    timeout = 600
+
+    lines = 1000000
+
+    def setUp(self):
+        return self.setUpBuildStep()
+
+    def tearDown(self):
+        return self.tearDownBuildStep()
+
+    def loadLog(self):
+        path = os.environ.get('BUILDBOT_WARNINGS_LOG')
+        if path:
+            with open(path) as f:
+                return f.read(), None
+        return generateCompilerLog(self.lines)
+
+    def makeStep(self):
+        step = shell.Compile(warningExtractor=shell.WarningCountingShellCommand.warnExtractFromRegexpGroups,
+                             warningPattern=r"^(.*?):([0-9]+):[0-9]+: warning: (.*)$")
+        step = self.setupStep(step)
+        step.addSuppression([(None, '.*unused parameter.*', None, None),
+                             (None, '.*-Wsign-compare.*', None, None),
+                             ('.*/vendor/.*', None, None, None),
+                             (None, '.*deprecated declaration.*', None, None)])
+        step.setupLogfiles(None, {})
+        return step
+
+    def test_largeCompilerLog(self):
+        text, expectedWarnings = self.loadLog()
+        chunkSize = LogFile.chunkSize
+
+        step = self.makeStep()
+        observer = step.warningObserver
+        longestChunk = 0
+        start = time.time()
+        for offset in xrange(0, len(text), chunkSize):
+            chunkStart = time.time()
+            observer.outReceived(text[offset:offset + chunkSize])
+            longestChunk = max(longestChunk, time.time() - chunkStart)
+        scanned = time.time() - start
+
+        start = time.time()
+        step.createSummary(None)
+        summary = time.time() - start
+
+        # the whole log at once, as the steps used to scan it at their end
+        oneShot = self.makeStep()
+        start = time.time()
+        oneShot.warningObserver.outReceived(text)
+        oneShot.warningObserver.finish()
+        oneShotScanned = time.time() - start
+
+        lines = text.count("\n")
+        result = {
+            'bytes': len(text),
+            'lines': lines,
+            'warnings': step.warnCount,
+            'lines_per_second': lines / scanned if scanned else None,
+            'longest_chunk_seconds': longestChunk,
+            'summary_seconds': summary,
+            'one_shot_seconds': oneShotScanned,
+        }
+        log.msg("benchmark warning_scanner: %s" % (json.dumps(result, sort_keys=True),))
+
+        self.assertEqual(oneShot.warnCount, step.warnCount)
+        if expectedWarnings is not None:
+            # half of the generated warnings are suppressed
+            self.assertEqual(step.warnCount, expectedWarnings - expectedWarnings // 2)
+            self.assertEqual(step.getProperty('warnings-count'), step.warnCount)
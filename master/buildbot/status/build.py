@@ -15,10 +15,9 @@
 
 from __future__ import with_statement
 
-import os, shutil, re
-from cPickle import dump
+import re
 from zope.interface import implements
-from twisted.python import log, runtime, components
+from twisted.python import log, components
 from twisted.persisted import styles
 from twisted.internet import reactor, defer, threads
 from buildbot import interfaces, util, sourcestamp
@@ -589,28 +588,54 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         yield threads.deferToThread(self.saveYourself)
 
     def saveYourself(self):
-        filename = os.path.join(self.builder.basedir, "%d" % self.number)
-        if os.path.isdir(filename):
-            # leftover from 0.5.0, which stored builds in directories
-            shutil.rmtree(filename, ignore_errors=True)
-        tmpfilename = filename + ".tmp"
-
         try:
-            with open(tmpfilename, "wb") as f:
-                dump(self, f, -1)
-            if runtime.platformType  == 'win32':
-                # windows cannot rename a file on top of an existing one, so
-                # fall back to delete-first. There are ways this can fail and
-                # lose the builder's history, so we avoid using it in the
-                # general (non-windows) case
-                if os.path.exists(filename):
-                    os.unlink(filename)
-
-            os.rename(tmpfilename, filename)
+            self.builder.getBuildStore().saveBuild(self)
         except:
             log.msg("unable to save build %s-#%d" % (self.builder.name,
                                                      self.number))
             klog.err_json()
+            return
+        if self.isFinished():
+            self.builder.buildSaved(self)
+
+    def getSummary(self):
+        """
+        Return the fields of this build shown in the build listings, as a
+        JSON-able dictionary.  The build stores keep it apart from the rest
+        of the build, and L{BuildSummary} renders it.
+
+        The fields computed from the master (the URLs of the logs, the
+        failure URL and the build tags) are only there when the build has
+        its process objects, see L{isSummaryComplete}.
+        """
+        summary = {
+            'number': self.number,
+            'results': self.results,
+            'text': self.getText(),
+            'times': list(self.getTimes()),
+            'slavename': self.slavename,
+            'reason': self.reason,
+            'submittedTime': self.submitted,
+            'owners': self.owners,
+            'brids': self.brids,
+            'buildChainID': self.buildChainID,
+            'blame': self.blamelist,
+            'resume': self.resume,
+            'resumeSlavepool': self.resumeSlavepool,
+            'artifacts': self.get_artifacts(),
+            'properties': self.getProperties().asList(),
+            'sourceStamps': [ss.asDict() for ss in self.sources or []],
+        }
+        if getattr(self, 'master', None) is not None:
+            summary['logs'] = [[l.getName(), self.master.status.getURLForThing(l)]
+                               for l in self.getLogs()]
+            summary['failure_url'] = self.get_failure_of_interest()
+            summary['build_tags'] = self.getBuildTags()
+        return summary
+
+    @staticmethod
+    def isSummaryComplete(summary):
+        return 'logs' in summary
 
     def currentStepDict(self, dict):
         if self.getCurrentStep():
@@ -746,29 +771,8 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
             result = self.currentStepDict(result)
 
         # Constant
-        project = None
-        for p, obj in status.getProjects().iteritems():
-            if p == self.builder.project:
-                project = obj
-                break
-
-        def getCodebaseObj(repo):
-            for c in project.codebases:
-                if c.values()[0]['repository'] == repo:
-                    return c.values()[0]
-
-        stamp_array = []
-        for ss in sourcestamps:
-            d = ss.asDict(status)
-            c = getCodebaseObj(d['repository'])
-            if c is not None and c.has_key("display_repository"):
-                d['display_repository'] = c['display_repository']
-            else:
-                d['display_repository'] = d['repository']
-
-            stamp_array.append(d)
-
-        result['sourceStamps'] = stamp_array
+        result['sourceStamps'] = addDisplayRepositories(status, self.builder.project,
+                                                        [ss.asDict(status) for ss in sourcestamps])
 
         return result
 
@@ -796,5 +800,146 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
 
         return result
 
+
+def addDisplayRepositories(status, projectName, stamps):
+    """
+    Set the repository shown for each of the source stamp dictionaries
+    C{stamps}, from the codebases of the project.
+    """
+    project = None
+    for p, obj in status.getProjects().iteritems():
+        if p == projectName:
+            project = obj
+            break
+
+    def getCodebaseObj(repo):
+        for c in project.codebases:
+            if c.values()[0]['repository'] == repo:
+                return c.values()[0]
+
+    for d in stamps:
+        c = getCodebaseObj(d['repository'])
+        if c is not None and c.has_key("display_repository"):
+            d['display_repository'] = c['display_repository']
+        else:
+            d['display_repository'] = d['repository']
+
+    return stamps
+
+
+class BuildSummary(object):
+    """
+    The summary of a finished build (see L{BuildStatus.getSummary}).  It
+    renders the same dictionaries as the build for the build listings,
+    without loading the build.
+    """
+
+    def __init__(self, builder, summary):
+        """
+        @type  builder: L{BuilderStatus}
+        @type  summary: dictionary
+        """
+        self.builder = builder
+        self.summary = summary
+        self.number = summary['number']
+        self.started, self.finished = summary['times']
+
+    def __repr__(self):
+        return "<%s #%s>" % (self.__class__.__name__, self.number)
+
+    def getNumber(self):
+        return self.number
+
+    def getTimes(self):
+        return (self.started, self.finished)
+
+    def isFinished(self):
+        return self.finished is not None
+
+    def getResults(self):
+        return self.summary['results']
+
+    def getSlavename(self):
+        return self.summary['slavename']
+
+    def getSourceStamps(self):
+        return self.summary['sourceStamps']
+
+    def asBaseDict(self, request=None, include_artifacts=False, include_failure_url=False):
+        from buildbot.status.master import Status
+        from buildbot.status.web.base import getCodebasesArg, css_classes
+
+        summary = self.summary
+        status = self.builder.master.status
+        args = getCodebasesArg(request, sourcestamps=summary['sourceStamps'])
+
+        result = {}
+        result['builderName'] = self.builder.name
+        result['builderFriendlyName'] = self.builder.getFriendlyName()
+        result['number'] = self.number
+        result['reason'] = summary['reason']
+        result['submittedTime'] = summary['submittedTime']
+        result['owners'] = summary['owners']
+        result['brids'] = summary['brids']
+        result['buildChainID'] = summary['buildChainID']
+        result['blame'] = summary['blame']
+        result['url'] = status.getURLForBuild(self.builder.getName(), self.number)
+        result['url']['path'] += args
+        result['builder_url'] = status.getURLForThing(self.builder) + args
+        result['builder_tags'] = self.builder.tags
+        result['build_tags'] = summary['build_tags']
+
+        if summary['resume']:
+            result['resume'] = summary['resume']
+
+        if summary['resumeSlavepool']:
+            result['resumeSlavepool'] = summary['resumeSlavepool']
+
+        if include_failure_url:
+            result['failure_url'] = summary['failure_url']
+            if result['failure_url'] is not None:
+                result['failure_url'] += args
+
+        if include_artifacts:
+            result['artifacts'] = summary['artifacts']
+
+        result['times'] = self.getTimes()
+        result['text'] = summary['text']
+        result['results'] = summary['results']
+        result['slave'] = summary['slavename']
+        slave = status.getSlave(summary['slavename'])
+        if slave is not None:
+            result['slave_friendly_name'] = slave.getFriendlyName()
+            result['slave_url'] = status.getURLForThing(slave)
+        result['eta'] = None
+        result['results_text'] = css_classes.get(result['results'], "")
+
+        stamps = []
+        for ss in summary['sourceStamps']:
+            d = dict(ss)
+            if isinstance(status, Status):
+                d['url'] = status.get_rev_url(d['revision'], d['repository'])
+            stamps.append(d)
+        result['sourceStamps'] = addDisplayRepositories(status, self.builder.project, stamps)
+
+        return result
+
+    def asDict(self, request=None, include_artifacts=False, include_failure_url=False,
+               include_properties=True):
+        from buildbot.status.web.base import getCodebasesArg
+        result = self.asBaseDict(request, include_artifacts=include_artifacts,
+                                 include_failure_url=include_failure_url)
+
+        args = getCodebasesArg(request)
+        result['logs'] = [[name, url + args] for name, url in self.summary['logs']]
+        result['isWaiting'] = False
+        result['currentStep'] = None
+
+        if include_properties:
+            result['properties'] = self.summary['properties']
+
+        return result
+
+
 components.registerAdapter(lambda build_status : build_status.properties,
         BuildStatus, interfaces.IProperties)
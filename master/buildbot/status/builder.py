@@ -16,19 +16,21 @@
 from __future__ import with_statement
 
 
-import os, re, itertools
-from cPickle import load, dump
+import os, re, itertools, bisect
+from cPickle import dump
 import datetime
 from buildbot.interfaces import IStatusReceiver
-from twisted.internet import defer, threads
+from twisted.internet import defer, reactor, threads
 
 from zope.interface import implements
-from twisted.python import log, runtime
+from twisted.python import log, runtime, threadable
 from twisted.persisted import styles
 from buildbot import interfaces, util
+from buildbot.process import metrics
 from buildbot.util.lru import LRUCache
+from buildbot.status import buildstore
 from buildbot.status.event import Event
-from buildbot.status.build import BuildStatus
+from buildbot.status.build import BuildStatus, BuildSummary
 from buildbot.status.buildrequest import BuildRequestStatus
 import klog
 
@@ -129,6 +131,7 @@ class BuilderStatus(styles.Versioned):
         self.tags = []
         self.loadingBuilds = {}
         self.cancelBuilds = {}
+        self.buildStore = None
 
 
     # persistence
@@ -163,6 +166,7 @@ class BuilderStatus(styles.Versioned):
         self.deleteKey('nextBuildNumber', d)
         del d['master']
         self.deleteKey('loadingBuilds', d)
+        self.deleteKey('buildStore', d)
 
         if 'pendingBuildsCache' in d:
             del d['pendingBuildsCache']
@@ -181,6 +185,7 @@ class BuilderStatus(styles.Versioned):
         self.startSlavenames = []
         self.loadingBuilds = {}
         self.cancelBuilds = {}
+        self.buildStore = None
         # self.basedir must be filled in by our parent
         # self.status must be filled in by our parent
         # self.master must be filled in by our parent
@@ -211,6 +216,8 @@ class BuilderStatus(styles.Versioned):
             if r is not None and len(r.groups()) > 0:
                 existing_builds.append(int(r.groups()[0]))
 
+        existing_builds.extend(self.getBuildStore().getBuildNumbers())
+
         if len(existing_builds):
             self.nextBuildNumber = max(existing_builds) + 1
         else:
@@ -247,6 +254,19 @@ class BuilderStatus(styles.Versioned):
         if caches and 'BuilderBuildRequestStatus' in caches:
             self.pendingBuildsCache.buildRequestStatusCache.set_max_size(caches['BuilderBuildRequestStatus'])
 
+    def getBuildStore(self):
+        """
+        @returns: the build store of this builder, as configured by
+            C{buildStatusStorage}
+        """
+        storage = self.master.config.buildStatusStorage
+        store = self.buildStore
+        if store is None or store.name != storage or store.basedir != self.basedir:
+            if store is not None:
+                store.close()
+            store = self.buildStore = buildstore.getBuildStore(storage, self.basedir)
+        return store
+
     def makeBuildFilename(self, number):
         return os.path.join(self.basedir, "%d" % number)
 
@@ -257,22 +277,20 @@ class BuilderStatus(styles.Versioned):
         if number in self.unavailable_build_numbers:
             return None
 
-        filename = self.makeBuildFilename(number)
         try:
-            if not os.path.exists(filename):
+            log.msg("Loading builder %s's build %d from the build store" % (self.name, number))
+            try:
+                build = self.getBuildStore().loadBuild(number)
+            except ImportError as err:
+                log.msg("ImportError loading builder %s's build %d from the build store" % (self.name, number))
+                klog.err_json(err)
+                return None
+
+            if build is None:
                 if number < self.nextBuildNumber:
                     self.unavailable_build_numbers.add(number)
                 return None
 
-            log.msg("Loading builder %s's build %d from on-disk pickle" % (self.name, number))
-            with open(filename, "rb") as f:
-                try:
-                    build = load(f)
-                except ImportError as err:
-                    log.msg("ImportError loading builder %s's build %d from disk pickle" % (self.name, number))
-                    klog.err_json(err)
-                    return None
-
             build.setProcessObjects(self, self.master)
 
             # (bug #1068) if we need to upgrade, we probably need to rewrite
@@ -294,6 +312,68 @@ class BuilderStatus(styles.Versioned):
         except EOFError:
             raise IndexError("corrupted build pickle %d" % number)
 
+    def getBuildSummary(self, number):
+        """
+        Return the summary of a build (see L{BuildStatus.getSummary}),
+        without loading the build when it is not already in memory and the
+        build store keeps a complete summary of it.  The builds loaded for
+        their summary do not go through the build cache.
+
+        @returns: dictionary, or None if there is no such build
+        """
+        if number < 0:
+            number = self.nextBuildNumber + number
+        if number < 0 or number >= self.nextBuildNumber:
+            return None
+
+        build = self.buildCache.cache.get(number)
+        if build is None:
+            for b in self.currentBuilds:
+                if b.number == number:
+                    build = b
+        if build is not None:
+            return build.getSummary()
+
+        store = self.getBuildStore()
+        try:
+            if store.keepsSummaries:
+                summary = store.loadSummary(number)
+                if summary is None or BuildStatus.isSummaryComplete(summary):
+                    return summary
+            build = self.loadBuildFromFile(number)
+        except IndexError:
+            return None
+        if build is None:
+            return None
+
+        if store.keepsSummaries:
+            # e.g. saved by upgrade-master: keep its complete summary now
+            try:
+                store.saveBuild(build)
+            except:
+                log.msg("unable to save build %s-#%d" % (self.name, number))
+                klog.err_json()
+        return build.getSummary()
+
+    def getBuildSummaryAsync(self, number):
+        """
+        @returns: the L{BuildSummary} of a finished build, or None, via
+            Deferred, from the build summary cache
+        """
+        return self.master.status.getBuildSummary(self.name, number)
+
+    def buildSaved(self, build):
+        """
+        Called by the finished builds when they are saved, to keep their
+        summary in the build summary cache.  May be called from a thread.
+        """
+        summary = BuildSummary(self, build.getSummary())
+        if threadable.isInIOThread():
+            self.master.status.putBuildSummary(self.name, summary)
+        else:
+            reactor.callFromThread(self.master.status.putBuildSummary,
+                                   self.name, summary)
+
     def cacheMiss(self, number, **kwargs):
         # If kwargs['val'] exists, this is a new value being added to
         # the cache.  Just return it.
@@ -363,6 +443,15 @@ class BuilderStatus(styles.Versioned):
                 try: os.unlink(pathname)
                 except OSError: pass
 
+        # and the builds kept by the build store
+        store = self.getBuildStore()
+        for num in store.getBuildNumbers():
+            if num >= earliest_build:
+                break
+            if num in self.buildCache.cache: continue
+            log.msg("pruning build %d of builder %s" % (num, self.name))
+            store.removeBuild(num)
+
     # IBuilderStatus methods
     def getName(self):
         # if builderstatus page does show not up without any reason then 
@@ -532,13 +621,15 @@ class BuilderStatus(styles.Versioned):
         return None
 
     @defer.inlineCallbacks
-    def getLatestBuildCacheAsync(self, key):
+    def getLatestBuildCacheAsync(self, key, load=None):
+        if load is None:
+            load = self.deferToThread
         cache = self.latestBuildCache[key]
         max_cache = datetime.timedelta(days=self.master.config.lastBuildCacheDays)
         if datetime.datetime.now() - cache["date"] > max_cache:
             del self.latestBuildCache[key]
         elif cache["build"] is not None:
-            build = yield self.deferToThread(self.latestBuildCache[key]["build"])
+            build = yield load(self.latestBuildCache[key]["build"])
             defer.returnValue(build)
             return
         defer.returnValue(None)
@@ -580,11 +671,21 @@ class BuilderStatus(styles.Versioned):
         build = self.getLoadedBuildFromThread(buildnumber)
         defer.returnValue(build)
 
-    @defer.inlineCallbacks
     def getFinishedBuildsByNumbers(self, buildnumbers=[], results=None):
+        return self._getFinishedBuildsByNumbers(self.deferToThread, buildnumbers, results)
+
+    def getFinishedBuildSummariesByNumbers(self, buildnumbers=[], results=None):
+        """
+        Like L{getFinishedBuildsByNumbers}, but returns L{BuildSummary}
+        instances from the build summary cache.
+        """
+        return self._getFinishedBuildsByNumbers(self.getBuildSummaryAsync, buildnumbers, results)
+
+    @defer.inlineCallbacks
+    def _getFinishedBuildsByNumbers(self, load, buildnumbers, results):
         finishedBuilds = []
         for bn in buildnumbers:
-            build = yield self.deferToThread(bn)
+            build = yield load(bn)
 
             if build:
                 if results is not None and build.getResults() not in results:
@@ -595,12 +696,26 @@ class BuilderStatus(styles.Versioned):
         defer.returnValue(finishedBuilds)
 
 
-    @defer.inlineCallbacks
     def generateFinishedBuildsAsync(self, branches=[], codebases={},
                                num_builds=None,
                                results=None,
                                useCache=False):
+        return self._generateFinishedBuildsAsync(self.deferToThread, branches, codebases,
+                                                 num_builds, results, useCache)
 
+    def generateFinishedBuildSummariesAsync(self, branches=[], codebases={},
+                                            num_builds=None,
+                                            results=None,
+                                            useCache=False):
+        """
+        Like L{generateFinishedBuildsAsync}, but returns L{BuildSummary}
+        instances from the build summary cache, for the build listings.
+        """
+        return self._generateFinishedBuildsAsync(self.getBuildSummaryAsync, branches, codebases,
+                                                 num_builds, results, useCache)
+
+    @defer.inlineCallbacks
+    def _generateFinishedBuildsAsync(self, load, branches, codebases, num_builds, results, useCache):
         build = None
         finishedBuilds = []
         branches = set(branches)
@@ -608,7 +723,7 @@ class BuilderStatus(styles.Versioned):
         key = self.getCodebasesCacheKey(codebases)
 
         if self.shouldUseLatestBuildCache(useCache, num_builds, key):
-            build = yield self.getLatestBuildCacheAsync(key)
+            build = yield self.getLatestBuildCacheAsync(key, load)
 
             if build:
                 finishedBuilds.append(build)
@@ -618,7 +733,7 @@ class BuilderStatus(styles.Versioned):
         buildNumbers = yield self.generateBuildNumbers(codebases, branches, results, num_builds)
 
         for bn in buildNumbers:
-            build = yield self.deferToThread(bn)
+            build = yield load(bn)
 
             if build is None:
                 continue
@@ -946,8 +1061,13 @@ class BuilderStatus(styles.Versioned):
             ss = build.getSourceStamps()
             codebases = {}
             for s in ss:
-                if s.codebase and s.branch:
-                    codebases[s.codebase] = s.branch
+                if isinstance(s, dict):
+                    # from a BuildSummary
+                    codebase, branch = s['codebase'], s['branch']
+                else:
+                    codebase, branch = s.codebase, s.branch
+                if codebase and branch:
+                    codebases[codebase] = branch
 
             # We save it in the same way as we access it
             key = self.getCodebasesCacheKey(codebases)
@@ -1013,27 +1133,65 @@ class BuilderStatus(styles.Versioned):
 
 # vim: set ts=4 sts=4 sw=4 et:
 
+def requestMatchesCodebases(sourcestamps, codebases):
+    """
+    Check if a build request with the given C{sourcestamps} is listed by
+    C{getBuildRequestInQueue} when filtering by C{codebases}; this mirrors
+    L{buildbot.db.buildrequests.maybeFilterBuildRequestsBySourceStamps}.
+    """
+    if not codebases:
+        return True
+
+    included = False
+    for codebase, branch in codebases.iteritems():
+        for ss in sourcestamps:
+            if ss['codebase'] != codebase:
+                continue
+            if ss['branch'] == branch:
+                included = True
+            elif len(codebases) > 1:
+                return False
+
+    return included
+
+
 class PendingBuildsCache():
     implements(IStatusReceiver)
 
     """
-    A class which caches the pending builds for a builder
-    it will clear the cache and request them again when
-    a build is requested or started
+    A class which caches the pending builds for a builder, for each set of
+    codebases it was asked about.  The caches are kept up to date with the
+    requests submitted, cancelled and claimed, and fetched again from the
+    database every C{refreshInterval} seconds or when invalidated.
     """
+
+    # seconds after which the cached queues are fetched again, to pick up the
+    # changes the other masters did not tell us about
+    refreshInterval = 300
+
     def __init__(self, builder):
         self.builder = builder
         self.buildRequestStatusCodebasesCache = {}
         self.buildRequestStatusCodebasesDictsCache = {}
         self.buildRequestStatusCache = LRUCache(BuildRequestStatus.createBuildRequestStatus, 50)
+        # codebases used to fetch each key, and brdicts of the cached requests
+        self.codebasesCache = {}
+        self.brdicts = {}
+        # requests being added, and those removed in the meantime
+        self.addingBrids = set()
+        self.removedBrids = set()
+        # bumped on every change, so a queue fetched meanwhile is not cached
+        self.generation = 0
+        self.lastRefresh = None
         self.cache_now()
         self.builder.subscribe(self)
 
     @defer.inlineCallbacks
-    def fetchPendingBuildRequestStatuses(self, codebases={}):
+    def fetchPendingBuildRequestStatuses(self, codebases={}, brids=None):
         sourcestamps = [{'b_codebase': key, 'b_branch': value} for key, value in codebases.iteritems()]
 
         brdicts = yield self.builder.master.db.buildrequests.getBuildRequestInQueue(
+                brids=brids,
                 buildername=self.builder.name,
                 sourcestamps=sourcestamps,
                 sorted=True
@@ -1041,33 +1199,66 @@ class PendingBuildsCache():
 
         result = []
         for brdict in brdicts:
-            brs = self.buildRequestStatusCache.get(
-                    key=brdict['brid'],
-                    buildername=self.builder.name,
-                    status=self.builder.status
-            )
-
-            brs.update(brdict)
-            result.append(brs)
+            result.append(self.getBuildRequestStatus(brdict))
 
         defer.returnValue(result)
 
+    def getBuildRequestStatus(self, brdict):
+        brs = self.buildRequestStatusCache.get(
+                key=brdict['brid'],
+                buildername=self.builder.name,
+                status=self.builder.status
+        )
+
+        brs.update(brdict)
+        self.brdicts[brdict['brid']] = brdict
+        return brs
+
+    def queueOrder(self, brs):
+        # same order as getBuildRequestInQueue(sorted=True): the unclaimed
+        # requests, then the ones waiting to be resumed
+        brdict = self.brdicts[brs.brid]
+        return (brdict['results'] == RESUME, -brdict['priority'],
+                brdict['submitted_at'], brdict['brid'])
+
     @defer.inlineCallbacks
     def cache_now(self):
+        self.invalidate()
+        if hasattr(self.builder, "status"):
+            yield self.getPendingBuilds()
+
+    def invalidate(self):
+        """
+        Forget all the cached queues; they are fetched again when needed.
+        """
+        metrics.MetricCountEvent.log("PendingBuildsCache.refreshes")
         self.buildRequestStatusCodebasesCache = {}
         self.buildRequestStatusCodebasesDictsCache = {}
-        if hasattr(self.builder, "status"):
-            key = self.builder.getCodebasesCacheKey()
-            self.buildRequestStatusCodebasesCache[key] = yield self.fetchPendingBuildRequestStatuses()
-            defer.returnValue(self.buildRequestStatusCodebasesCache[key])
+        self.codebasesCache = {}
+        self.brdicts = {}
+        self.generation += 1
+        self.lastRefresh = util.now()
+
+    def maybeRefresh(self):
+        if self.lastRefresh is None or util.now() - self.lastRefresh > self.refreshInterval:
+            self.invalidate()
 
     @defer.inlineCallbacks
     def getPendingBuilds(self, codebases={}):
+        self.maybeRefresh()
         key = self.builder.getCodebasesCacheKey(codebases)
 
-        if not self.buildRequestStatusCodebasesCache or key not in self.buildRequestStatusCodebasesCache:
-            self.buildRequestStatusCodebasesCache[key] = \
-                yield self.fetchPendingBuildRequestStatuses(codebases=codebases)
+        if key in self.buildRequestStatusCodebasesCache:
+            metrics.MetricCountEvent.log("PendingBuildsCache.hits")
+        else:
+            metrics.MetricCountEvent.log("PendingBuildsCache.misses")
+            generation = self.generation
+            pendingBuilds = yield self.fetchPendingBuildRequestStatuses(codebases=codebases)
+            if generation != self.generation:
+                defer.returnValue(pendingBuilds)
+                return
+            self.buildRequestStatusCodebasesCache[key] = pendingBuilds
+            self.codebasesCache[key] = codebases
 
         defer.returnValue(self.buildRequestStatusCodebasesCache[key])
 
@@ -1077,9 +1268,12 @@ class PendingBuildsCache():
 
         if not self.buildRequestStatusCodebasesDictsCache or key not in self.buildRequestStatusCodebasesDictsCache:
             pendingBuilds = yield self.getPendingBuilds(codebases)
-            self.buildRequestStatusCodebasesDictsCache[key] = [
-                (yield brs.asDict_async(codebases=codebases)) for brs in pendingBuilds
-                ]
+            generation = self.generation
+            dicts = [(yield brs.asDict_async(codebases=codebases)) for brs in pendingBuilds]
+            if generation != self.generation:
+                defer.returnValue(dicts)
+                return
+            self.buildRequestStatusCodebasesDictsCache[key] = dicts
 
         defer.returnValue(self.buildRequestStatusCodebasesDictsCache[key])
 
@@ -1088,22 +1282,86 @@ class PendingBuildsCache():
         pendingBuilds = yield self.getPendingBuilds(codebases)
         defer.returnValue(len(pendingBuilds))
 
+    @defer.inlineCallbacks
+    def addRequests(self, brids):
+        """
+        Add the requests C{brids} to the cached queues they belong to, if they
+        are still in the queue.
+        """
+        self.addingBrids.update(brids)
+        try:
+            pendingBuilds = yield self.fetchPendingBuildRequestStatuses(brids=brids)
+            brdicts = dict((brs.brid, self.brdicts[brs.brid]) for brs in pendingBuilds)
+            sourcestamps = {}
+            if brdicts:
+                # the buildsets and sourcestamps of all the requests at once
+                db = self.builder.master.db
+                bsids = list(set(brdict['buildsetid'] for brdict in brdicts.itervalues()))
+                buildsets = yield db.buildsets.getBuildsetsByIds(bsids)
+                sslists = yield db.sourcestamps.getSourceStampsForSets(
+                        list(set(bsdict['sourcestampsetid'] for bsdict in buildsets.itervalues())))
+                for brid, brdict in brdicts.iteritems():
+                    bsdict = buildsets[brdict['buildsetid']]
+                    sourcestamps[brid] = sslists[bsdict['sourcestampsetid']]
+        except Exception:
+            klog.err_json(None, 'while adding build requests %r to the pending builds cache' % (brids,))
+            self.invalidate()
+            return
+        finally:
+            self.addingBrids.difference_update(brids)
+
+        # skip the requests removed while we were fetching them
+        added = [brs for brs in pendingBuilds if brs.brid not in self.removedBrids]
+        self.removedBrids.difference_update(brids)
+        self.generation += 1
+        for brs in added:
+            self.brdicts[brs.brid] = brdicts[brs.brid]
+
+        for key, codebases in self.codebasesCache.items():
+            queue = self.buildRequestStatusCodebasesCache.get(key)
+            if queue is None:
+                continue
+            changed = False
+            for brs in added:
+                if brs.brid in [b.brid for b in queue] or \
+                        not requestMatchesCodebases(sourcestamps[brs.brid], codebases):
+                    continue
+                orders = [self.queueOrder(b) for b in queue]
+                queue.insert(bisect.bisect(orders, self.queueOrder(brs)), brs)
+                changed = True
+            if changed:
+                self.buildRequestStatusCodebasesDictsCache.pop(key, None)
+
+    def removeRequests(self, brids):
+        """
+        Remove the requests C{brids} from all the cached queues.
+        """
+        brids = set(brids)
+        self.removedBrids.update(brids & self.addingBrids)
+        self.generation += 1
+        for brid in brids:
+            self.brdicts.pop(brid, None)
+        for key, queue in self.buildRequestStatusCodebasesCache.items():
+            queue[:] = [brs for brs in queue if brs.brid not in brids]
+        for key, dicts in self.buildRequestStatusCodebasesDictsCache.items():
+            dicts[:] = [d for d in dicts if d['brid'] not in brids]
+
     def buildStarted(self, builderName, state):
-        self.cache_now()
+        self.removeRequests(state.brids or [])
 
     def buildFinished(self, builderName, state, results):
-        self.cache_now()
-        
+        # the requests of a build finished with RESUME go back to the queue,
+        # the others were already removed when the build started
+        if results == RESUME:
+            return self.addRequests(state.brids or [])
+
     def requestSubmitted(self, req):
-        self.cache_now()
+        return self.addRequests([req.brid])
 
-    def requestCancelled(self, req):
-        self.cache_now()
+    def requestCancelled(self, builder, req):
+        self.removeRequests([req.brid])
 
     def builderChangedState(self, builderName, state):
         """
         Do nothing
         """
-
-
-
@@ -0,0 +1,263 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import zlib
+from cPickle import dump, dumps, load, loads
+
+from twisted.python import log, runtime
+
+from buildbot.util import json
+import klog
+
+
+class PickleBuildStore(object):
+    """
+    Keeps each build of a builder pickled in a file named after its number,
+    in the builder directory.  Summaries are read by loading the whole
+    build.
+    """
+
+    name = 'pickle'
+    keepsSummaries = False
+
+    build_re = re.compile(r"^([0-9]+)$")
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+    def makeBuildFilename(self, number):
+        return os.path.join(self.basedir, "%d" % number)
+
+    def getBuildNumbers(self):
+        if not os.path.isdir(self.basedir):
+            return []
+        numbers = []
+        for filename in os.listdir(self.basedir):
+            mo = self.build_re.match(filename)
+            if mo and os.path.isfile(os.path.join(self.basedir, filename)):
+                numbers.append(int(mo.group(1)))
+        return sorted(numbers)
+
+    def hasBuild(self, number):
+        return os.path.isfile(self.makeBuildFilename(number))
+
+    def saveBuild(self, build):
+        filename = self.makeBuildFilename(build.number)
+        if os.path.isdir(filename):
+            # leftover from 0.5.0, which stored builds in directories
+            shutil.rmtree(filename, ignore_errors=True)
+        tmpfilename = filename + ".tmp"
+
+        with open(tmpfilename, "wb") as f:
+            dump(build, f, -1)
+        if runtime.platformType  == 'win32':
+            # windows cannot rename a file on top of an existing one, so
+            # fall back to delete-first. There are ways this can fail and
+            # lose the builder's history, so we avoid using it in the
+            # general (non-windows) case
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+        os.rename(tmpfilename, filename)
+
+    def loadBuild(self, number):
+        """
+        Unpickle a build.  The caller is responsible for upgrading it (see
+        L{twisted.persisted.styles.doUpgrade}) and for setting its process
+        objects.
+
+        @returns: the L{BuildStatus}, or None if there is no such build
+        @raises IndexError: if the build cannot be read
+        """
+        filename = self.makeBuildFilename(number)
+        if not os.path.isfile(filename):
+            return None
+        try:
+            with open(filename, "rb") as f:
+                return load(f)
+        except IOError:
+            raise IndexError("no such build %d" % number)
+        except EOFError:
+            raise IndexError("corrupted build pickle %d" % number)
+
+    def loadSummary(self, number):
+        """
+        @returns: the summary of the build (see L{BuildStatus.getSummary}),
+            or None if there is no such build
+        """
+        build = self.loadBuild(number)
+        if build is None:
+            return None
+        return build.getSummary()
+
+    def removeBuild(self, number):
+        try:
+            os.unlink(self.makeBuildFilename(number))
+        except OSError:
+            pass
+
+    def close(self):
+        pass
+
+
+class SQLiteBuildStore(object):
+    """
+    Keeps the builds of a builder in an SQLite file in the builder
+    directory, one row per build.  The summary of each build is stored as
+    JSON, next to the compressed pickle of the whole build, so that the
+    summaries are read without unpickling anything.
+
+    The builds not found in the file are looked up in the pickles of
+    L{PickleBuildStore}, which L{migrate} moves into the file.
+    """
+
+    name = 'sqlite'
+    keepsSummaries = True
+    filename = 'builds.sqlite'
+
+    # version of the rows; bump it when the summary or the detail change
+    # format, and handle the older versions in loadBuild and loadSummary
+    version = 1
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.pickles = PickleBuildStore(basedir)
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _getConnection(self):
+        # called with the lock held
+        if self.conn is None:
+            if not os.path.isdir(self.basedir):
+                os.makedirs(self.basedir)
+            conn = sqlite3.connect(os.path.join(self.basedir, self.filename),
+                                   check_same_thread=False)
+            conn.text_factory = str
+            conn.execute("CREATE TABLE IF NOT EXISTS builds ("
+                         "number INTEGER PRIMARY KEY, "
+                         "version INTEGER NOT NULL, "
+                         "summary TEXT NOT NULL, "
+                         "detail BLOB NOT NULL)")
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _execute(self, query, args=(), commit=False):
+        with self.lock:
+            conn = self._getConnection()
+            rows = conn.execute(query, args).fetchall()
+            if commit:
+                conn.commit()
+            return rows
+
+    def getBuildNumbers(self):
+        rows = self._execute("SELECT number FROM builds")
+        numbers = set(row[0] for row in rows)
+        numbers.update(self.pickles.getBuildNumbers())
+        return sorted(numbers)
+
+    def hasBuild(self, number):
+        rows = self._execute("SELECT 1 FROM builds WHERE number = ?",
+                             (number,))
+        return bool(rows) or self.pickles.hasBuild(number)
+
+    def _makeRow(self, build):
+        return (build.number, self.version,
+                json.dumps(build.getSummary()),
+                sqlite3.Binary(zlib.compress(dumps(build, -1))))
+
+    def saveBuild(self, build):
+        self._execute("INSERT OR REPLACE INTO builds "
+                      "(number, version, summary, detail) VALUES (?, ?, ?, ?)",
+                      self._makeRow(build), commit=True)
+        # the row now supersedes the pickle
+        self.pickles.removeBuild(build.number)
+
+    def loadBuild(self, number):
+        rows = self._execute("SELECT detail FROM builds WHERE number = ?",
+                             (number,))
+        if not rows:
+            return self.pickles.loadBuild(number)
+        try:
+            return loads(zlib.decompress(rows[0][0]))
+        except (zlib.error, EOFError):
+            raise IndexError("corrupted build %d" % number)
+
+    def loadSummary(self, number):
+        rows = self._execute("SELECT summary FROM builds WHERE number = ?",
+                             (number,))
+        if not rows:
+            return self.pickles.loadSummary(number)
+        return json.loads(rows[0][0])
+
+    def removeBuild(self, number):
+        self._execute("DELETE FROM builds WHERE number = ?", (number,),
+                      commit=True)
+        self.pickles.removeBuild(number)
+
+    def migrate(self, upgrade=None):
+        """
+        Move the pickled builds into the file, calling C{upgrade(build)} on
+        each of them first, and remove the pickles.
+
+        @returns: the number of builds migrated
+        """
+        migrated = 0
+        for number in self.pickles.getBuildNumbers():
+            try:
+                build = self.pickles.loadBuild(number)
+                if build is None:
+                    continue
+                if upgrade is not None:
+                    upgrade(build)
+                row = self._makeRow(build)
+            except Exception:
+                log.msg("unable to migrate build %d from %s"
+                        % (number, self.basedir))
+                klog.err_json()
+                continue
+            self._execute("INSERT OR REPLACE INTO builds "
+                          "(number, version, summary, detail) "
+                          "VALUES (?, ?, ?, ?)", row, commit=True)
+            self.pickles.removeBuild(number)
+            migrated += 1
+        return migrated
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+build_stores = {
+    PickleBuildStore.name: PickleBuildStore,
+    SQLiteBuildStore.name: SQLiteBuildStore,
+}
+
+
+def getBuildStore(storage, basedir):
+    """
+    @param storage: the C{buildStatusStorage} configuration
+    @returns: a build store for the builder directory C{basedir}
+    """
+    return build_stores.get(storage, PickleBuildStore)(basedir)
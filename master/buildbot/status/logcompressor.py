@@ -0,0 +1,141 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import heapq
+import itertools
+import time
+
+from twisted.application import service
+from twisted.internet import defer, reactor, threads
+from twisted.python import failure, threadpool
+
+from buildbot import config
+from buildbot.process import metrics
+
+
+class LogCompressor(config.ReconfigurableServiceMixin, service.Service):
+    """
+    Compresses the finished logs in its own pool of threads, at most
+    C{logCompressionWorkers} at a time, so that a lot of builds finishing
+    together do not fill the reactor thread pool.  The queued logs are
+    compressed smallest first, and are all compressed before the service
+    stops.
+
+    The bz2 and zlib codecs release the GIL while they compress, so the
+    threads do not hold up the reactor thread.
+
+    There is generally only one instance of this class, available at
+    C{master.log_compressor}.
+    """
+
+    workers = 2
+
+    def __init__(self, _reactor=reactor):
+        self.setName('log_compressor')
+        self._reactor = _reactor
+        self.pool = None
+        # (size, number, fn, args, deferred)
+        self.queue = []
+        self.counter = itertools.count()
+        self.active = 0
+        self.drainedWatchers = []
+
+    def startService(self):
+        self.pool = threadpool.ThreadPool(minthreads=0,
+                                          maxthreads=self.workers,
+                                          name='LogCompressor')
+        self.pool.start()
+        service.Service.startService(self)
+        self._dispatch()
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        yield service.Service.stopService(self)
+        # compress the logs still queued, so they are not left uncompressed
+        # for good
+        if self.queue or self.active:
+            d = defer.Deferred()
+            self.drainedWatchers.append(d)
+            yield d
+        self.pool.stop()
+        self.pool = None
+
+    def reconfigService(self, new_config):
+        self.workers = new_config.logCompressionWorkers
+        if self.pool:
+            self.pool.adjustPoolsize(maxthreads=self.workers)
+            self._dispatch()
+        return config.ReconfigurableServiceMixin.reconfigService(self,
+                                                                 new_config)
+
+    def compress(self, size, fn, *args):
+        """
+        Queue the compression of a log of C{size} bytes, done by calling
+        C{fn(*args)} in a thread.  C{fn} returns the size of the compressed
+        log and a result.
+
+        @returns: the result of C{fn} via Deferred
+        """
+        if self.pool is None:
+            # not started (or already stopped), e.g. in tests
+            d = threads.deferToThread(fn, *args)
+            d.addCallback(lambda (compressedSize, result): result)
+            return d
+
+        d = defer.Deferred()
+        heapq.heappush(self.queue, (size, next(self.counter), fn, args, d))
+        self._dispatch()
+        return d
+
+    def _dispatch(self):
+        while self.pool and self.queue and self.active < self.workers:
+            size, _, fn, args, d = heapq.heappop(self.queue)
+            self.active += 1
+            job = threads.deferToThreadPool(self._reactor, self.pool,
+                                            self._compress, size, fn, args)
+            job.addBoth(self._compressed, size, d)
+        self._logQueue()
+
+    def _compress(self, size, fn, args):
+        # in the thread
+        start = time.time()
+        compressedSize, result = fn(*args)
+        return compressedSize, time.time() - start, result
+
+    def _compressed(self, res, size, d):
+        self.active -= 1
+        self._dispatch()
+        if not self.queue and not self.active:
+            watchers, self.drainedWatchers = self.drainedWatchers, []
+            for w in watchers:
+                w.callback(None)
+
+        if isinstance(res, failure.Failure):
+            d.errback(res)
+            return
+        compressedSize, elapsed, result = res
+        metrics.MetricCountEvent.log("LogCompressor.bytes_in", size)
+        metrics.MetricCountEvent.log("LogCompressor.bytes_out",
+                                     compressedSize)
+        if size:
+            metrics.MetricTimeEvent.log("LogCompressor.seconds_per_mb",
+                                        elapsed * 1024 * 1024 / size)
+        d.callback(result)
+
+    def _logQueue(self):
+        metrics.MetricCountEvent.log("LogCompressor.queued",
+                                     len(self.queue), absolute=True)
+        metrics.MetricCountEvent.log("LogCompressor.active",
+                                     self.active, absolute=True)
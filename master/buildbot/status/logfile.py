@@ -13,14 +13,18 @@
 #
 # Copyright Buildbot Team Members
 
+import bisect
+import bz2
+import json
 import os
+import zlib
 from cStringIO import StringIO
 from bz2 import BZ2File
 from gzip import GzipFile
 
 from zope.interface import implements
 from twisted.python import log, runtime
-from twisted.internet import defer, threads, reactor
+from twisted.internet import defer, reactor
 from buildbot.util import netstrings
 from buildbot.util.eventual import eventually
 from buildbot import interfaces
@@ -31,6 +35,9 @@ STDOUT = interfaces.LOG_CHANNEL_STDOUT
 STDERR = interfaces.LOG_CHANNEL_STDERR
 HEADER = interfaces.LOG_CHANNEL_HEADER
 ChunkTypes = ["stdout", "stderr", "build-log-header"]
+# the channels of getText and getTextWithHeaders
+TEXT_CHANNELS = [STDOUT, STDERR]
+ALL_CHANNELS = [STDOUT, STDERR, HEADER]
 
 class LogFileScanner(netstrings.NetstringParser):
     def __init__(self, chunk_cb, channels=[]):
@@ -43,6 +50,227 @@ class LogFileScanner(netstrings.NetstringParser):
         if not self.channels or (channel in self.channels):
             self.chunk_cb((channel, line[1:]))
 
+def _compressBlock(data, method, level=9):
+    if method == "bz2":
+        return bz2.compress(data, level)
+    # a gzip member, so that the concatenated blocks are still a gzip file
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def _decompressBlock(data, method):
+    if method == "bz2":
+        return bz2.decompress(data)
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+class LogFileIndex:
+    """
+    The index of the on-disk encoding of a L{LogFile}, stored next to it in
+    C{<logfilename>.idx}.
+
+    The encoding is split in blocks of about C{blockSize} bytes, each one
+    starting on a chunk boundary. For each block, the index records its
+    offset in the encoding, the channel of its first chunk, its offset in
+    the file on disk, and the length and number of lines of the text of each
+    channel before it. Compressed logs are written as independently
+    compressed blocks (which bzip2 and gzip still read as one file), so that
+    a reader can go to a line, a text position or an offset and only read and
+    decompress the blocks it needs.
+
+    The text positions and line numbers are counted on the text of the given
+    channels (stdout, stderr and headers, none of the other channels), e.g.
+    C{[STDOUT, STDERR]} for the text of L{LogFile.getText}.
+
+    @ivar compression: None, 'bz2' or 'gz'
+    @ivar length: length of the encoding
+    @ivar fileLength: length of the file on disk
+    @ivar textLengths: length of the text of each channel
+    @ivar lineCounts: number of newlines in the text of each channel
+    """
+
+    version = 2
+    blockSize = 64*1024
+
+    def __init__(self, compression=None):
+        self.compression = compression
+        self.offsets = []
+        self.channels = []
+        self.fileOffsets = []
+        self.textOffsets = []
+        self.lineNumbers = []
+        self.length = 0
+        self.fileLength = 0
+        self.textLengths = [0] * len(ChunkTypes)
+        self.lineCounts = [0] * len(ChunkTypes)
+        # the number of the last chunk of each channel, and whether it ends
+        # in the middle of a line
+        self.chunkCount = 0
+        self.lastChunks = [0] * len(ChunkTypes)
+        self.partial = [False] * len(ChunkTypes)
+
+    def addBlock(self, offset, channel, fileOffset, textOffsets, lineNumbers):
+        self.offsets.append(offset)
+        self.channels.append(channel)
+        self.fileOffsets.append(fileOffset)
+        self.textOffsets.append(textOffsets)
+        self.lineNumbers.append(lineNumbers)
+
+    def addChunk(self, offset, channel, text, size):
+        """
+        Record a chunk of C{text}, encoded in C{size} bytes at C{offset} of an
+        uncompressed log file.
+        """
+        if not self.offsets or offset - self.offsets[-1] >= self.blockSize:
+            self.addBlock(offset, channel, offset,
+                          list(self.textLengths), list(self.lineCounts))
+        self.length = self.fileLength = offset + size
+        if channel >= len(ChunkTypes) or not text:
+            return
+        self.textLengths[channel] += len(text)
+        self.lineCounts[channel] += text.count("\n")
+        self.chunkCount += 1
+        self.lastChunks[channel] = self.chunkCount
+        self.partial[channel] = not text.endswith("\n")
+
+    def _select(self, counts, channels):
+        return [sum([c[channel] for channel in channels]) for c in counts]
+
+    def getTextLength(self, channels):
+        return sum([self.textLengths[channel] for channel in channels])
+
+    def getNewlineCount(self, channels):
+        return sum([self.lineCounts[channel] for channel in channels])
+
+    def endsWithinLine(self, channels):
+        """
+        @returns: true if the text ends with a line without a newline
+        """
+        last = max(channels, key=lambda channel: self.lastChunks[channel])
+        return bool(self.lastChunks[last]) and self.partial[last]
+
+    def findLine(self, line, channels):
+        """
+        Find the last block starting before line C{line} of the text, counted
+        from 0.
+
+        @returns: (offset, line) of the block
+        """
+        lineNumbers = self._select(self.lineNumbers, channels)
+        # a block starting after C{line} newlines may start within that line
+        i = bisect.bisect_left(lineNumbers, line) - 1
+        if i < 0:
+            return 0, 0
+        return self.offsets[i], lineNumbers[i]
+
+    def findTextOffset(self, position, channels):
+        """
+        Find the last block starting at or before C{position} in the text.
+
+        @returns: (offset, position) of the block
+        """
+        textOffsets = self._select(self.textOffsets, channels)
+        i = bisect.bisect_right(textOffsets, position) - 1
+        if i < 0:
+            return 0, 0
+        return self.offsets[i], textOffsets[i]
+
+    def findOffset(self, offset):
+        """
+        @returns: the number of the block holding C{offset}
+        """
+        return max(bisect.bisect_right(self.offsets, offset) - 1, 0)
+
+    def getBlockSpan(self, i):
+        """
+        @returns: (offset, fileOffset, fileLength) of block C{i}
+        """
+        if i + 1 < len(self.fileOffsets):
+            end = self.fileOffsets[i + 1]
+        else:
+            end = self.fileLength
+        return self.offsets[i], self.fileOffsets[i], end - self.fileOffsets[i]
+
+    def save(self, filename):
+        data = dict(version=self.version, compression=self.compression,
+                    length=self.length, fileLength=self.fileLength,
+                    textLengths=self.textLengths, lineCounts=self.lineCounts,
+                    chunkCount=self.chunkCount, lastChunks=self.lastChunks,
+                    partial=self.partial,
+                    blocks=zip(self.offsets, self.channels, self.fileOffsets,
+                               self.textOffsets, self.lineNumbers))
+        with open(filename, "w") as f:
+            json.dump(data, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        @returns: the index stored in C{filename}, or None if there is none
+        """
+        try:
+            with open(filename, "r") as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if data.get('version') != cls.version:
+            return None
+        index = cls(data['compression'])
+        for block in data['blocks']:
+            index.addBlock(*block)
+        for attr in ('length', 'fileLength', 'textLengths', 'lineCounts',
+                     'chunkCount', 'lastChunks', 'partial'):
+            setattr(index, attr, data[attr])
+        return index
+
+class LogFileBlockReader:
+    """
+    A read-only file object for a log compressed in blocks, which decompresses
+    the blocks as they are read.
+    """
+
+    def __init__(self, f, index):
+        self.f = f
+        self.index = index
+        self.offset = 0
+        self.block = None # (number, offset, data)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.offset
+        elif whence == 2:
+            offset += self.index.length
+        self.offset = offset
+
+    def tell(self):
+        return self.offset
+
+    def read(self, size=-1):
+        data = []
+        while size and self.offset < self.index.length:
+            start, block = self._getBlock(self.offset)
+            pos = self.offset - start
+            if size > 0:
+                piece = block[pos:pos + size]
+                size -= len(piece)
+            else:
+                piece = block[pos:]
+            if not piece:
+                break
+            data.append(piece)
+            self.offset += len(piece)
+        return "".join(data)
+
+    def _getBlock(self, offset):
+        i = self.index.findOffset(offset)
+        if not self.block or self.block[0] != i:
+            start, fileOffset, fileLength = self.index.getBlockSpan(i)
+            self.f.seek(fileOffset)
+            data = _decompressBlock(self.f.read(fileLength),
+                                    self.index.compression)
+            self.block = (i, start, data)
+        return self.block[1:]
+
+    def close(self):
+        self.f.close()
+
 class LogFileProducer:
     """What's the plan?
 
@@ -185,6 +413,8 @@ class LogFile:
 
     @ivar length: length of the data in the logfile (sum of chunk sizes; not
     the length of the on-disk encoding)
+    @ivar index: L{LogFileIndex} of the on-disk encoding, None for logs
+    written before the indexes, or until it is read (see L{getIndex})
     """
 
     implements(interfaces.IStatusLog, interfaces.ILogFile)
@@ -204,6 +434,7 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    index = None
 
     def __init__(self, parent, name, logfilename):
         """
@@ -231,6 +462,7 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        self.index = LogFileIndex()
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -254,6 +486,19 @@ class LogFile:
         """
         return os.path.join(self.step.build.builder.basedir, self.filename)
 
+    def getIndexFilename(self):
+        return self.getFilename() + ".idx"
+
+    def getIndex(self):
+        """
+        Get the index of this log file, reading it from disk if necessary.
+
+        @returns: L{LogFileIndex}, or None for logs without an index
+        """
+        if self.index is None:
+            self.index = LogFileIndex.load(self.getIndexFilename())
+        return self.index
+
     def hasContents(self):
         """
         Return true if this logfile's contents are available.  For a newly
@@ -319,6 +564,15 @@ class LogFile:
             # don't close it!
             return self.openfile
         # otherwise they get their own read-only handle
+        index = self.getIndex()
+        if index and not index.compression and \
+                not os.path.exists(self.getFilename()):
+            # the log was compressed since we read its index
+            index = self.index = LogFileIndex.load(self.getIndexFilename())
+        if index and index.compression:
+            return LogFileBlockReader(
+                open(self.getFilename() + "." + index.compression, "rb"),
+                index)
         # try a compressed log first
         try:
             return BZ2File(self.getFilename() + ".bz2", "r")
@@ -337,12 +591,15 @@ class LogFile:
     def getTextWithHeaders(self):
         return "".join(self.getChunks(onlyText=True))
 
-    def getChunks(self, channels=[], onlyText=False):
+    def getChunks(self, channels=[], onlyText=False, offset=0):
         # generate chunks for everything that was logged at the time we were
         # first called, so remember how long the file was when we started.
         # Don't read beyond that point. The current contents of
         # self.runEntries will follow.
 
+        # offset is where to start in the on-disk encoding, and must be on a
+        # chunk boundary, e.g. from LogFileIndex.findLine
+
         # this returns an iterator, which means arbitrary things could happen
         # while we're yielding. This will faithfully deliver the log as it
         # existed when it was started, and not return anything after that
@@ -352,11 +609,9 @@ class LogFile:
 
         f = self.getFile()
         if not self.finished:
-            offset = 0
             f.seek(0, 2)
-            remaining = f.tell()
+            remaining = f.tell() - offset
         else:
-            offset = 0
             remaining = None
 
         leftover = None
@@ -405,6 +660,130 @@ class LogFile:
             else:
                 yield leftover
 
+    def _getLeftover(self, channels):
+        if self.runEntries and self.runEntries[0][0] in channels:
+            return "".join([c[1] for c in self.runEntries])
+        return ""
+
+    def getTextLength(self, channels=ALL_CHANNELS):
+        """
+        Get the length of the text of the given channels.
+
+        @returns: int
+        """
+        index = self.getIndex()
+        if index is None:
+            return sum([len(text)
+                        for text in self.getChunks(channels, onlyText=True)])
+        return index.getTextLength(channels) + \
+            len(self._getLeftover(channels))
+
+    def getLineCount(self, channels=ALL_CHANNELS):
+        """
+        Get the number of lines of the text of the given channels, counting a
+        last line without a newline.
+
+        @returns: int
+        """
+        index = self.getIndex()
+        if index is None:
+            count = 0
+            last = ""
+            for text in self.getChunks(channels, onlyText=True):
+                count += text.count("\n")
+                last = text or last
+            return count + int(bool(last) and not last.endswith("\n"))
+
+        leftover = self._getLeftover(channels)
+        count = index.getNewlineCount(channels) + leftover.count("\n")
+        if leftover:
+            partial = not leftover.endswith("\n")
+        else:
+            partial = index.endsWithinLine(channels)
+        return count + int(partial)
+
+    def generateText(self, start=0, stop=None, channels=ALL_CHANNELS):
+        """
+        Generate the text of the given channels from position C{start} to
+        C{stop} (excluded), only reading the blocks of the log file that hold
+        it when the log has an index.
+        """
+        if stop is not None and start >= stop:
+            return
+        index = self.getIndex()
+        if index is None:
+            offset, position = 0, 0
+        else:
+            offset, position = index.findTextOffset(start, channels)
+
+        for text in self.getChunks(channels, onlyText=True, offset=offset):
+            end = position + len(text)
+            if end > start:
+                if stop is None:
+                    piece = text[max(start - position, 0):]
+                else:
+                    piece = text[max(start - position, 0):stop - position]
+                if piece:
+                    yield piece
+            position = end
+            if stop is not None and position >= stop:
+                return
+
+    def generateLines(self, start=0, stop=None, channels=ALL_CHANNELS):
+        """
+        Generate the text of lines C{start} to C{stop} (excluded) of the
+        given channels, counted from 0 like list indices, only reading the
+        blocks of the log file that hold them when the log has an index.
+        """
+        if start < 0 or (stop is not None and stop < 0):
+            start, stop, _ = slice(start, stop).indices(
+                self.getLineCount(channels))
+        if stop is not None and start >= stop:
+            return
+        index = self.getIndex()
+        if index is None:
+            offset, line = 0, 0
+        else:
+            offset, line = index.findLine(start, channels)
+
+        for text in self.getChunks(channels, onlyText=True, offset=offset):
+            pos = 0
+            while line < start:
+                end = text.find("\n", pos)
+                if end == -1:
+                    break
+                line += 1
+                pos = end + 1
+            if line < start:
+                continue
+
+            if stop is None:
+                end = len(text)
+            else:
+                end = pos
+                while line < stop:
+                    newline = text.find("\n", end)
+                    if newline == -1:
+                        end = len(text)
+                        break
+                    line += 1
+                    end = newline + 1
+            if end > pos:
+                yield text[pos:end]
+            if stop is not None and line >= stop:
+                return
+
+    def getLines(self, start=0, stop=None, channels=ALL_CHANNELS):
+        """
+        Get lines of the text of the given channels, like
+        C{getTextWithHeaders().splitlines(True)[start:stop]} for the default
+        channels, without reading the whole log file.
+
+        @returns: list of strings, newline-terminated except maybe the last
+        """
+        text = "".join(self.generateLines(start, stop, channels))
+        return StringIO(text).readlines()
+
     def readlines(self):
         """Return an iterator that produces newline-terminated lines,
         excluding header chunks."""
@@ -442,12 +821,18 @@ class LogFile:
         assert channel < 10, "channel number must be a single decimal digit"
         f = self.openfile
         f.seek(0, 2)
+        fileOffset = f.tell()
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
-            f.write("%d:%d" % (1 + size, channel))
+            header = "%d:%d" % (1 + size, channel)
+            f.write(header)
             f.write(text[offset:offset+size])
             f.write(",")
+            self.index.addChunk(fileOffset, channel,
+                                text[offset:offset+size],
+                                len(header) + size + 1)
+            fileOffset += len(header) + size + 1
             offset += size
         self.runEntries = []
         self.runLength = 0
@@ -577,6 +962,7 @@ class LogFile:
             # filehandle will be released and automatically closed.
             self.openfile.flush()
             self.openfile = None
+            self.index.save(self.getIndexFilename())
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -587,6 +973,7 @@ class LogFile:
 
     def compressLog(self):
         logCompressionMethod = self.master.config.logCompressionMethod
+        logCompressionLevel = self.master.config.logCompressionLevel
         # bail out if there's no compression support
         if logCompressionMethod == "bz2":
             compressed = self.getFilename() + ".bz2.tmp"
@@ -595,22 +982,63 @@ class LogFile:
         else:
             return defer.succeed(None)
 
+        compressedIndex = self.getIndexFilename() + ".tmp"
+
         def _compressLog():
             infile = self.getFile()
-            if logCompressionMethod == "bz2":
-                cf = BZ2File(compressed, 'w')
-            elif logCompressionMethod == "gz":
-                cf = GzipFile(compressed, 'w')
-            bufsize = 1024*1024
-            while True:
-                buf = infile.read(bufsize)
-                cf.write(buf)
-                if len(buf) < bufsize:
-                    break
-            cf.close()
-        d = threads.deferToThread(_compressLog)
+            index = self.getIndex()
+            if index is None:
+                # a log written before the indexes, compress it in one piece
+                if logCompressionMethod == "bz2":
+                    cf = BZ2File(compressed, 'w', 0, logCompressionLevel)
+                elif logCompressionMethod == "gz":
+                    cf = GzipFile(compressed, 'w', logCompressionLevel)
+                bufsize = 1024*1024
+                while True:
+                    buf = infile.read(bufsize)
+                    cf.write(buf)
+                    if len(buf) < bufsize:
+                        break
+                cf.close()
+                return os.path.getsize(compressed), None
+
+            # compress each block on its own, up to the end of the file in
+            # case it has more than the index knows of
+            infile.seek(0, 2)
+            length = infile.tell()
+            blocks = zip(index.offsets, index.channels,
+                         index.textOffsets, index.lineNumbers)
+            if not blocks:
+                blocks = [(0, STDOUT, index.textLengths, index.lineCounts)]
+            newIndex = LogFileIndex(logCompressionMethod)
+            with open(compressed, 'wb') as cf:
+                for i, (offset, channel, textOffsets, lineNumbers) in \
+                        enumerate(blocks):
+                    if i + 1 < len(blocks):
+                        end = blocks[i + 1][0]
+                    else:
+                        end = length
+                    infile.seek(offset)
+                    newIndex.addBlock(offset, channel, cf.tell(),
+                                      textOffsets, lineNumbers)
+                    cf.write(_compressBlock(infile.read(end - offset),
+                                            logCompressionMethod,
+                                            logCompressionLevel))
+                newIndex.fileLength = cf.tell()
+            newIndex.length = length
+            for attr in ('textLengths', 'lineCounts', 'chunkCount',
+                         'lastChunks', 'partial'):
+                setattr(newIndex, attr, getattr(index, attr))
+            newIndex.save(compressedIndex)
+            return newIndex.fileLength, newIndex
+
+        try:
+            size = os.path.getsize(self.getFilename())
+        except OSError:
+            size = 0 # the compression fails, and logs it
+        d = self.master.log_compressor.compress(size, _compressLog)
 
-        def _renameCompressedLog(rv):
+        def _renameCompressedLog(newIndex):
             if logCompressionMethod == "bz2":
                 filename = self.getFilename() + '.bz2'
             else:
@@ -622,15 +1050,23 @@ class LogFile:
                 # general (non-windows) case
                 if os.path.exists(filename):
                     os.unlink(filename)
+                if newIndex and os.path.exists(self.getIndexFilename()):
+                    os.unlink(self.getIndexFilename())
             if not os.path.exists(filename):
                 os.rename(compressed, filename)
+                if newIndex:
+                    # readers go by the index, so it must only point to the
+                    # compressed log once it is in place
+                    os.rename(compressedIndex, self.getIndexFilename())
+                    self.index = newIndex
             _tryremove(self.getFilename(), 1, 5)
         d.addCallback(_renameCompressedLog)
 
         def _cleanupFailedCompress(failure):
             log.msg("failed to compress %s" % self.getFilename())
-            if os.path.exists(compressed):
-                _tryremove(compressed, 1, 5)
+            for tmpfile in (compressed, compressedIndex):
+                if os.path.exists(tmpfile):
+                    _tryremove(tmpfile, 1, 5)
             failure.trap() # reraise the failure
         d.addErrback(_cleanupFailedCompress)
         return d
@@ -649,6 +1085,7 @@ class LogFile:
         d['entries'] = []  # let 0.6.4 tolerate the saved log. TODO: really?
         self.deleteKey('finished', d)
         self.deleteKey('openfile', d)
+        self.deleteKey('index', d)  # read from disk when needed
 
     def __getstate__(self):
         d = self.__dict__.copy()
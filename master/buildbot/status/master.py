@@ -19,7 +19,7 @@ import os, urllib
 from cPickle import load
 from twisted.python import log
 from twisted.persisted import styles
-from twisted.internet import defer
+from twisted.internet import defer, threads
 from twisted.application import service
 from zope.interface import implements
 from buildbot import config, interfaces, util
@@ -28,6 +28,7 @@ from buildbot.util import bbcollections
 from buildbot.util.eventual import eventually
 from buildbot.changes import changes
 from buildbot.status import buildset, builder, buildrequest
+from buildbot.status.build import BuildSummary
 from buildbot.status.results import RETRY
 from datetime import datetime, timedelta
 import klog
@@ -367,8 +368,20 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
             self.total_builds_lastday = {lastday: total_builds_lastday}
         defer.returnValue(self.total_builds_lastday[lastday])
 
-    @defer.inlineCallbacks
     def generateFinishedBuildsAsync(self, num_builds=15, results=None, slavename=None):
+        return self._generateFinishedBuildsAsync('getFinishedBuildsByNumbers',
+                                                 num_builds, results, slavename)
+
+    def generateFinishedBuildSummariesAsync(self, num_builds=15, results=None, slavename=None):
+        """
+        Like L{generateFinishedBuildsAsync}, but returns L{BuildSummary}
+        instances from the build summary cache, for the build listings.
+        """
+        return self._generateFinishedBuildsAsync('getFinishedBuildSummariesByNumbers',
+                                                 num_builds, results, slavename)
+
+    @defer.inlineCallbacks
+    def _generateFinishedBuildsAsync(self, method, num_builds, results, slavename):
         #TODO: support filter by RETRY result
         results_filter = [r for r in results if r is not None and r != RETRY] if results else []
         lastBuilds = yield self.master.db.builds.getLastsBuildsNumbersBySlave(slavename, results_filter, num_builds)
@@ -381,13 +394,52 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         all_builds = []
         for bn in builder_names:
             b = self.getBuilder(bn)
-            finished_builds = yield b.getFinishedBuildsByNumbers(buildnumbers=lastBuilds[bn],
-                                                                 results=results)
+            finished_builds = yield getattr(b, method)(buildnumbers=lastBuilds[bn],
+                                                       results=results)
             all_builds.extend(finished_builds)
 
         sorted_builds = sorted(all_builds, key=lambda build: build.finished, reverse=True)
         defer.returnValue(sorted_builds)
 
+    # build summaries
+
+    def _getBuildSummaryCache(self):
+        return self.master.caches.get_cache("BuildSummaries",
+                                            self._loadBuildSummary)
+
+    def _loadBuildSummary(self, key):
+        builderName, number = key
+        builder_status = self.getBuilder(builderName)
+        if builder_status is None:
+            return defer.succeed(None)
+
+        d = threads.deferToThread(builder_status.getBuildSummary, number)
+        @d.addCallback
+        def wrap(summary):
+            # only the finished builds are kept
+            if summary is None or summary['times'][1] is None:
+                return None
+            return BuildSummary(builder_status, summary)
+        return d
+
+    def getBuildSummary(self, builderName, number):
+        """
+        Get the summary of a finished build from the build summary cache,
+        which is kept apart from the build cache of the builders, and loads
+        the summaries from the build stores.
+
+        @returns: L{BuildSummary}, or None, via Deferred
+        """
+        return self._getBuildSummaryCache().get((builderName, number))
+
+    def putBuildSummary(self, builderName, summary):
+        cache = self._getBuildSummaryCache()
+        key = (builderName, summary.number)
+        if key in cache:
+            cache.put(key, summary)
+        else:
+            cache.put_new(key, summary)
+
     def generateFinishedBuilds(self, builders=[], branches=[],
                                num_builds=None, finished_before=None,
                                max_search=200):
@@ -630,7 +682,8 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
                                                 notif['brid'], self)
             for observer in self._builder_observers[buildername]:
                 if hasattr(observer, 'requestCancelled'):
-                    eventually(observer.requestSubmitted, brs)
+                    eventually(observer.requestCancelled,
+                               self.getBuilder(buildername), brs)
 
     def get_rev_url(self, rev, repo):
         # Lazy load this so that the config is ready for us
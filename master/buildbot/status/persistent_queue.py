@@ -18,6 +18,8 @@ from __future__ import with_statement
 
 from collections import deque
 import os
+import re
+import struct
 import cPickle as pickle
 
 from zope.interface import implements, Interface
@@ -33,6 +35,10 @@ def WriteFile(path, buf):
         f.write(buf)
 
 
+def PickleItem(item):
+    return pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+
+
 class IQueue(Interface):
     """Abstraction of a queue."""
     def pushItem(item):
@@ -247,6 +253,307 @@ class DiskQueue(object):
             self.lastItemId = files[-1]
 
 
+class SegmentDiskQueue(object):
+    """Keeps a list of abstract items on disk, in append-only segment files
+    of length-prefixed pickles, rather than in a file per item like
+    DiskQueue.
+
+    The items are appended to the last segment, a new segment being started
+    every segmentItems items, and read from the first one, which is removed
+    once read.  The position of the first item is kept in a small checkpoint
+    file, written once per popChunk().  The items queued back are appended
+    to a separate file in reverse order, and truncated away once popped.
+    The files are all removed when the queue is empty.
+
+    The items popped just before a crash are popped again after it.  The
+    item files of DiskQueue found in the directory are moved into the
+    segments.
+    """
+    implements(IQueue)
+
+    segment_re = re.compile(r"^segment-([0-9]+)$")
+    frontName = 'front'
+    checkpointName = 'checkpoint'
+    header = struct.Struct('>I')
+
+    def __init__(self, path, maxItems=None, pickleFn=PickleItem,
+                 unpickleFn=pickle.loads, segmentItems=1000):
+        """
+        @path: directory to save the items.
+        @maxItems: maximum number of items to keep on disk, flush the
+        older ones.
+        @pickleFn: function used to pack the items to disk.
+        @unpickleFn: function used to unpack items from disk.
+        @segmentItems: number of items of each segment file.
+        """
+        self.path = path
+        self._maxItems = maxItems
+        if self._maxItems is None:
+            self._maxItems = 100000
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        self.pickleFn = pickleFn
+        self.unpickleFn = unpickleFn
+        self.segmentItems = segmentItems
+
+        # [segment number, number of items left in it], oldest first
+        self.segments = deque()
+        self.nextSegment = 0
+        # items written to the last segment
+        self.tailItems = 0
+        # offset of the first item in the first segment
+        self.headOffset = 0
+        self._nbSegmentItems = 0
+        # offsets of the records of the items queued back, the last one
+        # being the first item
+        self.front = []
+        self.headFile = self.tailFile = self.frontFile = None
+        self._loadFromDisk()
+
+    def pushItem(self, item):
+        ret = None
+        if self.nbItems() == self._maxItems:
+            ret = self.popChunk(1)[0]
+        self._append(self.pickleFn(item))
+        return ret
+
+    def insertBackChunk(self, chunk):
+        ret = None
+        excess = self.nbItems() + len(chunk) - self._maxItems
+        if excess > 0:
+            ret = chunk[0:excess]
+            chunk = chunk[excess:]
+        if not chunk:
+            return ret
+        f = self._getFrontFile()
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        records = []
+        for item in reversed(chunk):
+            record = self._makeRecord(self.pickleFn(item))
+            self.front.append(offset)
+            records.append(record)
+            offset += len(record)
+        f.write(''.join(records))
+        f.flush()
+        return ret
+
+    def popChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self._maxItems
+        ret = []
+        if self.front and nbItems:
+            ret.extend(self._popFront(nbItems))
+        if len(ret) < nbItems and self._nbSegmentItems:
+            ret.extend(self._popSegments(nbItems - len(ret)))
+        return ret
+
+    def save(self):
+        self._close()
+
+    def items(self):
+        """Warning, slow."""
+        ret = []
+        if self.front:
+            with open(self._frontPath(), 'rb') as f:
+                f.seek(self.front[0])
+                ret.extend(reversed(self._readRecords(f, len(self.front))))
+        offset = self.headOffset
+        for segment, count in self.segments:
+            with open(self._segmentPath(segment), 'rb') as f:
+                f.seek(offset)
+                ret.extend(self._readRecords(f, count))
+            offset = 0
+        return ret
+
+    def nbItems(self):
+        return len(self.front) + self._nbSegmentItems
+
+    def maxItems(self):
+        return self._maxItems
+
+    #### Protected functions
+
+    def _segmentPath(self, segment):
+        return os.path.join(self.path, 'segment-%d' % segment)
+
+    def _frontPath(self):
+        return os.path.join(self.path, self.frontName)
+
+    def _checkpointPath(self):
+        return os.path.join(self.path, self.checkpointName)
+
+    def _makeRecord(self, data):
+        return self.header.pack(len(data)) + data
+
+    def _readRecords(self, f, count):
+        items = []
+        for i in xrange(count):
+            length, = self.header.unpack(f.read(self.header.size))
+            items.append(self.unpickleFn(f.read(length)))
+        return items
+
+    def _getFrontFile(self):
+        if self.frontFile is None:
+            path = self._frontPath()
+            self.frontFile = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        return self.frontFile
+
+    def _popFront(self, nbItems):
+        offsets = self.front[-nbItems:]
+        del self.front[-nbItems:]
+        f = self._getFrontFile()
+        f.seek(offsets[0])
+        items = self._readRecords(f, len(offsets))
+        if self.front:
+            f.seek(offsets[0])
+            f.truncate()
+            f.flush()
+        else:
+            f.close()
+            self.frontFile = None
+            os.remove(self._frontPath())
+        items.reverse()
+        return items
+
+    def _append(self, data):
+        if not self.segments or self.tailItems >= self.segmentItems:
+            if self.tailFile is not None:
+                self.tailFile.close()
+                self.tailFile = None
+            self.segments.append([self.nextSegment, 0])
+            self.nextSegment += 1
+            self.tailItems = 0
+        if self.tailFile is None:
+            self.tailFile = open(self._segmentPath(self.segments[-1][0]), 'ab')
+        self.tailFile.write(self._makeRecord(data))
+        self.tailFile.flush()
+        self.segments[-1][1] += 1
+        self.tailItems += 1
+        self._nbSegmentItems += 1
+
+    def _popSegments(self, nbItems):
+        items = []
+        while len(items) < nbItems and self._nbSegmentItems:
+            head = self.segments[0]
+            if self.headFile is None:
+                self.headFile = open(self._segmentPath(head[0]), 'rb')
+                self.headFile.seek(self.headOffset)
+            count = min(nbItems - len(items), head[1])
+            items.extend(self._readRecords(self.headFile, count))
+            head[1] -= count
+            self._nbSegmentItems -= count
+            self.headOffset = self.headFile.tell()
+            if not head[1] and len(self.segments) > 1:
+                # the older segments are complete
+                self._removeHead()
+
+        if not self._nbSegmentItems:
+            self._removeSegments()
+        else:
+            self._writeCheckpoint()
+        return items
+
+    def _removeSegments(self):
+        while self.segments:
+            self._removeHead()
+        self._removeFile(self._checkpointPath())
+
+    def _removeHead(self):
+        segment = self.segments.popleft()[0]
+        if self.headFile is not None:
+            self.headFile.close()
+            self.headFile = None
+        self.headOffset = 0
+        if not self.segments and self.tailFile is not None:
+            self.tailFile.close()
+            self.tailFile = None
+        self._removeFile(self._segmentPath(segment))
+
+    def _removeFile(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _writeCheckpoint(self):
+        path = self._checkpointPath()
+        WriteFile(path + '.tmp', '%d %d' % (self.segments[0][0], self.headOffset))
+        os.rename(path + '.tmp', path)
+
+    def _close(self):
+        for name in ('headFile', 'tailFile', 'frontFile'):
+            f = getattr(self, name)
+            if f is not None:
+                f.close()
+                setattr(self, name, None)
+
+    def _scanRecords(self, path, offset=0):
+        """Returns the offsets of the records of a file, after truncating
+        an incomplete last record."""
+        offsets = []
+        with open(path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            while offset + self.header.size <= size:
+                f.seek(offset)
+                length, = self.header.unpack(f.read(self.header.size))
+                end = offset + self.header.size + length
+                if end > size:
+                    break
+                offsets.append(offset)
+                offset = end
+            if offset < size:
+                f.truncate(offset)
+        return offsets
+
+    def _loadFromDisk(self):
+        segments = []
+        legacy = []
+        for name in os.listdir(self.path):
+            mo = self.segment_re.match(name)
+            if mo:
+                segments.append(int(mo.group(1)))
+            elif name.isdigit():
+                legacy.append(int(name))
+        segments.sort()
+
+        head = None
+        try:
+            head = map(int, ReadFile(self._checkpointPath()).split())
+        except (IOError, ValueError):
+            pass
+        for segment in segments:
+            offset = 0
+            if head and head[0] == segment:
+                offset = head[1]
+            elif head and head[0] > segment:
+                # read before the checkpoint
+                self._removeFile(self._segmentPath(segment))
+                continue
+            count = len(self._scanRecords(self._segmentPath(segment), offset))
+            if not self.segments:
+                self.headOffset = offset
+            self.segments.append([segment, count])
+            self._nbSegmentItems += count
+            self.tailItems = count
+        if segments:
+            self.nextSegment = segments[-1] + 1
+        if not self._nbSegmentItems:
+            self._removeSegments()
+
+        if os.path.exists(self._frontPath()):
+            self.front = self._scanRecords(self._frontPath())
+
+        # the items of DiskQueue
+        for id in sorted(legacy):
+            path = os.path.join(self.path, str(id))
+            self._append(ReadFile(path))
+            os.remove(path)
+        if self.tailFile is not None:
+            self.tailFile.close()
+            self.tailFile = None
+
+
 class PersistentQueue(object):
     """Keeps a list of abstract items and serializes it to the disk.
 
@@ -143,7 +143,7 @@ class SlaveStatus:
     @defer.inlineCallbacks
     def getRecentBuilds(self, num_builds=15):
         status = self.master.status
-        builds = yield status.generateFinishedBuildsAsync(num_builds=num_builds, slavename=self.name)
+        builds = yield status.generateFinishedBuildSummariesAsync(num_builds=num_builds, slavename=self.name)
         defer.returnValue(builds)
 
     @defer.inlineCallbacks
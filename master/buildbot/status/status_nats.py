@@ -20,7 +20,6 @@
 
 from buildbot import config
 import pynats
-import json
 
 from buildbot.status.status_queue import QueuedStatusPush
 
@@ -51,8 +50,7 @@ class NatsStatusPush(QueuedStatusPush):
                 self.client.connect()
 
             for item in items:
-                json_str = json.dumps(item, separators=(',', ':'))
-                self.client.publish('%s.%s' % (self.subject, item.get('event', 'unknown')), json_str)
+                self.client.publish('%s.%s' % (self.subject, item.event or 'unknown'), item.data)
 
             return True, None
         except pynats.connection.SocketError as e:
@@ -30,6 +30,8 @@ except ImportError:
 Implements the HTTP receiver."""
 
 import datetime
+import hashlib
+import hmac
 import os
 import urllib
 import urlparse
@@ -42,8 +44,9 @@ except ImportError:
 
 from buildbot import config
 from buildbot.status.base import StatusReceiverMultiService
-from buildbot.status.persistent_queue import DiskQueue, IndexedQueue, \
-        MemoryQueue, PersistentQueue
+from buildbot.status.persistent_queue import IndexedQueue, MemoryQueue, \
+        PersistentQueue, SegmentDiskQueue
+from buildbot.status.web.jsonpush import JsonResourcePusher
 from buildbot.status.web.status_json import FilterOut
 import klog
 from twisted.internet import defer, reactor
@@ -51,6 +54,111 @@ from twisted.python import log
 from twisted.web import client
 
 
+class EncodedObject(object):
+    """An object of the payload of status push events, converted to JSON on
+    first use."""
+
+    def __init__(self, obj, filter):
+        self.obj = obj
+        self.filter = filter
+        self.data = None
+
+    def getJSON(self):
+        if self.data is None:
+            obj = self.obj
+            if hasattr(obj, 'asDict'):
+                obj = obj.asDict()
+            if self.filter:
+                obj = FilterOut(obj)
+            self.data = json.dumps(obj, separators=(',', ':'))
+        return self.data
+
+
+class EventEncoder(object):
+    """Shares the conversion of the objects of the status events between the
+    push receivers.
+
+    The status calls all the receivers in turn for each event, with the same
+    objects, and each of them pushes the objects it wants.  Each dispatched
+    event gets its own conversion of its objects to JSON (with asDict, which
+    can be expensive), shared by the receivers which push it, and done at
+    most once, after the dispatch, when the first receiver encodes its
+    pending events.  A dispatch ends when another event is pushed, or when a
+    receiver pushes the same event again.  The objects are kept until the
+    next reactor turn, so that their ids are not reused meanwhile."""
+
+    def __init__(self):
+        # (dispatch, id(obj), filter) -> EncodedObject
+        self.objects = {}
+        self.clearCall = None
+        self.dispatch = 0
+        # the event and object ids of the current dispatch, and the ids of
+        # the receivers which pushed it
+        self.dispatched = None
+        self.receivers = set()
+
+    def encode(self, receiver, event, objs, filter):
+        """Returns the (name, EncodedObject) pairs of the objects of the
+        event pushed by receiver."""
+        key = (event, sorted((name, id(obj)) for name, obj in objs.items()))
+        if key != self.dispatched or id(receiver) in self.receivers:
+            self.dispatch += 1
+            self.dispatched = key
+            self.receivers = set()
+        self.receivers.add(id(receiver))
+
+        payload = []
+        for name, obj in objs.items():
+            objKey = (self.dispatch, id(obj), bool(filter))
+            encoded = self.objects.get(objKey)
+            if encoded is None:
+                encoded = self.objects[objKey] = EncodedObject(obj, filter)
+                if self.clearCall is None:
+                    self.clearCall = reactor.callLater(0, self.clear)
+            payload.append((name, encoded))
+        return payload
+
+    def clear(self):
+        self.clearCall = None
+        self.objects.clear()
+        self.dispatched = None
+        self.receivers = set()
+
+eventEncoder = EventEncoder()
+
+
+class EncodedPacket(object):
+    """A status push packet, in JSON, as it is queued."""
+
+    def __init__(self, id, event, data):
+        self.id = id
+        self.event = event
+        self.data = data
+
+    @classmethod
+    def fromPayload(cls, packet, payload):
+        """Encodes the packet dict, with the payload made of the
+        (name, EncodedObject) pairs."""
+        header = json.dumps(packet, separators=(',', ':'))
+        objects = ','.join('%s:%s' % (json.dumps(name), obj.getJSON())
+                           for name, obj in payload)
+        data = '%s,"payload":{%s}}' % (header[:-1], objects)
+        return cls(packet['id'], packet['event'], data)
+
+    @classmethod
+    def fromItem(cls, item):
+        """Returns the queued item as an EncodedPacket; the queues saved by
+        previous versions hold the packet dicts."""
+        if isinstance(item, cls):
+            return item
+        if hasattr(item, 'asDict'):
+            item = item.asDict()
+        return cls(item.get('id'), item.get('event'),
+                   json.dumps(item, separators=(',', ':')))
+
+    def asDict(self):
+        return json.loads(self.data)
+
 
 class StatusPush(StatusReceiverMultiService):
     """Event streamer to a abstract channel.
@@ -107,6 +215,9 @@ class StatusPush(StatusReceiverMultiService):
         self.task = None
         self.stopped = False
         self.lastIndex = -1
+        # Events waiting to be encoded, as (packet, [(name, EncodedObject)]).
+        self.pending = []
+        self.encodeCall = None
         self.state = {}
         self.state['started'] = str(datetime.datetime.utcnow())
         self.state['next_id'] = 1
@@ -195,6 +306,7 @@ class StatusPush(StatusReceiverMultiService):
         """Shutting down."""
         self.finalPush()
         self.stopped = True
+        self.encodePending()
         if (self.task and self.task.active()):
             # We don't have time to wait, force an immediate call.
             self.task.cancel()
@@ -223,6 +335,9 @@ class StatusPush(StatusReceiverMultiService):
         - Queued in memory to reduce network usage
         - Queued to disk when the sink server is down
         - Pushed (along the other queued items) to the server
+
+        The objects of the event are converted to JSON once the current status
+        event is dispatched to all the receivers, see L{EventEncoder}.
         """
         if self.blackList and event in self.blackList:
             return
@@ -234,18 +349,65 @@ class StatusPush(StatusReceiverMultiService):
         packet['project'] = self.status.getTitle()
         packet['started'] = self.state['started']
         packet['event'] = event
-        packet['payload'] = {}
-        for obj_name, obj in objs.items():
-            if hasattr(obj, 'asDict'):
-                obj = obj.asDict()
-            if self.filter:
-                obj = FilterOut(obj)
-            packet['payload'][obj_name] = obj
-        self.queue.pushItem(packet)
-        if self.task is None or not self.task.active():
+        payload = eventEncoder.encode(self, event, objs, self.filter)
+        self.pending.append((packet, payload))
+        if self.stopped:
+            return self.encodePending()
+        if self.encodeCall is None:
+            self.encodeCall = reactor.callLater(0, self.encodePending)
+
+    def encodePending(self):
+        """Encode the pending events, and queue them to be pushed."""
+        if self.encodeCall is not None:
+            if self.encodeCall.active():
+                self.encodeCall.cancel()
+            self.encodeCall = None
+        pending, self.pending = self.pending, []
+        for packet, payload in pending:
+            try:
+                item = EncodedPacket.fromPayload(packet, payload)
+            except Exception:
+                klog.err_json(_why="Failed to encode the %s event %d"
+                              % (packet['event'], packet['id']))
+                continue
+            self.queue.pushItem(item)
+        if pending and (self.task is None or not self.task.active()):
             # No task queued since it was probably idle, let's queue a task.
             return self.queueNextServerPush()
 
+    def popPackets(self, chunkSize, maxSize=None, overhead=0, separator=',',
+                   quote=None):
+        """Pops up to chunkSize packets from the queue, as many as fit in
+        maxSize bytes once joined with separator, after overhead bytes.
+
+        Returns the JSON of the packets, quoted with quote, and the packets.
+        Packets which can never fit are dropped, the ones which don't fit
+        after the others are queued back."""
+        items = self.queue.popChunk(chunkSize)
+        packets = []
+        encoded = []
+        size = overhead
+        for i, item in enumerate(items):
+            item = EncodedPacket.fromItem(item)
+            data = item.data
+            if quote is not None:
+                data = quote(data)
+            itemSize = len(data)
+            if encoded:
+                itemSize += len(separator)
+            if maxSize and size + itemSize >= maxSize:
+                if not encoded:
+                    # This packet is just too large. Drop this packet.
+                    log.msg("ERROR: packet %s was dropped, too large: %d > %d" %
+                            (item.id, overhead + len(data), maxSize))
+                    continue
+                self.queue.insertBackChunk(items[i:])
+                break
+            size += itemSize
+            packets.append(item)
+            encoded.append(data)
+        return encoded, packets
+
     #### Events
 
     def initialPush(self):
@@ -374,7 +536,7 @@ class HttpStatusPush(StatusPush):
                     urlparse.urlparse(self.serverUrl)[1].split(':')[0])
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=SegmentDiskQueue(path, maxItems=maxDiskItems))
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -395,34 +557,24 @@ class HttpStatusPush(StatusPush):
         else:
             chunkSize = 1
 
-        while True:
-            items = self.queue.popChunk(chunkSize)
-            newitems = []
-            for item in items:
-                if hasattr(item, 'asDict'):
-                    newitems.append(item.asDict())
-                else:
-                    newitems.append(item)
-            if self.debug:
-                packets = json.dumps(newitems, indent=2, sort_keys=True)
-            else:
-                packets = json.dumps(newitems, separators=(',',':'))
-            params = {'packets': packets}
-            params.update(self.extra_post_params)
-            data = urllib.urlencode(params)
-            if (not self.maxHttpRequestSize or
-                len(data) < self.maxHttpRequestSize):
-                return (data, items)
-
-            if chunkSize == 1:
-                # This packet is just too large. Drop this packet.
-                log.msg("ERROR: packet %s was dropped, too large: %d > %d" %
-                        (items[0]['id'], len(data), self.maxHttpRequestSize))
-                chunkSize = self.chunkSize
-            else:
-                # Try with half the packets.
-                chunkSize /= 2
-                self.queue.insertBackChunk(items)
+        # The packets are sent url-encoded, the JSON of each of them is
+        # quoted once to know the size of the request.
+        extra = urllib.urlencode(self.extra_post_params)
+        overhead = len('packets=%5B%5D')
+        if extra:
+            overhead += len('&' + extra)
+        encoded, items = self.popPackets(chunkSize, self.maxHttpRequestSize,
+                                         overhead=overhead, separator='%2C',
+                                         quote=urllib.quote_plus)
+        if self.debug:
+            packets = json.dumps([item.asDict() for item in items],
+                                 indent=2, sort_keys=True)
+            data = urllib.urlencode({'packets': packets})
+        else:
+            data = 'packets=%5B' + '%2C'.join(encoded) + '%5D'
+        if extra:
+            data += '&' + extra
+        return (data, items)
 
     def pushHttp(self):
         """Do the HTTP POST to the server."""
@@ -464,13 +616,15 @@ class AutobahnProtocol(WebSocketClientProtocol):
         print("Connected to autobahn server: {0}".format(response.peer))
 
     def onOpen(self):
-        return
+        self.factory.autobahn_status_push.relayOpened(self)
 
     def onMessage(self, payload, isBinary):
-        return
+        if not isBinary:
+            self.factory.autobahn_status_push.relayMessage(self, payload)
 
     def onClose(self, wasClean, code, reason):
         print("Connection to autobahn server closed: {0}".format(reason))
+        self.factory.autobahn_status_push.relayClosed(self)
 
 
 class AutobahnFactory(WebSocketClientFactory):
@@ -497,7 +651,7 @@ class AutobahnStatusPush(StatusPush):
     """Event streamer to a Autobahn server."""
 
     def __init__(self, serverIP, serverPort, debug=None, maxMemoryItems=None,
-                 maxDiskItems=None, chunkSize=200, **kwargs):
+                 maxDiskItems=None, chunkSize=200, pushSecret=None, **kwargs):
         """
         @serverIP: IP of the autobahn server
         @serverPort: Port of the autobahn server
@@ -506,6 +660,8 @@ class AutobahnStatusPush(StatusPush):
         @maxDiskItems: Maximum number of items to buffer to disk, if 0, doesn't
         use disk at all.
         @chunkSize: maximum number of items to send in each at each PUSH.
+        @pushSecret: the secret shared with the autobahn server, to push it
+        the JSON of the URLs it serves instead of it fetching them.
         """
         if not serverIP and not serverPort:
             raise config.ConfigErrors(['AutobahnStatusPush requires a serverIP and serverPort'])
@@ -516,16 +672,19 @@ class AutobahnStatusPush(StatusPush):
         self.serverUrl = "ws://{0}:{1}/ws".format(serverIP, serverPort)
         self.debug = debug
         self.chunkSize = chunkSize
+        self.pushSecret = pushSecret
         self.lastPushWasSuccessful = True
         self.protocol = None
         self.factory = None
+        self.resources = JsonResourcePusher(self.getWebStatus, self.pushResources,
+                                            _reactor=reactor)
         if maxDiskItems != 0:
             # The queue directory is determined by the server url.
             path = ('events_' +
                     urlparse.urlparse(self.serverUrl)[1].split(':')[0])
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=SegmentDiskQueue(path, maxItems=maxDiskItems))
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -545,6 +704,73 @@ class AutobahnStatusPush(StatusPush):
     def setProtocolInstance(self, protocol_instance):
         self.protocol = protocol_instance
 
+    def stopService(self):
+        self.resources.stop()
+        return StatusPush.stopService(self)
+
+    def getWebStatus(self):
+        """
+        @returns: the web status rendering the JSON pushed to the autobahn
+        server, or None
+        """
+        if self.parent is None:
+            return None
+        for sr in self.parent:
+            if getattr(sr, 'jsonResponseCache', None) is not None:
+                return sr
+        return None
+
+    def relayOpened(self, protocol):
+        self.resources.stop()
+        if self.pushSecret:
+            protocol.sendMessage(json.dumps(
+                {"cmd": "krtServerHello",
+                 "data": {"server": self.status.getBuildbotURL()}}))
+
+    def relayClosed(self, protocol):
+        if protocol is self.protocol:
+            self.resources.stop()
+
+    def relayMessage(self, protocol, payload):
+        """Answers the challenge of the autobahn server, and its
+        subscriptions to the JSON of the URLs of the master."""
+        if not self.pushSecret:
+            return
+        try:
+            msg = json.loads(payload)
+            cmd, data = msg["cmd"], msg["data"]
+        except (ValueError, KeyError, TypeError):
+            log.msg("Unexpected message from the autobahn server: %r" % (payload,))
+            return
+
+        server = self.status.getBuildbotURL()
+        if cmd == "krtAuthChallenge":
+            challenge = (u"%s %s" % (data["nonce"], server)).encode("utf-8")
+            response = hmac.new(self.pushSecret, challenge, hashlib.sha256).hexdigest()
+            protocol.sendMessage(json.dumps(
+                {"cmd": "krtAuthResponse", "data": {"response": response}}))
+        elif cmd == "krtSubscribeResources":
+            self.resources.subscribe([(url, url[len(server):]) for url in data["urls"]
+                                      if url.startswith(server)])
+            refused = [url for url in data["urls"] if not url.startswith(server)]
+            if refused:
+                self.pushResources([], refused)
+        elif cmd == "krtUnsubscribeResources":
+            self.resources.unsubscribe(data["urls"])
+
+    def pushResources(self, pushed, refused):
+        """Sends the autobahn server the JSON of the URLs which changed, as
+        rendered, and the URLs it has to fetch itself."""
+        if self.protocol is None or not self.protocol.connected:
+            return
+        if pushed:
+            self.protocol.sendMessage('{"cmd":"krtPushResources","data":[%s]}' % ','.join(
+                '{"url":%s,"etag":%s,"data":%s}' % (json.dumps(url), json.dumps(etag), data)
+                for url, etag, data in pushed))
+        if refused:
+            self.protocol.sendMessage(json.dumps(
+                {"cmd": "krtRefuseResources", "data": {"urls": refused}}))
+
     def wasLastPushSuccessful(self):
         return self.lastPushWasSuccessful
 
@@ -557,15 +783,17 @@ class AutobahnStatusPush(StatusPush):
         else:
             chunkSize = 1
 
-        while True:
-            items = self.queue.popChunk(chunkSize)
-            item_data = {"cmd": "krtPushData", "data": items, "server": self.status.getBuildbotURL()}
-
-            if self.debug:
-                packets = json.dumps(item_data, indent=2, sort_keys=True)
-            else:
-                packets = json.dumps(item_data, separators=(',',':'))
-            return packets, items
+        encoded, items = self.popPackets(chunkSize)
+        server = self.status.getBuildbotURL()
+        if self.debug:
+            item_data = {"cmd": "krtPushData",
+                         "data": [item.asDict() for item in items],
+                         "server": server}
+            packets = json.dumps(item_data, indent=2, sort_keys=True)
+        else:
+            packets = '{"cmd":"krtPushData","server":%s,"data":[%s]}' % (
+                json.dumps(server), ','.join(encoded))
+        return packets, items
 
     def pushHttp(self):
         """Do the HTTP POST to the server."""
@@ -19,7 +19,7 @@
 ."""
 
 from buildbot.status.status_push import StatusPush
-from buildbot.status.persistent_queue import DiskQueue, MemoryQueue, PersistentQueue
+from buildbot.status.persistent_queue import MemoryQueue, PersistentQueue, SegmentDiskQueue
 
 from twisted.python import log
 import json
@@ -49,7 +49,7 @@ class QueuedStatusPush(StatusPush):
             path = 'queue_%s' % (self.eventName())
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=SegmentDiskQueue(path, maxItems=maxDiskItems))
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -75,33 +75,16 @@ class QueuedStatusPush(StatusPush):
         else:
             chunkSize = 1
 
-        while True:
-            items = self.queue.popChunk(chunkSize)
-            newitems = []
-            for item in items:
-                if hasattr(item, 'asDict'):
-                    newitems.append(item.asDict())
-                else:
-                    newitems.append(item)
-            if self.debug:
-                packets = json.dumps(newitems, indent=2, sort_keys=True)
-            else:
-                packets = json.dumps(newitems, separators=(',', ':'))
-
-            data = self.formatPackets(packets)
-
-            if not self.maxPushSize or len(data) < self.maxPushSize:
-                return data, items
-
-            if chunkSize == 1:
-                # This packet is just too large. Drop this packet.
-                log.msg("ERROR: packet %s was dropped, too large: %d > %d" %
-                        (items[0]['id'], len(data), self.maxPushSize))
-                chunkSize = self.chunkSize
-            else:
-                # Try with half the packets.
-                chunkSize /= 2
-                self.queue.insertBackChunk(items)
+        # formatPackets wraps the JSON array of the packets
+        overhead = len(self.formatPackets('[]'))
+        encoded, items = self.popPackets(chunkSize, self.maxPushSize,
+                                         overhead=overhead)
+        if self.debug:
+            packets = json.dumps([item.asDict() for item in items],
+                                 indent=2, sort_keys=True)
+        else:
+            packets = '[' + ','.join(encoded) + ']'
+        return self.formatPackets(packets), items
 
     def _pushData(self):
         """Do the PUSH to the server."""
@@ -42,6 +42,7 @@ from buildbot.status.web.buildstatus import BuildStatusStatusResource
 from buildbot.status.web.slaves import BuildSlavesResource
 from buildbot.status.web.loginkatana import LoginKatanaResource, LogoutKatanaResource
 from buildbot.status.web.status_json import JsonStatusResource
+from buildbot.status.web.jsoncache import JsonResponseCache
 from buildbot.status.web.about import AboutBuildbot
 from buildbot.status.web.projects import ProjectsResource
 from buildbot.status.web.authz import Authz
@@ -359,6 +360,9 @@ class WebStatus(service.MultiService):
         self.http_svc = None
         self.distrib_svc = None
 
+        # the rendered JSON responses, created with the site
+        self.jsonResponseCache = None
+
         # store the log settings until we create the site object
         self.logRotateLength = logRotateLength
         self.maxRotatedFiles = maxRotatedFiles        
@@ -547,6 +551,8 @@ class WebStatus(service.MultiService):
         #    root.putChild("atom", Atom10StatusResource(status))
         if "json" in self.provide_feeds:
             root.putChild("json", JsonStatusResource(status))
+            self.jsonResponseCache = JsonResponseCache(status)
+            self.jsonResponseCache.start()
 
         root.putChild("png", PngStatusResource(status))
 
@@ -573,6 +579,10 @@ class WebStatus(service.MultiService):
                 klog.err_json()
         yield service.MultiService.stopService(self)
 
+        if self.jsonResponseCache:
+            self.jsonResponseCache.stop()
+            self.jsonResponseCache = None
+
         # having shut them down, now remove our child services so they don't
         # start up again if we're re-started
         if self.http_svc:
@@ -0,0 +1,186 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from collections import OrderedDict, defaultdict
+from hashlib import sha1
+
+from twisted.internet import reactor
+
+from buildbot.process import metrics
+from buildbot.status.base import StatusReceiverBase
+from buildbot.util.subscription import SubscriptionPoint
+
+
+class JsonResponseCache(StatusReceiverBase):
+    """
+    Keeps the rendered responses of the JSON resources, keyed by the request
+    path and query arguments, so that the clients polling the same URLs do
+    not rebuild and serialize the same data again and again.
+
+    Each response has a scope: the builder or slave it describes, e.g.
+    C{('builder', 'runtests')}, or None when it depends on the whole master.
+    The status events drop the responses of the builders and slaves they
+    concern, and all the responses without a scope.  The responses are also
+    dropped after C{maxAge} seconds, for the data that changes without a
+    status event (e.g. the latest revisions seen by the pollers).
+    """
+
+    maxAge = 30
+    maxEntries = 1000
+
+    def __init__(self, status, _reactor=reactor):
+        self.status = status
+        self._reactor = _reactor
+        # key -> (scope, created, etag, data)
+        self.entries = OrderedDict()
+        self.scopes = defaultdict(set)
+        # bumped when the responses of a scope are dropped, so that the
+        # responses rendered meanwhile are not kept
+        self.generations = defaultdict(int)
+        self.started = False
+        self._invalidation_subs = SubscriptionPoint("json_response_invalidations")
+
+    def start(self):
+        if not self.started:
+            self.status.subscribe(self)
+            self.started = True
+
+    def stop(self):
+        if self.started:
+            self.status.unsubscribe(self)
+            for builderName in self.status.getBuilderNames():
+                builder = self.status.getBuilder(builderName)
+                if builder and self in builder.watchers:
+                    builder.unsubscribe(self)
+            self.started = False
+        self.entries.clear()
+        self.scopes.clear()
+
+    @staticmethod
+    def getKey(request):
+        args = tuple(sorted((name, tuple(values)) for name, values in request.args.iteritems()))
+        return (tuple(request.prepath), tuple(request.postpath), args)
+
+    def subscribeToInvalidations(self, callback):
+        """
+        Request that C{callback(scopes)} be called whenever the responses of
+        C{scopes} are dropped, C{scopes} including None.
+        """
+        return self._invalidation_subs.subscribe(callback)
+
+    def getGeneration(self, scope):
+        return self.generations[scope]
+
+    def get(self, key):
+        """
+        @returns: (etag, data) or None
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            scope, created, etag, data = entry
+            if self._reactor.seconds() - created < self.maxAge:
+                metrics.MetricCountEvent.log("JsonResponseCache.hits")
+                return etag, data
+            self._remove(key)
+
+        metrics.MetricCountEvent.log("JsonResponseCache.misses")
+        return None
+
+    def put(self, key, scope, generation, data):
+        """
+        Keep the response C{data}, rendered while the scope was at
+        C{generation} (see L{getGeneration}).
+
+        @returns: the etag of the response
+        """
+        etag = '"%s"' % sha1(data).hexdigest()
+        if generation != self.getGeneration(scope):
+            return etag
+
+        self._remove(key)
+        self.entries[key] = (scope, self._reactor.seconds(), etag, data)
+        self.scopes[scope].add(key)
+        while len(self.entries) > self.maxEntries:
+            self._remove(next(iter(self.entries)))
+        return etag
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.scopes[entry[0]].discard(key)
+
+    def invalidate(self, *scopes):
+        """
+        Drop the responses of the given scopes, and the ones without a scope.
+        """
+        scopes = (None,) + scopes
+        for scope in scopes:
+            self.generations[scope] += 1
+            for key in self.scopes.pop(scope, ()):
+                self.entries.pop(key, None)
+        self._invalidation_subs.deliver(scopes)
+
+    def invalidateBuild(self, build):
+        self.invalidate(('builder', build.getBuilder().getName()),
+                        ('slave', build.getSlavename()))
+
+    # IStatusReceiver
+
+    def builderAdded(self, builderName, builder, friendly_name=None):
+        self.invalidate(('builder', builderName))
+        return self
+
+    def builderRemoved(self, builderName):
+        self.invalidate(('builder', builderName))
+
+    def builderChangedState(self, builderName, state):
+        self.invalidate(('builder', builderName))
+
+    def requestSubmitted(self, request):
+        self.invalidate(('builder', request.buildername))
+
+    def requestCancelled(self, builder, request):
+        self.invalidate(('builder', request.buildername))
+
+    def buildStarted(self, builderName, build):
+        self.invalidateBuild(build)
+        return self
+
+    def stepStarted(self, build, step):
+        self.invalidateBuild(build)
+
+    def stepFinished(self, build, step, results):
+        self.invalidateBuild(build)
+
+    def buildFinished(self, builderName, build, results):
+        self.invalidateBuild(build)
+
+    def changeAdded(self, change):
+        self.invalidate()
+
+    def slaveConnected(self, slaveName):
+        self.invalidate(('slave', slaveName))
+
+    def slaveDisconnected(self, slaveName):
+        self.invalidate(('slave', slaveName))
+
+    def slavePaused(self, slavename, url, user):
+        self.invalidate(('slave', slavename))
+
+    def slaveUnpaused(self, slavename, url, user):
+        self.invalidate(('slave', slavename))
+
+    def slaveShutdownGraceFully(self, slavename, url, user):
+        self.invalidate(('slave', slavename))
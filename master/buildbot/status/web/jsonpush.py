@@ -0,0 +1,206 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import urllib
+import urlparse
+
+from twisted.internet import defer, reactor
+from twisted.web import resource
+
+import klog
+from buildbot.status.web.jsoncache import JsonResponseCache
+from buildbot.status.web.status_json import JsonResource
+
+
+class JsonPushRequest(object):
+    """
+    A GET of a JSON resource made by the master itself, with the parts of
+    a twisted.web request the JSON resources use.
+    """
+
+    method = 'GET'
+    client = None
+
+    def __init__(self, site, path, args):
+        self.site = site
+        self.sitepath = []
+        self.prepath = []
+        self.postpath = map(urllib.unquote, path.split('/'))
+        self.path = '/' + path
+        self.args = args
+        self.headers = {}
+
+    def getHeader(self, name):
+        return None
+
+    def setHeader(self, name, value):
+        self.headers[name.lower()] = value
+
+    def setResponseCode(self, code, message=None):
+        self.code = code
+
+
+def renderJsonResource(webStatus, path):
+    """
+    Render the JSON resource at C{path}, relative to the root of
+    C{webStatus}, from its response cache.
+
+    @returns: (etag, data) via Deferred, or None if the resource is not one
+        of the JSON resources shared by all the clients
+    """
+    path, _, query = path.partition('?')
+    args = urlparse.parse_qs(query, keep_blank_values=True)
+    if 'callback' in args:
+        # JSONP
+        return defer.succeed(None)
+    request = JsonPushRequest(webStatus.site, path, args)
+    child = resource.getChildForRequest(webStatus.site.resource, request)
+    if not isinstance(child, JsonResource):
+        return defer.succeed(None)
+    cache = child.getResponseCache(request)
+    if cache is None:
+        return defer.succeed(None)
+    return child.cachedContent(cache, request)
+
+
+class JsonResourcePusher(object):
+    """
+    Keeps the JSON resources subscribed to by the autobahn relay, and sends
+    the ones whose response changed, so that the relay does not fetch them.
+
+    The subscribed resources are rendered again C{pushDelay} seconds after
+    their responses are dropped from the response cache of the web status,
+    and every C{refreshInterval} seconds, for the data that changes without
+    a status event.  The resources not in the response cache are refused.
+    """
+
+    pushDelay = 1
+    refreshInterval = JsonResponseCache.maxAge
+
+    def __init__(self, getWebStatus, send, _reactor=reactor):
+        """
+        @param getWebStatus: returns the web status rendering the resources,
+            or None
+        @param send: called with the (url, etag, data) of the resources to
+            push, and the URLs refused
+        """
+        self.getWebStatus = getWebStatus
+        self.send = send
+        self._reactor = _reactor
+        # url -> (path, etag last sent)
+        self.resources = {}
+        self.dirty = set()
+        self.pushCall = None
+        self.refreshCall = None
+        self.pushing = False
+        self.cache = None
+        self.invalidationSub = None
+
+    def subscribe(self, resources):
+        """
+        @param resources: the URLs, and their path relative to the web status
+        """
+        for url, path in resources:
+            self.resources[url] = (path, None)
+            self.dirty.add(url)
+        self.schedulePush(0)
+        if self.refreshCall is None:
+            self.refreshCall = self._reactor.callLater(self.refreshInterval, self.refresh)
+
+    def unsubscribe(self, urls):
+        for url in urls:
+            self.resources.pop(url, None)
+            self.dirty.discard(url)
+
+    def stop(self):
+        for call in (self.pushCall, self.refreshCall):
+            if call is not None and call.active():
+                call.cancel()
+        self.pushCall = self.refreshCall = None
+        self.resources.clear()
+        self.dirty.clear()
+        self.watchCache(None)
+
+    def watchCache(self, cache):
+        if cache is self.cache:
+            return
+        if self.invalidationSub is not None:
+            self.invalidationSub.unsubscribe()
+            self.invalidationSub = None
+        self.cache = cache
+        if cache is not None:
+            self.invalidationSub = cache.subscribeToInvalidations(self.invalidated)
+
+    def invalidated(self, scopes):
+        # scopes always include None, which all the responses may depend on
+        self.dirty.update(self.resources)
+        if self.dirty:
+            self.schedulePush(self.pushDelay)
+
+    def refresh(self):
+        self.refreshCall = None
+        if self.resources:
+            self.dirty.update(self.resources)
+            self.schedulePush(0)
+            self.refreshCall = self._reactor.callLater(self.refreshInterval, self.refresh)
+
+    def schedulePush(self, delay):
+        if self.pushCall is not None and self.pushCall.active():
+            if self.pushCall.getTime() <= self._reactor.seconds() + delay:
+                return
+            self.pushCall.cancel()
+        self.pushCall = self._reactor.callLater(delay, self.push)
+
+    @defer.inlineCallbacks
+    def push(self):
+        self.pushCall = None
+        if self.pushing:
+            # once the current push is done
+            self.schedulePush(self.pushDelay)
+            return
+
+        urls, self.dirty = self.dirty, set()
+        webStatus = self.getWebStatus()
+        self.watchCache(getattr(webStatus, 'jsonResponseCache', None))
+
+        pushed = []
+        refused = []
+        self.pushing = True
+        try:
+            for url in sorted(urls):
+                if url not in self.resources:
+                    continue
+                response = None
+                if self.cache is not None:
+                    try:
+                        response = yield renderJsonResource(webStatus, self.resources[url][0])
+                    except Exception:
+                        klog.err_json(None, 'while rendering %s for the autobahn relay' % (url,))
+                if url not in self.resources:
+                    # unsubscribed meanwhile
+                    continue
+                if response is None:
+                    del self.resources[url]
+                    refused.append(url)
+                    continue
+                etag, data = response
+                if etag != self.resources[url][1]:
+                    self.resources[url] = (self.resources[url][0], etag)
+                    pushed.append((url, etag, data))
+        finally:
+            self.pushing = False
+
+        if pushed or refused:
+            self.send(pushed, refused)
@@ -15,9 +15,10 @@
 
 
 from zope.interface import implements
+from twisted.internet.interfaces import IPullProducer
 from twisted.python import components
 from twisted.spread import pb
-from twisted.web import server
+from twisted.web import http, server
 from twisted.web.resource import Resource, NoResource
 
 from buildbot import interfaces, version
@@ -30,6 +31,79 @@ from buildbot.status.web.jsontestresults import JSONTestResource
 
 import re
 
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parseRange(header, length):
+    """
+    Parse a Range header asking for a single range of bytes of a text of
+    C{length} bytes.
+
+    @returns: (start, stop), with C{stop} excluded and C{start} past the end
+    of the text if the range is not satisfiable, or None to ignore the header
+    """
+    mo = _RANGE_RE.match(header.strip())
+    if not mo or mo.groups() == ("", ""):
+        return None
+    first, last = mo.groups()
+    if not first:
+        # the last bytes
+        return max(length - int(last), 0), length
+    first = int(first)
+    if not last:
+        return first, length
+    if int(last) < first:
+        return None
+    return first, min(int(last) + 1, length)
+
+def _getIntArg(req, name):
+    try:
+        value = int(req.args.get(name, [None])[0])
+    except (TypeError, ValueError):
+        return None
+    if value < 0:
+        return None
+    return value
+
+class TextProducer:
+    """
+    Writes the text generated by C{texts} to a request as the client reads
+    it, so that a log is never held in memory at once.
+    """
+    implements(IPullProducer)
+
+    bufferSize = 64*1024
+
+    def __init__(self, request, texts):
+        self.request = request
+        self.texts = texts
+
+    def start(self):
+        self.request.notifyFinish().addErrback(lambda _: self.stopProducing())
+        self.request.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if not self.request:
+            return
+        data = []
+        size = 0
+        for text in self.texts:
+            data.append(text)
+            size += len(text)
+            if size >= self.bufferSize:
+                self.request.write("".join(data))
+                return
+
+        request = self.request
+        self.stopProducing()
+        if data:
+            request.write("".join(data))
+        request.unregisterProducer()
+        request.finish()
+
+    def stopProducing(self):
+        self.request = None
+        self.texts = None
+
 class ChunkConsumer:
     implements(interfaces.IStatusLogConsumer)
 
@@ -115,13 +189,60 @@ class TextLog(Resource, ContextMixin):
         else:
             return self.chunk_template.module.chunks(html_entries)
 
+    def getChannels(self):
+        if self.withHeaders:
+            return logfile.ALL_CHANNELS
+        return logfile.TEXT_CHANNELS
+
     def render_HEAD(self, req):
         self._setContentType(req)
 
-        # vague approximation, ignores markup
-        req.setHeader("content-length", self.original.length)
+        if self.asDownload or self.newWindow:
+            req.setHeader("Accept-Ranges", "bytes")
+            req.setHeader("content-length",
+                          str(self.original.getTextLength(self.getChannels())))
+        else:
+            # vague approximation, ignores markup
+            req.setHeader("content-length", self.original.length)
         return ''
 
+    def renderText(self, req):
+        """
+        Stream the text of the log, or only the lines given by the C{tail}
+        and C{offset} arguments, or the bytes given by the Range header.
+        """
+        channels = self.getChannels()
+        tail = _getIntArg(req, "tail")
+        offset = _getIntArg(req, "offset")
+
+        if tail is not None or offset is not None:
+            start = offset or 0
+            if tail is not None:
+                start = max(start,
+                            self.original.getLineCount(channels) - tail)
+            texts = self.original.generateLines(start, None, channels)
+        else:
+            length = self.original.getTextLength(channels)
+            start, stop = 0, length
+            req.setHeader("Accept-Ranges", "bytes")
+            header = req.getHeader("range")
+            span = header and parseRange(header, length)
+            if span:
+                start, stop = span
+                if start >= length:
+                    req.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    req.setHeader("Content-Range", "bytes */%d" % length)
+                    return ""
+                req.setResponseCode(http.PARTIAL_CONTENT)
+                req.setHeader("Content-Range",
+                              "bytes %d-%d/%d" % (start, stop - 1, length))
+            # the log may grow meanwhile, only send what is announced
+            req.setHeader("Content-Length", str(stop - start))
+            texts = self.original.generateText(start, stop, channels)
+
+        TextProducer(req, texts).start()
+        return server.NOT_DONE_YET
+
     def render_GET(self, req):
         self._setContentType(req)
         self.req = req
@@ -137,12 +258,12 @@ class TextLog(Resource, ContextMixin):
             base_name = self.original.step.getName() + "_" + self.original.getName() + with_headers
             base_name = re.sub(r'[\W]', '_', base_name) + ".log"
             req.setHeader("Content-Disposition", "attachment; filename =\"" + base_name + "\"")
-            return self.original.getTextWithHeaders() if self.withHeaders else self.original.getText()
+            return self.renderText(req)
 
         # Or open in new window
         if self.newWindow:
             req.setHeader("Content-Disposition", "inline")
-            return self.original.getTextWithHeaders() if self.withHeaders else self.original.getText()
+            return self.renderText(req)
 
         # Else render the logs template
         
@@ -242,8 +363,10 @@ class LogsResource(HtmlResource):
         for log in self.step_status.getLogs():
             if path == log.getName():
                 if log.hasContents():
-                    content = log.getText()
                     is_html_log = isinstance(log, HTMLLogFile)
+                    # only the html logs can be test results, don't read the
+                    # (possibly huge) text logs
+                    content = log.getText() if is_html_log else ''
                     if is_html_log and log.content_type == 'json':
                         return JSONTestResource(log, self.step_status)
                     elif is_html_log and (log.content_type == 'xml' or ('xml-stylesheet' in content or 'nosetests' in content)):
@@ -24,7 +24,7 @@ import time
 import jsonschema
 from twisted.python import log
 from twisted.internet import defer
-from twisted.web import html, resource, server
+from twisted.web import html, http, resource, server
 
 import klog
 from buildbot.schedulers.forcesched import ForceScheduler
@@ -203,6 +203,22 @@ def RequestArgToBool(request, arg, default):
     return default
 
 
+def RequestArgToInt(request, arg, default, minimum=None, maximum=None):
+    """Returns the argument as an int clamped to [minimum, maximum], or
+    default when it is missing or not a number."""
+    try:
+        value = int(RequestArg(request, arg, default))
+    except (TypeError, ValueError):
+        value = default
+    if value is None:
+        return None
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
 def FilterOut(data):
     """Returns a copy with None, False, "", [], () and {} removed.
     Warning: converts tuple to list."""
@@ -227,6 +243,8 @@ class JsonResource(resource.Resource):
 
     contentType = "application/json"
     cache_seconds = 60
+    # keep the rendered responses in the JsonResponseCache of the WebStatus
+    cacheable = True
     help = None
     pageTitle = None
     level = 0
@@ -264,13 +282,57 @@ class JsonResource(resource.Resource):
         RecurseFix(res, self.level)
         resource.Resource.putChild(self, name, res)
 
-    def render_GET(self, request):
-        """Renders a HTTP GET at the http request level."""
+    def getCacheScope(self):
+        """
+        The builder or slave this resource describes, e.g.
+        C{('builder', name)}, or None if it depends on the whole master; see
+        L{buildbot.status.web.jsoncache.JsonResponseCache}.
+        """
+        return None
+
+    def getResponseCache(self, request):
+        if not self.cacheable:
+            return None
+        return getattr(request.site.buildbot_service, 'jsonResponseCache', None)
+
+    def renderContent(self, request):
         d = defer.maybeDeferred(lambda: self.content(request))
 
-        def handle(data):
+        def encode(data):
             if isinstance(data, unicode):
                 data = data.encode("utf-8")
+            return data
+        d.addCallback(encode)
+        return d
+
+    def cachedContent(self, cache, request):
+        """
+        Get the response from C{cache}, or render it and keep it there.
+
+        @returns: (etag, data) via Deferred
+        """
+        key = cache.getKey(request)
+        response = cache.get(key)
+        if response is not None:
+            return defer.succeed(response)
+
+        # a selection gathers the data of several resources
+        scope = None if 'select' in request.args else self.getCacheScope()
+        generation = cache.getGeneration(scope)
+        d = self.renderContent(request)
+        d.addCallback(lambda data: (cache.put(key, scope, generation, data), data))
+        return d
+
+    def render_GET(self, request):
+        """Renders a HTTP GET at the http request level."""
+        cache = self.getResponseCache(request)
+        if cache is not None:
+            d = self.cachedContent(cache, request)
+        else:
+            d = self.renderContent(request)
+            d.addCallback(lambda data: (None, data))
+
+        def handle((etag, data)):
             request.setHeader("Access-Control-Allow-Origin", "*")
             if RequestArgToBool(request, 'as_text', False):
                 request.setHeader("content-type", 'text/plain')
@@ -283,6 +345,8 @@ class JsonResource(resource.Resource):
                 request.setHeader("Expires",
                                   expires.strftime("%a, %d %b %Y %H:%M:%S GMT"))
                 request.setHeader("Pragma", "no-cache")
+            if etag and request.setETag(etag) == http.CACHED:
+                return ''
             return data
 
         d.addCallback(handle)
@@ -469,6 +533,7 @@ class AliveJsonResource(JsonResource):
     help = """Used to check if server is running.
 """
     pageTitle = 'Alive'
+    cacheable = False
 
     def asDict(self, request):
         return 1
@@ -483,6 +548,9 @@ class BuilderPendingBuildsJsonResource(JsonResource):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
 
+    def getCacheScope(self):
+        return ('builder', self.builder_status.getName())
+
     def asDict(self, request):
         # buildbot.status.builder.BuilderStatus
         d = self.builder_status.getPendingBuildRequestStatusesDicts(codebases=getCodebases(request=request))
@@ -502,6 +570,9 @@ class BuilderJsonResource(JsonResource):
         self.putChild('pendingBuilds', BuilderPendingBuildsJsonResource(status, builder_status))
         self.putChild('start-build', StartBuildJsonResource(status, builder_status))
 
+    def getCacheScope(self):
+        return ('builder', self.builder_status.getName())
+
     def asDict(self, request):
         # buildbot.status.builder.BuilderStatus
         builder_dict = self.builder_status.asDict_async(
@@ -685,6 +756,9 @@ class BuildJsonResource(JsonResource):
                       SourceStampJsonResource(status, sourcestamp))
         self.putChild('steps', BuildStepsJsonResource(status, build_status))
 
+    def getCacheScope(self):
+        return ('builder', self.build_status.getBuilder().getName())
+
     def asDict(self, request):
         return self.build_status.asDict(request)
 
@@ -698,6 +772,9 @@ class AllBuildsJsonResource(JsonResource):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
 
+    def getCacheScope(self):
+        return ('builder', self.builder_status.getName())
+
     def getChild(self, path, request):
         # Dynamic childs.
         if isinstance(path, int) or _IS_INT.match(path):
@@ -745,6 +822,11 @@ class PastBuildsJsonResource(JsonResource):
         self.number = number
         self.slave_status = slave_status
 
+    def getCacheScope(self):
+        if self.builder_status is not None:
+            return ('builder', self.builder_status.getName())
+        return ('slave', getSlaveName(self.slave_status))
+
     @defer.inlineCallbacks
     def asDict(self, request, params=None):
         include_steps = True
@@ -768,24 +850,29 @@ class PastBuildsJsonResource(JsonResource):
             encoding = getRequestCharset(request)
             branches = [b.decode(encoding) for b in request.args.get("branch", []) if b]
 
-            builds = yield self.builder_status.generateFinishedBuildsAsync(branches=map_branches(branches),
-                                                                           codebases=codebases,
-                                                                           results=results,
-                                                                           num_builds=self.number)
+            if include_steps:
+                generate = self.builder_status.generateFinishedBuildsAsync
+            else:
+                # the build summaries have all but the steps
+                generate = self.builder_status.generateFinishedBuildSummariesAsync
+            builds = yield generate(branches=map_branches(branches),
+                                    codebases=codebases,
+                                    results=results,
+                                    num_builds=self.number)
 
             defer.returnValue([b.asDict(request,
                                         include_artifacts=True,
                                         include_failure_url=True,
-                                        include_steps=include_steps,
                                         include_properties=include_props) for b in builds])
             return
 
         if self.slave_status is not None:
             slavename = self.slave_status.getName()
-            builds = yield self.status.generateFinishedBuildsAsync(num_builds=self.number, results=results,
-                                                                   slavename=slavename)
+            builds = yield self.status.generateFinishedBuildSummariesAsync(num_builds=self.number,
+                                                                          results=results,
+                                                                          slavename=slavename)
 
-            defer.returnValue([rb.asDict(request=request, include_steps=False) for rb in builds])
+            defer.returnValue([rb.asDict(request=request) for rb in builds])
             return
 
 
@@ -836,6 +923,9 @@ class BuildStepJsonResource(JsonResource):
         self.build_step_status = build_step_status
         # TODO self.putChild('logs', LogsJsonResource())
 
+    def getCacheScope(self):
+        return ('builder', self.build_step_status.getBuild().getBuilder().getName())
+
     def asDict(self, request):
         return self.build_step_status.asDict()
 
@@ -851,6 +941,9 @@ class BuildStepsJsonResource(JsonResource):
         # The build steps are constantly changing until the build is done so
         # keep a reference to build_status instead
 
+    def getCacheScope(self):
+        return ('builder', self.build_status.getBuilder().getName())
+
     def getChild(self, path, request):
         # Dynamic childs.
         build_step_status = None
@@ -1050,6 +1143,8 @@ class SingleProjectBuilderJsonResource(LatestRevisionResource):
         self.latest_rev = latest_rev
         LatestRevisionResource.__init__(self, status, project)
 
+    def getCacheScope(self):
+        return ('builder', self.builder.getName())
 
     @defer.inlineCallbacks
     def builder_dict(self, builder, codebases, request, branches, base_build_dict, include_build_steps,
@@ -1060,10 +1155,10 @@ class SingleProjectBuilderJsonResource(LatestRevisionResource):
                                        include_pending_builds)
 
         #Get latest build
-        builds = yield builder.generateFinishedBuildsAsync(branches=map_branches(branches),
-                                                           codebases=codebases,
-                                                           num_builds=1,
-                                                           useCache=True)
+        builds = yield builder.generateFinishedBuildSummariesAsync(branches=map_branches(branches),
+                                                                   codebases=codebases,
+                                                                   num_builds=1,
+                                                                   useCache=True)
 
         if len(builds) > 0:
             d['latestBuild'] = builds[0].asBaseDict(request, include_artifacts=True, include_failure_url=True)
@@ -1105,8 +1200,15 @@ class SingleProjectBuilderJsonResource(LatestRevisionResource):
 
 
 class QueueJsonResource(JsonResource):
-    help = """List the builds in the queue."""
+    help = """List the builds in the queue.
+
+The queue is returned in pages of at most 'limit' builds (200 by default,
+1000 at most); pass the brid of the last build of a page as 'after' to get the
+next one.
+"""
     pageTitle = 'Queue'
+    defaultLimit = 200
+    maxLimit = 1000
 
     def __init__(self, status):
         JsonResource.__init__(self, status)
@@ -1114,8 +1216,17 @@ class QueueJsonResource(JsonResource):
 
     @defer.inlineCallbacks
     def asDict(self, request):
-        unclaimed_brq = yield self.status.master.db.buildrequests\
-            .getBuildRequestInQueue(sorted=True, limit=200)
+        db = self.status.master.db
+        limit = RequestArgToInt(request, 'limit', self.defaultLimit,
+                                minimum=1, maximum=self.maxLimit)
+        after = RequestArgToInt(request, 'after', None)
+        if after is not None:
+            after = yield db.buildrequests.getBuildRequest(after)
+            if after is None:
+                defer.returnValue([])
+
+        unclaimed_brq = yield db.buildrequests\
+            .getBuildRequestInQueue(sorted=True, limit=limit, after=after)
 
         #Convert to dictionary
         output = []
@@ -1150,6 +1261,9 @@ class SinglePendingBuildsJsonResource(JsonResource):
         self.status = status
         self.builder = builder
 
+    def getCacheScope(self):
+        return ('builder', self.builder.getName())
+
     @defer.inlineCallbacks
     def asDict(self, request):
         #Get codebases
@@ -1170,6 +1284,9 @@ class SlaveBuildsJsonResource(JsonResource):
         self.slave_status = slave_status
         self.name = getSlaveName(self.slave_status)
 
+    def getCacheScope(self):
+        return ('slave', self.name)
+
     def getChild(self, path, request):
         # Dynamic childs.
         if "<" in path:
@@ -1210,6 +1327,9 @@ class SlaveBuildersJsonResource(JsonResource):
         self.slave_status = slave_status
         self.name = getSlaveName(self.slave_status)
 
+    def getCacheScope(self):
+        return ('slave', self.name)
+
     def asDict(self, request):
         slavename = getSlaveName(self.slave_status)
         my_builders = []
@@ -1235,6 +1355,9 @@ class SlaveJsonResource(JsonResource):
         self.putChild('builds', SlaveBuildsJsonResource(status, slave_status))
         self.putChild('builders', SlaveBuildersJsonResource(status, slave_status))
 
+    def getCacheScope(self):
+        return ('slave', self.name)
+
     def getBuilders(self):
         if self.builders is None:
             # Figure out all the builders to which it's attached
@@ -1306,6 +1429,7 @@ class MetricsJsonResource(JsonResource):
     help = """Master metrics.
 """
     title = "Metrics"
+    cacheable = False
 
     def asDict(self, request):
         metrics = self.status.getMetrics()
@@ -1319,6 +1443,7 @@ class MetricsJsonResource(JsonResource):
 class GlobalJsonResource(JsonResource):
     help = """Gives information that can be used on all realtime pages"""
     pageTitle = 'Global Info'
+    cacheable = False
 
     def __init__(self, status):
         JsonResource.__init__(self, status)
@@ -1390,6 +1515,7 @@ class BuildNumberForRequestJsonResource(JsonResource):
 class MyBuildsJsonResource(JsonResource):
     help = 'Gives information about my builds from last 7 days'
     pageTitle = 'My builds from last 7 days'
+    cacheable = False
 
     @defer.inlineCallbacks
     def asDict(self, request):
@@ -1416,6 +1542,7 @@ status. You may want to use a child instead to reduce the load on the server.
 For help on any sub directory, use url /child/help
 """
     pageTitle = 'Katana JSON'
+    cacheable = False
 
     def __init__(self, status):
         JsonResource.__init__(self, status)
@@ -16,6 +16,8 @@
 
 import re
 import inspect
+import sre_constants
+import sre_parse
 from twisted.python import log, failure
 from twisted.spread import pb
 from buildbot.process import buildstep
@@ -387,10 +389,130 @@ class StringFileWriter(pb.Referenceable):
     def remote_close(self):
         pass
 
+def _refersToGroups(regex):
+    """
+    Return True if the compiled C{regex} refers to its own groups, with a
+    backreference or a conditional, which would point to other groups once
+    combined with other expressions.
+    """
+    stack = [sre_parse.parse(regex.pattern, regex.flags)]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, sre_parse.SubPattern):
+            for op, av in value:
+                if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+                    return True
+                stack.append(av)
+        elif isinstance(value, (tuple, list)):
+            stack.extend(value)
+    return False
+
+
+class WarningCountingLogObserver(buildstep.LogLineObserver):
+    """
+    Scans the output of a L{WarningCountingShellCommand} for warnings as it
+    arrives, so that the step does not go through the whole log in the
+    reactor thread when the command finishes.
+
+    The lines with warnings are kept in C{warnings}, and counted in the
+    C{warnCount} of the step.  An exception raised while scanning (e.g. by
+    the warning extractor) stops the scan, and is raised again by
+    L{finish}.
+    """
+
+    def __init__(self):
+        buildstep.LogLineObserver.__init__(self)
+        self.warnings = []
+        self.failure = None
+        # the end of the last line of each channel, until its newline arrives
+        self.outBuffer = ''
+        self.errBuffer = ''
+        self.warningRe = None
+
+    # the lines are split here rather than by the line receivers of
+    # LogLineObserver, which drop the long lines and keep the unfinished
+    # last line to themselves
+
+    def outReceived(self, data):
+        lines = (self.outBuffer + data).split("\n")
+        self.outBuffer = lines.pop()
+        self.scanLines(lines)
+
+    def errReceived(self, data):
+        lines = (self.errBuffer + data).split("\n")
+        self.errBuffer = lines.pop()
+        self.scanLines(lines)
+
+    def outLineReceived(self, line):
+        self.scanLines([line])
+
+    def errLineReceived(self, line):
+        self.scanLines([line])
+
+    def _compilePatterns(self):
+        step = self.step
+
+        wre = step.warningPattern
+        if isinstance(wre, basestring):
+            wre = re.compile(wre)
+        self.warningRe = wre
+
+        directoryEnterRe = step.directoryEnterPattern
+        if isinstance(directoryEnterRe, basestring):
+            directoryEnterRe = re.compile(directoryEnterRe)
+        self.directoryEnterRe = directoryEnterRe
+
+        directoryLeaveRe = step.directoryLeavePattern
+        if isinstance(directoryLeaveRe, basestring):
+            directoryLeaveRe = re.compile(directoryLeaveRe)
+        self.directoryLeaveRe = directoryLeaveRe
+
+    def scanLines(self, lines):
+        if self.failure is not None:
+            return
+        if self.warningRe is None:
+            self._compilePatterns()
+
+        step = self.step
+        warnings = self.warnings
+        directoryStack = step.directoryStack
+        warningMatch = self.warningRe.match
+        enterSearch = self.directoryEnterRe and self.directoryEnterRe.search
+        leaveSearch = self.directoryLeaveRe and self.directoryLeaveRe.search
+
+        try:
+            for line in lines:
+                if enterSearch:
+                    match = enterSearch(line)
+                    if match:
+                        directoryStack.append(match.group(1))
+                        continue
+                if leaveSearch and directoryStack and leaveSearch(line):
+                    directoryStack.pop()
+                    continue
+
+                match = warningMatch(line)
+                if match:
+                    step.maybeAddWarning(warnings, line, match)
+        except Exception:
+            self.failure = failure.Failure()
+
+    def finish(self):
+        """
+        Scan the unfinished last lines, once the command is done.
+        """
+        lines = [buf for buf in (self.outBuffer, self.errBuffer) if buf]
+        self.outBuffer = self.errBuffer = ''
+        self.scanLines(lines)
+        if self.failure is not None:
+            self.failure.raiseException()
+
+
 class WarningCountingShellCommand(ShellCommand):
     renderables = [ 'suppressionFile' ]
 
     warnCount = 0
+    warningObserver = None
     warningPattern = '.*warning[: ].*'
     # The defaults work for GNU Make.
     directoryEnterPattern = (u"make.*: Entering directory " 
@@ -426,6 +548,8 @@ class WarningCountingShellCommand(ShellCommand):
         ShellCommand.__init__(self, **kwargs)
 
         self.suppressions = []
+        # (suppressAll, textRe, otherSuppressions), see _getSuppressionMatchers
+        self.suppressionMatchers = None
         self.directoryStack = []
 
     def addSuppression(self, suppressionList):
@@ -455,6 +579,43 @@ class WarningCountingShellCommand(ShellCommand):
             if warnRe != None and isinstance(warnRe, basestring):
                 warnRe = re.compile(warnRe)
             self.suppressions.append((fileRe, warnRe, start, end))
+        self.suppressionMatchers = None
+
+    def _getSuppressionMatchers(self):
+        # The suppressions that match any file and line only look at the
+        # text of the warnings: their expressions are combined into one, so
+        # that each warning is searched once for all of them.  Combining
+        # renumbers the groups, so the expressions which refer to their own
+        # groups are kept apart.
+        if self.suppressionMatchers is not None:
+            return self.suppressionMatchers
+
+        suppressAll = False
+        patterns = []
+        textSuppressions = []
+        others = []
+        for supp in self.suppressions:
+            fileRe, warnRe, start, end = supp
+            if fileRe == None and start == None and end == None:
+                if warnRe == None:
+                    suppressAll = True
+                    continue
+                if not warnRe.flags and not _refersToGroups(warnRe):
+                    patterns.append("(?:%s)" % warnRe.pattern)
+                    textSuppressions.append(supp)
+                    continue
+            others.append(supp)
+
+        textRe = None
+        if patterns:
+            try:
+                textRe = re.compile("|".join(patterns))
+            except (re.error, AssertionError, OverflowError):
+                # e.g. too many groups, or clashing group names
+                others.extend(textSuppressions)
+
+        self.suppressionMatchers = (suppressAll, textRe, others)
+        return self.suppressionMatchers
 
     def warnExtractWholeLine(self, line, match):
         """
@@ -484,7 +645,12 @@ class WarningCountingShellCommand(ShellCommand):
                     file = "%s/%s" % (currentDirectory, file)
 
             # Skip adding the warning if any suppression matches.
-            for fileRe, warnRe, start, end in self.suppressions:
+            suppressAll, textRe, others = self._getSuppressionMatchers()
+            if suppressAll:
+                return
+            if textRe is not None and textRe.search(text):
+                return
+            for fileRe, warnRe, start, end in others:
                 if not (file == None or fileRe == None or fileRe.match(file)):
                     continue
                 if not (warnRe == None or warnRe.search(text)):
@@ -537,52 +703,23 @@ class WarningCountingShellCommand(ShellCommand):
         self.addSuppression(list)
         return ShellCommand.start(self)
 
+    def setupLogfiles(self, cmd, logfiles):
+        # match the output against warningPattern as it arrives
+        self.warningObserver = WarningCountingLogObserver()
+        self.addLogObserver('stdio', self.warningObserver)
+        ShellCommand.setupLogfiles(self, cmd, logfiles)
+
     def createSummary(self, log):
         """
-        Match log lines against warningPattern.
+        Report the warnings found in the output by the log observer.
 
         Warnings are collected into another log for this step, and the
         build-wide 'warnings-count' is updated."""
 
-        self.warnCount = 0
-
-        # Now compile a regular expression from whichever warning pattern we're
-        # using
-        wre = self.warningPattern
-        if isinstance(wre, str):
-            wre = re.compile(wre)
-
-        directoryEnterRe = self.directoryEnterPattern
-        if (directoryEnterRe != None
-                and isinstance(directoryEnterRe, basestring)):
-            directoryEnterRe = re.compile(directoryEnterRe)
-
-        directoryLeaveRe = self.directoryLeavePattern
-        if (directoryLeaveRe != None
-                and isinstance(directoryLeaveRe, basestring)):
-            directoryLeaveRe = re.compile(directoryLeaveRe)
-
-        # Check if each line in the output from this command matched our
-        # warnings regular expressions. If did, bump the warnings count and
-        # add the line to the collection of lines with warnings
         warnings = []
-        # TODO: use log.readlines(), except we need to decide about stdout vs
-        # stderr
-        for line in log.getText().split("\n"):
-            if directoryEnterRe:
-                match = directoryEnterRe.search(line)
-                if match:
-                    self.directoryStack.append(match.group(1))
-                    continue
-            if (directoryLeaveRe and
-                self.directoryStack and
-                directoryLeaveRe.search(line)):
-                    self.directoryStack.pop()
-                    continue
-
-            match = wre.match(line)
-            if match:
-                self.maybeAddWarning(warnings, line, match)
+        if self.warningObserver is not None:
+            self.warningObserver.finish()
+            warnings = self.warningObserver.warnings
 
         # If there were any warnings, make the log if lines with warnings
         # available
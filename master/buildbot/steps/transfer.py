@@ -16,14 +16,17 @@
 from __future__ import with_statement
 
 
-import os.path, tarfile, tempfile
+import os.path, tarfile, tempfile, threading
+import Queue
 try:
     from cStringIO import StringIO
     assert StringIO
 except ImportError:
     from StringIO import StringIO
+from twisted.internet import defer, reactor, threads
 from twisted.spread import pb
-from twisted.python import log
+from twisted.python import failure, log
+from buildbot import util
 from buildbot.process import buildstep
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.buildstep import SUCCESS, FAILURE, SKIPPED
@@ -33,12 +36,54 @@ from buildbot.util.eventual import eventually
 from buildbot import config
 
 
+class _TransferStats(object):
+    """
+    Counts the bytes transferred by a writer or a reader, for the throughput
+    of the transfer
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.started = util.now()
+        self.lastActivity = self.started
+
+    def transferred(self, length):
+        self.bytes += length
+        self.lastActivity = util.now()
+
+    def getElapsed(self):
+        return self.lastActivity - self.started
+
+
+class _SerialThread(object):
+    """
+    Runs functions one after the other in the reactor thread pool, so that
+    the writes of a transfer are done in order without blocking the reactor
+    """
+
+    def __init__(self):
+        self.last = defer.succeed(None)
+
+    def run(self, fn, *args):
+        d = defer.Deferred()
+        def call(_):
+            t = threads.deferToThread(fn, *args)
+            t.chainDeferred(d)
+            # the next call waits for this one, whatever its result
+            return t.addErrback(lambda _: None)
+        self.last.addCallback(call)
+        return d
+
+
 class _FileWriter(pb.Referenceable):
     """
-    Helper class that acts as a file-object with write access
+    Helper class that acts as a file-object with write access.  With
+    C{threaded}, the file is written in a thread, and L{remote_write} and
+    L{remote_close} return a Deferred once done, for the slaves which keep
+    several writes in flight.
     """
 
-    def __init__(self, destfile, maxsize, mode):
+    def __init__(self, destfile, maxsize, mode, threaded=False):
         # Create missing directories.
         destfile = os.path.abspath(destfile)
         dirname = os.path.dirname(destfile)
@@ -50,6 +95,8 @@ class _FileWriter(pb.Referenceable):
         fd, self.tmpname = tempfile.mkstemp(dir=dirname)
         self.fp = os.fdopen(fd, 'wb')
         self.remaining = maxsize
+        self.stats = _TransferStats()
+        self.thread = _SerialThread() if threaded else None
 
     def remote_write(self, data):
         """
@@ -62,10 +109,11 @@ class _FileWriter(pb.Referenceable):
         if self.remaining is not None:
             if len(data) > self.remaining:
                 data = data[:self.remaining]
-            self.fp.write(data)
             self.remaining = self.remaining - len(data)
-        else:
-            self.fp.write(data)
+        self.stats.transferred(len(data))
+        if self.thread:
+            return self.thread.run(self.fp.write, data)
+        self.fp.write(data)
 
     def remote_utime(self, accessed_modified):
         os.utime(self.destfile,accessed_modified)
@@ -74,6 +122,11 @@ class _FileWriter(pb.Referenceable):
         """
         Called by remote slave to state that no more data will be transfered
         """
+        if self.thread:
+            return self.thread.run(self._close)
+        self._close()
+
+    def _close(self):
         self.fp.close()
         self.fp = None
         # on windows, os.rename does not automatically unlink, so do it manually
@@ -85,6 +138,15 @@ class _FileWriter(pb.Referenceable):
             os.chmod(self.destfile, self.mode)
 
     def cancel(self):
+        if self.thread:
+            # after the writes in flight
+            d = self.thread.run(self._cancel)
+            d.addErrback(log.err, "while cancelling the upload of %s"
+                         % (self.destfile,))
+        else:
+            self._cancel()
+
+    def _cancel(self):
         # unclean shutdown, the file is probably truncated, so delete it
         # altogether rather than deliver a corrupted file
         fp = getattr(self, "fp", None)
@@ -171,6 +233,140 @@ class _DirectoryWriter(_FileWriter):
         os.remove(self.tarname)
 
 
+class _TarStream(object):
+    """
+    A file object read by the thread which unpacks the blocks of a
+    directory upload while they arrive.  The Deferred of each block fires
+    once the thread has read it, and the slave sends the next blocks when
+    they fire.
+    """
+
+    # put in the queue by the reactor at the end of the upload, and when it
+    # is cancelled
+    EOF = 'eof'
+    CANCEL = 'cancel'
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        # the current block, and how much of it was read
+        self.block = ''
+        self.offset = 0
+        self.finished = False
+
+    def feed(self, data, d):
+        self.queue.put((data, d))
+
+    def read(self, size=-1):
+        # in the thread
+        pieces = []
+        while size != 0:
+            if self.offset >= len(self.block):
+                if self.finished or not self._nextBlock():
+                    break
+            if size < 0:
+                end = len(self.block)
+            else:
+                end = min(self.offset + size, len(self.block))
+                size -= end - self.offset
+            pieces.append(self.block[self.offset:end])
+            self.offset = end
+        return ''.join(pieces)
+
+    def _nextBlock(self):
+        item = self.queue.get()
+        if item is self.CANCEL:
+            raise IOError("directory upload cancelled")
+        if item is self.EOF:
+            self.finished = True
+            return False
+        self.block, d = item
+        self.offset = 0
+        reactor.callFromThread(d.callback, None)
+        return True
+
+
+class _DirectoryStreamWriter(pb.Referenceable):
+    """
+    Unpacks a directory upload in a thread while its blocks arrive, without
+    storing the archive first.  Used instead of L{_DirectoryWriter} for the
+    slaves which keep several writes in flight.
+    """
+
+    def __init__(self, destroot, maxsize, compress):
+        self.destroot = destroot
+        self.remaining = maxsize
+        self.stats = _TransferStats()
+        self.stream = _TarStream()
+        self.failure = None
+        self.done = False
+
+        if compress in ('bz2', 'gz'):
+            self.tarmode = 'r|' + compress
+        else:
+            self.tarmode = 'r|'
+        # a thread of its own rather than one of the reactor pool, which it
+        # would hold for the whole upload
+        self.unpacked = defer.Deferred()
+        self.unpacked.addErrback(self._unpackFailed)
+        thread = threading.Thread(target=self._run, name='DirectoryUpload')
+        thread.setDaemon(True)
+        thread.start()
+
+    def _run(self):
+        try:
+            self._unpack()
+        except Exception:
+            reactor.callFromThread(self.unpacked.errback, failure.Failure())
+        else:
+            reactor.callFromThread(self.unpacked.callback, None)
+
+    def _unpack(self):
+        archive = tarfile.open(mode=self.tarmode, fileobj=self.stream)
+        archive.extractall(path=self.destroot)
+        archive.close()
+        # read what is left, so that the slave is not left waiting
+        while self.stream.read(64*1024):
+            pass
+
+    def _unpackFailed(self, why):
+        self.failure = why
+        # release the slave's writes in flight
+        while True:
+            try:
+                item = self.stream.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if isinstance(item, tuple):
+                item[1].errback(why)
+        return why
+
+    def remote_write(self, data):
+        if self.failure:
+            return defer.fail(self.failure)
+        if self.remaining is not None:
+            if len(data) > self.remaining:
+                data = data[:self.remaining]
+            self.remaining = self.remaining - len(data)
+        self.stats.transferred(len(data))
+        d = defer.Deferred()
+        self.stream.feed(data, d)
+        return d
+
+    def remote_unpack(self):
+        """
+        Called by remote slave to state that no more data will be transfered
+        """
+        self.done = True
+        self.stream.queue.put(_TarStream.EOF)
+        return self.unpacked
+
+    def cancel(self):
+        if not self.done:
+            self.done = True
+            self.stream.queue.put(_TarStream.CANCEL)
+            self.unpacked.addErrback(lambda _: None)
+
+
 def makeStatusRemoteCommand(step, remote_command, args):
     self = buildstep.RemoteCommand(remote_command, args,  decodeRC={None:SUCCESS, 0:SUCCESS})
     callback = lambda arg: step.step_status.addLog('stdio')
@@ -189,6 +385,13 @@ class _TransferBuildStep(BuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
+    # the largest blocks the pipelining slaves send or ask for, under the
+    # 640kB limit of PB on strings
+    maxBlocksize = 512*1024
+
+    # the object transferring the file on the master, with its stats
+    transfer = None
+
     def setDefaultWorkdir(self, workdir):
         if self.workdir is None:
             self.workdir = workdir
@@ -206,6 +409,32 @@ class _TransferBuildStep(BuildStep):
             d = self.cmd.interrupt(reason)
             return d
 
+    def usePipeline(self, command):
+        """
+        @returns: True if the slave command keeps several blocks in flight,
+            and the step wants it to
+        """
+        # slave commands 2.19 and later
+        version = self.slaveVersion(command)
+        return bool(self.pipeline and isinstance(version, basestring) and
+                    not self.slaveVersionIsOlderThan(command, "2.19"))
+
+    def addPipelineArgs(self, args):
+        args['pipeline'] = self.pipeline
+        args['maxblocksize'] = self.maxBlocksize
+
+    def reportThroughput(self):
+        if self.transfer is None:
+            return
+        stats = self.transfer.stats
+        elapsed = stats.getElapsed()
+        self.step_status.setStatistic('transfer_bytes', stats.bytes)
+        self.step_status.setStatistic('transfer_seconds', elapsed)
+        if elapsed > 0:
+            rate = stats.bytes / elapsed
+            self.step_status.setStatistic('transfer_bytes_per_second', rate)
+            self.step_status.setText2(['%.1f MB/s' % (rate / (1024 * 1024))])
+
     def finished(self, result):
         # Subclasses may choose to skip a transfer. In those cases, self.cmd
         # will be None, and we should just let BuildStep.finished() handle
@@ -213,6 +442,7 @@ class _TransferBuildStep(BuildStep):
         if result == SKIPPED:
             return BuildStep.finished(self, SKIPPED)
 
+        self.reportThroughput()
         if self.cmd.didFail():
             return BuildStep.finished(self, FAILURE)
         return BuildStep.finished(self, SUCCESS)
@@ -226,7 +456,7 @@ class FileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 keepstamp=False, url=None,
+                 keepstamp=False, url=None, pipeline=4,
                  **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
@@ -235,6 +465,7 @@ class FileUpload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.pipeline = pipeline
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -263,8 +494,11 @@ class FileUpload(_TransferBuildStep):
         if self.url is not None:
             self.addURL(os.path.basename(masterdest), self.url)
 
+        pipeline = self.usePipeline("uploadFile")
         # we use maxsize to limit the amount of data on both sides
-        fileWriter = _FileWriter(masterdest, self.maxsize, self.mode)
+        fileWriter = _FileWriter(masterdest, self.maxsize, self.mode,
+                                 threaded=pipeline)
+        self.transfer = fileWriter
 
         if self.keepstamp and self.slaveVersionIsOlderThan("uploadFile","2.13"):
             m = ("This buildslave (%s) does not support preserving timestamps. "
@@ -280,6 +514,8 @@ class FileUpload(_TransferBuildStep):
             'blocksize': self.blocksize,
             'keepstamp': self.keepstamp,
             }
+        if pipeline:
+            self.addPipelineArgs(args)
 
         self.cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
         d = self.runCommand(self.cmd)
@@ -298,7 +534,7 @@ class DirectoryUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16*1024,
-                 compress=None, url=None, **buildstep_kwargs):
+                 compress=None, url=None, pipeline=4, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.slavesrc = slavesrc
@@ -306,6 +542,7 @@ class DirectoryUpload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.pipeline = pipeline
         if compress not in (None, 'gz', 'bz2'):
             config.error(
                 "'compress' must be one of None, 'gz', or 'bz2'")
@@ -333,8 +570,15 @@ class DirectoryUpload(_TransferBuildStep):
         if self.url is not None:
             self.addURL(os.path.basename(masterdest), self.url)
         
+        pipeline = self.usePipeline("uploadDirectory")
         # we use maxsize to limit the amount of data on both sides
-        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
+        if pipeline:
+            dirWriter = _DirectoryStreamWriter(masterdest, self.maxsize,
+                                               self.compress)
+        else:
+            dirWriter = _DirectoryWriter(masterdest, self.maxsize,
+                                         self.compress, 0600)
+        self.transfer = dirWriter
 
         # default arguments
         args = {
@@ -345,6 +589,8 @@ class DirectoryUpload(_TransferBuildStep):
             'blocksize': self.blocksize,
             'compress': self.compress
             }
+        if pipeline:
+            self.addPipelineArgs(args)
 
         self.cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         d = self.runCommand(self.cmd)
@@ -352,6 +598,13 @@ class DirectoryUpload(_TransferBuildStep):
         def cancel(res):
             dirWriter.cancel()
             return res
+        if pipeline:
+            # the slave does not unpack interrupted uploads, so stop the
+            # unpacking thread whatever happens (it is a no-op once unpacked)
+            @d.addCallback
+            def stopUnpacking(res):
+                dirWriter.cancel()
+                return res
         d.addCallback(self.finished).addErrback(self.failed)
 
     def finished(self, result):
@@ -361,6 +614,7 @@ class DirectoryUpload(_TransferBuildStep):
         if result == SKIPPED:
             return BuildStep.finished(self, SKIPPED)
 
+        self.reportThroughput()
         if self.cmd.didFail():
             return BuildStep.finished(self, FAILURE)
         return BuildStep.finished(self, SUCCESS)
@@ -373,6 +627,7 @@ class _FileReader(pb.Referenceable):
 
     def __init__(self, fp):
         self.fp = fp
+        self.stats = _TransferStats()
 
     def remote_read(self, maxlength):
         """
@@ -388,6 +643,7 @@ class _FileReader(pb.Referenceable):
             return ''
 
         data = self.fp.read(maxlength)
+        self.stats.transferred(len(data))
         return data
 
     def remote_close(self):
@@ -407,7 +663,7 @@ class FileDownload(_TransferBuildStep):
 
     def __init__(self, mastersrc, slavedest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 pipeline=4, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.mastersrc = mastersrc
@@ -415,6 +671,7 @@ class FileDownload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.pipeline = pipeline
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -448,6 +705,7 @@ class FileDownload(_TransferBuildStep):
             eventually(BuildStep.finished, self, FAILURE)
             return
         fileReader = _FileReader(fp)
+        self.transfer = fileReader
 
         # default arguments
         args = {
@@ -458,6 +716,8 @@ class FileDownload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        if self.usePipeline("downloadFile"):
+            self.addPipelineArgs(args)
 
         self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
         d = self.runCommand(self.cmd)
@@ -471,7 +731,7 @@ class StringDownload(_TransferBuildStep):
 
     def __init__(self, s, slavedest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 pipeline=4, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
 
         self.s = s
@@ -479,6 +739,7 @@ class StringDownload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.pipeline = pipeline
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -501,6 +762,7 @@ class StringDownload(_TransferBuildStep):
         # setup structures for reading the file
         fp = StringIO(self.s)
         fileReader = _FileReader(fp)
+        self.transfer = fileReader
 
         # default arguments
         args = {
@@ -511,6 +773,8 @@ class StringDownload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        if self.usePipeline("downloadFile"):
+            self.addPipelineArgs(args)
 
         self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
         d = self.runCommand(self.cmd)
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 from twisted.application import service
+from buildbot.process.slaveavailability import SlaveAvailabilityIndex
 
 
 class FakeBotMaster(service.MultiService):
@@ -24,6 +25,7 @@ class FakeBotMaster(service.MultiService):
         self.locks = {}
         self.builders = {}
         self.buildsStartedForSlaves = []
+        self.slaveAvailability = SlaveAvailabilityIndex()
 
     def getLockByID(self, lockid):
         if not lockid in self.locks:
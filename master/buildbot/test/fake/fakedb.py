@@ -94,8 +94,8 @@ class BuildRequest(Row):
         triggeredbybrid = None,
         mergebrid = None,
         startbrid = None,
-        slavepool = None
-
+        slavepool = None,
+        selected_slave = None
     )
 
     id_column = 'id'
@@ -663,6 +663,14 @@ class FakeSourceStampsComponent(FakeDBComponent):
                 sslist.append(ssdictcpy)
         return defer.succeed(sslist)
 
+    def getSourceStampsForSets(self, sourcestampsetids):
+        rv = {}
+        for sourcestampsetid in sourcestampsetids:
+            rv[sourcestampsetid] = [self._getSourceStamp(ssdict['id'])
+                                    for ssdict in sorted(self.sourcestamps.itervalues(), key=lambda ss: ss['id'])
+                                    if ssdict['sourcestampsetid'] == sourcestampsetid]
+        return defer.succeed(rv)
+
 class FakeBuildsetsComponent(FakeDBComponent):
 
     def setUp(self):
@@ -694,10 +702,12 @@ class FakeBuildsetsComponent(FakeDBComponent):
     def addBuildset(self, sourcestampsetid, reason, properties, triggeredbybrid=None,
                     builderNames=None, external_idstring=None, _reactor=reactor):
         bsid = self._newBsid()
+        selected_slave = properties.get('selected_slave', (None, None))[0] if properties else None
         br_rows = []
         for buildername in builderNames:
             br_rows.append(
-                    BuildRequest(buildsetid=bsid, buildername=buildername))
+                    BuildRequest(buildsetid=bsid, buildername=buildername,
+                                 selected_slave=selected_slave))
         self.db.buildrequests.insertTestData(br_rows)
 
         # make up a row and keep its dictionary, with the properties tacked on
@@ -1009,11 +1019,29 @@ class FakeBuildRequestsComponent(FakeDBComponent):
 
         return defer.succeed(rv)
 
-    def getBuildRequestsInQueue(self, queue=None):
-        return self.getBuildRequests(complete=False, claimed=False)
-
-    def getBuildRequestInQueue(self, buildername=None, sourcestamps=None, sorted=True, limit=None):
-        return self.getBuildRequests(buildername=buildername, complete=False, claimed=False)
+    def _pageQueue(self, brdicts, limit=None, after=None):
+        key = lambda br: (-br["priority"], br["submitted_at"], br["brid"])
+        brdicts.sort(key=key)
+        if after is not None:
+            brdicts = [br for br in brdicts if key(br) > key(after)]
+        if limit:
+            brdicts = brdicts[:limit]
+        return brdicts
+
+    def getBuildRequestsInQueue(self, queue=None, limit=None, after=None):
+        d = self.getBuildRequests(complete=False, claimed=False)
+        d.addCallback(self._pageQueue, limit=limit, after=after)
+        return d
+
+    def getBuildRequestInQueue(self, brids=None, buildername=None, sourcestamps=None, sorted=True, limit=None,
+                               after=None):
+        if limit is True:
+            limit = 200
+        d = self.getBuildRequests(buildername=buildername, complete=False, claimed=False)
+        if brids:
+            d.addCallback(lambda brdicts: [br for br in brdicts if br['brid'] in brids])
+        d.addCallback(self._pageQueue, limit=limit, after=after)
+        return d
 
     def getBuildRequestsIDsMergedInto(self, brids):
         rv = [br.id for br in self.reqs.itervalues() if br.mergebrid in brids]
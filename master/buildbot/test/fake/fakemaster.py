@@ -42,6 +42,12 @@ class FakeCache(object):
         d.addCallback(mkref)
         return d
 
+    def __contains__(self, key):
+        return False
+
+    def put_new(self, key, value):
+        pass
+
 
 class FakeCaches(object):
 
@@ -66,6 +72,9 @@ class FakeStatus(object):
     def getFriendlyName(self, name):
         return name
 
+    def putBuildSummary(self, builderName, summary):
+        pass
+
 
 class FakeBuildRequestMerger(object):
 
@@ -165,6 +174,9 @@ class FakeMaster(object):
     def subscribeToBuildRequests(self, callback):
         pass
 
+    def subscribeToCancelledBuildRequests(self, callback):
+        pass
+
     # work around http://code.google.com/p/mock/issues/detail?id=105
     def _get_child_mock(self, **kw):
         return mock.Mock(**kw)
@@ -172,6 +184,9 @@ class FakeMaster(object):
     def maybeBuildsetComplete(self, bsid):
         pass
 
+    def buildRequestAdded(self, bsid, brid, buildername):
+        pass
+
     def buildRequestRemoved(self, bsid, brid, buildername):
         pass
 
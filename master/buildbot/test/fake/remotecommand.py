@@ -140,14 +140,20 @@ class FakeLogFile(object):
     def getTextWithHeaders(self):
         return ''.join([ c for str,c in self.chunks])
 
-    def getChunks(self, channels=[], onlyText=False):
+    def getChunks(self, channels=[], onlyText=False, offset=0):
+        # offset counts the netstring encoding of the chunks, like LogFile
+        chunks = self.chunks
+        while offset > 0:
+            skippedCh, skipped = chunks[0]
+            offset -= len("%d:%d%s," % (1 + len(skipped), skippedCh, skipped))
+            chunks = chunks[1:]
         if onlyText:
             return [ data
-                        for (ch, data) in self.chunks
+                        for (ch, data) in chunks
                         if not channels or ch in channels ]
         else:
             return [ (ch, data)
-                        for (ch, data) in self.chunks
+                        for (ch, data) in chunks
                         if not channels or ch in channels ]
 
     def setTimestampsMode(self, prepend_timestamps):
@@ -15,3 +15,5 @@
 
 class FakeSlave(object):
     slave_system = 'posix'
+    compress_output = False
+    update_window = None
@@ -78,7 +78,7 @@ class Tests(interfaces.InterfaceTests):
     def test_signature_getChunks(self):
         log = self.makeLogFile()
         @self.assertArgSpecMatches(log.getChunks)
-        def getChunks(self, channels=[], onlyText=False):
+        def getChunks(self, channels=[], onlyText=False, offset=0):
             pass
 
     def test_signature_finish(self):
@@ -99,6 +99,15 @@ class Tests(interfaces.InterfaceTests):
             some text with"""), log.getText())
 
 
+    def test_getChunks_offset(self):
+        log = self.makeLogFile()
+        log.addStdout('hello')
+        log.addStderr('world')
+        log.finish()
+        self.assertEqual(list(log.getChunks(offset=len('6:0hello,'))),
+                         [(1, 'world')])
+
+
 class RealTests(Tests):
 
     def test_getTextWithHeaders(self):
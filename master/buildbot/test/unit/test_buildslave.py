@@ -49,6 +49,8 @@ class TestAbstractBuildSlave(unittest.TestCase):
         self.assertEqual(bs.properties.getProperty('slavename'), 'bot')
         self.assertEqual(bs.access, [])
         self.assertEqual(bs.keepalive_interval, 3600)
+        self.assertEqual(bs.compress_output, False)
+        self.assertEqual(bs.update_window, None)
 
     def test_constructor_full(self):
         lock1, lock2 = mock.Mock(name='lock1'), mock.Mock(name='lock2')
@@ -58,13 +60,17 @@ class TestAbstractBuildSlave(unittest.TestCase):
                 missing_timeout=120,
                 properties={'a':'b'},
                 locks=[lock1, lock2],
-                keepalive_interval=60)
+                keepalive_interval=60,
+                compress_output=True,
+                update_window=8)
         self.assertEqual(bs.max_builds, 2)
         self.assertEqual(bs.notify_on_missing, ['me@me.com'])
         self.assertEqual(bs.missing_timeout, 120)
         self.assertEqual(bs.properties.getProperty('a'), 'b')
         self.assertEqual(bs.access, [lock1, lock2])
         self.assertEqual(bs.keepalive_interval, 60)
+        self.assertEqual(bs.compress_output, True)
+        self.assertEqual(bs.update_window, 8)
 
     def test_constructor_notify_on_missing_not_list(self):
         bs = self.ConcreteBuildSlave('bot', 'pass',
@@ -77,6 +83,10 @@ class TestAbstractBuildSlave(unittest.TestCase):
             self.ConcreteBuildSlave('bot', 'pass',
                     notify_on_missing=['a@b.com', 13]))
 
+    def test_constructor_update_window_not_positive(self):
+        self.assertRaises(config.ConfigErrors, lambda :
+            self.ConcreteBuildSlave('bot', 'pass', update_window=0))
+
     @defer.inlineCallbacks
     def do_test_reconfigService(self, old, old_port, new, new_port):
         master = self.master = fakemaster.make_master()
@@ -42,8 +42,11 @@ global_defaults = dict(
     buildHorizon=None,
     logCompressionLimit=4096,
     logCompressionMethod='bz2',
+    logCompressionLevel=9,
+    logCompressionWorkers=2,
     logMaxTailSize=None,
     logMaxSize=None,
+    buildStatusStorage='pickle',
     properties=properties.Properties(),
     prioritizeBuilders=None,
     slavePortnum=None,
@@ -62,8 +65,11 @@ load_global_defaults = dict(
     buildHorizon=None,
     logCompressionLimit=4096,
     logCompressionMethod='bz2',
+    logCompressionLevel=9,
+    logCompressionWorkers=2,
     logMaxTailSize=None,
     logMaxSize=None,
+    buildStatusStorage='pickle',
     properties=properties.Properties(),
     mergeRequests=False,
     prioritizeBuilders=None,
@@ -189,8 +195,10 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
             db=dict(
                 db_url='sqlite:///state.sqlite',
                 db_poll_interval=None),
+            notifications=dict(type=None, connect=None, listen=None,
+                poll_interval=300),
             metrics = None,
-            caches = dict(Changes=10, Builds=15),
+            caches = dict(Changes=10, Builds=15, BuildSummaries=5000),
             schedulers = {},
             builders = [],
             slaves = [],
@@ -318,6 +326,7 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
         self.failUnless(rv.load_global.called)
         self.failUnless(rv.load_validation.called)
         self.failUnless(rv.load_db.called)
+        self.failUnless(rv.load_notifications.called)
         self.failUnless(rv.load_metrics.called)
         self.failUnless(rv.load_caches.called)
         self.failUnless(rv.load_schedulers.called)
@@ -429,6 +438,33 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                 dict(logCompressionMethod='foo'))
         self.assertConfigError(self.errors, "must be 'bz2' or 'gz'")
 
+    def test_load_global_logCompressionLevel(self):
+        self.do_test_load_global(dict(logCompressionLevel=1),
+                                 logCompressionLevel=1)
+
+    def test_load_global_logCompressionLevel_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(logCompressionLevel=10))
+        self.assertConfigError(self.errors, "must be between 1 and 9")
+
+    def test_load_global_logCompressionWorkers(self):
+        self.do_test_load_global(dict(logCompressionWorkers=4),
+                                 logCompressionWorkers=4)
+
+    def test_load_global_logCompressionWorkers_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(logCompressionWorkers=0))
+        self.assertConfigError(self.errors, "must be at least 1")
+
+    def test_load_global_buildStatusStorage(self):
+        self.do_test_load_global(dict(buildStatusStorage='sqlite'),
+                                 buildStatusStorage='sqlite')
+
+    def test_load_global_buildStatusStorage_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(buildStatusStorage='foo'))
+        self.assertConfigError(self.errors, "must be 'pickle' or 'sqlite'")
+
     def test_load_global_codebaseGenerator(self):
         func = lambda _: "dummy"
         self.do_test_load_global(dict(codebaseGenerator=func),
@@ -490,6 +526,15 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.do_test_load_global(dict(slavePortnum='udp:123'),
                 slavePortnum='udp:123')
 
+    def test_load_global_buildStartConcurrency(self):
+        self.do_test_load_global(dict(buildStartConcurrency=20),
+                buildStartConcurrency=20)
+
+    def test_load_global_buildStartConcurrency_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(buildStartConcurrency=0))
+        self.assertConfigError(self.errors, 'must be at least 1')
+
     def test_load_global_multiMaster(self):
         self.do_test_load_global(dict(multiMaster=1), multiMaster=1)
 
@@ -566,6 +611,44 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.assertConfigError(self.errors, "must be an int")
 
 
+    def test_load_notifications_defaults(self):
+        self.cfg.load_notifications(self.filename, {})
+        self.assertResults(notifications=dict(type=None, connect=None,
+                                              listen=None, poll_interval=300))
+
+    def test_load_notifications_broker(self):
+        self.cfg.load_notifications(self.filename,
+            dict(notifications=dict(type='broker', listen='tcp:9990',
+                                    connect='tcp:host=localhost:port=9990')))
+        self.assertResults(notifications=dict(type='broker', listen='tcp:9990',
+                                              connect='tcp:host=localhost:port=9990',
+                                              poll_interval=300))
+
+    def test_load_notifications_invalid(self):
+        self.cfg.load_notifications(self.filename, dict(notifications=13))
+        self.assertConfigError(self.errors, "must be a dictionary")
+
+    def test_load_notifications_unk_keys(self):
+        self.cfg.load_notifications(self.filename,
+            dict(notifications=dict(type='broker', connect='unix:path=s', bar='bar')))
+        self.assertConfigError(self.errors, "unrecognized keys in")
+
+    def test_load_notifications_unk_type(self):
+        self.cfg.load_notifications(self.filename,
+            dict(notifications=dict(type='amqp', connect='unix:path=s')))
+        self.assertConfigError(self.errors, "must be 'broker'")
+
+    def test_load_notifications_no_connect(self):
+        self.cfg.load_notifications(self.filename,
+            dict(notifications=dict(type='broker', listen='tcp:9990')))
+        self.assertConfigError(self.errors, "'connect'] is required")
+
+    def test_load_notifications_poll_interval_not_int(self):
+        self.cfg.load_notifications(self.filename,
+            dict(notifications=dict(type='broker', connect='unix:path=s',
+                                    poll_interval='ten')))
+        self.assertConfigError(self.errors, "must be an int")
+
     def test_load_metrics_defaults(self):
         self.cfg.load_metrics(self.filename, {})
         self.assertResults(metrics=None)
@@ -582,7 +665,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
 
     def test_load_caches_defaults(self):
         self.cfg.load_caches(self.filename, {})
-        self.assertResults(caches=dict(Changes=10, Builds=15))
+        self.assertResults(caches=dict(Changes=10, Builds=15,
+                                          BuildSummaries=5000))
 
     def test_load_caches_invalid(self):
         self.cfg.load_caches(self.filename, dict(caches=13))
@@ -591,7 +675,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches_buildCacheSize(self):
         self.cfg.load_caches(self.filename,
                 dict(buildCacheSize=13))
-        self.assertResults(caches=dict(Builds=13, Changes=10))
+        self.assertResults(caches=dict(Builds=13, Changes=10,
+                                          BuildSummaries=5000))
 
     def test_load_caches_buildCacheSize_and_caches(self):
         self.cfg.load_caches(self.filename,
@@ -601,7 +686,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches_changeCacheSize(self):
         self.cfg.load_caches(self.filename,
                 dict(changeCacheSize=13))
-        self.assertResults(caches=dict(Changes=13, Builds=15))
+        self.assertResults(caches=dict(Changes=13, Builds=15,
+                                          BuildSummaries=5000))
 
     def test_load_caches_changeCacheSize_and_caches(self):
         self.cfg.load_caches(self.filename,
@@ -611,7 +697,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches(self):
         self.cfg.load_caches(self.filename,
                 dict(caches=dict(foo=1)))
-        self.assertResults(caches=dict(Changes=10, Builds=15, foo=1))
+        self.assertResults(caches=dict(Changes=10, Builds=15,
+                                       BuildSummaries=5000, foo=1))
 
     def test_load_caches_entries_test(self):
         self.cfg.load_caches(self.filename,
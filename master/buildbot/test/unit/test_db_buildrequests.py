@@ -1276,7 +1276,7 @@ class TestBuildsetsConnectorComponent(
     def insertPrioritizedBreqs(self):
         breqs = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
                                      priority=20, submitted_at=1450171024),
-                 fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                 fakedb.BuildRequest(id=2, buildsetid=2, selected_slave='build-slave-03', buildername="bldr1",
                                      priority=50, submitted_at=1450171039),
                  fakedb.BuildRequest(id=3, buildsetid=3, buildername="bldr2",
                                      priority=100, submitted_at=1449668061,
@@ -1287,7 +1287,7 @@ class TestBuildsetsConnectorComponent(
                  fakedb.BuildRequest(id=5, buildsetid=5, buildername="bldr1",
                                      priority=75, submitted_at=1450451019,
                                      results=RESUME, complete=0),
-                 fakedb.BuildRequest(id=6, buildsetid=6, buildername="bldr3",
+                 fakedb.BuildRequest(id=6, buildsetid=6, selected_slave='build-slave-02', buildername="bldr3",
                                      priority=100, submitted_at=1446632022,
                                      results=RESUME, complete=0),
                  fakedb.BuildRequest(id=7, buildsetid=7, buildername="bldr3",
@@ -1378,6 +1378,59 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(lambda queue: self.assertEqual(queue, expectedBreqs))
         return d
 
+    @defer.inlineCallbacks
+    def test_getBuildRequestsInQueueFilterByBrids(self):
+        yield self.insertPrioritizedBreqs()
+
+        # claimed and resume buildrequests are not part of the unclaimed queue
+        result = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed,
+                                                                     brids=[1, 2, 4, 6, 42],
+                                                                     order=False)
+        self.assertEqual(sorted(br['brid'] for br in result), [1, 2])
+
+        result = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.resume,
+                                                                     brids=[1, 2, 4, 6, 42],
+                                                                     order=False)
+        self.assertEqual(sorted(br['brid'] for br in result), [4, 6])
+
+        result = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed, brids=[])
+        self.assertEqual(result, [])
+
+    @defer.inlineCallbacks
+    def test_getBuildRequestsInQueuePages(self):
+        # requests with the same priority and submitted time are ordered by id
+        testdata = [fakedb.BuildRequest(id=id, buildsetid=id, buildername="bldr1",
+                                        priority=priority, submitted_at=submitted_at)
+                    for id, priority, submitted_at in [(1, 20, 1450171024), (2, 50, 1450171039),
+                                                       (3, 50, 1450171039), (4, 50, 1450171024),
+                                                       (5, 20, 1450171024), (6, 100, 1450171039)]]
+        yield self.insertTestData(testdata)
+
+        pages = []
+        after = None
+        while True:
+            page = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed,
+                                                                       limit=4, after=after)
+            pages.append([br['brid'] for br in page])
+            if len(page) < 4:
+                break
+            after = page[-1]
+
+        self.assertEqual(pages, [[6, 4, 2, 3], [1, 5]])
+
+    @defer.inlineCallbacks
+    def test_getBuildRequestInQueuePages(self):
+        yield self.insertBuildRequestsInQueue()
+
+        page = yield self.db.buildrequests.getBuildRequestInQueue(sorted=True, limit=2)
+        self.assertEqual([br['brid'] for br in page], [3, 7])
+
+        page = yield self.db.buildrequests.getBuildRequestInQueue(sorted=True, limit=2, after=page[-1])
+        self.assertEqual([br['brid'] for br in page], [2, 8])
+
+        page = yield self.db.buildrequests.getBuildRequestInQueue(sorted=True, limit=2, after=page[-1])
+        self.assertEqual([br['brid'] for br in page], [1])
+
     @defer.inlineCallbacks
     def test_getPrioritizedBuildRequestsInUnclaimedQueueUsesFilters(self):
         sources = [{'repository': 'repo1', 'codebase': 'cb1', 'branch': 'master', 'revision': 'asz3113'},
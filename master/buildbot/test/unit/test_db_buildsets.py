@@ -136,6 +136,19 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(self.checkBuildRequest(priority=Priority.Medium))
         return d
 
+    @defer.inlineCallbacks
+    def test_addBuildset_selected_slave(self):
+        bsid, brids = yield self.db.buildsets.addBuildset(sourcestampsetid=234, reason='because',
+                                properties={'selected_slave': ('slave-01', 'Force Build Form')},
+                                builderNames=['a', 'b'])
+
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            res = conn.execute(sa.select([reqs_tbl.c.id, reqs_tbl.c.selected_slave]))
+            return sorted(tuple(row) for row in res.fetchall())
+        rows = yield self.db.pool.do(thd)
+        self.assertEqual(rows, sorted([(brids['a'], 'slave-01'), (brids['b'], 'slave-01')]))
+
     def test_addBuildset_bigger(self):
         props = dict(prop=(['list'], 'test'))
         d = defer.succeed(None)
@@ -90,6 +90,48 @@ class Basic(unittest.TestCase):
         return d
 
 
+    def select(self, conn):
+        return conn.execute("SELECT 1").scalar()
+
+    @defer.inlineCallbacks
+    def test_query_counter(self):
+        counter = pool.QueryCounter()
+
+        @defer.inlineCallbacks
+        def operation():
+            yield self.pool.do(self.select)
+            yield self.pool.do_with_engine(self.select)
+            yield pool.QueryCounter.runUncounted(self.pool.do, self.select)
+            yield self.pool.do(self.select)
+            defer.returnValue('done')
+
+        @defer.inlineCallbacks
+        def otherOperation():
+            # queries sent while the counted operation waits
+            for i in range(5):
+                yield self.pool.do(self.select)
+
+        other = otherOperation()
+        res = yield counter.run(operation)
+        yield other
+        self.assertEqual(res, 'done')
+        self.assertEqual(counter.queries, 3)
+        self.assertEqual(pool.QueryCounter.current(), None)
+
+    @defer.inlineCallbacks
+    def test_query_counter_failure(self):
+        counter = pool.QueryCounter()
+
+        @defer.inlineCallbacks
+        def operation():
+            yield self.pool.do(self.select)
+            yield self.pool.do(lambda conn: conn.execute("EAT COOKIES"))
+
+        yield self.assertFailure(counter.run(operation), sa.exc.OperationalError)
+        self.assertEqual(counter.queries, 2)
+        self.assertEqual(pool.QueryCounter.current(), None)
+
+
 class Stress(unittest.TestCase):
 
     def setUp(self):
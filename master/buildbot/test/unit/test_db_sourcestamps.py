@@ -265,3 +265,38 @@ class TestSourceStampsConnectorComponent(
 
         self.assertEqual(len(sourcestamps), 3)
         self.assertEqual(set(sourcestampsetids), result_sourcestampsetids)
+
+    @defer.inlineCallbacks
+    def test_getSourceStampsForSets(self):
+        yield self.insertTestData([
+            fakedb.Change(changeid=16),
+            fakedb.Change(changeid=20),
+            fakedb.Patch(id=99, patch_base64='aGVsbG8sIHdvcmxk',
+                patch_author='bar', patch_comment='foo', subdir='/foo',
+                patchlevel=3),
+            fakedb.SourceStampSet(id=11),
+            fakedb.SourceStampSet(id=33),
+            fakedb.SourceStamp(id=1, branch="HEAD", sourcestampsetid=11, codebase="fmod", patchid=99),
+            fakedb.SourceStamp(id=2, branch="trunk", sourcestampsetid=33, codebase="bar"),
+            fakedb.SourceStamp(id=3, branch="general", sourcestampsetid=33, codebase="foo"),
+            fakedb.SourceStamp(id=4, branch="trunk", sourcestampsetid=44, codebase="bar"),
+            fakedb.SourceStampChange(sourcestampid=2, changeid=16),
+            fakedb.SourceStampChange(sourcestampid=2, changeid=20),
+        ])
+
+        sslists = yield self.db.sourcestamps.getSourceStampsForSets([11, 33, 55])
+
+        self.assertEqual(sorted(sslists.keys()), [11, 33, 55])
+        self.assertEqual([ss['ssid'] for ss in sslists[11]], [1])
+        self.assertEqual([ss['ssid'] for ss in sslists[33]], [2, 3])
+        self.assertEqual(sslists[55], [])
+
+        self.assertEqual(sslists[11][0]['patch_body'], 'hello, world')
+        self.assertEqual(sslists[11][0]['patch_level'], 3)
+        self.assertEqual(sslists[33][0]['changeids'], set([16, 20]))
+        self.assertEqual(sslists[33][1]['changeids'], set())
+
+        # the result matches the sourcestamps returned one set at a time
+        for sourcestampsetid in (11, 33):
+            sslist = yield self.db.sourcestamps.getSourceStamps(sourcestampsetid)
+            self.assertEqual(sslists[sourcestampsetid], sslist)
@@ -216,6 +216,58 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         # assert the notification sub was called correctly
         cb.assert_called_with(938593, 999)
 
+    def test_notifications_published(self):
+        self.master.notifications = mock.Mock()
+
+        self.master._buildsetComplete(938593, 999)
+        self.master.buildRequestAdded(938593, 19, 'bldr')
+        self.master.buildRequestRemoved(938593, 20, 'bldr')
+
+        self.assertEqual(self.master.notifications.publish.call_args_list, [
+            mock.call('buildset_complete', bsid=938593, results=999),
+            mock.call('buildrequest_added', bsid=938593, brid=19, buildername='bldr'),
+            mock.call('buildrequest_removed', bsid=938593, brid=20, buildername='bldr'),
+        ])
+
+    def test_buildset_subscription_polling_with_notifications(self):
+        # with notifications enabled, the requests are delivered right away
+        # even if the master polls the database
+        self.master.config.db['db_poll_interval'] = 10
+        self.master.notifications = mock.Mock()
+        self.master.notifications.isEnabled.return_value = True
+        self.master.buildrequest_merger = mock.Mock()
+        self.master.buildrequest_merger.addBuildset.return_value = \
+            defer.succeed((938593, dict(a=19)))
+
+        cb = mock.Mock()
+        self.master.subscribeToBuildRequests(cb)
+
+        d = self.master.addBuildset(ssid=999)
+
+        def check(_):
+            cb.assert_called_with(dict(bsid=938593, brid=19, buildername='a'))
+            self.master.notifications.publish.assert_called_with(
+                'buildrequest_added', bsid=938593, brid=19, buildername='a')
+        d.addCallback(check)
+        return d
+
+    def test_buildset_subscription_polling(self):
+        self.master.config.db['db_poll_interval'] = 10
+        self.master.buildrequest_merger = mock.Mock()
+        self.master.buildrequest_merger.addBuildset.return_value = \
+            defer.succeed((938593, dict(a=19)))
+
+        cb = mock.Mock()
+        self.master.subscribeToBuildRequests(cb)
+
+        d = self.master.addBuildset(ssid=999)
+
+        def check(_):
+            # left to the database poll
+            self.assertFalse(cb.called)
+        d.addCallback(check)
+        return d
+
 class StartupAndReconfig(dirs.DirsMixin, logging.LoggingMixin, unittest.TestCase):
 
     def setUp(self):
@@ -374,6 +426,22 @@ class StartupAndReconfig(dirs.DirsMixin, logging.LoggingMixin, unittest.TestCase
         new.db['db_url'] = 'bbbb'
         self.failureResultOf(self.master.reconfigService(new), config.ConfigErrors)
 
+    def test_reconfigService_polling_with_notifications(self):
+        loopingcall = mock.Mock()
+        self.patch(task, 'LoopingCall', lambda fn : loopingcall)
+
+        self.master.config = config.MasterConfig()
+        new = config.MasterConfig()
+        new.db['db_poll_interval'] = 10
+        new.notifications.update(type='broker', connect='unix:path=s', poll_interval=600)
+
+        d = self.master.reconfigService(new)
+        @d.addCallback
+        def check(_):
+            # only reconcile from time to time
+            loopingcall.start.assert_called_with(600, now=False)
+        return d
+
     def test_reconfigService_start_polling(self):
         loopingcall = mock.Mock()
         self.patch(task, 'LoopingCall', lambda fn : loopingcall)
@@ -668,3 +736,137 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+
+    @defer.inlineCallbacks
+    def test_deliverChangeById(self):
+        self.db.insertTestData([
+            fakedb.Change(changeid=11),
+        ])
+        self.master.configured_poll_interval = 10
+
+        yield self.master._deliverChangeById(11)
+        # delivered only once
+        yield self.master._deliverChangeById(11)
+        # unknown change
+        yield self.master._deliverChangeById(12)
+
+        self.assertEqual([ch.number for ch in self.gotten_changes], [11])
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseChanges_skips_notified_changes(self):
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=12),
+        ])
+        self.master.configured_poll_interval = 10
+
+        # change 12 was received from another master
+        yield self.master._deliverChangeById(12)
+        yield self.master.pollDatabaseChanges()
+
+        self.assertEqual([ch.number for ch in self.gotten_changes], [12, 11])
+        self.assertEqual(self.master._notified_changeids, set())
+        self.db.state.assertState(53, last_processed_change=12)
+
+        # already processed by the poll
+        yield self.master._deliverChangeById(11)
+        self.assertEqual([ch.number for ch in self.gotten_changes], [12, 11])
+
+    def holdChangeConversions(self):
+        # Change.fromChdict waits for the test to fire its Deferred, as if the
+        # conversion yielded to a database query
+        held = {}
+        def fromChdict(master, chdict):
+            d = held[chdict['changeid']] = defer.Deferred()
+            d.addCallback(lambda _ : mock.Mock(number=chdict['changeid']))
+            return d
+        self.patch(changes.Change, 'fromChdict', staticmethod(fromChdict))
+        return held
+
+    def insertPolledChanges(self):
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=12),
+        ])
+        self.master.configured_poll_interval = 10
+
+    @defer.inlineCallbacks
+    def test_deliverChangeById_while_polling(self):
+        self.insertPolledChanges()
+        held = self.holdChangeConversions()
+
+        poll = self.master.pollDatabaseChanges()
+        self.assertEqual(held.keys(), [11])
+        # both changes are notified while the poll converts change 11
+        notified = [self.master._deliverChangeById(11),
+                    self.master._deliverChangeById(12)]
+        self.assertEqual(sorted(held.keys()), [11, 12])
+        held[12].callback(None)
+        held[11].callback(None)
+        yield defer.gatherResults(notified + [poll])
+
+        self.assertEqual([ch.number for ch in self.gotten_changes], [12, 11])
+        self.assertEqual(self.master._notified_changeids, set())
+        self.db.state.assertState(53, last_processed_change=12)
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseChanges_while_delivering(self):
+        self.insertPolledChanges()
+        held = self.holdChangeConversions()
+
+        notified = self.master._deliverChangeById(11)
+        poll = self.master.pollDatabaseChanges()
+        # the poll skips change 11, being delivered
+        self.assertEqual(sorted(held.keys()), [11, 12])
+        held[12].callback(None)
+        held[11].callback(None)
+        yield defer.gatherResults([notified, poll])
+
+        self.assertEqual([ch.number for ch in self.gotten_changes], [12, 11])
+
+    @defer.inlineCallbacks
+    def test_addChange_while_polling(self):
+        self.insertPolledChanges()
+        self.patch(self.master.notifications, 'isEnabled', lambda : True)
+        self.patch(self.master.notifications, 'publish', mock.Mock())
+        held = self.holdChangeConversions()
+
+        added = self.master.addChange(author='me', comments='new')
+        changeid = held.keys()[0]
+        poll = self.master.pollDatabaseChanges()
+        held[11].callback(None)
+        held[12].callback(None)
+        held[changeid].callback(None)
+        yield defer.gatherResults([added, poll])
+
+        self.assertEqual([ch.number for ch in self.gotten_changes],
+                         [11, 12, changeid])
+        self.master.notifications.publish.assert_called_once_with(
+            'change_added', changeid=changeid)
+
+    @defer.inlineCallbacks
+    def test_deliverChangeById_failure_unclaims(self):
+        self.insertPolledChanges()
+        held = self.holdChangeConversions()
+
+        notified = self.master._deliverChangeById(12)
+        held[12].errback(RuntimeError('db down'))
+        yield self.assertFailure(notified, RuntimeError)
+        self.assertEqual(self.master._notified_changeids, set())
+
+        del held[12]
+        poll = self.master.pollDatabaseChanges()
+        held[11].callback(None)
+        held[12].callback(None)
+        yield poll
+        self.assertEqual([ch.number for ch in self.gotten_changes], [11, 12])
@@ -21,7 +21,7 @@ from twisted.internet import defer
 from buildbot import config
 from buildbot.test.fake import fakedb, fakemaster
 from buildbot.test.fake import fakebuild
-from buildbot.process import builder, factory
+from buildbot.process import builder, factory, slavebuilder
 from buildbot.util import epoch2datetime
 from buildbot.test.util.katanabuildrequestdistributor import KatanaBuildRequestDistributorTestSetup
 from buildbot.status.results import SUCCESS, BEGINNING, RETRY
@@ -419,6 +419,59 @@ class TestReconfig(BuilderMixin, unittest.TestCase):
                     category="NewCat"))
 
 
+class TestSlaveAvailability(BuilderMixin, unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.makeBuilder(startSlavenames=['slave-02'])
+        self.slaveAvailability = self.master.botmaster.slaveAvailability
+
+    def makeSlaveBuilder(self, slavename):
+        sb = slavebuilder.SlaveBuilder()
+        sb.setBuilder(self.bldr)
+        sb.slave = mock.Mock()
+        sb.slave.slavename = slavename
+        sb.state = slavebuilder.IDLE
+        return sb
+
+    def test_addSlaveBuilder(self):
+        sb1 = self.makeSlaveBuilder('slave-01')
+        sb2 = self.makeSlaveBuilder('slave-02')
+        self.bldr.addSlaveBuilder(sb1)
+        self.bldr.addSlaveBuilder(sb2)
+
+        self.assertEqual(self.slaveAvailability.getIdleSlaveBuilders('bldr', builder.Slavepool.slavenames), [sb1])
+        self.assertEqual(self.slaveAvailability.getIdleSlaveBuilders('bldr', builder.Slavepool.startSlavenames),
+                         [sb2])
+
+    def test_removeSlaveBuilder(self):
+        sb = self.makeSlaveBuilder('slave-01')
+        self.bldr.addSlaveBuilder(sb)
+        self.bldr.removeSlaveBuilder(sb)
+
+        self.assertFalse(self.slaveAvailability.hasIdleSlaves('bldr'))
+
+    def test_buildStartedAndFinished(self):
+        sb = self.makeSlaveBuilder('slave-01')
+        self.bldr.addSlaveBuilder(sb)
+
+        self.assertTrue(sb.buildStarted())
+        self.assertFalse(self.slaveAvailability.hasIdleSlaves('bldr'))
+
+        sb.buildFinished()
+        self.assertTrue(self.slaveAvailability.hasIdleSlaves('bldr', builder.Slavepool.slavenames))
+
+    def test_getSlavepoolToProcessBuildRequests(self):
+        self.assertEqual(self.bldr.getSlavepoolToProcessBuildRequests(builder.Slavepool.startSlavenames),
+                         builder.Slavepool.startSlavenames)
+        self.assertEqual(self.bldr.getSlavepoolToProcessBuildRequests(builder.Slavepool.slavenames),
+                         builder.Slavepool.slavenames)
+
+        self.bldr.config.startSlavenames = []
+        self.assertEqual(self.bldr.getSlavepoolToProcessBuildRequests(builder.Slavepool.startSlavenames),
+                         builder.Slavepool.slavenames)
+
+
 class TestFinishBuildRequests(unittest.TestCase, KatanaBuildRequestDistributorTestSetup):
 
     @defer.inlineCallbacks
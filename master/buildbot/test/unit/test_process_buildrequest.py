@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 from twisted.trial import unittest
+from twisted.internet import defer
 from buildbot.test.fake import fakedb, fakemaster
 from buildbot.process import buildrequest
 from buildbot.status.results import CANCELED, BEGINNING
@@ -171,6 +172,64 @@ class TestBuildRequest(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_fromBrdicts(self):
+        master = fakemaster.make_master()
+        master.db = fakedb.FakeDBConnector(self)
+        master.db.insertTestData([
+            fakedb.Change(changeid=13, branch='trunk', revision='9283',
+                        repository='svn://a..', codebase='A',
+                        project='world-domination'),
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234, branch='trunk',
+                        revision='9283', repository='svn://a..',
+                        codebase='A', project='world-domination'),
+            fakedb.SourceStampChange(sourcestampid=234, changeid=13),
+            fakedb.SourceStamp(id=235, sourcestampsetid=234, branch='trunk',
+                        revision='9284', repository='svn://b..',
+                        codebase='B', project='world-domination'),
+            fakedb.Buildset(id=539, reason='triggered', sourcestampsetid=234),
+            fakedb.BuildsetProperty(buildsetid=539, property_name='x',
+                        property_value='[1, "X"]'),
+            fakedb.Buildset(id=540, reason='forced', sourcestampsetid=234),
+            fakedb.BuildRequest(id=288, buildsetid=539, buildername='bldr',
+                        priority=13, submitted_at=1200000000),
+            fakedb.BuildRequest(id=289, buildsetid=539, buildername='bldr2',
+                        priority=13, submitted_at=1200000000),
+            fakedb.BuildRequest(id=290, buildsetid=540, buildername='bldr',
+                        priority=50, submitted_at=1200000001),
+        ])
+        brdicts = yield master.db.buildrequests.getBuildRequests()
+        brdicts.sort(key=lambda brdict: -brdict['brid'])
+
+        breqs = yield buildrequest.BuildRequest.fromBrdicts(master, brdicts)
+
+        self.assertEqual([br.id for br in breqs], [290, 289, 288])
+        self.assertEqual([br.bsid for br in breqs], [540, 539, 539])
+        self.assertEqual([br.reason for br in breqs], ['forced', 'triggered', 'triggered'])
+        self.assertEqual([br.properties.getProperty('x') for br in breqs], [None, 1, 1])
+        self.assertEqual([br.priority for br in breqs], [50, 13, 13])
+
+        for br in breqs:
+            self.assertEqual(br.sources['A'].ssid, 234)
+            self.assertEqual(br.sources['B'].ssid, 235)
+            self.assertEqual([ch.number for ch in br.sources['A'].changes], [13])
+
+    def test_fromBrdicts_no_sourcestamps(self):
+        master = fakemaster.make_master()
+        master.db = fakedb.FakeDBConnector(self)
+        master.db.insertTestData([
+            fakedb.SourceStampSet(id=234),
+            # Sourcestampset has no sourcestamps
+            fakedb.Buildset(id=539, reason='triggered', sourcestampsetid=234),
+            fakedb.BuildRequest(id=288, buildsetid=539, buildername='not important',
+                        priority=0, submitted_at=None),
+        ])
+        d = master.db.buildrequests.getBuildRequest(288)
+        d.addCallback(lambda brdict:
+            buildrequest.BuildRequest.fromBrdicts(master, [brdict]))
+        return self.assertFailure(d, AssertionError)
+
     def test_mergeSourceStampsWith_common_codebases(self):
         """ This testcase has two buildrequests
             Request Change Codebase Revision Comment
@@ -1,5 +1,5 @@
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task, reactor
 from twisted.python import log
 from buildbot.test.fake import fakedb
 from buildbot.process import buildrequestdistributor
@@ -8,7 +8,7 @@ from buildbot.process import builder, factory
 from buildbot import config
 import mock
 from buildbot.db.buildrequests import Queue
-from buildbot.status.results import RESUME, BEGINNING
+from buildbot.status.results import RESUME, BEGINNING, CANCELED
 from buildbot.test.util.katanabuildrequestdistributor import KatanaBuildRequestDistributorTestSetup
 from buildbot.test.util import compat
 from buildbot.db.buildrequests import AlreadyClaimedError
@@ -179,7 +179,7 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
     def test_getNextPriorityBuilderSelectedSlaveUnclaimQueue(self):
         testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr2",
                                         priority=2, submitted_at=1450171024),
-                 fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                 fakedb.BuildRequest(id=2, buildsetid=2, selected_slave='slave-01', buildername="bldr1",
                                      priority=50, submitted_at=1450171039)]
 
         testdata += [fakedb.BuildsetProperty(buildsetid=2,
@@ -215,7 +215,7 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
     def test_getNextPriorityBuilderSelectedSlaveResumeQueue(self):
         testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr2", results=RESUME, complete=0,
                                         priority=20, submitted_at=1449578391),
-                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                    fakedb.BuildRequest(id=2, buildsetid=2, selected_slave='slave-01', buildername="bldr1",
                                         priority=50, submitted_at=1450171039,
                                         results=RESUME, complete=0)]
 
@@ -246,7 +246,7 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
     def test_getNextPriorityBuilderIgnoreSelectedSlaveResumeQueue(self):
         testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr2", results=RESUME, complete=0,
                                         priority=20, submitted_at=1449578391),
-                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                    fakedb.BuildRequest(id=2, buildsetid=2, selected_slave='slave-01', buildername="bldr1",
                                         priority=50, submitted_at=1450171039,
                                         results=RESUME, complete=0, slavepool=Slavepool.startSlavenames)]
 
@@ -270,13 +270,57 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
         self.assertEquals((breq.buildername, breq.id), ("bldr1", 2))
 
 
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderSkipsBuildersWithoutIdleSlaves(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
+                                        priority=50, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr2",
+                                        priority=20, submitted_at=1450171039)]
+
+        testdata += self.getBuildSetTestData(xrange=xrange(1, 3))
+
+        yield self.insertTestData(testdata)
+
+        bldr1 = self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True})
+        self.setupBuilderInMaster(name='bldr2', slavenames={'slave-02': True})
+        bldr1.getAvailableSlavesToProcessBuildRequests = mock.Mock()
+
+        # slave-01 started a build on another builder
+        self.botmaster.slaveAvailability.setIdle('bldr1', self.slaves['slave-01'], False)
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals((breq.buildername, breq.id), ('bldr2', 2))
+        self.assertFalse(bldr1.getAvailableSlavesToProcessBuildRequests.called)
+
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderSelectedSlaveNotIdle(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, selected_slave='slave-01', buildername="bldr1",
+                                        priority=50, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                                        priority=20, submitted_at=1450171039)]
+
+        testdata += [fakedb.BuildsetProperty(buildsetid=1,
+                                             property_name='selected_slave',
+                                             property_value='["slave-01", "Force Build Form"]')]
+
+        testdata += self.getBuildSetTestData(xrange=xrange(1, 3))
+
+        yield self.insertTestData(testdata)
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True, 'slave-02': True})
+        self.botmaster.slaveAvailability.setIdle('bldr1', self.slaves['slave-01'], False)
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals((breq.buildername, breq.id), ('bldr1', 2))
+
+
 class TestKatanaBuildRequestDistributorMaybeStartBuildsOn(KatanaBuildRequestDistributorTestSetup, unittest.TestCase):
 
     @defer.inlineCallbacks
     def generateResumeBuilds(self, slave=None, buildnumber=None, breqs=None):
         testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr2", results=RESUME, complete=0,
                                         priority=20, submitted_at=1449578391),
-                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                    fakedb.BuildRequest(id=2, buildsetid=2, selected_slave='slave-01', buildername="bldr1",
                                         priority=50, submitted_at=1450171039,
                                         results=RESUME, complete=0, slavepool=Slavepool.startSlavenames)]
 
@@ -393,6 +437,72 @@ class TestKatanaBuildRequestDistributorMaybeStartBuildsOn(KatanaBuildRequestDist
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    @defer.inlineCallbacks
+    def test_maybeStartBuildsOnLimitsConcurrentBuildStarts(self):
+        self.brd.master.config.buildStartConcurrency = 2
+        inProgress = []
+
+        def maybeStartBuild(slavebuilder, breqs):
+            # the slave stays busy while the build is being started
+            slavebuilder.isAvailable.return_value = False
+            inProgress.append(len(self.brd._pendingBuildStarts) + 1)
+            return task.deferLater(reactor, 0.2, self.addProcessedBuilds, slavebuilder, breqs)
+
+        self.setupBuilderInMaster(name='bldr1', slavenames=self.createSlaveList(True, xrange(1, 5)),
+                                  maybeStartBuild=maybeStartBuild)
+        self.initialized()
+        self.insertBuildrequests('bldr1', Priority.Default, xrange(1, 5))
+        yield self.insertTestData(self.testdata)
+
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        yield self.quiet_deferred
+        yield defer.DeferredList(list(self.brd._pendingBuildStarts))
+
+        self.checkBRDCleanedUp()
+        self.assertEqual(len(inProgress), 4)
+        self.assertEqual(max(inProgress), 2)
+        self.assertEqual(sorted(brid for _, brids in self.processedBuilds for brid in brids), [1, 2, 3, 4])
+        self.assertEqual(self.brd._pendingBuildStarts, [])
+
+    def test_maybeStartBuildsOnRequeuesFailedBuildStarts(self):
+        def maybeStartBuild(slavebuilder, breqs):
+            slavebuilder.isAvailable.return_value = False
+            return defer.fail(RuntimeError("ping failed"))
+        return self.checkBuildStartRequeued(maybeStartBuild)
+
+    def test_maybeStartBuildsOnRequeuesBuildsNotStarted(self):
+        def maybeStartBuild(slavebuilder, breqs):
+            # the builder is not running
+            slavebuilder.isAvailable.return_value = False
+            return defer.succeed(False)
+        return self.checkBuildStartRequeued(maybeStartBuild)
+
+    @defer.inlineCallbacks
+    def checkBuildStartRequeued(self, maybeStartBuild):
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True},
+                                  maybeStartBuild=maybeStartBuild)
+        self.initialized()
+        self.insertBuildrequests('bldr1', Priority.Default, xrange(1, 2))
+        yield self.insertTestData(self.testdata)
+
+        countEvent = mock.Mock()
+        self.patch(buildrequestdistributor.metrics.MetricCountEvent, 'log', countEvent)
+
+        yield self.brd._maybeStartOrResumeBuildsOn(['bldr1'])
+        yield defer.DeferredList(list(self.brd._pendingBuildStarts))
+
+        brdicts = yield self.db.buildrequests.getBuildRequests(brids=[1])
+        self.assertFalse(brdicts[0]['claimed'])
+        chooser = self.brd.katanaBuildChooser
+        self.assertEqual(chooser.failedStarts, {1: 1})
+        brQueue = yield chooser._getBuildRequestsQueue(Queue.unclaimed)
+        self.assertEqual([br['brid'] for br in brQueue], [1])
+        self.botmaster.maybeStartBuildsForBuilder.assert_called_with('bldr1')
+        counters = [c[0][0] for c in countEvent.call_args_list]
+        self.assertTrue("KatanaBuildRequestDistributor.startBuild.failed" in counters)
+        self.assertFalse("KatanaBuildRequestDistributor.startBuild.started" in counters)
+
     @defer.inlineCallbacks
     def generateMergableBuilds(self, results=BEGINNING):
         self.initialized()
@@ -709,7 +819,7 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
     def instertTestDataPopNextBuild(self, slavepool):
         breqs = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1", results=RESUME, complete=0,
                                      priority=20, submitted_at=1449578391),
-                 fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                 fakedb.BuildRequest(id=2, buildsetid=2, selected_slave='slave-01', buildername="bldr1",
                                      priority=50, submitted_at=1450171039,
                                      results=RESUME, complete=0, slavepool=slavepool)]
 
@@ -734,7 +844,7 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
                                      priority=20, submitted_at=1450171024),
                  fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
                                      priority=50, submitted_at=1449668061),
-                fakedb.BuildRequest(id=3, buildsetid=3, buildername="bldr1",
+                fakedb.BuildRequest(id=3, buildsetid=3, selected_slave='slave-01', buildername="bldr1",
                                     priority=100, submitted_at=1450171039)]
 
         bset = [fakedb.Buildset(id=1, sourcestampsetid=1),
@@ -816,8 +926,13 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
 
     def __prepare_chooser_and_buildrequest(self):
         chooser = self.brd.katanaBuildChooser
-        chooser.unclaimedBrdicts = [{'brid': 1}, {'brid': 2}]
-        chooser.resumeBrdicts = [{'brid': 3}, {'brid': 4}]
+
+        def brdict(brid):
+            return {'brid': brid, 'buildername': 'bldr1', 'priority': 50,
+                    'submitted_at': 1450171039, 'selected_slave': None}
+
+        chooser.unclaimedQueue.reset([brdict(1), brdict(2)])
+        chooser.resumeQueue.reset([brdict(3), brdict(4)])
         chooser.breqCache = mock.Mock()
         chooser.breqCache.remove = mock.Mock()
         buildrequest = mock.Mock()
@@ -826,6 +941,9 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
         buildrequest.hasBeenMerged = True
         return chooser, buildrequest
 
+    def __queued_brids(self, brQueue):
+        return [brdict['brid'] for brdict in brQueue]
+
     def __check_buildrequest_status(self, buildrequest):
         self.assertEqual(buildrequest.checkMerges, True)
         self.assertEqual(buildrequest.retries, 0)
@@ -834,26 +952,26 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
     def test_removeBuildRequest_for_resumeBrdict(self):
         chooser, buildrequest = self.__prepare_chooser_and_buildrequest()
         buildrequest.brdict = {'brid': 3}
-        expected_unclaimed = [{'brid': 1}, {'brid': 2}]
-        expected_resume = [{'brid': 4}]
+        expected_unclaimed = [1, 2]
+        expected_resume = [4]
 
         chooser.removeBuildRequest(buildrequest)
 
-        self.assertEqual(chooser.unclaimedBrdicts, expected_unclaimed)
-        self.assertEqual(chooser.resumeBrdicts, expected_resume)
+        self.assertEqual(self.__queued_brids(chooser.unclaimedQueue), expected_unclaimed)
+        self.assertEqual(self.__queued_brids(chooser.resumeQueue), expected_resume)
         self.assertEqual(chooser.breqCache.remove.called, True)
         self.__check_buildrequest_status(buildrequest)
 
     def test_removeBuildRequest_for_unclaimedBrdict(self):
         chooser, buildrequest = self.__prepare_chooser_and_buildrequest()
         buildrequest.brdict = {'brid': 1}
-        expected_unclaimed = [{'brid': 2}]
-        expected_resume = [{'brid': 3}, {'brid': 4}]
+        expected_unclaimed = [2]
+        expected_resume = [3, 4]
 
         chooser.removeBuildRequest(buildrequest)
 
-        self.assertEqual(chooser.unclaimedBrdicts, expected_unclaimed)
-        self.assertEqual(chooser.resumeBrdicts, expected_resume)
+        self.assertEqual(self.__queued_brids(chooser.unclaimedQueue), expected_unclaimed)
+        self.assertEqual(self.__queued_brids(chooser.resumeQueue), expected_resume)
         self.assertEqual(chooser.breqCache.remove.called, True)
         self.__check_buildrequest_status(buildrequest)
 
@@ -861,14 +979,14 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
     def test_removeBuildRequest_for_uknown_brid(self, err_json):
         chooser, buildrequest = self.__prepare_chooser_and_buildrequest()
         buildrequest.brdict = {'brid': 5}
-        expected_unclaimed = [{'brid': 1}, {'brid': 2}]
-        expected_resume = [{'brid': 3}, {'brid': 4}]
+        expected_unclaimed = [1, 2]
+        expected_resume = [3, 4]
 
         chooser.removeBuildRequest(buildrequest)
 
         self.assertEqual(err_json.called, True)
-        self.assertEqual(chooser.unclaimedBrdicts, expected_unclaimed)
-        self.assertEqual(chooser.resumeBrdicts, expected_resume)
+        self.assertEqual(self.__queued_brids(chooser.unclaimedQueue), expected_unclaimed)
+        self.assertEqual(self.__queued_brids(chooser.resumeQueue), expected_resume)
         # function did not clear buildrequest merges' data
         self.assertEqual(chooser.breqCache.remove.called, False)
         self.assertEqual(buildrequest.check_merges, False)
@@ -879,14 +997,14 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
     def test_removeBuildRequest_for_empty_brdict(self, err_json):
         chooser, buildrequest = self.__prepare_chooser_and_buildrequest()
         buildrequest.brdict = {}
-        expected_unclaimed = [{'brid': 1}, {'brid': 2}]
-        expected_resume = [{'brid': 3}, {'brid': 4}]
+        expected_unclaimed = [1, 2]
+        expected_resume = [3, 4]
 
         chooser.removeBuildRequest(buildrequest)
 
         self.assertEqual(err_json.called, True)
-        self.assertEqual(chooser.unclaimedBrdicts, expected_unclaimed)
-        self.assertEqual(chooser.resumeBrdicts, expected_resume)
+        self.assertEqual(self.__queued_brids(chooser.unclaimedQueue), expected_unclaimed)
+        self.assertEqual(self.__queued_brids(chooser.resumeQueue), expected_resume)
         # function did not clear buildrequest merges' data
         self.assertEqual(chooser.breqCache.remove.called, False)
         self.assertEqual(buildrequest.check_merges, False)
@@ -894,6 +1012,199 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
         self.assertEqual(buildrequest.hasBeenMerged, True)
 
 
+class TestKatanaBuildChooserBuildRequestQueue(KatanaBuildRequestDistributorTestSetup, unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpComponents()
+        self.patch(buildrequestdistributor.KatanaBuildChooser, 'RECONCILE_INTERVAL', 60)
+        yield self.setUpKatanaBuildRequestDistributor()
+        self.clock = task.Clock()
+        self.chooser = self.brd.katanaBuildChooser
+        self.chooser._reactor = self.clock
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True}, startSlavenames={'slave-02': True})
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.tearDownComponents()
+        yield self.stopKatanaBuildRequestDistributor()
+
+    def insertBuildRequest(self, brid, priority, **kwargs):
+        testdata = [fakedb.BuildRequest(id=brid, buildsetid=brid, buildername="bldr1",
+                                        priority=priority, submitted_at=1450171039, **kwargs)]
+        testdata += self.getBuildSetTestData(xrange=xrange(brid, brid + 1))
+        return self.insertTestData(testdata)
+
+    @defer.inlineCallbacks
+    def assertNextBuildRequest(self, brid):
+        self.chooser.refreshBuildRequestQueue()
+        breq = yield self.chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id if breq else None, brid)
+
+    @defer.inlineCallbacks
+    def test_queueIsUpdatedByNotifications(self):
+        yield self.insertBuildRequest(brid=1, priority=20)
+        yield self.assertNextBuildRequest(1)
+
+        # not notified yet
+        yield self.insertBuildRequest(brid=2, priority=50)
+        yield self.assertNextBuildRequest(1)
+
+        self.chooser.buildRequestAdded(dict(bsid=2, brid=2, buildername='bldr1'))
+        yield self.assertNextBuildRequest(2)
+        self.assertEquals([br['brid'] for br in self.chooser.unclaimedQueue], [2, 1])
+        self.assertEquals(len(self.chooser.resumeQueue), 0)
+
+    @defer.inlineCallbacks
+    def test_queueIsReconciledAfterInterval(self):
+        yield self.insertBuildRequest(brid=1, priority=20)
+        yield self.assertNextBuildRequest(1)
+
+        yield self.insertBuildRequest(brid=2, priority=50)
+        self.clock.advance(59)
+        yield self.assertNextBuildRequest(1)
+
+        self.clock.advance(1)
+        yield self.assertNextBuildRequest(2)
+
+    @defer.inlineCallbacks
+    def test_queueIsLoadedInPages(self):
+        self.patch(buildrequestdistributor.KatanaBuildChooser, 'QUEUE_PAGE_SIZE', 2)
+        for brid, priority in [(1, 20), (2, 50), (3, 50), (4, 30), (5, 10)]:
+            yield self.insertBuildRequest(brid=brid, priority=priority)
+
+        roundTrips = self.db.pool.round_trips
+        brQueue = yield self.chooser._getBuildRequestsQueue(Queue.unclaimed)
+
+        self.assertEquals(self.db.pool.round_trips - roundTrips, 3)
+        self.assertEquals([br['brid'] for br in brQueue], [2, 3, 4, 1, 5])
+
+    @defer.inlineCallbacks
+    def test_buildRequestRemoved(self):
+        yield self.insertBuildRequest(brid=1, priority=20)
+        yield self.insertBuildRequest(brid=2, priority=50)
+        yield self.assertNextBuildRequest(2)
+
+        yield self.db.buildrequests.completeBuildRequests([2], CANCELED)
+        self.chooser.buildRequestRemoved(dict(bsid=2, brid=2, buildername='bldr1'))
+
+        yield self.assertNextBuildRequest(1)
+        self.assertEquals([br['brid'] for br in self.chooser.unclaimedQueue], [1])
+
+    @defer.inlineCallbacks
+    def test_retryBuildRequestPostponesRequest(self):
+        yield self.insertBuildRequest(brid=1, priority=20)
+        yield self.insertBuildRequest(brid=2, priority=50)
+        yield self.assertNextBuildRequest(2)
+
+        self.chooser.nextBreq.retries = 4
+        self.chooser.retryBuildRequest()
+
+        breq = yield self.chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+
+        # requeued on the next pass
+        yield self.assertNextBuildRequest(2)
+
+
+    @defer.inlineCallbacks
+    def test_buildStartFailedPostponesRequest(self):
+        yield self.insertBuildRequest(brid=1, priority=20)
+        yield self.insertBuildRequest(brid=2, priority=50)
+        yield self.assertNextBuildRequest(2)
+        breq = self.chooser.nextBreq
+        self.chooser.removeBuildRequests([breq])
+
+        for retries in range(1, 5):
+            self.chooser.buildStartFailed([breq])
+            self.assertEquals(self.chooser.failedStarts, {2: retries})
+            yield self.assertNextBuildRequest(2)
+            self.chooser.removeBuildRequests([self.chooser.nextBreq])
+
+        # the fifth failure postpones the request after the rest of the queue
+        self.chooser.buildStartFailed([breq])
+        self.assertEquals(self.chooser.failedStarts, {})
+        breq = yield self.chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+        yield self.assertNextBuildRequest(2)
+
+    @defer.inlineCallbacks
+    def test_buildStartSucceededForgetsFailures(self):
+        yield self.insertBuildRequest(brid=1, priority=20)
+        yield self.assertNextBuildRequest(1)
+        breq = self.chooser.nextBreq
+        self.chooser.removeBuildRequests([breq])
+
+        self.chooser.buildStartFailed([breq])
+        self.assertEquals(self.chooser.failedStarts, {1: 1})
+        self.chooser.buildStartSucceeded([breq])
+        self.assertEquals(self.chooser.failedStarts, {})
+
+    @defer.inlineCallbacks
+    def test_getBuildRequestsForBrdicts(self):
+        for brid in range(1, 151):
+            yield self.insertBuildRequest(brid=brid, priority=50)
+        brdicts = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed)
+        self.chooser.initializeBreqCache()
+
+        roundTrips = self.db.pool.round_trips
+        breqs = yield self.chooser._getBuildRequestsForBrdicts(brdicts)
+
+        # buildsets, properties and sourcestamps for each batch of 100 requests
+        self.assertEquals(self.db.pool.round_trips - roundTrips, 6)
+        self.assertEquals([breq.id for breq in breqs], [br['brid'] for br in brdicts])
+        self.assertEquals([breq.brdict for breq in breqs], brdicts)
+        self.assertTrue(all(br['brid'] in self.chooser.breqCache for br in brdicts))
+
+        # the second lookup is served from the cache
+        roundTrips = self.db.pool.round_trips
+        cached = yield self.chooser._getBuildRequestsForBrdicts(brdicts[:10])
+        self.assertEquals(self.db.pool.round_trips, roundTrips)
+        self.assertEquals(cached, breqs[:10])
+
+    @defer.inlineCallbacks
+    def test_maybeStartBuildsOnBuilderLogsDBRoundTrips(self):
+        yield self.insertBuildRequest(brid=1, priority=20)
+        self.chooser.refreshBuildRequestQueue()
+
+        bldr = self.botmaster.builders['bldr1']
+        startBuild = bldr.maybeStartBuild
+        started = []
+
+        def maybeStartBuild(slavebuilder, breqs):
+            # the queries of the build start-up are not the decision's
+            d = self.db.buildrequests.getBuildRequests()
+            d.addCallback(lambda _: startBuild(slavebuilder, breqs))
+            started.append(d)
+            return d
+        bldr.maybeStartBuild = maybeStartBuild
+
+        @defer.inlineCallbacks
+        def otherQueries():
+            # queries sent by the rest of the master meanwhile
+            for i in range(5):
+                yield self.db.buildrequests.getBuildRequests()
+
+        countEvent = mock.Mock()
+        self.patch(buildrequestdistributor.metrics.MetricCountEvent, 'log', countEvent)
+
+        roundTrips = self.db.pool.round_trips
+        other = otherQueries()
+        yield self.brd._selectNextBuildRequest(queue=Queue.unclaimed,
+                                               asyncFunc=self.brd._maybeStartBuildsOnBuilder)
+        yield other
+        yield defer.gatherResults(started)
+
+        events = [c[0] for c in countEvent.call_args_list
+                  if c[0][0].endswith(('.decisions', '.db_round_trips'))]
+        self.assertEquals([counter for counter, _ in events],
+                          ["KatanaBuildRequestDistributor.startBuild.decisions",
+                           "KatanaBuildRequestDistributor.startBuild.db_round_trips"])
+        self.assertEquals(len(started), 1)
+        self.assertTrue(events[1][1] > 0)
+        self.assertEquals(events[1][1], self.db.pool.round_trips - roundTrips - 6)
+
+
 class TestKatanaMaybeStartBuildsOnBuilder(KatanaBuildRequestDistributorTestSetup, unittest.TestCase):
 
     @defer.inlineCallbacks
@@ -992,6 +1303,7 @@ class TestKatanaMaybeStartBuildsOnBuilder(KatanaBuildRequestDistributorTestSetup
             sb.slave.slave_status = mock.Mock(spec=['getName'])
             sb.slave.slave_status.getName.return_value = name
             self.bldr.slaves.append(sb)
+        self.registerIdleSlaves(self.bldr)
 
     def assertBuildsStarted(self, exp):
         # munge builds_started into (slave, [brids])
@@ -0,0 +1,125 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from buildbot.db.buildrequests import Queue
+from buildbot.process.buildrequestqueue import BuildRequestQueue
+from buildbot.util import epoch2datetime
+
+
+class TestBuildRequestQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = BuildRequestQueue(Queue.unclaimed)
+
+    def brdict(self, brid, buildername='bldr1', priority=50, submitted_at=1450171039, selected_slave=None):
+        return dict(brid=brid, buildername=buildername, priority=priority,
+                    submitted_at=epoch2datetime(submitted_at), selected_slave=selected_slave)
+
+    def brids(self, brdicts):
+        return [br['brid'] for br in brdicts]
+
+    def test_reset(self):
+        self.queue.reset([self.brdict(1, priority=20),
+                          self.brdict(2, priority=50, submitted_at=1450171040),
+                          self.brdict(3, priority=50, submitted_at=1450171039)], now=10)
+
+        self.assertTrue(self.queue.loaded)
+        self.assertEqual(self.queue.lastReconciled, 10)
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual(self.brids(self.queue), [3, 2, 1])
+        self.assertTrue(2 in self.queue)
+        self.assertFalse(4 in self.queue)
+
+        self.queue.reset([self.brdict(4)])
+        self.assertEqual(self.brids(self.queue), [4])
+
+    def test_add_keeps_order(self):
+        self.queue.add(self.brdict(1, priority=20))
+        self.queue.add(self.brdict(2, priority=100))
+        self.queue.add(self.brdict(3, priority=20, submitted_at=1450171000))
+        self.assertEqual(self.brids(self.queue), [2, 3, 1])
+
+    def test_add_replaces_existing(self):
+        self.queue.add(self.brdict(1, priority=20))
+        self.queue.add(self.brdict(2, priority=50))
+        self.queue.add(self.brdict(1, priority=100))
+        self.assertEqual(self.brids(self.queue), [1, 2])
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual(self.queue.get(1)['priority'], 100)
+
+    def test_remove(self):
+        self.queue.reset([self.brdict(1, selected_slave='slave-01'), self.brdict(2, buildername='bldr2')])
+
+        removed = self.queue.remove(1)
+
+        self.assertEqual(removed['brid'], 1)
+        self.assertEqual(self.queue.remove(1), None)
+        self.assertEqual(self.brids(self.queue), [2])
+        self.assertEqual(self.queue.buildernames(), ['bldr2'])
+        self.assertEqual(self.brids(self.queue.iterSelectedSlave('slave-01')), [])
+
+    def test_buildernames(self):
+        self.queue.reset([self.brdict(1, buildername='bldr1', priority=20),
+                          self.brdict(2, buildername='bldr2', priority=50),
+                          self.brdict(3, buildername='bldr1', priority=100),
+                          self.brdict(4, buildername='bldr3', priority=10)])
+
+        self.assertEqual(self.queue.buildernames(), ['bldr1', 'bldr2', 'bldr3'])
+        self.assertEqual(self.queue.peekBuilder('bldr1')['brid'], 3)
+        self.assertEqual(self.queue.peekBuilder('bldr4'), None)
+        self.assertEqual(self.brids(self.queue.iterBuilder('bldr1')), [3, 1])
+        self.assertEqual(self.brids(self.queue.iterBuilder('bldr4')), [])
+
+    def test_iterBuilder_skips_removed_requests(self):
+        self.queue.reset([self.brdict(1), self.brdict(2), self.brdict(3)])
+        brids = []
+        for br in self.queue.iterBuilder('bldr1'):
+            brids.append(br['brid'])
+            self.queue.remove(2)
+        self.assertEqual(brids, [1, 3])
+
+    def test_iterSelectedSlave(self):
+        self.queue.reset([self.brdict(1, priority=20, selected_slave='slave-01'),
+                          self.brdict(2, buildername='bldr2', priority=50, selected_slave='slave-01'),
+                          self.brdict(3, selected_slave='slave-02')])
+
+        self.assertEqual(self.brids(self.queue.iterSelectedSlave('slave-01')), [2, 1])
+        self.assertEqual(self.brids(self.queue.iterSelectedSlave('slave-03')), [])
+
+    def test_update(self):
+        self.queue.reset([self.brdict(1), self.brdict(2)])
+        self.queue.markPending(2)
+        self.queue.markPending(3)
+
+        self.assertTrue(self.queue.hasPendingBrids())
+        brids = self.queue.popPendingBrids()
+        self.assertEqual(brids, [2, 3])
+        self.assertFalse(self.queue.hasPendingBrids())
+
+        # 2 is not in the queue anymore, 3 has been added
+        self.queue.update(brids, [self.brdict(3, priority=100)])
+        self.assertEqual(self.brids(self.queue), [3, 1])
+
+    def test_needsReconcile(self):
+        self.assertTrue(self.queue.needsReconcile(now=10, interval=60))
+
+        self.queue.reset([], now=10)
+        self.assertFalse(self.queue.needsReconcile(now=69, interval=60))
+        self.assertTrue(self.queue.needsReconcile(now=70, interval=60))
+
+        self.queue.invalidate()
+        self.assertFalse(self.queue.loaded)
+        self.assertTrue(self.queue.needsReconcile(now=11, interval=60))
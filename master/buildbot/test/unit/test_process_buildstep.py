@@ -14,15 +14,16 @@
 # Copyright Buildbot Team Members
 
 import re
+import zlib
 import mock
 from twisted.trial import unittest
 from twisted.internet import defer
 from twisted.python import log
 import klog
-from buildbot.process import buildstep
+from buildbot.process import buildstep, metrics
 from buildbot.process.buildstep import regex_log_evaluator
 from buildbot.status.results import FAILURE, SUCCESS, WARNINGS, EXCEPTION, SKIPPED
-from buildbot.test.fake import fakebuild, remotecommand
+from buildbot.test.fake import fakebuild, remotecommand, slave
 from buildbot.test.util import config, steps, compat
 from buildbot.util.eventual import eventually
 from twisted.spread import pb
@@ -453,3 +454,105 @@ class TestRemoteShellCommand(unittest.TestCase):
         self.step.remote_complete()
         self.assertEqual(self.step.remote.broker.localObjects, expectedObjects)
         self.assertEqual(self.step.remote.broker.luids, expectedLuids)
+
+
+class TestRemoteCommandUpdates(unittest.TestCase):
+
+    def makeRemoteCommand(self, slaveVersion):
+        cmd = buildstep.RemoteCommand("shell", {'workdir': 'build'})
+        cmd.step = mock.Mock()
+        cmd.step.manifest = {}
+        cmd.step.slaveVersion.return_value = slaveVersion
+        cmd.step.slaveVersionIsOlderThan.side_effect = \
+            lambda command, version: map(int, slaveVersion.split(".")) < map(int, version.split("."))
+        cmd.step.buildslave = slave.FakeSlave()
+        cmd.remote = mock.Mock()
+        cmd.commandID = "1"
+        return cmd
+
+    def test_start_update_version(self):
+        cmd = self.makeRemoteCommand("2.17")
+        cmd._start()
+        self.assertEqual(cmd.args['update_version'], 2)
+
+    def test_start_old_slave(self):
+        cmd = self.makeRemoteCommand("2.16")
+        cmd._start()
+        self.assertNotIn('update_version', cmd.args)
+
+    def test_start_compressed(self):
+        cmd = self.makeRemoteCommand("2.18")
+        cmd.step.buildslave.compress_output = True
+        cmd.step.buildslave.update_window = 4
+        cmd._start()
+        self.assertEqual(cmd.args['update_version'], 3)
+        self.assertEqual(cmd.args['update_window'], 4)
+
+    def test_start_compressed_old_slave(self):
+        cmd = self.makeRemoteCommand("2.17")
+        cmd.step.buildslave.compress_output = True
+        cmd.step.buildslave.update_window = 4
+        cmd._start()
+        self.assertEqual(cmd.args['update_version'], 2)
+        self.assertNotIn('update_window', cmd.args)
+
+    def test_remoteUpdate_logs(self):
+        cmd = self.makeRemoteCommand("2.17")
+        stdio = mock.Mock()
+        testlog = mock.Mock()
+        cmd.logs = {'stdio': stdio, 'test.log': testlog}
+        cmd.updates = {}
+
+        cmd.remoteUpdate({'logs': [
+            ['stdout', 'out1', '2013-01-01T00:00:00'],
+            ['stderr', 'err', '2013-01-01T00:00:00'],
+            ['header', 'hdr', '2013-01-01T00:00:00'],
+            [('log', 'test.log'), 'test', '2013-01-01T00:00:01'],
+            ['stdout', 'out2', '2013-01-01T00:00:01'],
+        ]})
+
+        self.assertEqual(stdio.method_calls, [
+            mock.call.addStdout('out1'),
+            mock.call.addStderr('err'),
+            mock.call.addHeader('hdr'),
+            mock.call.addStdout('out2'),
+        ])
+        testlog.addStdout.assert_called_once_with('test')
+        self.assertEqual(cmd.updates, {})
+
+    def test_remoteUpdate_zlogs(self):
+        events = []
+        def logEvent(name=None, value=1, **kwargs):
+            if name and name.startswith('RemoteCommand.update'):
+                events.append((name, value))
+        self.patch(metrics.MetricCountEvent, 'log', staticmethod(logEvent))
+        self.patch(metrics.MetricTimeEvent, 'log', staticmethod(logEvent))
+        cmd = self.makeRemoteCommand("2.18")
+        stdio = mock.Mock()
+        testlog = mock.Mock()
+        cmd.logs = {'stdio': stdio, 'test.log': testlog}
+        cmd._closeWhenFinished = {'stdio': False, 'test.log': False}
+        cmd.updates = {}
+        compressed = zlib.compress('out1' * 10 + 'test' + 'err')
+
+        cmd.remoteUpdate({'zlogs': [compressed, [
+            ['stdout', 40, '2013-01-01T00:00:00'],
+            [('log', 'test.log'), 4, '2013-01-01T00:00:00'],
+            ['stderr', 3, '2013-01-01T00:00:01'],
+        ]]})
+        cmd.remoteUpdate({'update_stats': {'acks': 2, 'ack_seconds': 3.0}})
+        cmd.remoteComplete(None)
+
+        self.assertEqual(stdio.method_calls, [
+            mock.call.addStdout('out1' * 10),
+            mock.call.addStderr('err'),
+        ])
+        testlog.addStdout.assert_called_once_with('test')
+        self.assertEqual(cmd.updates, {})
+        self.assertEqual(events, [
+            ('RemoteCommand.update_bytes', 47),
+            ('RemoteCommand.update_wire_bytes', len(compressed)),
+            ('RemoteCommand.update_ack_latency', 1.5),
+            ('RemoteCommand.update_compression_ratio',
+             float(len(compressed)) / 47),
+        ])
@@ -0,0 +1,179 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+from buildbot import config
+from buildbot.process import notifications
+from buildbot.util import json
+
+
+class FakeMaster(object):
+
+    def __init__(self):
+        self.events = []
+        self.deferred = None
+
+    def _record(self, name, **kwargs):
+        self.events.append((name, kwargs))
+        if self.deferred:
+            d, self.deferred = self.deferred, None
+            d.callback(None)
+
+    def waitForEvent(self):
+        self.deferred = defer.Deferred()
+        return self.deferred
+
+    def _deliverBuildRequestAdded(self, **kwargs):
+        self._record('buildrequest_added', **kwargs)
+
+    def _deliverBuildRequestRemoved(self, **kwargs):
+        self._record('buildrequest_removed', **kwargs)
+
+    def _deliverBuildsetComplete(self, **kwargs):
+        self._record('buildset_complete', **kwargs)
+
+    def _deliverChangeById(self, **kwargs):
+        self._record('change_added', **kwargs)
+
+
+class TestNotificationBus(unittest.TestCase):
+
+    def setUp(self):
+        self.master = FakeMaster()
+        self.bus = notifications.NotificationBus(self.master)
+
+    def message(self, event, master='other-master', **kwargs):
+        return json.dumps(dict(event=event, master=master, args=kwargs))
+
+    def test_messageReceived(self):
+        self.bus.messageReceived(self.message('buildrequest_added', bsid=1, brid=2, buildername='bldr'))
+        self.bus.messageReceived(self.message('buildrequest_removed', bsid=1, brid=2, buildername='bldr'))
+        self.bus.messageReceived(self.message('buildset_complete', bsid=1, results=0))
+        self.bus.messageReceived(self.message('change_added', changeid=13))
+
+        self.assertEqual(self.master.events, [
+            ('buildrequest_added', dict(bsid=1, brid=2, buildername='bldr')),
+            ('buildrequest_removed', dict(bsid=1, brid=2, buildername='bldr')),
+            ('buildset_complete', dict(bsid=1, results=0)),
+            ('change_added', dict(changeid=13)),
+        ])
+
+    def test_messageReceived_ignored(self):
+        self.bus.messageReceived('not json')
+        self.bus.messageReceived(json.dumps(dict(event='change_added')))
+        self.bus.messageReceived(self.message('unknown', changeid=13))
+        self.bus.messageReceived(self.message('change_added', master=self.bus.masterid, changeid=13))
+        self.assertEqual(self.master.events, [])
+
+    def test_publish_without_channel(self):
+        # nothing to do, but should not fail
+        self.bus.publish('change_added', changeid=13)
+        self.assertFalse(self.bus.isEnabled())
+
+    def test_publish(self):
+        self.bus.channel = mock.Mock()
+        self.bus.publish('change_added', changeid=13)
+
+        message = json.loads(self.bus.channel.publish.call_args[0][0])
+        self.assertEqual(message, dict(event='change_added', master=self.bus.masterid,
+                                       args=dict(changeid=13)))
+
+    @defer.inlineCallbacks
+    def test_reconfigService(self):
+        channel = mock.Mock()
+        self.patch(notifications.NotificationBus, 'channel_types',
+                   dict(broker=lambda bus, **kwargs: channel))
+
+        new_config = config.MasterConfig()
+        yield self.bus.reconfigService(new_config)
+        self.assertFalse(self.bus.isEnabled())
+
+        new_config = config.MasterConfig()
+        new_config.notifications.update(type='broker', connect='unix:path=s')
+        yield self.bus.reconfigService(new_config)
+        self.assertTrue(self.bus.isEnabled())
+        channel.setServiceParent.assert_called_with(self.bus)
+
+        yield self.bus.reconfigService(config.MasterConfig())
+        self.assertFalse(self.bus.isEnabled())
+        self.assertTrue(channel.disownServiceParent.called)
+
+
+class TestBrokerNotificationChannel(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        # keep the socket path short, UNIX sockets have a small limit
+        self.path = os.path.abspath('notifications.sock')
+        self.masters = []
+        self.buses = []
+        self.channels = []
+        for i in range(3):
+            master = FakeMaster()
+            bus = notifications.NotificationBus(master)
+            bus.masterid = 'master%d' % i
+            channel = notifications.BrokerNotificationChannel(bus,
+                connect='unix:path=%s' % self.path,
+                listen='unix:%s' % self.path if i == 0 else None)
+            bus.channel = channel
+            channel.startService()
+            self.masters.append(master)
+            self.buses.append(bus)
+            self.channels.append(channel)
+
+        yield defer.gatherResults([c.whenConnected() for c in self.channels])
+        # wait for the broker to see all the connections
+        while len(self.channels[0].broker.clients) < 3:
+            d = defer.Deferred()
+            reactor.callLater(0.01, d.callback, None)
+            yield d
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for channel in reversed(self.channels):
+            yield channel.stopService()
+
+    @defer.inlineCallbacks
+    def test_publish(self):
+        waits = [m.waitForEvent() for m in self.masters[1:]]
+        self.buses[0].publish('buildrequest_added', bsid=1, brid=2, buildername='bldr')
+        yield defer.gatherResults(waits)
+
+        event = ('buildrequest_added', dict(bsid=1, brid=2, buildername='bldr'))
+        self.assertEqual(self.masters[0].events, [])
+        self.assertEqual(self.masters[1].events, [event])
+        self.assertEqual(self.masters[2].events, [event])
+
+    @defer.inlineCallbacks
+    def test_publish_from_client(self):
+        waits = [m.waitForEvent() for m in (self.masters[0], self.masters[2])]
+        self.buses[1].publish('change_added', changeid=13)
+        yield defer.gatherResults(waits)
+
+        self.assertEqual(self.masters[0].events, [('change_added', dict(changeid=13))])
+        self.assertEqual(self.masters[1].events, [])
+        self.assertEqual(self.masters[2].events, [('change_added', dict(changeid=13))])
+
+    @defer.inlineCallbacks
+    def test_publish_disconnected(self):
+        channel = self.channels.pop()
+        yield channel.stopService()
+
+        # the message is dropped, the database poll will catch up
+        self.assertFalse(channel.publish('message'))
+        self.assertTrue(self.channels[1].publish('message'))
@@ -0,0 +1,82 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from buildbot.process.builder import Slavepool
+from buildbot.process.slaveavailability import SlaveAvailabilityIndex
+
+
+class TestSlaveAvailabilityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SlaveAvailabilityIndex()
+
+    def test_addSlaveBuilder(self):
+        self.index.addSlaveBuilder('bldr1', Slavepool.slavenames, 'sb1')
+        self.index.addSlaveBuilder('bldr2', Slavepool.startSlavenames, 'sb2', idle=False)
+
+        self.assertEqual(self.index.getBuildersWithIdleSlaves(), ['bldr1'])
+        self.assertTrue(self.index.hasIdleSlaves('bldr1'))
+        self.assertTrue(self.index.hasIdleSlaves('bldr1', Slavepool.slavenames))
+        self.assertFalse(self.index.hasIdleSlaves('bldr1', Slavepool.startSlavenames))
+        self.assertFalse(self.index.hasIdleSlaves('bldr2'))
+        self.assertEqual(self.index.getIdleSlaveBuilders('bldr1'), ['sb1'])
+        self.assertEqual(self.index.getIdleSlaveBuilders('bldr2'), [])
+
+    def test_setIdle(self):
+        self.index.addSlaveBuilder('bldr1', Slavepool.slavenames, 'sb1')
+        self.index.addSlaveBuilder('bldr1', Slavepool.slavenames, 'sb2')
+
+        self.index.setIdle('bldr1', 'sb1', False)
+        self.assertEqual(self.index.getIdleSlaveBuilders('bldr1', Slavepool.slavenames), ['sb2'])
+
+        self.index.setIdle('bldr1', 'sb2', False)
+        self.assertFalse(self.index.hasIdleSlaves('bldr1'))
+        self.assertEqual(self.index.getBuildersWithIdleSlaves(), [])
+
+        self.index.setIdle('bldr1', 'sb1', True)
+        self.assertEqual(self.index.getIdleSlaveBuilders('bldr1'), ['sb1'])
+
+    def test_setIdle_unknown_slavebuilder(self):
+        self.index.setIdle('bldr1', 'sb1', True)
+        self.assertFalse(self.index.hasIdleSlaves('bldr1'))
+
+    def test_same_slavebuilder_in_several_builders(self):
+        self.index.addSlaveBuilder('bldr1', Slavepool.slavenames, 'sb1')
+        self.index.addSlaveBuilder('bldr2', Slavepool.slavenames, 'sb1')
+
+        self.index.setIdle('bldr1', 'sb1', False)
+        self.assertEqual(self.index.getBuildersWithIdleSlaves(), ['bldr2'])
+
+    def test_removeSlaveBuilder(self):
+        self.index.addSlaveBuilder('bldr1', Slavepool.slavenames, 'sb1')
+        self.index.removeSlaveBuilder('bldr1', 'sb1')
+        self.index.removeSlaveBuilder('bldr1', 'sb1')
+
+        self.assertFalse(self.index.hasIdleSlaves('bldr1'))
+        # not registered anymore
+        self.index.setIdle('bldr1', 'sb1', True)
+        self.assertFalse(self.index.hasIdleSlaves('bldr1'))
+
+    def test_removeBuilder(self):
+        self.index.addSlaveBuilder('bldr1', Slavepool.slavenames, 'sb1')
+        self.index.addSlaveBuilder('bldr1', Slavepool.startSlavenames, 'sb2')
+        self.index.addSlaveBuilder('bldr2', Slavepool.slavenames, 'sb1')
+
+        self.index.removeBuilder('bldr1')
+
+        self.assertEqual(self.index.getBuildersWithIdleSlaves(), ['bldr2'])
+        self.index.setIdle('bldr1', 'sb2', True)
+        self.assertFalse(self.index.hasIdleSlaves('bldr1'))
@@ -24,6 +24,7 @@ from buildbot import config as config_module
 from buildbot.db import connector, model
 from buildbot.test.util import dirs, misc, compat
 from buildbot.scripts import base as base_module
+from buildbot.status import buildstore
 
 def mkconfig(**kwargs):
     config = dict(quiet=False, replace=False, basedir='test')
@@ -245,6 +246,31 @@ class TestUpgradeMasterFunctions(dirs.DirsMixin, misc.StdoutAssertionsMixin,
         self.assertEqual(self.readFile("test/templates/root.html"), 'ROOT')
         self.assertInStdout('Decide')
 
+    def makeBuildStatusConfig(self, storage):
+        master_cfg = config_module.MasterConfig()
+        master_cfg.buildStatusStorage = storage
+        master_cfg.builders = [mock.Mock(builddir='b1'),
+                               mock.Mock(builddir='missing')]
+        master_cfg.builders[0].name = 'b1'
+        os.makedirs(os.path.join('test', 'b1'))
+        return master_cfg
+
+    def test_upgradeBuildStatus(self):
+        master_cfg = self.makeBuildStatusConfig('sqlite')
+        migrate = mock.Mock(return_value=2)
+        self.patch(buildstore.SQLiteBuildStore, 'migrate', migrate)
+        upgrade_master.upgradeBuildStatus(mkconfig(basedir='test'),
+                                          master_cfg)
+        self.assertEqual(migrate.call_count, 1)
+        self.assertInStdout('b1: 2 builds')
+
+    def test_upgradeBuildStatus_pickle(self):
+        master_cfg = self.makeBuildStatusConfig('pickle')
+        upgrade_master.upgradeBuildStatus(mkconfig(basedir='test'),
+                                          master_cfg)
+        self.assertEqual(os.listdir(os.path.join('test', 'b1')), [])
+        self.assertWasQuiet()
+
     @defer.inlineCallbacks
     def test_upgradeDatabase(self):
         setup = mock.Mock(side_effect=lambda **kwargs : defer.succeed(None))
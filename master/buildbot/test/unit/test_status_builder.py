@@ -5,7 +5,7 @@ from buildbot.status import buildrequest
 from buildbot.config import ProjectConfig
 from mock import Mock
 from buildbot.status.build import BuildStatus
-from buildbot.status.results import SUCCESS
+from buildbot.status.results import SUCCESS, RESUME
 from buildbot.sourcestamp import SourceStamp
 from twisted.internet import defer
 from buildbot.status.master import Status
@@ -174,11 +174,14 @@ class TestBuilderStatus(unittest.TestCase):
         status = Status(self.master)
         self.builder_status.setStatus(status=status)
 
-        self.builder_status.pendingBuildsCache.buildRequestStatusCodebasesCache = initialCache
+        self.builder_status.pendingBuildsCache.buildRequestStatusCodebasesCache = dict(initialCache)
 
-        self.builder_status.pendingBuildsCache.buildRequestStatusCodebasesDictsCache = initialDictsCache
+        self.builder_status.pendingBuildsCache.buildRequestStatusCodebasesDictsCache = dict(initialDictsCache)
 
         row = [
+            fakedb.SourceStampSet(id=2),
+            fakedb.SourceStamp(id=2, sourcestampsetid=2, codebase='katana-buildbot', branch='katana'),
+            fakedb.Buildset(id=2, sourcestampsetid=2),
             fakedb.BuildRequest(id=2, buildsetid=2, buildername='builder-01', priority=13, results=-1)
         ]
         yield self.master.db.insertTestData(row)
@@ -201,44 +204,138 @@ class TestBuilderStatus(unittest.TestCase):
                     expectedCache[key][0].brid)
 
     @defer.inlineCallbacks
-    def test_requestSubmittedResetsPendingBuildsCache(self):
-        yield self.setupPendingBuildCache(
-                initialCache={'codebase=branch': [Mock(brid=1)]},
-                initialDictsCache={'codebase=branch': [{'brid': 1}]}
-        )
-        self.builder_status.pendingBuildsCache.requestSubmitted(req=Mock())
-        self.checkPendingBuildsCache(expectedCache={'': [Mock(brid=2)]})
+    def addPendingBuildRequest(self, brid, branch, priority=13):
+        yield self.master.db.insertTestData([
+            fakedb.SourceStampSet(id=brid),
+            fakedb.SourceStamp(id=brid, sourcestampsetid=brid, codebase='katana-buildbot', branch=branch),
+            fakedb.Buildset(id=brid, sourcestampsetid=brid),
+            fakedb.BuildRequest(id=brid, buildsetid=brid, buildername='builder-01', priority=priority, results=-1)
+        ])
+
+    def getCachedBrids(self, key=''):
+        cache = self.builder_status.pendingBuildsCache.buildRequestStatusCodebasesCache
+        return [brs.brid for brs in cache[key]]
 
     @defer.inlineCallbacks
-    def test_requestCanceledResetsPendingBuildsCache(self):
-        yield self.setupPendingBuildCache(
-                initialCache={'codebase=branch': [Mock(brid=1)]},
-                initialDictsCache={'codebase=branch': [{'brid': 1}]}
-        )
-        self.builder_status.pendingBuildsCache.requestCancelled(req=Mock())
-        self.checkPendingBuildsCache(expectedCache={'': [Mock(brid=2)]})
+    def test_requestSubmittedAddsToPendingBuildsCache(self):
+        yield self.setupPendingBuildCache()
+        pendingBuildsCache = self.builder_status.pendingBuildsCache
+        yield pendingBuildsCache.getPendingBuilds()
+
+        yield self.addPendingBuildRequest(brid=3, branch='katana', priority=20)
+        yield self.addPendingBuildRequest(brid=4, branch='katana', priority=1)
+        yield pendingBuildsCache.requestSubmitted(req=Mock(brid=3))
+        yield pendingBuildsCache.requestSubmitted(req=Mock(brid=4))
+
+        self.assertEquals(self.getCachedBrids(), [3, 2, 4])
 
     @defer.inlineCallbacks
-    def test_buildStartedResetsPendingBuildsCache(self):
-        yield self.setupPendingBuildCache(
-                initialCache={'codebase=branch': [Mock(brid=1)]},
-                initialDictsCache={'codebase=branch': [{'brid': 1}]}
-        )
-        self.builder_status.pendingBuildsCache.buildStarted(builderName='builder-01', state=Mock())
-        self.checkPendingBuildsCache(expectedCache={'': [Mock(brid=2)]})
+    def test_requestSubmittedOnlyAddsToMatchingCodebases(self):
+        yield self.setupPendingBuildCache()
+        pendingBuildsCache = self.builder_status.pendingBuildsCache
+        codebases = {'katana-buildbot': 'staging'}
+        key = self.builder_status.getCodebasesCacheKey(codebases)
+        yield pendingBuildsCache.getPendingBuilds()
+        yield pendingBuildsCache.getPendingBuilds(codebases)
+        pendingBuildsCache.buildRequestStatusCodebasesCache[key] = []
+
+        yield self.addPendingBuildRequest(brid=3, branch='staging')
+        yield self.addPendingBuildRequest(brid=4, branch='master')
+        yield pendingBuildsCache.requestSubmitted(req=Mock(brid=3))
+        yield pendingBuildsCache.requestSubmitted(req=Mock(brid=4))
+
+        self.assertEquals(self.getCachedBrids(), [2, 3, 4])
+        self.assertEquals(self.getCachedBrids(key), [3])
+
+    @defer.inlineCallbacks
+    def test_addRequestsFetchesBuildsetsAndSourceStampsOnce(self):
+        yield self.setupPendingBuildCache()
+        pendingBuildsCache = self.builder_status.pendingBuildsCache
+        yield pendingBuildsCache.getPendingBuilds()
+
+        for brid in (3, 4, 5):
+            yield self.addPendingBuildRequest(brid=brid, branch='katana', priority=brid)
+        db = self.master.db
+        db.buildsets.getBuildset = Mock()
+        db.sourcestamps.getSourceStamps = Mock()
+        self.patch(db.buildsets, 'getBuildsetsByIds', Mock(wraps=db.buildsets.getBuildsetsByIds))
+        self.patch(db.sourcestamps, 'getSourceStampsForSets',
+                   Mock(wraps=db.sourcestamps.getSourceStampsForSets))
+
+        # the requests of a build finished with RESUME go back to the queue
+        yield pendingBuildsCache.buildFinished(builderName='builder-01',
+                                               state=Mock(brids=[3, 4, 5]), results=RESUME)
+
+        self.assertEquals(self.getCachedBrids(), [2, 5, 4, 3])
+        self.assertEquals(db.buildsets.getBuildsetsByIds.call_count, 1)
+        self.assertEquals(db.sourcestamps.getSourceStampsForSets.call_count, 1)
+        self.assertFalse(db.buildsets.getBuildset.called)
+        self.assertFalse(db.sourcestamps.getSourceStamps.called)
 
     @defer.inlineCallbacks
-    def test_buildFinishedResetsPendingBuildsCache(self):
+    def test_requestSubmittedIgnoresClaimedRequests(self):
+        yield self.setupPendingBuildCache()
+        pendingBuildsCache = self.builder_status.pendingBuildsCache
+        yield pendingBuildsCache.getPendingBuilds()
+
+        yield self.addPendingBuildRequest(brid=3, branch='katana')
+        yield self.master.db.buildrequests.claimBuildRequests([3])
+        yield pendingBuildsCache.requestSubmitted(req=Mock(brid=3))
+
+        self.assertEquals(self.getCachedBrids(), [2])
+
+    @defer.inlineCallbacks
+    def test_requestCancelledRemovesFromPendingBuildsCache(self):
         yield self.setupPendingBuildCache(
-                initialCache={'codebase=branch': [Mock(brid=1)]},
-                initialDictsCache={'codebase=branch': [{'brid': 1}]}
+                initialDictsCache={'': [{'brid': 2}]}
         )
-        self.builder_status.pendingBuildsCache.buildFinished(
+        pendingBuildsCache = self.builder_status.pendingBuildsCache
+        yield pendingBuildsCache.getPendingBuilds()
+
+        pendingBuildsCache.requestCancelled(builder=self.builder_status, req=Mock(brid=2))
+
+        self.checkPendingBuildsCache(expectedDictsCache={'': []})
+        self.assertEquals(self.getCachedBrids(), [])
+
+    @defer.inlineCallbacks
+    def test_buildStartedRemovesFromPendingBuildsCache(self):
+        yield self.setupPendingBuildCache()
+        pendingBuildsCache = self.builder_status.pendingBuildsCache
+        yield pendingBuildsCache.getPendingBuilds()
+
+        pendingBuildsCache.buildStarted(builderName='builder-01', state=Mock(brids=[2]))
+
+        self.assertEquals(self.getCachedBrids(), [])
+
+    @defer.inlineCallbacks
+    def test_buildFinishedDoesNotChangeCache(self):
+        yield self.setupPendingBuildCache()
+        pendingBuildsCache = self.builder_status.pendingBuildsCache
+        yield pendingBuildsCache.getPendingBuilds()
+        self.master.db.buildrequests.getBuildRequestInQueue = Mock()
+
+        yield pendingBuildsCache.buildFinished(
                 builderName='builder-01',
-                state=Mock(),
-                results=4,
+                state=Mock(brids=[1]),
+                results=SUCCESS,
         )
-        self.checkPendingBuildsCache(expectedCache={'': [Mock(brid=2)]})
+
+        self.assertEquals(self.getCachedBrids(), [2])
+        self.assertFalse(self.master.db.buildrequests.getBuildRequestInQueue.called)
+
+    @defer.inlineCallbacks
+    def test_getPendingBuildsRefreshesAfterInterval(self):
+        yield self.setupPendingBuildCache()
+        pendingBuildsCache = self.builder_status.pendingBuildsCache
+        yield pendingBuildsCache.getPendingBuilds()
+        yield self.addPendingBuildRequest(brid=3, branch='katana')
+
+        cache = yield pendingBuildsCache.getPendingBuilds()
+        self.assertEquals([brs.brid for brs in cache], [2])
+
+        pendingBuildsCache.lastRefresh -= pendingBuildsCache.refreshInterval + 1
+        cache = yield pendingBuildsCache.getPendingBuilds()
+        self.assertEquals([brs.brid for brs in cache], [2, 3])
 
     @defer.inlineCallbacks
     def test_builderChangedStateDoesNotChangeCache(self):
@@ -258,7 +355,7 @@ class TestBuilderStatus(unittest.TestCase):
         self.assertEquals(len(cache), 1)
         self.assertEquals(cache[0].brid, 2)
 
-    def getBuildRequestInQueueMock(self, buildername, sourcestamps, sorted):
+    def getBuildRequestInQueueMock(self, buildername, sourcestamps, sorted, brids=None):
         expectedParam = [{'b_codebase': key, 'b_branch': value} for key, value in self.codebases.iteritems()]
         self.assertEquals(sourcestamps, expectedParam)
 
@@ -338,3 +435,24 @@ class TestBuilderStatus(unittest.TestCase):
         )
         self.assertEquals(len(cache), 2)
         self.assertEquals(cache, [{'brid': 1}, {'brid': 2}])
+
+
+class TestRequestMatchesCodebases(unittest.TestCase):
+
+    sourcestamps = [{'codebase': 'a', 'branch': 'master'},
+                    {'codebase': 'b', 'branch': 'staging'}]
+
+    def test_noCodebases(self):
+        self.assertTrue(builder.requestMatchesCodebases(self.sourcestamps, {}))
+
+    def test_oneCodebase(self):
+        self.assertTrue(builder.requestMatchesCodebases(self.sourcestamps, {'a': 'master'}))
+        self.assertFalse(builder.requestMatchesCodebases(self.sourcestamps, {'a': 'staging'}))
+
+    def test_severalCodebases(self):
+        self.assertTrue(builder.requestMatchesCodebases(self.sourcestamps,
+                                                        {'a': 'master', 'b': 'staging'}))
+        self.assertTrue(builder.requestMatchesCodebases(self.sourcestamps,
+                                                        {'a': 'master', 'c': 'staging'}))
+        self.assertFalse(builder.requestMatchesCodebases(self.sourcestamps,
+                                                         {'a': 'master', 'b': 'master'}))
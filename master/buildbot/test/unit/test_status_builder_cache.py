@@ -16,8 +16,11 @@
 import os
 from mock import Mock
 from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+from buildbot.process import cache
 from buildbot.status import builder, master
 from buildbot.test.fake import fakemaster
+from buildbot.util.lru import LRUCache
 from buildbot.test.fake.fakedb import FakeBuildsComponent, FakeUsersComponent, User
 
 
@@ -46,8 +49,12 @@ class TestBuildStatus(unittest.TestCase):
         # Must initialize these fields before pickling.
         b.currentBigState = 'idle'
         b.status = 'idle'
+        self.addCleanup(lambda: b.buildStore and b.buildStore.close())
         return b
 
+    def clearBuildCache(self, b):
+        b.buildCache = LRUCache(b.cacheMiss)
+
     def setupStatus(self, b):
         m = Mock()
         m.buildbotURL = 'http://buildbot:8010/'
@@ -82,3 +89,113 @@ class TestBuildStatus(unittest.TestCase):
                              'propval%d' % build.number)
             self.assertEqual(b.buildCache.hits, hits+1)
             hits = hits + 1
+
+    def testBuildCacheSQLite(self):
+        b = self.setupBuilder('builder_1')
+        b.master.config.buildStatusStorage = 'sqlite'
+        for i in xrange(3):
+            build = b.newBuild()
+            build.setProperty('propkey', 'propval%d' % i, 'test')
+            build.buildStarted(build)
+            build.buildFinished()
+        self.clearBuildCache(b)
+
+        self.assertEqual(os.listdir(b.basedir), ['builds.sqlite'])
+        for i in xrange(3):
+            self.assertEqual(b.getBuild(i).getProperty('propkey'),
+                             'propval%d' % i)
+
+        b.buildStore = None
+        b.determineNextBuildNumber()
+        self.assertEqual(b.nextBuildNumber, 3)
+
+    def testGetBuildSummary(self):
+        b = self.setupBuilder('builder_1')
+        b.master.config.buildStatusStorage = 'sqlite'
+        build = b.newBuild()
+        build.setReason('because')
+        build.buildStarted(build)
+        build.buildFinished()
+        self.clearBuildCache(b)
+
+        self.patch(b, 'loadBuildFromFile', lambda number: self.fail())
+        self.assertEqual(b.getBuildSummary(0)['reason'], 'because')
+        self.assertEqual(b.getBuildSummary(-1)['number'], 0)
+        self.assertEqual(b.getBuildSummary(1), None)
+
+    def testGetBuildSummaryIncomplete(self):
+        b = self.setupBuilder('builder_1')
+        b.master.config.buildStatusStorage = 'sqlite'
+        build = b.newBuild()
+        build.setReason('because')
+        build.buildStarted(build)
+        build.buildFinished()
+        # as saved by upgrade-master, without the process objects
+        build.master = None
+        b.getBuildStore().saveBuild(build)
+        self.clearBuildCache(b)
+
+        summary = b.getBuildSummary(0)
+        self.assertEqual(summary['reason'], 'because')
+        self.assertIn('logs', summary)
+
+        # the complete summary was saved
+        self.patch(b, 'loadBuildFromFile', lambda number: self.fail())
+        self.assertIn('logs', b.getBuildSummary(0))
+
+    @defer.inlineCallbacks
+    def testBuildSummaryCache(self):
+        b = self.setupBuilder('builder_1')
+        s = self.setupStatus(b)
+        s.master.caches = cache.CacheManager()
+        s.master.caches.config = {'BuildSummaries': 10}
+        s.getBuilder = lambda name: b
+        b.master.status = s
+
+        build = b.newBuild()
+        build.setReason('because')
+        build.buildStarted(build)
+        build.buildFinished()
+        self.clearBuildCache(b)
+        # the summary is handed to the reactor thread
+        yield task.deferLater(reactor, 0, lambda: None)
+
+        # kept when the build was saved
+        self.patch(b, 'getBuildSummary', lambda number: self.fail())
+        summary = yield b.getBuildSummaryAsync(0)
+        self.assertEqual(summary.getNumber(), 0)
+        self.assertEqual(summary.summary['reason'], 'because')
+        self.assertTrue(summary.isFinished())
+
+    @defer.inlineCallbacks
+    def testBuildSummaryCacheMiss(self):
+        b = self.setupBuilder('builder_1')
+        s = self.setupStatus(b)
+        s.master.caches = cache.CacheManager()
+        s.getBuilder = lambda name: b
+
+        build = b.newBuild()
+        build.setReason('because')
+        build.buildStarted(build)
+        build.buildFinished()
+        unfinished = b.newBuild()
+        unfinished.buildStarted(unfinished)
+
+        summary = yield s.getBuildSummary('builder_1', 0)
+        self.assertEqual(summary.getResults(), build.getResults())
+        summary = yield s.getBuildSummary('builder_1', 1)
+        self.assertEqual(summary, None)
+
+    def testPruneSQLite(self):
+        b = self.setupBuilder('builder_1')
+        b.master.config.buildStatusStorage = 'sqlite'
+        b.master.config.buildHorizon = 2
+        for i in xrange(4):
+            build = b.newBuild()
+            build.buildStarted(build)
+            build.buildFinished()
+        self.clearBuildCache(b)
+
+        b.prune()
+
+        self.assertEqual(b.getBuildStore().getBuildNumbers(), [2, 3])
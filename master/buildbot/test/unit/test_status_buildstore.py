@@ -0,0 +1,161 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+
+from zope.interface import implements
+from twisted.trial import unittest
+
+from buildbot import interfaces, sourcestamp
+from buildbot.status import build, buildstore
+from buildbot.status.results import SUCCESS
+
+
+class FakeBuilderStatus:
+    implements(interfaces.IBuilderStatus)
+
+
+class BuildStoreMixin(object):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+        self.store = self.makeStore()
+        self.addCleanup(self.store.close)
+
+    def makeBuild(self, number):
+        # as in the pickles, without the process objects
+        b = build.BuildStatus(FakeBuilderStatus(), None, number)
+        b.setSourceStamps([sourcestamp.SourceStamp(branch='master',
+                                                   revision='abcdef',
+                                                   repository='repo',
+                                                   codebase='cb')])
+        b.setReason('because')
+        b.setText(['build', 'successful'])
+        b.setResults(SUCCESS)
+        b.setProperty('prop', 'value', 'test')
+        b.started, b.finished = 10, 20
+        return b
+
+    def test_saveBuild_loadBuild(self):
+        self.store.saveBuild(self.makeBuild(3))
+        b = self.store.loadBuild(3)
+        self.assertEqual(b.number, 3)
+        self.assertEqual(b.getProperty('prop'), 'value')
+        self.assertEqual(self.store.loadBuild(4), None)
+
+    def test_loadSummary(self):
+        self.store.saveBuild(self.makeBuild(3))
+        summary = self.store.loadSummary(3)
+        stamps = summary.pop('sourceStamps')
+        # tuples in the pickles, lists once in JSON
+        properties = map(list, summary.pop('properties'))
+        self.assertEqual(summary, {
+            'number': 3,
+            'results': SUCCESS,
+            'text': ['build', 'successful'],
+            'times': [10, 20],
+            'slavename': '???',
+            'reason': 'because',
+            'submittedTime': None,
+            'owners': None,
+            'brids': [],
+            'buildChainID': None,
+            'blame': [],
+            'resume': [],
+            'resumeSlavepool': None,
+            'artifacts': None,
+        })
+        self.assertEqual(properties, [['prop', 'value', 'test']])
+        self.assertEqual([(ss['codebase'], ss['repository'], ss['branch'],
+                           ss['revision']) for ss in stamps],
+                         [('cb', 'repo', 'master', 'abcdef')])
+        self.assertEqual(self.store.loadSummary(4), None)
+
+    def test_getBuildNumbers_removeBuild(self):
+        for number in (1, 0, 2):
+            self.store.saveBuild(self.makeBuild(number))
+        self.store.removeBuild(1)
+        self.assertEqual(self.store.getBuildNumbers(), [0, 2])
+        self.assertTrue(self.store.hasBuild(2))
+        self.assertFalse(self.store.hasBuild(1))
+
+
+class TestPickleBuildStore(BuildStoreMixin, unittest.TestCase):
+
+    def makeStore(self):
+        return buildstore.PickleBuildStore(self.basedir)
+
+    def test_saveBuild_writes_pickle(self):
+        self.store.saveBuild(self.makeBuild(3))
+        self.assertEqual(os.listdir(self.basedir), ['3'])
+
+    def test_loadBuild_corrupted(self):
+        open(os.path.join(self.basedir, '3'), 'wb').close()
+        self.assertRaises(IndexError, self.store.loadBuild, 3)
+
+
+class TestSQLiteBuildStore(BuildStoreMixin, unittest.TestCase):
+
+    def makeStore(self):
+        return buildstore.SQLiteBuildStore(self.basedir)
+
+    def savePickle(self, number):
+        buildstore.PickleBuildStore(self.basedir).saveBuild(
+            self.makeBuild(number))
+
+    def test_saveBuild_writes_no_pickle(self):
+        self.store.saveBuild(self.makeBuild(3))
+        self.assertEqual(os.listdir(self.basedir), ['builds.sqlite'])
+
+    def test_saveBuild_replaces_pickle(self):
+        self.savePickle(3)
+        self.store.saveBuild(self.makeBuild(3))
+        self.assertEqual(os.listdir(self.basedir), ['builds.sqlite'])
+        self.assertEqual(self.store.getBuildNumbers(), [3])
+
+    def test_reads_pickles(self):
+        self.savePickle(3)
+        self.assertEqual(self.store.getBuildNumbers(), [3])
+        self.assertEqual(self.store.loadBuild(3).number, 3)
+        self.assertEqual(self.store.loadSummary(3)['reason'], 'because')
+
+    def test_reopen(self):
+        self.store.saveBuild(self.makeBuild(3))
+        self.store.close()
+        self.store = self.makeStore()
+        self.assertEqual(self.store.loadSummary(3)['number'], 3)
+
+    def test_migrate(self):
+        self.savePickle(1)
+        self.savePickle(2)
+        upgraded = []
+
+        self.assertEqual(self.store.migrate(upgrade=upgraded.append), 2)
+
+        self.assertEqual([b.number for b in upgraded], [1, 2])
+        self.assertEqual(os.listdir(self.basedir), ['builds.sqlite'])
+        self.assertEqual(self.store.getBuildNumbers(), [1, 2])
+        self.assertEqual(self.store.loadBuild(2).getProperty('prop'), 'value')
+
+    def test_migrate_corrupted(self):
+        self.savePickle(1)
+        open(os.path.join(self.basedir, '2'), 'wb').close()
+
+        self.assertEqual(self.store.migrate(), 1)
+
+        self.assertEqual(sorted(os.listdir(self.basedir)),
+                         ['2', 'builds.sqlite'])
+        self.assertEqual(len(self.flushLoggedErrors(IndexError)), 1)
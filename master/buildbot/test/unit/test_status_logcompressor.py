@@ -0,0 +1,148 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from buildbot import config
+from buildbot.process import metrics
+from buildbot.status import logcompressor
+
+
+class TestLogCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.compressor = logcompressor.LogCompressor()
+        self.jobs = []
+        self.metrics = []
+        log = staticmethod(lambda *args, **kwargs: self.metrics.append(args))
+        self.patch(metrics.MetricCountEvent, 'log', log)
+        self.patch(metrics.MetricTimeEvent, 'log', log)
+
+    def patchThreads(self):
+        # run the jobs when the test says so
+        def deferToThreadPool(reactor, pool, fn, *args):
+            d = defer.Deferred()
+            self.jobs.append((d, fn, args))
+            return d
+        self.patch(logcompressor.threads, 'deferToThreadPool',
+                   deferToThreadPool)
+
+    def runJob(self, i=0):
+        d, fn, args = self.jobs.pop(i)
+        try:
+            result = fn(*args)
+        except Exception:
+            d.errback()
+        else:
+            d.callback(result)
+
+    def job(self, name, compressedSize=1):
+        return lambda: (compressedSize, name)
+
+    def reconfig(self, **kwargs):
+        new_config = config.MasterConfig()
+        for k, v in kwargs.items():
+            setattr(new_config, k, v)
+        return self.compressor.reconfigService(new_config)
+
+    @defer.inlineCallbacks
+    def test_compress(self):
+        self.compressor.startService()
+        result = yield self.compressor.compress(10, self.job('log'))
+        yield self.compressor.stopService()
+        self.assertEqual(result, 'log')
+
+    @defer.inlineCallbacks
+    def test_compress_not_started(self):
+        result = yield self.compressor.compress(10, self.job('log'))
+        self.assertEqual(result, 'log')
+
+    def test_compress_bounded_smallest_first(self):
+        self.patchThreads()
+        self.reconfig(logCompressionWorkers=1)
+        self.compressor.startService()
+        results = []
+        for size in (30, 10, 20):
+            d = self.compressor.compress(size, self.job(size))
+            d.addCallback(results.append)
+
+        self.assertEqual(len(self.jobs), 1)
+        self.runJob()
+        self.runJob()
+        self.runJob()
+        self.assertEqual(results, [30, 10, 20])
+        self.assertEqual(self.compressor.active, 0)
+        return self.compressor.stopService()
+
+    def test_reconfig_workers(self):
+        self.patchThreads()
+        self.reconfig(logCompressionWorkers=1)
+        self.compressor.startService()
+        for size in (30, 10, 20):
+            self.compressor.compress(size, self.job(size))
+        self.assertEqual(len(self.jobs), 1)
+
+        self.reconfig(logCompressionWorkers=3)
+        self.assertEqual(len(self.jobs), 3)
+        self.assertEqual(self.compressor.pool.max, 3)
+        while self.jobs:
+            self.runJob()
+        return self.compressor.stopService()
+
+    def test_compress_failure(self):
+        self.patchThreads()
+        self.compressor.startService()
+        def fail():
+            raise RuntimeError('oh noes')
+        d = self.compressor.compress(10, fail)
+        self.runJob()
+        self.assertEqual(self.compressor.active, 0)
+        self.stopped = self.compressor.stopService()
+        return self.assertFailure(d, RuntimeError)
+
+    def test_stopService_drains(self):
+        self.patchThreads()
+        self.reconfig(logCompressionWorkers=1)
+        self.compressor.startService()
+        results = []
+        for size in (10, 20):
+            self.compressor.compress(size, self.job(size)).addCallback(
+                results.append)
+
+        stopped = []
+        self.compressor.stopService().addCallback(stopped.append)
+        self.runJob()
+        self.assertEqual(stopped, [])
+        self.runJob()
+        self.assertEqual(stopped, [None])
+        self.assertEqual(results, [10, 20])
+        self.assertEqual(self.compressor.pool, None)
+
+    def test_metrics(self):
+        self.patchThreads()
+        self.compressor.startService()
+        self.compressor.compress(2 * 1024 * 1024, self.job('log', 1024))
+        self.assertIn(('LogCompressor.active', 1), self.metrics)
+        self.runJob()
+
+        self.assertIn(('LogCompressor.bytes_in', 2 * 1024 * 1024),
+                      self.metrics)
+        self.assertIn(('LogCompressor.bytes_out', 1024), self.metrics)
+        self.assertEqual([m[0] for m in self.metrics
+                          if m[0] == 'LogCompressor.seconds_per_mb'],
+                         ['LogCompressor.seconds_per_mb'])
+        self.assertIn(('LogCompressor.active', 0), self.metrics)
+        return self.compressor.stopService()
@@ -21,7 +21,7 @@ import mock
 import time
 from twisted.trial import unittest
 from twisted.internet import defer
-from buildbot.status import logfile
+from buildbot.status import logcompressor, logfile
 from buildbot.test.util import dirs
 from buildbot import config
 
@@ -58,6 +58,7 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
         self.master = self.logfile.master = mock.Mock()
         self.config = self.logfile.master.config = config.MasterConfig()
+        self.master.log_compressor = logcompressor.LogCompressor()
 
     def tearDown(self):
         if self.logfile.openfile:
@@ -339,3 +340,144 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         self.config.logCompressionMethod = None
         return self.do_test_compressLog('', expect_comp=False)
 
+
+    # indexed logs
+
+    def add_lines(self, count):
+        self.logfile.chunkSize = 50
+        self.logfile.index.blockSize = 200
+        lines = []
+        for i in range(count):
+            channel = logfile.HEADER if i % 10 == 0 else logfile.STDOUT
+            line = 'line %d %s\n' % (i, 'x' * (i % 7))
+            self.logfile.addEntry(channel, line)
+            lines.append(line)
+        return lines
+
+    def compress(self, method):
+        self.config.logCompressionMethod = method
+        return self.logfile.compressLog()
+
+    def check_getLines(self, lines):
+        for start, stop in [(0, 5), (37, 52), (-10, None), (95, 200),
+                            (0, None), (50, 40)]:
+            self.assertEqual(self.logfile.getLines(start, stop),
+                             lines[start:stop])
+        # without the headers
+        output = cStringIO.StringIO(self.logfile.getText()).readlines()
+        for start, stop in [(0, 5), (37, 52), (-10, None)]:
+            self.assertEqual(
+                self.logfile.getLines(start, stop, logfile.TEXT_CHANNELS),
+                output[start:stop])
+
+    def check_generateText(self):
+        for channels in (logfile.ALL_CHANNELS, logfile.TEXT_CHANNELS):
+            text = ''.join(self.logfile.getChunks(channels, onlyText=True))
+            self.assertEqual(self.logfile.getTextLength(channels), len(text))
+            for start, stop in [(0, 10), (1000, 1234), (1500, None),
+                                (len(text) - 10, len(text) + 10)]:
+                self.assertEqual(
+                    ''.join(self.logfile.generateText(start, stop, channels)),
+                    text[start:stop])
+
+    def test_index_blocks(self):
+        self.add_lines(100)
+        self.logfile.finish()
+        index = self.logfile.index
+        self.assertTrue(len(index.offsets) > 5)
+        self.assertEqual(index.offsets[0], 0)
+        self.assertEqual(index.lineCounts, [90, 0, 10])
+        self.assertEqual(index.length,
+                         os.path.getsize(self.logfile.getFilename()))
+        # each block starts on a chunk boundary
+        chunks = list(self.logfile.getChunks())
+        for offset in index.offsets:
+            tail = list(self.logfile.getChunks(offset=offset))
+            self.assertEqual(tail, chunks[len(chunks) - len(tail):])
+
+        saved = logfile.LogFileIndex.load(self.logfile.getIndexFilename())
+        del index.blockSize
+        self.assertEqual(saved.__dict__, index.__dict__)
+
+    def test_getLines_running(self):
+        lines = self.add_lines(100)
+        # the last lines are not merged yet
+        self.logfile.chunkSize = 1000
+        self.logfile.addStdout('partial')
+        self.assertTrue(self.logfile.runEntries)
+        self.check_getLines(lines + ['partial'])
+        self.check_generateText()
+        self.assertEqual(self.logfile.getLineCount(), 101)
+
+    def test_getLines_pickled(self):
+        lines = self.add_lines(100)
+        self.logfile.finish()
+        self.pickle_and_restore()
+        self.assertEqual(self.logfile.index, None)
+        self.check_getLines(lines)
+        self.check_generateText()
+        self.assertEqual(self.logfile.getLineCount(), 100)
+
+    def test_getLines_no_index(self):
+        lines = self.add_lines(100)
+        self.logfile.finish()
+        os.unlink(self.logfile.getIndexFilename())
+        self.pickle_and_restore()
+        self.check_getLines(lines)
+        self.check_generateText()
+
+    @defer.inlineCallbacks
+    def do_test_getLines_compressed(self, method):
+        lines = self.add_lines(100)
+        self.logfile.finish()
+        yield self.compress(method)
+        self.pickle_and_restore()
+        self.assertEqual(self.logfile.getIndex().compression, method)
+        self.check_getLines(lines)
+        self.check_generateText()
+
+        decompressed = []
+        decompressBlock = logfile._decompressBlock
+        def _decompressBlock(data, method):
+            decompressed.append(data)
+            return decompressBlock(data, method)
+        self.patch(logfile, '_decompressBlock', _decompressBlock)
+        self.assertEqual(self.logfile.getLines(-3), lines[-3:])
+        self.assertTrue(len(decompressed) <= 2)
+
+    def test_getLines_compressed_gz(self):
+        return self.do_test_getLines_compressed('gz')
+
+    def test_getLines_compressed_bz2(self):
+        return self.do_test_getLines_compressed('bz2')
+
+    @defer.inlineCallbacks
+    def test_compressLog_gz_blocks(self):
+        self.add_lines(100)
+        self.logfile.finish()
+        with open(self.logfile.getFilename()) as f:
+            contents = f.read()
+        yield self.compress('gz')
+        self.assertTrue(len(self.logfile.index.offsets) > 5)
+        # the blocks still make a gzip file
+        f = logfile.GzipFile(self.logfile.getFilename() + '.gz')
+        self.assertEqual(f.read(), contents)
+        self.assertEqual(self.logfile.getFile().read(), contents)
+        self.assertFalse(os.path.exists(self.logfile.getFilename()))
+
+    @defer.inlineCallbacks
+    def test_compressLog_no_index(self):
+        self.logfile.addStdout('hello, world')
+        self.logfile.finish()
+        os.unlink(self.logfile.getIndexFilename())
+        self.pickle_and_restore()
+        yield self.compress('bz2')
+        self.assertEqual(self.logfile.getIndex(), None)
+        self.assertEqual(self.logfile.getText(), 'hello, world')
+
+    def test_getChunks_offset(self):
+        self.logfile.addStdout('a' * 10)
+        self.logfile.addStderr('b' * 10)
+        self.logfile.finish()
+        self.assertEqual(list(self.logfile.getChunks(offset=15)),
+                         [(logfile.STDERR, 'b' * 10)])
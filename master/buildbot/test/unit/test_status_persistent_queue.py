@@ -19,7 +19,7 @@ from twisted.trial import unittest
 from buildbot.test.util import dirs
 
 from buildbot.status.persistent_queue import MemoryQueue, DiskQueue, \
-    IQueue, PersistentQueue, WriteFile
+    IQueue, PersistentQueue, SegmentDiskQueue, WriteFile
 
 class test_Queues(dirs.DirsMixin, unittest.TestCase):
 
@@ -144,4 +144,52 @@ class test_Queues(dirs.DirsMixin, unittest.TestCase):
         self._test_helper(PersistentQueue(MemoryQueue(3),
                                           DiskQueue('fake_dir', 5)))
 
+    def testSegmentDiskQueue(self):
+        self._test_helper(SegmentDiskQueue('fake_dir', maxItems=8,
+                                           segmentItems=3))
+
+    def testPersistentSegmentDiskQueue(self):
+        self._test_helper(PersistentQueue(MemoryQueue(3),
+            SegmentDiskQueue('fake_dir', 5, segmentItems=2)))
+
+    def testSegmentDiskQueueReload(self):
+        q = SegmentDiskQueue('fake_dir', 10, segmentItems=2)
+        for i in range(5):
+            q.pushItem(i)
+        self.assertEqual([0, 1, 2], q.popChunk(3))
+        self.assertEqual(None, q.insertBackChunk(['a', 'b']))
+        q.save()
+
+        q = SegmentDiskQueue('fake_dir', 10, segmentItems=2)
+        self.assertEqual(['a', 'b', 3, 4], q.items())
+        self.assertEqual(4, q.nbItems())
+        self.assertEqual(['a'], q.popChunk(1))
+        q.pushItem(5)
+        q.save()
+
+        q = SegmentDiskQueue('fake_dir', 10, segmentItems=2)
+        self.assertEqual(['b', 3, 4, 5], q.popChunk())
+        self.assertEqual(0, q.nbItems())
+
+    def testSegmentDiskQueueIncompleteRecord(self):
+        q = SegmentDiskQueue('fake_dir', 10, pickleFn=str, unpickleFn=str)
+        q.pushItem('foo')
+        q.save()
+        # a write interrupted by a crash
+        with open(os.path.join('fake_dir', 'segment-0'), 'ab') as f:
+            f.write('\x00\x00\x00\x09ba')
+
+        q = SegmentDiskQueue('fake_dir', 10, pickleFn=str, unpickleFn=str)
+        self.assertEqual(['foo'], q.items())
+        q.pushItem('bar')
+        self.assertEqual(['foo', 'bar'], q.popChunk())
+
+    def testSegmentDiskQueueFromDiskQueue(self):
+        WriteFile(os.path.join('fake_dir', '3'), 'foo3')
+        WriteFile(os.path.join('fake_dir', '5'), 'foo5')
+        WriteFile(os.path.join('fake_dir', '8'), 'foo8')
+        q = SegmentDiskQueue('fake_dir', 5, pickleFn=str, unpickleFn=str)
+        self.assertEqual(['segment-0'], os.listdir('fake_dir'))
+        self.assertEqual(['foo3', 'foo5', 'foo8'], q.popChunk())
+
 # vim: set ts=4 sts=4 sw=4 et:
@@ -0,0 +1,282 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import hashlib
+import hmac
+import urlparse
+
+import mock
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from buildbot.status import status_push
+from buildbot.status.status_queue import QueuedStatusPush
+from buildbot.util import json
+
+
+class FakeStatus(object):
+
+    def getTitle(self):
+        return 'Katana'
+
+    def getBuildbotURL(self):
+        return 'http://katana/'
+
+
+class FakeBuilder(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.asDictCalls = 0
+
+    def asDict(self):
+        self.asDictCalls += 1
+        return {'name': self.name, 'slaves': [], 'state': 'idle'}
+
+
+class TestStatusPushEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(status_push, 'reactor', self.clock)
+        self.patch(status_push, 'eventEncoder', status_push.EventEncoder())
+
+    def makePush(self, cls=status_push.HttpStatusPush, **kwargs):
+        if cls is status_push.HttpStatusPush:
+            kwargs.setdefault('serverUrl', 'http://receiver/')
+        push = cls(maxDiskItems=0, bufferDelay=10, **kwargs)
+        push.status = FakeStatus()
+        self.addCleanup(self.cancelTask, push)
+        return push
+
+    def cancelTask(self, push):
+        if push.task and push.task.active():
+            push.task.cancel()
+
+    def queuedPackets(self, push):
+        items = push.queue.popChunk(push.queue.nbItems())
+        push.queue.insertBackChunk(items)
+        return [json.loads(item.data) for item in items]
+
+    def test_push_encodes_once_for_all_receivers(self):
+        pushes = [self.makePush(), self.makePush()]
+        pushes[1].state['next_id'] = 7
+        builder = FakeBuilder('b1')
+        for push in pushes:
+            push.builderAdded('b1', builder, 'b1')
+
+        # converted after the status event is dispatched
+        self.assertEqual(builder.asDictCalls, 0)
+        self.clock.advance(0)
+        self.assertEqual(builder.asDictCalls, 1)
+
+        packets = [self.queuedPackets(push) for push in pushes]
+        self.assertEqual([p['id'] for p in packets[0] + packets[1]], [1, 7])
+        self.assertEqual(packets[0][0]['event'], 'builderAdded')
+        self.assertEqual(packets[0][0]['project'], 'Katana')
+        self.assertEqual(packets[0][0]['payload'],
+                         {'builderName': 'b1',
+                          'builder': {'name': 'b1', 'state': 'idle'}})
+        self.assertEqual(packets[0][0]['payload'], packets[1][0]['payload'])
+        self.assertEqual(pushes[0].task.getTime(), 10)
+
+    def pendingObjects(self, push):
+        return [[obj for name, obj in payload]
+                for packet, payload in push.pending]
+
+    def test_push_encodes_each_event_separately(self):
+        pushes = [self.makePush(), self.makePush()]
+        builder = FakeBuilder('b1')
+        # the same object in two events, then the same event twice, in one
+        # reactor turn
+        for event in ('builderAdded', 'builderAdded', 'builderRemoved'):
+            for push in pushes:
+                push.push(event, builder=builder)
+
+        objects = [self.pendingObjects(push) for push in pushes]
+        self.assertEqual(objects[0], objects[1])
+        encoded = [objs[0] for objs in objects[0]]
+        self.assertEqual(len(set(map(id, encoded))), 3)
+
+        self.clock.advance(0)
+        self.assertEqual(builder.asDictCalls, 3)
+        self.assertEqual([p['event'] for p in self.queuedPackets(pushes[1])],
+                         ['builderAdded', 'builderAdded', 'builderRemoved'])
+
+    def test_push_keeps_order_of_events(self):
+        push = self.makePush()
+        push.builderChangedState('b1', 'building')
+        push.builderChangedState('b1', 'idle')
+        self.clock.advance(0)
+        self.assertEqual([(p['id'], p['payload']['state'])
+                          for p in self.queuedPackets(push)],
+                         [(1, 'building'), (2, 'idle')])
+
+    def test_push_unfiltered(self):
+        push = self.makePush(filter=False)
+        push.push('event', builder=FakeBuilder('b1'))
+        self.clock.advance(0)
+        self.assertEqual(self.queuedPackets(push)[0]['payload'],
+                         {'builder': {'name': 'b1', 'slaves': [],
+                                      'state': 'idle'}})
+
+    def test_push_encoding_failure(self):
+        push = self.makePush()
+        push.push('bad', obj=object())
+        push.push('good', obj='x')
+        self.clock.advance(0)
+        self.assertEqual([p['event'] for p in self.queuedPackets(push)],
+                         ['good'])
+        self.assertEqual(len(self.flushLoggedErrors(TypeError)), 1)
+
+    def test_blackList(self):
+        push = self.makePush(blackList=['builderChangedState'])
+        push.builderChangedState('b1', 'idle')
+        self.assertEqual(push.pending, [])
+        self.assertEqual(push.encodeCall, None)
+
+    def fillQueue(self, push, sizes):
+        for size in sizes:
+            push.push('event', text='x' * size)
+        push.encodePending()
+
+    def test_http_popChunk_by_size(self):
+        push = self.makePush(maxHttpRequestSize=800,
+                             extra_post_params={'key': 'a b'})
+        self.fillQueue(push, [100, 100, 100, 1000, 100])
+
+        data, items = push.popChunk()
+        params = urlparse.parse_qs(data)
+        self.assertEqual(params['key'], ['a b'])
+        packets = json.loads(params['packets'][0])
+        self.assertEqual([p['id'] for p in packets], [1, 2])
+        self.assertEqual([item.id for item in items], [1, 2])
+        self.assertTrue(len(data) < 800)
+
+        # the third packet does not fit with the large one, which is dropped
+        data, items = push.popChunk()
+        self.assertEqual([item.id for item in items], [3])
+        data, items = push.popChunk()
+        self.assertEqual([item.id for item in items], [5])
+        self.assertEqual(push.queue.nbItems(), 0)
+
+    def test_http_popChunk_legacy_items(self):
+        push = self.makePush()
+        packet = {'id': 3, 'event': 'buildFinished', 'payload': {'x': 1}}
+        push.queue.pushItem(packet)
+        data, items = push.popChunk()
+        self.assertEqual(json.loads(urlparse.parse_qs(data)['packets'][0]),
+                         [packet])
+        self.assertEqual((items[0].id, items[0].event), (3, 'buildFinished'))
+
+    def test_http_popChunk_debug(self):
+        push = self.makePush(debug=True)
+        self.fillQueue(push, [1, 2])
+        data, items = push.popChunk()
+        packets = urlparse.parse_qs(data)['packets'][0]
+        self.assertIn('\n', packets)
+        self.assertEqual([p['payload'] for p in json.loads(packets)],
+                         [{'text': 'x'}, {'text': 'xx'}])
+
+    def test_queued_popChunk(self):
+        class WrappedStatusPush(QueuedStatusPush):
+            def formatPackets(self, packets):
+                return '{"packets":%s}' % (packets,)
+        push = self.makePush(WrappedStatusPush, maxPushSize=600)
+        self.fillQueue(push, [100, 100, 100])
+
+        data, items = push.popChunk()
+        self.assertEqual([p['id'] for p in json.loads(data)['packets']],
+                         [1, 2])
+        self.assertEqual(push.queue.nbItems(), 1)
+
+
+class FakeRelayProtocol(object):
+
+    connected = True
+
+    def __init__(self):
+        self.messages = []
+
+    def sendMessage(self, msg):
+        self.messages.append(json.loads(msg))
+
+
+class TestAutobahnResourcePush(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(status_push, 'reactor', self.clock)
+        self.patch(status_push.AutobahnStatusPush, 'connectToAutobahn', lambda self: None)
+        self.push = status_push.AutobahnStatusPush('relay', 8010, pushSecret='secret',
+                                                   maxDiskItems=0)
+        self.push.status = FakeStatus()
+        self.protocol = FakeRelayProtocol()
+        self.push.setProtocolInstance(self.protocol)
+        self.addCleanup(self.push.resources.stop)
+
+    def relayMessage(self, cmd, data):
+        self.push.relayMessage(self.protocol, json.dumps({'cmd': cmd, 'data': data}))
+
+    def test_authentication(self):
+        self.push.relayOpened(self.protocol)
+        self.assertEqual(self.protocol.messages, [
+            {'cmd': 'krtServerHello', 'data': {'server': 'http://katana/'}}])
+
+        self.relayMessage('krtAuthChallenge', {'nonce': 'abcd'})
+        expected = hmac.new('secret', 'abcd http://katana/', hashlib.sha256).hexdigest()
+        self.assertEqual(self.protocol.messages[-1], {
+            'cmd': 'krtAuthResponse', 'data': {'response': expected}})
+
+    def test_without_push_secret(self):
+        self.push.pushSecret = None
+        self.push.relayOpened(self.protocol)
+        self.relayMessage('krtAuthChallenge', {'nonce': 'abcd'})
+        self.relayMessage('krtSubscribeResources', {'urls': ['http://katana/json/builders']})
+        self.assertEqual(self.protocol.messages, [])
+        self.assertEqual(self.push.resources.resources, {})
+
+    def test_subscriptions(self):
+        self.relayMessage('krtSubscribeResources', {'urls': [
+            'http://katana/json/builders?as_text=1', 'http://other/json/builders']})
+        self.assertEqual(self.push.resources.resources, {
+            'http://katana/json/builders?as_text=1': ('json/builders?as_text=1', None)})
+        self.assertEqual(self.protocol.messages, [
+            {'cmd': 'krtRefuseResources', 'data': {'urls': ['http://other/json/builders']}}])
+
+        self.relayMessage('krtUnsubscribeResources', {'urls': [
+            'http://katana/json/builders?as_text=1']})
+        self.assertEqual(self.push.resources.resources, {})
+
+    def test_subscriptions_dropped_on_close(self):
+        self.relayMessage('krtSubscribeResources', {'urls': ['http://katana/json/builders']})
+        self.push.relayClosed(self.protocol)
+        self.assertEqual(self.push.resources.resources, {})
+
+    def test_pushResources(self):
+        self.push.pushResources(
+            [('http://katana/json/builders', '"etag1"', '{"b1":{"state":"idle"}}')],
+            ['http://katana/json/mybuilds'])
+        self.assertEqual(self.protocol.messages, [
+            {'cmd': 'krtPushResources',
+             'data': [{'url': 'http://katana/json/builders', 'etag': '"etag1"',
+                       'data': {'b1': {'state': 'idle'}}}]},
+            {'cmd': 'krtRefuseResources', 'data': {'urls': ['http://katana/json/mybuilds']}}])
+
+    def test_getWebStatus(self):
+        webStatus = mock.Mock()
+        self.push.parent = [mock.Mock(spec=[]), webStatus]
+        self.assertIdentical(self.push.getWebStatus(), webStatus)
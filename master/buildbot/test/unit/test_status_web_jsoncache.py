@@ -0,0 +1,175 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+from twisted.web import http
+
+from buildbot.status.web import status_json
+from buildbot.status.web.jsoncache import JsonResponseCache
+from buildbot.test.fake.web import FakeRequest
+
+
+class TestJsonResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = JsonResponseCache(mock.Mock(), _reactor=self.clock)
+
+    def put(self, key, scope, data='{}'):
+        return self.cache.put(key, scope, self.cache.getGeneration(scope), data)
+
+    def test_getKey_ignores_args_order(self):
+        request = mock.Mock(prepath=['json', 'builders'], postpath=[])
+        request.args = {'b': ['1'], 'a': ['2']}
+        key = JsonResponseCache.getKey(request)
+        request.args = {'a': ['2'], 'b': ['1']}
+        self.assertEqual(JsonResponseCache.getKey(request), key)
+
+    def test_put_get(self):
+        self.assertEqual(self.cache.get('k'), None)
+        etag = self.put('k', None, data='{"a":1}')
+        self.assertEqual(self.cache.get('k'), (etag, '{"a":1}'))
+
+    def test_get_expires(self):
+        self.put('k', None)
+        self.clock.advance(self.cache.maxAge)
+        self.assertEqual(self.cache.get('k'), None)
+        self.assertEqual(self.cache.entries, {})
+
+    def test_invalidate_scope(self):
+        self.put('global', None)
+        self.put('builder1', ('builder', 'b1'))
+        self.put('builder2', ('builder', 'b2'))
+
+        self.cache.invalidate(('builder', 'b1'))
+
+        self.assertEqual(self.cache.entries.keys(), ['builder2'])
+
+    def test_put_ignores_responses_rendered_before_invalidation(self):
+        generation = self.cache.getGeneration(('builder', 'b1'))
+        self.cache.invalidate(('builder', 'b1'))
+        self.cache.put('k', ('builder', 'b1'), generation, '{}')
+        self.assertEqual(self.cache.get('k'), None)
+
+    def test_put_evicts_oldest(self):
+        self.cache.maxEntries = 2
+        self.put('k1', None)
+        self.put('k2', None)
+        self.put('k3', None)
+        self.assertEqual(self.cache.entries.keys(), ['k2', 'k3'])
+
+    def test_buildStarted_invalidates_builder_and_slave(self):
+        self.put('builder', ('builder', 'b1'))
+        self.put('slave', ('slave', 's1'))
+        self.put('other', ('slave', 's2'))
+        build = mock.Mock()
+        build.getBuilder.return_value.getName.return_value = 'b1'
+        build.getSlavename.return_value = 's1'
+
+        self.assertIdentical(self.cache.buildStarted('b1', build), self.cache)
+
+        self.assertEqual(self.cache.entries.keys(), ['other'])
+
+    def test_invalidate_delivers_scopes(self):
+        invalidated = []
+        sub = self.cache.subscribeToInvalidations(invalidated.append)
+        self.cache.invalidate(('builder', 'b1'))
+        sub.unsubscribe()
+        self.cache.invalidate(('builder', 'b2'))
+        self.assertEqual(invalidated, [(None, ('builder', 'b1'))])
+
+    def test_slaveConnected_invalidates_slave(self):
+        self.put('slave', ('slave', 's1'))
+        self.put('builder', ('builder', 'b1'))
+        self.cache.slaveConnected('s1')
+        self.assertEqual(self.cache.entries.keys(), ['builder'])
+
+
+class CountingJsonResource(status_json.JsonResource):
+
+    def __init__(self, status):
+        status_json.JsonResource.__init__(self, status)
+        self.calls = 0
+
+    def getCacheScope(self):
+        return ('builder', 'b1')
+
+    def asDict(self, request):
+        self.calls += 1
+        return {'calls': self.calls}
+
+
+class TestJsonResourceResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = JsonResponseCache(mock.Mock())
+        self.resource = CountingJsonResource(None)
+
+    def makeRequest(self, args={}):
+        request = FakeRequest(args=dict(args))
+        request.method = 'GET'
+        request.prepath = ['json', 'counting']
+        request.postpath = []
+        request.site.buildbot_service.jsonResponseCache = self.cache
+        request.setETag = mock.Mock(return_value=None)
+        return request
+
+    @defer.inlineCallbacks
+    def test_render_GET_uses_cache(self):
+        request = self.makeRequest()
+        yield request.test_render(self.resource)
+        request = self.makeRequest()
+        yield request.test_render(self.resource)
+
+        self.assertEqual(request.written, '{"calls":1}')
+        self.assertEqual(self.resource.calls, 1)
+        request.setETag.assert_called_with(self.cache.get(self.cache.getKey(request))[0])
+
+    @defer.inlineCallbacks
+    def test_render_GET_after_invalidation(self):
+        yield self.makeRequest().test_render(self.resource)
+        self.cache.builderChangedState('b1', 'idle')
+        request = self.makeRequest()
+        yield request.test_render(self.resource)
+
+        self.assertEqual(request.written, '{"calls":2}')
+
+    @defer.inlineCallbacks
+    def test_render_GET_different_args(self):
+        yield self.makeRequest().test_render(self.resource)
+        yield self.makeRequest({'compact': ['0']}).test_render(self.resource)
+
+        self.assertEqual(self.resource.calls, 2)
+
+    @defer.inlineCallbacks
+    def test_render_GET_not_modified(self):
+        yield self.makeRequest().test_render(self.resource)
+        request = self.makeRequest()
+        request.setETag.return_value = http.CACHED
+        yield request.test_render(self.resource)
+
+        self.assertEqual(request.written, '')
+
+    @defer.inlineCallbacks
+    def test_render_GET_not_cacheable(self):
+        self.resource.cacheable = False
+        yield self.makeRequest().test_render(self.resource)
+        yield self.makeRequest().test_render(self.resource)
+
+        self.assertEqual(self.resource.calls, 2)
+        self.assertEqual(self.cache.entries, {})
@@ -0,0 +1,165 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+from twisted.web import resource, server
+
+from buildbot.status.web import jsonpush, status_json
+from buildbot.status.web.jsoncache import JsonResponseCache
+from buildbot.util import json
+
+URL = 'http://katana/json/builders/b1?as_text=1'
+
+
+class StateJsonResource(status_json.JsonResource):
+
+    def __init__(self, status):
+        status_json.JsonResource.__init__(self, status)
+        self.state = 'idle'
+        self.calls = 0
+
+    def getCacheScope(self):
+        return ('builder', 'b1')
+
+    def asDict(self, request):
+        self.calls += 1
+        return {'state': self.state}
+
+
+class JsonPushTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = JsonResponseCache(mock.Mock(), _reactor=self.clock)
+        self.builder = StateJsonResource(None)
+        builders = status_json.JsonResource(None)
+        builders.putChild('b1', self.builder)
+        jsonRoot = status_json.JsonResource(None)
+        jsonRoot.putChild('builders', builders)
+        root = resource.Resource()
+        root.putChild('json', jsonRoot)
+        self.webStatus = mock.Mock(jsonResponseCache=self.cache)
+        self.webStatus.site = server.Site(root)
+        self.webStatus.site.buildbot_service = self.webStatus
+
+
+class TestRenderJsonResource(JsonPushTestCase):
+
+    @defer.inlineCallbacks
+    def test_render(self):
+        etag, data = yield jsonpush.renderJsonResource(self.webStatus, 'json/builders/b1?as_text=1')
+        self.assertEqual(json.loads(data), {'state': 'idle'})
+
+        # from the response cache, with the key of the HTTP requests
+        request = mock.Mock(prepath=['json', 'builders', 'b1'], postpath=[],
+                            args={'as_text': ['1']})
+        self.assertEqual(self.cache.get(self.cache.getKey(request)), (etag, data))
+        yield jsonpush.renderJsonResource(self.webStatus, 'json/builders/b1?as_text=1')
+        self.assertEqual(self.builder.calls, 1)
+
+    @defer.inlineCallbacks
+    def test_render_not_cacheable(self):
+        self.builder.cacheable = False
+        response = yield jsonpush.renderJsonResource(self.webStatus, 'json/builders/b1')
+        self.assertEqual(response, None)
+
+    @defer.inlineCallbacks
+    def test_render_not_json(self):
+        response = yield jsonpush.renderJsonResource(self.webStatus, 'builders/b1')
+        self.assertEqual(response, None)
+
+    @defer.inlineCallbacks
+    def test_render_jsonp(self):
+        response = yield jsonpush.renderJsonResource(self.webStatus, 'json/builders/b1?callback=f')
+        self.assertEqual(response, None)
+
+
+class TestJsonResourcePusher(JsonPushTestCase):
+
+    def setUp(self):
+        JsonPushTestCase.setUp(self)
+        self.sent = []
+        self.pusher = jsonpush.JsonResourcePusher(lambda: self.webStatus, self.send,
+                                                  _reactor=self.clock)
+        self.addCleanup(self.pusher.stop)
+
+    def send(self, pushed, refused):
+        self.sent.append(([(url, json.loads(data)) for url, etag, data in pushed],
+                          refused))
+
+    def test_subscribe(self):
+        self.pusher.subscribe([(URL, 'json/builders/b1?as_text=1')])
+        self.clock.advance(0)
+        self.assertEqual(self.sent, [([(URL, {'state': 'idle'})], [])])
+
+    def test_invalidated(self):
+        self.pusher.subscribe([(URL, 'json/builders/b1?as_text=1')])
+        self.clock.advance(0)
+
+        # the invalidations of a second make one push
+        self.builder.state = 'building'
+        self.cache.invalidate(('builder', 'b1'))
+        self.clock.advance(0.5)
+        self.cache.invalidate(('builder', 'b1'))
+        self.clock.advance(0.5)
+        self.assertEqual(self.sent[1:], [([(URL, {'state': 'building'})], [])])
+        self.assertEqual(self.builder.calls, 2)
+
+        # nothing is sent when the response did not change
+        self.cache.builderChangedState('b1', 'building')
+        self.clock.advance(self.pusher.pushDelay)
+        self.assertEqual(self.builder.calls, 3)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_refresh(self):
+        self.pusher.subscribe([(URL, 'json/builders/b1?as_text=1')])
+        self.clock.advance(0)
+
+        # changed without a status event
+        self.builder.state = 'offline'
+        self.clock.advance(self.pusher.refreshInterval)
+        self.assertEqual(self.sent[1:], [([(URL, {'state': 'offline'})], [])])
+
+    def test_unsubscribe(self):
+        self.pusher.subscribe([(URL, 'json/builders/b1?as_text=1')])
+        self.clock.advance(0)
+        self.pusher.unsubscribe([URL])
+        self.builder.state = 'building'
+        self.cache.builderChangedState('b1', 'building')
+        self.clock.advance(self.pusher.refreshInterval)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_refused(self):
+        self.pusher.subscribe([(URL, 'json/builders/b1?as_text=1'),
+                               ('http://katana/builders/b1', 'builders/b1')])
+        self.clock.advance(0)
+        self.assertEqual(self.sent, [([(URL, {'state': 'idle'})], ['http://katana/builders/b1'])])
+        self.assertEqual(self.pusher.resources.keys(), [URL])
+
+    def test_without_web_status(self):
+        self.webStatus = None
+        self.pusher.subscribe([(URL, 'json/builders/b1?as_text=1')])
+        self.clock.advance(0)
+        self.assertEqual(self.sent, [([], [URL])])
+
+    def test_render_failure(self):
+        self.builder.asDict = mock.Mock(side_effect=RuntimeError('oops'))
+        self.pusher.subscribe([(URL, 'json/builders/b1?as_text=1')])
+        self.clock.advance(0)
+        self.assertEqual(self.sent, [([], [URL])])
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
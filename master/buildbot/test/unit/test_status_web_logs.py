@@ -17,11 +17,17 @@ from buildbot.status.web.jsontestresults import JSONTestResource
 from buildbot.status.buildstep import BuildStepStatus
 from buildbot.status.build import BuildStatus
 from buildbot.status.logfile import HTMLLogFile, LogFile
-from buildbot.status.web.logs import LogsResource, HTMLLog, TextLog
+from buildbot.status.web.logs import LogsResource, HTMLLog, TextLog, TextProducer, parseRange
 
+import os
 import mock
+from buildbot import config
+from buildbot.status import logfile
 from buildbot.status.web.xmltestresults import XMLTestResource
+from buildbot.test.fake.web import FakeRequest
+from buildbot.test.util import dirs
 from twisted.trial import unittest
+from twisted.web import http, server
 from twisted.web.resource import NoResource
 
 
@@ -103,6 +109,13 @@ class TestLogsResource(unittest.TestCase):
 
         self.assertIsInstance(res, TextLog)
 
+    def test_log_resource_no_html_log_file_not_read(self):
+        st = self.setupStatus("test", "test content", True, html_log=False)
+        self.logs[0].getText = mock.Mock()
+        LogsResource(st).getChild("test", "")
+
+        self.assertFalse(self.logs[0].getText.called)
+
     def test_log_resource_no_logs(self):
         logs_resource = LogsResource(self.setupStatus())
         res = logs_resource.getChild("test1", "")
@@ -114,3 +127,114 @@ class TestLogsResource(unittest.TestCase):
         htmllog = HTMLLogFile(step, "example", "test file", "test html")
 
         self.assertEquals(htmllog.content_type, "")
+
+
+class TestTextLog(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        step = mock.Mock(name='build_step_status')
+        step.getName.return_value = 'compile'
+        self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.log = logfile.LogFile(step, 'stdio', '123-stdio')
+        self.log.master = mock.Mock()
+        self.log.master.config = config.MasterConfig()
+        for i in range(100):
+            self.log.addHeader('header %d\n' % i)
+            self.log.addStdout('line %d\n' % i)
+        self.log.finish()
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def render(self, path='plaintext', args={}, range=None):
+        resource = TextLog(self.log).getChild(path, None)
+        req = FakeRequest(args=args)
+        req.getHeader = lambda name: range if name == 'range' else None
+        req.headers = {}
+        req.setHeader = req.headers.__setitem__
+        result = resource.render_GET(req)
+        if result == server.NOT_DONE_YET:
+            producer = req.registerProducer.call_args[0][0]
+            while not req.finished:
+                producer.resumeProducing()
+        else:
+            req.write(result)
+        return req
+
+    def test_plaintext(self):
+        req = self.render()
+        self.assertEqual(req.written, self.log.getText())
+        self.assertEqual(req.headers['Content-Length'],
+                         str(len(req.written)))
+        self.assertEqual(req.headers['Accept-Ranges'], 'bytes')
+
+    def test_download_with_headers(self):
+        req = self.render('download_with_headers')
+        self.assertEqual(req.written, self.log.getTextWithHeaders())
+        self.assertEqual(req.headers['Content-Disposition'],
+                         'attachment; filename ="compile_stdio_with_headers.log"')
+
+    def test_tail(self):
+        req = self.render(args={'tail': ['3']})
+        self.assertEqual(req.written, 'line 97\nline 98\nline 99\n')
+
+    def test_offset(self):
+        req = self.render('plaintext_with_headers', args={'offset': ['196']})
+        self.assertEqual(req.written,
+                         'header 98\nline 98\nheader 99\nline 99\n')
+
+    def test_tail_and_offset(self):
+        req = self.render(args={'tail': ['3'], 'offset': ['98']})
+        self.assertEqual(req.written, 'line 98\nline 99\n')
+
+    def test_invalid_tail(self):
+        req = self.render(args={'tail': ['x']})
+        self.assertEqual(req.written, self.log.getText())
+
+    def test_range(self):
+        text = self.log.getText()
+        req = self.render(range='bytes=10-19')
+        self.assertEqual(req.written, text[10:20])
+        req.setResponseCode.assert_called_with(http.PARTIAL_CONTENT)
+        self.assertEqual(req.headers['Content-Range'],
+                         'bytes 10-19/%d' % len(text))
+        self.assertEqual(req.headers['Content-Length'], '10')
+
+    def test_range_suffix(self):
+        req = self.render(range='bytes=-8')
+        self.assertEqual(req.written, 'line 99\n')
+
+    def test_range_not_satisfiable(self):
+        length = len(self.log.getText())
+        req = self.render(range='bytes=%d-' % length)
+        self.assertEqual(req.written, '')
+        req.setResponseCode.assert_called_with(
+            http.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(req.headers['Content-Range'], 'bytes */%d' % length)
+
+    def test_range_ignored(self):
+        req = self.render(range='bytes=0-1,5-6')
+        self.assertEqual(req.written, self.log.getText())
+        self.assertFalse(req.setResponseCode.called)
+
+    def test_stream_bounded(self):
+        self.patch(TextProducer, 'bufferSize', 100)
+        resource = TextLog(self.log).getChild('plaintext', None)
+        req = FakeRequest()
+        req.getHeader = lambda name: None
+        resource.render_GET(req)
+        producer = req.registerProducer.call_args[0][0]
+        producer.resumeProducing()
+        self.assertTrue(100 <= len(req.written) < 200)
+        self.assertFalse(req.finished)
+
+    def test_parseRange(self):
+        self.assertEqual(parseRange('bytes=0-9', 100), (0, 10))
+        self.assertEqual(parseRange('bytes=90-200', 100), (90, 100))
+        self.assertEqual(parseRange('bytes=50-', 100), (50, 100))
+        self.assertEqual(parseRange('bytes=-10', 100), (90, 100))
+        self.assertEqual(parseRange('bytes=-200', 100), (0, 100))
+        self.assertEqual(parseRange('bytes=9-0', 100), None)
+        self.assertEqual(parseRange('bytes=-', 100), None)
+        self.assertEqual(parseRange('items=0-9', 100), None)
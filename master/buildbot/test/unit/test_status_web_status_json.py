@@ -28,7 +28,7 @@ from buildbot.config import ProjectConfig
 from buildbot.status import master
 from buildbot.test.fake import fakemaster, fakedb
 from buildbot.status.builder import BuilderStatus, PendingBuildsCache
-from buildbot.status.build import BuildStatus
+from buildbot.status.build import BuildStatus, BuildSummary
 from buildbot.status.slave import SlaveStatus
 from buildbot.status.results import SUCCESS
 from buildbot.config import BuilderConfig
@@ -472,9 +472,11 @@ class TestSingleProjectJsonResource(unittest.TestCase):
                                results=None,
                                max_search=2000,
                                useCache=False):
-            return defer.succeed([fakeBuildStatus(self.master, builder, 1)])
+            # as saved by the build stores
+            summary = json.loads(json.dumps(fakeBuildStatus(self.master, builder, 1).getSummary()))
+            return defer.succeed([BuildSummary(builder.builder_status, summary)])
 
-        builder.builder_status.generateFinishedBuildsAsync = mockFinishedBuildsAsync
+        builder.builder_status.generateFinishedBuildSummariesAsync = mockFinishedBuildsAsync
 
         project_json = status_json.SingleProjectJsonResource(self.master_status, self.project)
 
@@ -679,6 +681,7 @@ class TestQueueJsonResource(unittest.TestCase):
         self.request.getHeader = mock.Mock(return_value=None)
         self.request.prepath = ['json', 'buildqueue']
         self.request.path = '/json/buildqueue'
+        self.request.args = {}
 
     @defer.inlineCallbacks
     def test_getQueueJsonResource(self):
@@ -694,6 +697,53 @@ class TestQueueJsonResource(unittest.TestCase):
         queue_json = yield queue.asDict(self.request)
         self.assertEquals((len(queue_json), queue_json[0]['brid']), (1, 1))
 
+    @defer.inlineCallbacks
+    def test_getQueueJsonResourcePages(self):
+        testdata = [fakedb.BuildRequest(id=idx, buildsetid=idx, buildername="bldr1",
+                                        priority=20, submitted_at=1449578391) for idx in xrange(1, 4)]
+
+        testdata += [fakedb.Buildset(id=idx, sourcestampsetid=idx) for idx in xrange(1, 4)]
+        testdata += [fakedb.SourceStamp(sourcestampsetid=idx, branch='branch_%d' % idx) for idx in xrange(1, 4)]
+
+        yield self.master.db.insertTestData(testdata)
+
+        queue = status_json.QueueJsonResource(self.master_status)
+        self.request.args = {'limit': ['2']}
+        queue_json = yield queue.asDict(self.request)
+        self.assertEquals([br['brid'] for br in queue_json], [1, 2])
+
+        self.request.args = {'limit': ['2'], 'after': ['2']}
+        queue_json = yield queue.asDict(self.request)
+        self.assertEquals([br['brid'] for br in queue_json], [3])
+
+    @defer.inlineCallbacks
+    def test_getQueueJsonResourceBadPageArgs(self):
+        testdata = [fakedb.BuildRequest(id=idx, buildsetid=idx, buildername="bldr1",
+                                        priority=20, submitted_at=1449578391) for idx in xrange(1, 4)]
+
+        testdata += [fakedb.Buildset(id=idx, sourcestampsetid=idx) for idx in xrange(1, 4)]
+        testdata += [fakedb.SourceStamp(sourcestampsetid=idx, branch='branch_%d' % idx) for idx in xrange(1, 4)]
+
+        yield self.master.db.insertTestData(testdata)
+
+        queue = status_json.QueueJsonResource(self.master_status)
+        queue.maxLimit = 2
+
+        @defer.inlineCallbacks
+        def brids(**args):
+            self.request.args = dict((k, [v]) for k, v in args.items())
+            queue_json = yield queue.asDict(self.request)
+            defer.returnValue([br['brid'] for br in queue_json])
+
+        # at least one build, not the whole queue
+        self.assertEquals((yield brids(limit='0')), [1])
+        self.assertEquals((yield brids(limit='-5')), [1])
+        # the default limit, clamped to the maximum
+        self.assertEquals((yield brids(limit='abc')), [1, 2])
+        self.assertEquals((yield brids(limit='1000000')), [1, 2])
+        # the first page
+        self.assertEquals((yield brids(limit='1', after='abc')), [1])
+
 
 class TestAliveJsonResource(unittest.TestCase):
     def test_alive(self):
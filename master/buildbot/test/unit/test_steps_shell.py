@@ -552,6 +552,22 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         self.expectLogfile("warnings (2)", "scary: foo\nscary: bar\n")
         return self.runStep()
 
+    def test_chunked_output(self):
+        self.setupStep(shell.WarningCountingShellCommand(command=['make']))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='normal: foo\nwarn')
+            + ExpectShell.log('stdio', stderr='warning: on stderr\n')
+            + ExpectShell.log('stdio', stdout='ing: split\nwarning: last')
+            + 0
+        )
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 3)
+        self.expectLogfile("warnings (3)",
+                "warning: on stderr\nwarning: split\nwarning: last\n")
+        return self.runStep()
+
     def test_maxWarnCount(self):
         self.setupStep(shell.WarningCountingShellCommand(command=['make'],
             maxWarnCount=9))
@@ -754,6 +770,83 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         return self.do_test_suppressions(step, '', stdout, 2,
                                          exp_warning_log)
 
+    def test_suppressions_combined(self):
+        step = shell.WarningCountingShellCommand(command=['make'])
+        step.addSuppression([(None, '.*unused (variable|label).*', None, None),
+                             (None, re.compile('deprecated', re.I), None, None),
+                             ('abc.c', None, None, None),
+                             (None, '(?P<x>foo)', None, None),
+                             (None, '(?P<x>bar)', None, None)])
+        suppressAll, textRe, others = step._getSuppressionMatchers()
+        self.assertFalse(suppressAll)
+        # the named groups clash, so nothing is combined
+        self.assertEqual(textRe, None)
+        self.assertEqual(len(others), 5)
+
+        step.suppressions = step.suppressions[:3]
+        step.suppressionMatchers = None
+        suppressAll, textRe, others = step._getSuppressionMatchers()
+        self.assertEqual(textRe.pattern, '(?:.*unused (variable|label).*)')
+        self.assertEqual([fileRe and fileRe.pattern
+                          for fileRe, warnRe, start, end in others],
+                         [None, 'abc.c'])
+
+        def warningExtractor(step, line, match):
+            return line.split(':', 2)
+        step.warningExtractor = warningExtractor
+        warnings = []
+        for line in ['x.c:1: warning: unused label',
+                     'x.c:2: warning: DEPRECATED',
+                     'abc.c:3: warning: anything',
+                     'x.c:4: warning: seen']:
+            step.maybeAddWarning(warnings, line, None)
+        self.assertEqual(warnings, ['x.c:4: warning: seen'])
+
+        step.addSuppression([(None, None, None, None)])
+        self.assertTrue(step._getSuppressionMatchers()[0])
+
+    def test_suppressions_combined_backreferences(self):
+        step = shell.WarningCountingShellCommand(command=['make'])
+        step.addSuppression([(None, '.*unused (variable|label).*', None, None),
+                             (None, r'.*(foo)\1.*', None, None),
+                             (None, r'.*(?P<x>bar)(?P=x).*', None, None),
+                             (None, r': (<)?baz(?(1)>)$', None, None)])
+        suppressAll, textRe, others = step._getSuppressionMatchers()
+        # only the expression which does not refer to its groups is combined
+        self.assertEqual(textRe.pattern, '(?:.*unused (variable|label).*)')
+        self.assertEqual([warnRe.pattern for _, warnRe, _, _ in others],
+                         [r'.*(foo)\1.*', r'.*(?P<x>bar)(?P=x).*',
+                          r': (<)?baz(?(1)>)$'])
+
+        def warningExtractor(step, line, match):
+            return line.split(':', 2)
+        step.warningExtractor = warningExtractor
+        warnings = []
+        for line in ['x.c:1: warning: unused label',
+                     'x.c:2: warning: foofoo',
+                     'x.c:3: warning: foo',
+                     'x.c:4: warning: barbar',
+                     'x.c:5: warning: <baz>',
+                     'x.c:6: warning: <baz']:
+            step.maybeAddWarning(warnings, line, None)
+        self.assertEqual(warnings, ['x.c:3: warning: foo',
+                                    'x.c:6: warning: <baz'])
+
+    def test_WarningCountingLogObserver(self):
+        step = shell.WarningCountingShellCommand(command=['make'])
+        obs = shell.WarningCountingLogObserver()
+        obs.step = step
+        obs.outReceived("make: Entering directory 'src'\nwarning: one\n")
+        obs.outReceived("make: Leaving directory 'src'\nwarning: t")
+        obs.errReceived("warning: three\n")
+        obs.outReceived("wo")
+        self.assertEqual(obs.warnings, ['warning: one', 'warning: three'])
+        self.assertEqual(step.directoryStack, [])
+        obs.finish()
+        self.assertEqual(obs.warnings, ['warning: one', 'warning: three',
+                                        'warning: two'])
+        self.assertEqual(step.warnCount, 3)
+
     def test_warnExtractFromRegexpGroups(self):
         step = shell.WarningCountingShellCommand(command=['make'])
         we = shell.WarningCountingShellCommand.warnExtractFromRegexpGroups
@@ -19,6 +19,7 @@ import tempfile, os
 import shutil
 import tarfile
 from twisted.trial import unittest
+from twisted.internet import defer
 import ast
 
 from mock import Mock
@@ -26,7 +27,7 @@ from mock import Mock
 from buildbot.process.properties import Properties
 from buildbot.util import json
 from buildbot.steps import transfer
-from buildbot.status.results import SUCCESS
+from buildbot.status.results import SUCCESS, FAILURE
 from buildbot import config
 from buildbot.test.util import steps
 from buildbot.test.fake.remotecommand import Expect, ExpectRemoteRef
@@ -144,6 +145,34 @@ class TestFileUpload(unittest.TestCase):
         s.step_status.addURL.assert_called_once_with(
             os.path.basename(self.destfile), "http://server/file")
 
+    @defer.inlineCallbacks
+    def testPipeline(self):
+        s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile)
+        s.build = Mock()
+        s.build.getProperties.return_value = Properties()
+        s.build.getSlaveCommandVersion.return_value = "2.19"
+
+        s.step_status = Mock()
+        s.buildslave = Mock()
+        s.remote = Mock()
+        s.start()
+
+        kwargs = s.remote.method_calls[0][1][-1]
+        self.assertEqual((kwargs['pipeline'], kwargs['maxblocksize']),
+                         (4, 512*1024))
+        writer = kwargs['writer']
+        with open(__file__, "rb") as f:
+            data = f.read()
+        # the writes are done in order, in a thread
+        yield defer.gatherResults([writer.remote_write(data[:100]),
+                                   writer.remote_write(data[100:])])
+        self.assert_(not os.path.exists(self.destfile))
+        yield writer.remote_close()
+
+        with open(self.destfile, "rb") as dest:
+            self.assertEquals(dest.read(), data)
+        self.assertEqual(writer.stats.bytes, len(data))
+
 class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
     def setUp(self):
         self.destdir = os.path.abspath('destdir')
@@ -158,17 +187,24 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
 
         return self.tearDownBuildStep()
 
+    def makeArchive(self):
+        from cStringIO import StringIO
+        f = StringIO()
+        archive = tarfile.TarFile(fileobj=f, name='fake.tar', mode='w')
+        info = tarfile.TarInfo("test")
+        info.size = len("Hello World!")
+        archive.addfile(info, StringIO("Hello World!"))
+        archive.close()
+        return f.getvalue()
+
     def testBasic(self):
         self.setupStep(
-            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir))
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir),
+            slave_version={'*': "2.18"})
 
         def upload_behavior(command):
-            from cStringIO import StringIO
-            f = StringIO()
-            archive = tarfile.TarFile(fileobj=f, name='fake.tar', mode='w')
-            archive.addfile(tarfile.TarInfo("test"), StringIO("Hello World!"))
             writer = command.args['writer']
-            writer.remote_write(f.getvalue())
+            writer.remote_write(self.makeArchive())
             writer.remote_unpack()
 
         self.expectCommands(
@@ -183,6 +219,66 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    def testPipeline(self):
+        self.setupStep(
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir))
+
+        @defer.inlineCallbacks
+        def upload_behavior(command):
+            writer = command.args['writer']
+            data = self.makeArchive()
+            # several blocks in flight
+            writes = [writer.remote_write(data[i:i + 1000])
+                      for i in range(0, len(data), 1000)]
+            yield defer.gatherResults(writes)
+            yield writer.remote_unpack()
+
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress=None, maxsize=None,
+                pipeline=4, maxblocksize=512*1024,
+                writer=ExpectRemoteRef(transfer._DirectoryStreamWriter)))
+            + Expect.behavior(upload_behavior)
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
+        d = self.runStep()
+        @d.addCallback
+        def check(_):
+            with open(os.path.join(self.destdir, "test")) as f:
+                self.assertEqual(f.read(), "Hello World!")
+            self.assertEqual(self.step_statistics['transfer_bytes'],
+                             len(self.makeArchive()))
+        return d
+
+    def testPipelineCorrupted(self):
+        self.setupStep(
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir))
+
+        @defer.inlineCallbacks
+        def upload_behavior(command):
+            writer = command.args['writer']
+            try:
+                yield writer.remote_write("not a tarball" * 100)
+                yield writer.remote_unpack()
+            except tarfile.TarError:
+                pass
+            else:
+                self.fail("the upload did not fail")
+
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress=None, maxsize=None,
+                pipeline=4, maxblocksize=512*1024,
+                writer=ExpectRemoteRef(transfer._DirectoryStreamWriter)))
+            + Expect.behavior(upload_behavior)
+            + 1)
+
+        self.expectOutcome(result=FAILURE, status_text=["uploading", "srcdir"])
+        return self.runStep()
+
 class TestStringDownload(unittest.TestCase):
     def testBasic(self):
         s = transfer.StringDownload("Hello World", "hello.txt")
@@ -0,0 +1,66 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from buildbot.test.util import distributorbenchmark
+
+
+class TestPercentile(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(distributorbenchmark.percentile([], 50), None)
+
+    def test_percentiles(self):
+        values = range(100, 0, -1)
+        self.assertEqual(distributorbenchmark.percentile(values, 50), 50)
+        self.assertEqual(distributorbenchmark.percentile(values, 95), 95)
+        self.assertEqual(distributorbenchmark.percentile(values, 99), 99)
+        self.assertEqual(distributorbenchmark.percentile(values, 0), 1)
+
+    def test_single_value(self):
+        self.assertEqual(distributorbenchmark.percentile([3.5], 99), 3.5)
+
+
+class TestCompareWithBaseline(unittest.TestCase):
+
+    baseline = dict(time_to_claim=dict(p50=1.0, p95=2.0, p99=3.0),
+                    db_queries_per_decision=4.0,
+                    decisions_per_second=100.0)
+
+    def result(self, **kwargs):
+        result = dict(time_to_claim=dict(self.baseline['time_to_claim']),
+                      db_queries_per_decision=self.baseline['db_queries_per_decision'],
+                      decisions_per_second=self.baseline['decisions_per_second'])
+        for name, value in kwargs.iteritems():
+            if name.startswith('p'):
+                result['time_to_claim'][name] = value
+            else:
+                result[name] = value
+        return result
+
+    def test_within_tolerance(self):
+        result = self.result(p95=2.3, db_queries_per_decision=3.0, decisions_per_second=85.0)
+        self.assertEqual(distributorbenchmark.compareWithBaseline(result, self.baseline, 0.2), [])
+
+    def test_regressions(self):
+        result = self.result(p99=4.0, db_queries_per_decision=5.0, decisions_per_second=70.0)
+        regressions = distributorbenchmark.compareWithBaseline(result, self.baseline, 0.2)
+        self.assertEqual([r.split(':')[0] for r in regressions],
+                         ['time_to_claim.p99', 'db_queries_per_decision', 'decisions_per_second'])
+
+    def test_missing_metrics(self):
+        result = dict(decisions_per_second=10.0)
+        regressions = distributorbenchmark.compareWithBaseline(result, dict(time_to_claim={}), 0.2)
+        self.assertEqual(regressions, [])
@@ -248,6 +248,21 @@ class LRUCacheTest(unittest.TestCase):
         self.assertEqual(self.lru.get('p'), set(['PPP']))
         self.assertEqual(self.lru.get('q'), set(['QQQ'])) # not updated
 
+    def test_contains(self):
+        self.assertFalse('a' in self.lru)
+        val = self.lru.get('a')
+        self.assertTrue('a' in self.lru)
+        self.assertEqual(self.lru.misses, 1)
+        self.assertEqual(self.lru.hits, 0)
+
+        # still there as a weakref after being expelled
+        for k in 'bcd':
+            self.lru.get(k)
+        self.assertTrue('a' in self.lru)
+        del(val)
+        gc.collect()
+        self.assertFalse('a' in self.lru)
+
 
 class AsyncLRUCacheTest(unittest.TestCase):
 
@@ -0,0 +1,242 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import math
+import os
+import time
+
+from twisted.internet import defer
+from twisted.python import log
+
+from buildbot.process import buildrequestdistributor
+from buildbot.process.buildrequest import Priority
+from buildbot.test.util.katanabuildrequestdistributor import KatanaBuildRequestDistributorTestSetup
+from buildbot.util import json
+
+# metrics compared with the baseline, and whether a higher value is better
+BASELINE_METRICS = [
+    ('time_to_claim.p50', False),
+    ('time_to_claim.p95', False),
+    ('time_to_claim.p99', False),
+    ('db_queries_per_decision', False),
+    ('decisions_per_second', True),
+]
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile C{p} (0-100) of C{values}, or None if there are
+    no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def getMetric(result, name):
+    value = result
+    for key in name.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compareWithBaseline(result, baseline, tolerance):
+    """
+    Compare the metrics of a benchmark result with the baseline result of the
+    same benchmark.
+
+    @param tolerance: relative change allowed before a metric is reported,
+    e.g. 0.2 for 20%
+    @returns: list of messages describing the regressions
+    """
+    regressions = []
+    for name, higherIsBetter in BASELINE_METRICS:
+        value, reference = getMetric(result, name), getMetric(baseline, name)
+        if value is None or reference is None:
+            continue
+
+        if higherIsBetter:
+            regressed = value < reference * (1 - tolerance)
+        else:
+            regressed = value > reference * (1 + tolerance)
+
+        if regressed:
+            regressions.append("%s: %.4f, baseline %.4f" % (name, value, reference))
+    return regressions
+
+
+class Farm(object):
+    """
+    Description of a synthetic build farm: C{builders} builders sharing a
+    pool of C{slaves} slaves, each with C{queueDepth} pending build requests.
+
+    @ivar priorities: priorities given in turn to the requests of a builder
+    @ivar selectedSlaveRatio: fraction of the requests with a selected slave
+    @ivar mergeRatio: fraction of the requests with identical sourcestamps,
+    which can be merged into a single build
+    """
+
+    def __init__(self, name, builders, slaves, queueDepth,
+                 priorities=(Priority.Default,), selectedSlaveRatio=0.0, mergeRatio=0.0):
+        self.name = name
+        self.builders = builders
+        self.slaves = slaves
+        self.queueDepth = queueDepth
+        self.priorities = priorities
+        self.selectedSlaveRatio = selectedSlaveRatio
+        self.mergeRatio = mergeRatio
+
+    def asDict(self):
+        return dict(builders=self.builders, slaves=self.slaves, queueDepth=self.queueDepth,
+                    priorities=list(self.priorities), selectedSlaveRatio=self.selectedSlaveRatio,
+                    mergeRatio=self.mergeRatio)
+
+
+class DistributorBenchmarkMixin(KatanaBuildRequestDistributorTestSetup):
+    """
+    Runs the katana build request distributor against a generated L{Farm} and
+    measures the time each request waits before being handed to a slave
+    (time-to-claim), the database round trips per scheduling decision and the
+    decisions per second.
+
+    The database is a SQLite file, or the database in BUILDBOT_TEST_DB_URL
+    (e.g. MySQL).  If BUILDBOT_BENCHMARK_RESULTS is set, the results are saved
+    to that JSON file, keyed by farm name.  If BUILDBOT_BENCHMARK_BASELINE is
+    set, the results are compared with the results saved in that file and the
+    test fails on a regression larger than BUILDBOT_BENCHMARK_TOLERANCE
+    (0.2 by default).
+    """
+
+    reconcileInterval = buildrequestdistributor.KatanaBuildChooser.RECONCILE_INTERVAL
+    mergeableSources = [{'repository': 'repo1', 'codebase': 'cb1', 'branch': 'master', 'revision': 'asz3113'}]
+
+    @defer.inlineCallbacks
+    def setUpBenchmark(self):
+        yield self.setUpComponents(sqlite_memory=False)
+        # the farm is inserted before the run, keep the production reconcile
+        # interval so the queues are loaded once as on a real master
+        self.patch(buildrequestdistributor.KatanaBuildChooser, 'RECONCILE_INTERVAL',
+                   self.reconcileInterval)
+        self.setUpKatanaBuildRequestDistributor()
+        self.claimTimes = []
+        self.decisions = []
+        self.benchmarkStarted = None
+
+        logDBRoundTrips = self.brd._logDBRoundTrips
+
+        def recordDecision(decision, counter):
+            roundTrips = logDBRoundTrips(decision, counter)
+            self.decisions.append(roundTrips)
+            return roundTrips
+        self.brd._logDBRoundTrips = recordDecision
+
+    @defer.inlineCallbacks
+    def tearDownBenchmark(self):
+        if self.brd.running:
+            yield self.brd.stopService()
+        yield self.tearDownComponents()
+
+    def addProcessedBuilds(self, slavebuilder, breqs):
+        if self.benchmarkStarted is not None:
+            claimed = time.time() - self.benchmarkStarted
+            self.claimTimes.extend([claimed] * len(breqs))
+        return KatanaBuildRequestDistributorTestSetup.addProcessedBuilds(self, slavebuilder, breqs)
+
+    def generateFarm(self, farm):
+        self.initialized()
+        slavenames = self.createSlaveList(available=True, xrange=xrange(farm.slaves))
+        pool = sorted(slavenames)
+
+        for idx in xrange(farm.builders):
+            buildername = 'bldr%d' % idx
+            self.setupBuilderInMaster(name=buildername, slavenames=slavenames)
+
+            merged = int(farm.queueDepth * farm.mergeRatio)
+            selected = int(farm.queueDepth * farm.selectedSlaveRatio)
+            for n in xrange(farm.queueDepth):
+                priority = farm.priorities[n % len(farm.priorities)]
+                if n < merged:
+                    self.insertBuildrequests(buildername, priority, xrange(1, 2),
+                                             sources=self.mergeableSources)
+                elif n < merged + selected:
+                    self.insertBuildrequests(buildername, priority, xrange(1, 2),
+                                             selected_slave=pool[(idx + n) % len(pool)])
+                else:
+                    self.insertBuildrequests(buildername, priority, xrange(1, 2))
+
+    @defer.inlineCallbacks
+    def runBenchmark(self, farm):
+        """
+        Generate C{farm}, start as many builds as possible and report the
+        measures.
+
+        @returns: the benchmark result, via Deferred
+        """
+        self.generateFarm(farm)
+        yield self.insertTestData(self.testdata)
+
+        roundTrips = self.db.pool.round_trips
+        self.benchmarkStarted = time.time()
+        yield self.brd._maybeStartOrResumeBuildsOn(new_builders=self.botmaster.builders.keys())
+        elapsed = time.time() - self.benchmarkStarted
+
+        self.checkBRDCleanedUp()
+
+        decisions = len(self.decisions)
+        result = dict(
+            farm=farm.asDict(),
+            db=self.db_engine.dialect.name,
+            requests=self.lastbrid,
+            claimed=len(self.claimTimes),
+            builds=len(self.processedBuilds),
+            decisions=decisions,
+            elapsed=elapsed,
+            decisions_per_second=decisions / elapsed if elapsed else None,
+            db_queries=self.db.pool.round_trips - roundTrips,
+            db_queries_per_decision=float(sum(self.decisions)) / decisions if decisions else None,
+            time_to_claim=dict((name, percentile(self.claimTimes, p))
+                               for name, p in [('p50', 50), ('p95', 95), ('p99', 99)]))
+
+        self.reportBenchmark(farm.name, result)
+        defer.returnValue(result)
+
+    def reportBenchmark(self, name, result):
+        log.msg("benchmark %s: %s" % (name, json.dumps(result, sort_keys=True)))
+
+        path = os.environ.get('BUILDBOT_BENCHMARK_RESULTS')
+        if path:
+            results = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    results = json.load(f)
+            results[name] = result
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=4, sort_keys=True)
+
+        path = os.environ.get('BUILDBOT_BENCHMARK_BASELINE')
+        if path:
+            with open(path) as f:
+                baseline = json.load(f)
+            if name not in baseline:
+                log.msg("benchmark %s has no baseline" % (name,))
+                return
+            tolerance = float(os.environ.get('BUILDBOT_BENCHMARK_TOLERANCE', 0.2))
+            regressions = compareWithBaseline(result, baseline[name], tolerance)
+            if regressions:
+                self.fail("benchmark %s regressed:\n%s" % (name, "\n".join(regressions)))
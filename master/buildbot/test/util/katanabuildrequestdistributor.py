@@ -6,6 +6,7 @@ from buildbot.db import buildrequests, buildsets, sourcestamps, builds
 from buildbot.test.util import connector_component
 from buildbot.process import buildrequestdistributor
 from buildbot.process import cache
+from buildbot.process.slaveavailability import SlaveAvailabilityIndex
 from buildbot.test.fake import fakedb
 from buildbot.status.results import RESUME, BEGINNING
 import cProfile, pstats
@@ -17,10 +18,11 @@ class KatanaBuildRequestDistributorTestSetup(connector_component.ConnectorCompon
     MASTER_ID = 1
 
     @defer.inlineCallbacks
-    def setUpComponents(self):
+    def setUpComponents(self, sqlite_memory=True):
         yield self.setUpConnectorComponent(
             table_names=['buildrequests', 'buildrequest_claims', 'buildsets', 'buildset_properties',
-                         'sourcestamps', 'sourcestamp_changes', 'builds', 'sourcestampsets'])
+                         'sourcestamps', 'sourcestamp_changes', 'builds', 'sourcestampsets'],
+            sqlite_memory=sqlite_memory)
 
         self.db.buildrequests = buildrequests.BuildRequestsConnectorComponent(self.db)
         self.db.buildsets = buildsets.BuildsetsConnectorComponent(self.db)
@@ -29,15 +31,20 @@ class KatanaBuildRequestDistributorTestSetup(connector_component.ConnectorCompon
         self.db.master.getObjectId = lambda : defer.succeed(self.MASTER_ID)
         self.botmaster = mock.Mock(name='botmaster')
         self.botmaster.builders = {}
+        self.botmaster.slaveAvailability = SlaveAvailabilityIndex()
         self.master = self.botmaster.master = mock.Mock(name='master')
         self.master.is_changing_services = False
         self.master.db = self.db
         self.master.caches = cache.CacheManager()
         self.master.config.mergeRequests = None
+        self.master.config.buildStartConcurrency = None
         self.processedBuilds = []
         self.mergedBuilds = []
         self.addRunningBuilds = False
         self.slaves = {}
+        # the tests insert buildrequests straight into the db without
+        # notifying the master, so reload the queues on every pass
+        self.patch(buildrequestdistributor.KatanaBuildChooser, 'RECONCILE_INTERVAL', 0)
 
     def setUpQuietDeferred(self):
         # Detects the "end" of the test
@@ -154,8 +161,19 @@ class KatanaBuildRequestDistributorTestSetup(connector_component.ConnectorCompon
 
         self.addSlavesToList(bldr.slaves, slavenames)
         self.addSlavesToList(bldr.startSlaves, startSlavenames)
+        self.registerIdleSlaves(bldr)
         return bldr
 
+    def registerIdleSlaves(self, bldr):
+        # the mocked slavebuilders are always reported as idle,
+        # the tests control their availability with isAvailable
+        slaveAvailability = self.botmaster.slaveAvailability
+        slaveAvailability.removeBuilder(bldr.name)
+        for sb in bldr.slaves:
+            slaveAvailability.addSlaveBuilder(bldr.name, builder.Slavepool.slavenames, sb)
+        for sb in bldr.startSlaves:
+            slaveAvailability.addSlaveBuilder(bldr.name, builder.Slavepool.startSlavenames, sb)
+
     def setupBuilderInMaster(self, name, slavenames=None, startSlavenames=None,
                              maybeStartBuild=None, maybeResumeBuild=None, addRunningBuilds=False):
         bldr = self.createBuilder(name, slavenames, startSlavenames,
@@ -194,6 +212,7 @@ class KatanaBuildRequestDistributorTestSetup(connector_component.ConnectorCompon
                                               mergebrid=mergebrid,
                                               artifactbrid=artifactbrid,
                                               startbrid=startbrid,
+                                              selected_slave=selected_slave,
                                               submitted_at=submitted_at) for idx in xrange]
 
         if results == RESUME:
@@ -71,6 +71,9 @@ class LRUCache(object):
 
         return result
 
+    def __contains__(self, key):
+        return key in self.cache or key in self.weakrefs
+
     def keys(self):
         return self.cache.keys()
 
@@ -17,6 +17,7 @@ import os.path
 import socket
 import sys
 import signal
+from collections import deque
 
 from twisted.spread import pb
 from twisted.python import log, failure
@@ -29,11 +30,11 @@ import buildslave
 from buildslave.pbutil import ReconnectingPBClientFactory
 from buildslave.commands import registry, base
 from buildslave import monkeypatches
+from buildslave import util
+from buildslave.buildlog import BuildLogWriter
 
 from twisted.python.logfile import LogFile
 
-import json
-
 class UnknownCommand(pb.Error):
     pass
 
@@ -64,10 +65,21 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # if it missed a completedStep during an interrupt.
     prevStep = None
 
+    # the format of the output updates the master asked for with the
+    # 'update_version' argument of the current command; see
+    # RunProcess._sendBuffers
+    updateVersion = 1
+
+    # the most updates of the current command sent to the master and not
+    # acknowledged yet, as asked with the 'update_window' argument; the next
+    # updates wait in pendingUpdates for the acks. 0 sends them all at once.
+    updateWindow = 0
+
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
         self.manifest = None
+        self.resetUpdates()
 
     def __repr__(self):
         return "<SlaveBuilder '%s' at %d>" % (self.name, id(self))
@@ -115,20 +127,12 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self.resetUpdates()
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
     def saveCommandOutputToLog(self, data, time):
-        lines = data.splitlines()
-        messages = []
-
-        for line in lines:
-            buildlog = dict(self.manifest) if self.manifest else {}
-            buildlog['time'] = time
-            buildlog['message'] = line.strip()
-            messages.append(buildlog)
-
-        self.bot.saveOutputToBuildLog(messages)
+        self.bot.saveOutputToBuildLog(self.manifest, data, time)
 
     def remote_startCommand(self, stepref, stepId, command, args):
         """
@@ -151,6 +155,9 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             raise UnknownCommand, "unrecognized SlaveCommand '%s'" % command
 
         self.manifest = args.pop('manifest', {})
+        self.updateVersion = args.pop('update_version', 1)
+        self.updateWindow = args.pop('update_window', 0)
+        self.resetUpdates()
         self.command = factory(self, stepId, args)
 
         log.msg(" startCommand:%s [id %s]" % (command, stepId))
@@ -195,22 +202,81 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         L{buildbot.process.step.RemoteCommand} object, giving it a sequence
         number in the process. It adds the update to a queue, and asks the
         master to acknowledge the update so it can be removed from that
-        queue."""
+        queue. When updateWindow updates are already waiting for their
+        acknowledgement, the update is queued until one of them is
+        acknowledged."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
             # service is running or not. If we aren't running, don't send any
             # status messages.
             return
+        if self.remoteStep:
+            if self.updateWindow and self.unackedUpdates >= self.updateWindow:
+                self.pendingUpdates.append(data)
+                self.updateStats['queued_max'] = max(
+                    self.updateStats['queued_max'], len(self.pendingUpdates))
+                return
+            self._sendUpdate(data)
+
+    def _sendUpdate(self, data):
         # the update[1]=0 comes from the leftover 'updateNum', which the
         # master still expects to receive. Provide it to avoid significant
         # interoperability issues between new slaves and old masters.
-        if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
-            d = self.remoteStep.callRemote("update", updates)
-            d.addCallback(self.ackUpdate)
-            d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+        self._countUpdate(data)
+        self.unackedUpdates += 1
+        update = [data, 0]
+        updates = [update]
+        d = self.remoteStep.callRemote("update", updates)
+        d.addCallback(self.ackUpdate)
+        d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+        d.addCallback(self._updateAcked, self.remoteStep, util.now())
+
+    def resetUpdates(self):
+        self.unackedUpdates = 0
+        self.pendingUpdates = deque()
+        # the failure to send with the 'complete' call once the pending
+        # updates are sent, in a list
+        self.pendingComplete = None
+        self.updateStats = {
+            'updates': 0,
+            'bytes': 0,
+            'wire_bytes': 0,
+            'acks': 0,
+            'ack_seconds': 0.0,
+            'ack_seconds_max': 0.0,
+            'queued_max': 0,
+        }
+
+    def _countUpdate(self, data):
+        stats = self.updateStats
+        stats['updates'] += 1
+        if 'zlogs' in data:
+            compressed, entries = data['zlogs']
+            stats['bytes'] += sum(length for _, length, _ in entries)
+            stats['wire_bytes'] += len(compressed)
+        elif 'logs' in data:
+            size = sum(len(logdata) for _, logdata, _ in data['logs'])
+            stats['bytes'] += size
+            stats['wire_bytes'] += size
+
+    def _updateAcked(self, res, remoteStep, sent):
+        if remoteStep is not self.remoteStep:
+            # an update of a previous command, or the master went away
+            return
+        self.unackedUpdates -= 1
+        stats = self.updateStats
+        elapsed = util.now() - sent
+        stats['acks'] += 1
+        stats['ack_seconds'] += elapsed
+        stats['ack_seconds_max'] = max(stats['ack_seconds_max'], elapsed)
+
+        while self.pendingUpdates and self.unackedUpdates < self.updateWindow:
+            self._sendUpdate(self.pendingUpdates.popleft())
+        if not self.pendingUpdates and self.pendingComplete:
+            failure, = self.pendingComplete
+            self.pendingComplete = None
+            self._sendComplete(failure)
 
     def ackUpdate(self, acknum):
         self.activity() # update the "last activity" timer
@@ -240,12 +306,26 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             log.msg(" but we weren't running, quitting silently")
             return
         if self.remoteStep:
-            self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
-            d = self.remoteStep.callRemote("complete", failure)
-            d.addCallback(self.ackComplete)
-            d.addErrback(self._ackFailed, "sendComplete")
-            self.prevStep = self.remoteStep
-            self.remoteStep = None
+            if self.pendingUpdates:
+                # the master finishes the step on 'complete', so it must
+                # come after the updates
+                self.pendingComplete = [failure]
+                return
+            self._sendComplete(failure)
+
+    def _sendComplete(self, failure):
+        stats = self.updateStats
+        if stats['updates']:
+            log.msg("SlaveBuilder.updateStats", stats)
+            if self.updateVersion >= 3:
+                # the masters which ask for compressed updates record them
+                self._sendUpdate({'update_stats': dict(stats)})
+        self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
+        d = self.remoteStep.callRemote("complete", failure)
+        d.addCallback(self.ackComplete)
+        d.addErrback(self._ackFailed, "sendComplete")
+        self.prevStep = self.remoteStep
+        self.remoteStep = None
 
 
     def remote_shutdown(self):
@@ -259,19 +339,6 @@ class BuildLogFile(LogFile):
     def __init__(self, name, directory, rotateLength=1000000, defaultMode=None, maxRotatedFiles=None):
         LogFile.__init__(self, name, directory, rotateLength, defaultMode, maxRotatedFiles)
 
-    def save(self, messages):
-        for message in messages:
-            self.json_serialize(message)
-
-        self.flush()
-
-    def json_serialize(self, message):
-        try:
-            json.dump(message, self)
-            self.write(os.linesep)
-        except:
-            klog.err_json(failure.Failure(), "Failed to serialize message to json: " + str(message))
-
     def write(self, data):
         """
         Write some data to the file.
@@ -297,8 +364,11 @@ class Bot(pb.Referenceable, service.MultiService):
     """I represent the slave-side bot."""
     usePTY = None
     name = "bot"
+    # seconds between the reports of the build log queue depth
+    buildLogReportInterval = 60
 
-    def __init__(self, basedir, usePTY, unicode_encoding=None):
+    def __init__(self, basedir, usePTY, unicode_encoding=None,
+                 build_log_queue_size=10*1024*1024, build_log_overflow='block'):
         service.MultiService.__init__(self)
         self.basedir = basedir
         self.usePTY = usePTY
@@ -307,13 +377,25 @@ class Bot(pb.Referenceable, service.MultiService):
         self.logsdir = os.path.join(self.basedir, 'builds', 'logs')
         self.buildsLogsFilePath = os.path.join(self.logsdir, 'stdio.log')
         self.buildsLogsFile = None
+        self.buildLogWriter = BuildLogWriter(self.getBuildLogFile,
+                                             build_log_queue_size,
+                                             build_log_overflow)
+        self.buildLogReportLoop = None
 
     def stopService(self):
+        if self.buildLogReportLoop:
+            self.buildLogReportLoop.stop()
+            self.buildLogReportLoop = None
+        self.buildLogWriter.stop()
         self.closeBuildLogFile()
 
     def startService(self):
         assert os.path.isdir(self.basedir)
         self.createBuildsLogFile()
+        self.buildLogWriter.start()
+        self.buildLogReportLoop = l = task.LoopingCall(
+            self.buildLogWriter.reportQueueDepth)
+        l.start(interval=self.buildLogReportInterval, now=False)
         service.MultiService.startService(self)
 
     def createBuildsLogFile(self):
@@ -328,11 +410,14 @@ class Bot(pb.Referenceable, service.MultiService):
 
         self.buildsLogsFile.handleFileRotation()
 
-    def saveOutputToBuildLog(self, messages):
+    def getBuildLogFile(self):
+        # called by the build log writer, from its thread once started
         if not self.buildsLogsFile:
             self.createBuildsLogFile()
+        return self.buildsLogsFile
 
-        self.buildsLogsFile.save(messages)
+    def saveOutputToBuildLog(self, manifest, data, time):
+        self.buildLogWriter.add(manifest, data, time)
 
 
     def closeBuildLogFile(self):
@@ -528,13 +613,16 @@ class BotFactory(ReconnectingPBClientFactory):
 class BuildSlave(service.MultiService):
     def __init__(self, buildmaster_host, port, name, passwd, basedir,
                  keepalive, usePTY, keepaliveTimeout=None, umask=None,
-                 maxdelay=300, unicode_encoding=None, allow_shutdown=None):
+                 maxdelay=300, unicode_encoding=None, allow_shutdown=None,
+                 build_log_queue_size=10*1024*1024, build_log_overflow='block'):
 
         # note: keepaliveTimeout is ignored, but preserved here for
         # backward-compatibility
 
         service.MultiService.__init__(self)
-        bot = Bot(basedir, usePTY, unicode_encoding=unicode_encoding)
+        bot = Bot(basedir, usePTY, unicode_encoding=unicode_encoding,
+                  build_log_queue_size=build_log_queue_size,
+                  build_log_overflow=build_log_overflow)
         bot.setServiceParent(self)
         self.bot = bot
         if keepalive == 0:
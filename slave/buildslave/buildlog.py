@@ -0,0 +1,225 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import json
+import os
+import threading
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.python import log, failure
+
+import klog
+
+
+class BuildLogWriter(object):
+    """
+    Writes the output of the commands to the JSON build log of the slave, one
+    message per line of output, in a thread of its own, so that the reactor
+    does not wait for the disk while it reads the output of the commands.
+
+    The output blocks are queued as they are, and the writer serializes the
+    blocks queued meanwhile in one go, the manifest of the command once for
+    all the consecutive blocks of the command.
+
+    At most C{maxQueuedBytes} bytes of output are queued.  When the writer
+    falls behind, C{overflow} says what happens to the next blocks: with
+    C{'block'}, the reactor waits for the writer to catch up, which holds up
+    the commands; with C{'drop'}, they are not written to the build log.
+    """
+
+    overflowPolicies = ('block', 'drop')
+
+    def __init__(self, getFile, maxQueuedBytes=10*1024*1024, overflow='block',
+                 _reactor=reactor):
+        """
+        @param getFile: returns the file to write to, from the writer thread
+        """
+        if overflow not in self.overflowPolicies:
+            raise ValueError("unknown build log overflow policy %r"
+                             % (overflow,))
+        self.getFile = getFile
+        self.maxQueuedBytes = maxQueuedBytes
+        self.overflow = overflow
+        self._reactor = _reactor
+
+        self.cond = threading.Condition()
+        # (manifest, data, time)
+        self.queue = deque()
+        self.queuedBytes = 0
+        self.thread = None
+        self.stopping = False
+        self.overflowing = False
+        # the most bytes queued since the last report
+        self.queuedBytesPeak = 0
+        self.stats = {
+            'blocks': 0,
+            'bytes': 0,
+            'dropped_blocks': 0,
+            'dropped_bytes': 0,
+            'queued_bytes_max': 0,
+        }
+
+    def start(self):
+        assert self.thread is None
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run,
+                                       name='BuildLogWriter')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Write the queued output, and stop the thread.
+        """
+        if self.thread is None:
+            return
+        with self.cond:
+            self.stopping = True
+            self.cond.notifyAll()
+        self.thread.join()
+        self.thread = None
+        blocks, queuedBytes = self.getQueueDepth()
+        log.msg("BuildLogWriter stopped, with %d bytes in %d blocks left "
+                "unwritten: %s" % (queuedBytes, blocks, self.stats))
+
+    def getQueueDepth(self):
+        """
+        @returns: the number of blocks and of bytes of output queued
+        """
+        with self.cond:
+            return len(self.queue), self.queuedBytes
+
+    def reportQueueDepth(self):
+        """
+        Log how much output is queued, and the most that was queued since the
+        last report, unless nothing was queued meanwhile.
+        """
+        with self.cond:
+            blocks, queuedBytes = len(self.queue), self.queuedBytes
+            peak, self.queuedBytesPeak = self.queuedBytesPeak, queuedBytes
+        if peak:
+            log.msg("BuildLogWriter queue: %d bytes in %d blocks, at most %d "
+                    "bytes since the last report, %d bytes at most overall"
+                    % (queuedBytes, blocks, peak,
+                       self.stats['queued_bytes_max']))
+
+    def add(self, manifest, data, time):
+        """
+        Queue a block of the output of the command with C{manifest}, received
+        at C{time}.
+        """
+        size = len(data)
+        with self.cond:
+            if self.thread is None:
+                # not started, or already stopped
+                batch = [(manifest, data, time)]
+            else:
+                batch = None
+                if self.queue and self.queuedBytes + size > self.maxQueuedBytes:
+                    if not self._overflowed(size):
+                        return
+                self.overflowing = False
+                self.queue.append((manifest, data, time))
+                self.queuedBytes += size
+                self.queuedBytesPeak = max(self.queuedBytesPeak,
+                                           self.queuedBytes)
+                self.stats['queued_bytes_max'] = max(
+                    self.stats['queued_bytes_max'], self.queuedBytes)
+                self.cond.notifyAll()
+        if batch:
+            self._logErrors(self._writeBatch(batch))
+
+    def _overflowed(self, size):
+        # called with the lock held; returns True once the block can be
+        # queued
+        if not self.overflowing:
+            self.overflowing = True
+            log.msg("BuildLogWriter is behind, with %d bytes in %d blocks "
+                    "queued; %s the output"
+                    % (self.queuedBytes, len(self.queue),
+                       'waiting to write' if self.overflow == 'block'
+                       else 'not writing'))
+        if self.overflow == 'drop':
+            self.stats['dropped_blocks'] += 1
+            self.stats['dropped_bytes'] += size
+            return False
+        while (self.queue and self.thread is not None and
+               self.queuedBytes + size > self.maxQueuedBytes):
+            self.cond.wait()
+        return True
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopping:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                batch = list(self.queue)
+                self.queue.clear()
+                self.queuedBytes = 0
+                self.cond.notifyAll()
+            try:
+                errors = self._writeBatch(batch)
+            except Exception:
+                errors = [failure.Failure()]
+            if errors:
+                self._reactor.callFromThread(self._logErrors, errors)
+
+    def _writeBatch(self, batch):
+        """
+        Write the messages of the lines of the blocks in C{batch}.
+
+        @returns: the failures of the lines which could not be serialized
+        """
+        lines = []
+        errors = []
+        lastManifest = prefix = None
+        for manifest, data, time in batch:
+            if prefix is None or manifest is not lastManifest:
+                prefix = self.serializeManifest(manifest)
+                lastManifest = manifest
+            suffix = '"time": %s, "message": ' % (json.dumps(time),)
+            for line in data.splitlines():
+                try:
+                    message = json.dumps(line.strip())
+                except Exception:
+                    errors.append(failure.Failure())
+                    continue
+                lines.append(prefix + suffix + message + "}" + os.linesep)
+            self.stats['blocks'] += 1
+            self.stats['bytes'] += len(data)
+
+        f = self.getFile()
+        f.write("".join(lines))
+        f.flush()
+        return errors
+
+    @staticmethod
+    def serializeManifest(manifest):
+        """
+        @returns: the beginning of the JSON object of the messages of the
+            command with C{manifest}, up to their own fields
+        """
+        fields = dict((k, v) for k, v in (manifest or {}).iteritems()
+                      if k not in ('time', 'message'))
+        if not fields:
+            return '{'
+        return json.dumps(fields)[:-1] + ', '
+
+    def _logErrors(self, errors):
+        for why in errors:
+            klog.err_json(why, "Failed to write output to the build log")
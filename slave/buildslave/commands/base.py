@@ -32,7 +32,7 @@ from buildslave import util
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "2.16"
+command_version = "2.19"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -65,6 +65,13 @@ command_version = "2.16"
 #  >= 2.14: RemoveDirectory can delete multiple directories
 #  >= 2.15: 'interruptSignal' option is added to SlaveShellCommand
 #  >= 2.16: 'user' option is added to SlaveShellCommand
+#  >= 2.17: the commands accept 'update_version'; when it is 2, their output
+#           is sent as 'logs' updates, ordered lists of [logname, data, time]
+#  >= 2.18: when 'update_version' is 3, the output is sent zlib-compressed as
+#           'zlogs' updates, followed by an 'update_stats' update; the
+#           commands accept 'update_window', the most unacknowledged updates
+#  >= 2.19: the transfer commands accept 'pipeline' and 'maxblocksize';
+#           uploadDirectory streams the archive to the master when pipelined
 
 class Command:
     implements(ISlaveCommand)
@@ -16,13 +16,87 @@
 import os, tarfile, tempfile
 
 from twisted.python import log
-from twisted.internet import defer
+from twisted.internet import defer, threads
 
 import klog
 from buildslave.commands.base import Command
+from buildslave import util
 
 class TransferCommand(Command):
 
+    # with 'pipeline', up to that many blocks are in flight, and the blocks
+    # grow up to 'maxblocksize' while the master acknowledges them within
+    # fastAck seconds
+    pipeline = 0
+    maxblocksize = 512*1024
+    fastAck = 0.5
+
+    def setupPipeline(self, args):
+        self.pipeline = args.get('pipeline', 0)
+        self.maxblocksize = args.get('maxblocksize', self.maxblocksize)
+        self.inFlight = 0
+        self.pipelineFailure = None
+        self.roomWaiter = None
+        self.drainWaiter = None
+
+    def adaptBlocksize(self, elapsed):
+        if elapsed < self.fastAck:
+            self.blocksize = min(self.blocksize * 2, self.maxblocksize)
+        else:
+            self.blocksize = max(self.blocksize / 2, self.initialBlocksize)
+
+    def sendBlock(self, data):
+        """
+        Send a block to the remote writer, without waiting for the previous
+        ones to be written.
+
+        @returns: a Deferred firing once another block can be sent
+        """
+        if self.pipelineFailure:
+            return defer.fail(self.pipelineFailure)
+        self.inFlight += 1
+        d = self.writer.callRemote('write', data)
+        d.addCallbacks(self._blockWritten, self._blockFailed,
+                       callbackArgs=(util.now(),))
+        if self.inFlight < self.pipeline:
+            return defer.succeed(None)
+        self.roomWaiter = defer.Deferred()
+        return self.roomWaiter
+
+    def drainPipeline(self):
+        """
+        @returns: a Deferred firing once the blocks sent are written
+        """
+        d = self.drainWaiter = defer.Deferred()
+        self._blocksChanged()
+        return d
+
+    def _blockWritten(self, res, sent):
+        self.inFlight -= 1
+        self.adaptBlocksize(util.now() - sent)
+        self._blocksChanged()
+
+    def _blockFailed(self, why):
+        self.inFlight -= 1
+        if self.pipelineFailure is None:
+            self.pipelineFailure = why
+        self._blocksChanged()
+
+    def _blocksChanged(self):
+        waiters = []
+        if self.roomWaiter and (self.inFlight < self.pipeline or
+                                self.pipelineFailure):
+            waiters.append(self.roomWaiter)
+            self.roomWaiter = None
+        if self.drainWaiter and not self.inFlight:
+            waiters.append(self.drainWaiter)
+            self.drainWaiter = None
+        for d in waiters:
+            if self.pipelineFailure:
+                d.errback(self.pipelineFailure)
+            else:
+                d.callback(None)
+
     def finished(self, res):
         if self.debug:
             log.msg('finished: stderr=%r, rc=%r' % (self.stderr, self.rc))
@@ -65,10 +139,11 @@ class SlaveFileUploadCommand(TransferCommand):
         self.filename = args['slavesrc']
         self.writer = args['writer']
         self.remaining = args['maxsize']
-        self.blocksize = args['blocksize']
+        self.blocksize = self.initialBlocksize = args['blocksize']
         self.keepstamp = args.get('keepstamp', False)
         self.stderr = None
         self.rc = 0
+        self.setupPipeline(args)
 
     def start(self):
         if self.debug:
@@ -97,7 +172,10 @@ class SlaveFileUploadCommand(TransferCommand):
         self.sendStatus({'header': "sending %s" % self.path})
 
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if self.pipeline:
+            self._reactor.callLater(0, self._pipelineLoop, d)
+        else:
+            self._reactor.callLater(0, self._loop, d)
         def _close_ok(res):
             self.fp = None
             d1 = self.writer.callRemote("close")
@@ -134,13 +212,39 @@ class SlaveFileUploadCommand(TransferCommand):
         d.addCallbacks(_done, _err)
         return None
 
+    def _pipelineLoop(self, fire_when_done):
+        d = self._sendBlocks()
+        d.chainDeferred(fire_when_done)
+
+    @defer.inlineCallbacks
+    def _sendBlocks(self):
+        while True:
+            data = self._readBlock()
+            if not data:
+                break
+            yield self.sendBlock(data)
+        yield self.drainPipeline()
+
     def _writeBlock(self):
         """Write a block of data to the remote writer"""
+        data = self._readBlock()
+        if not data:
+            return True
+        d = self.writer.callRemote('write', data)
+        d.addCallback(lambda res: False)
+        return d
+
+    def _readBlock(self):
+        """
+        Read the next block of data to send
+
+        @returns: the data, or an empty string once done
+        """
 
         if self.interrupted or self.fp is None:
             if self.debug:
-                log.msg('SlaveFileUploadCommand._writeBlock(): end')
-            return True
+                log.msg('SlaveFileUploadCommand._readBlock(): end')
+            return ''
 
         length = self.blocksize
         if self.remaining is not None and length > self.remaining:
@@ -156,18 +260,47 @@ class SlaveFileUploadCommand(TransferCommand):
             data = self.fp.read(length)
 
         if self.debug:
-            log.msg('SlaveFileUploadCommand._writeBlock(): '+
+            log.msg('SlaveFileUploadCommand._readBlock(): '+
                     'allowed=%d readlen=%d' % (length, len(data)))
         if len(data) == 0:
             log.msg("EOF: callRemote(close)")
-            return True
+            return ''
 
         if self.remaining is not None:
             self.remaining = self.remaining - len(data)
             assert self.remaining >= 0
-        d = self.writer.callRemote('write', data)
-        d.addCallback(lambda res: False)
-        return d
+        return data
+
+
+class _ArchiveStream(object):
+    """
+    The file object the archive of a directory upload is written to, in a
+    thread, when the blocks are pipelined: it sends them as they are filled,
+    and holds up the thread while the pipeline is full.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.pieces = []
+        self.size = 0
+
+    def write(self, data):
+        self.pieces.append(data)
+        self.size += len(data)
+        if self.size >= self.command.blocksize:
+            self.flush()
+
+    def flush(self):
+        if not self.size:
+            return
+        data = ''.join(self.pieces)
+        self.pieces = []
+        self.size = 0
+        threads.blockingCallFromThread(self.command._reactor,
+                                       self.command.sendArchiveBlock, data)
+
+    def close(self):
+        self.flush()
 
 
 class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
@@ -178,10 +311,13 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         self.dirname = args['slavesrc']
         self.writer = args['writer']
         self.remaining = args['maxsize']
-        self.blocksize = args['blocksize']
+        self.blocksize = self.initialBlocksize = args['blocksize']
         self.compress = args['compress']
         self.stderr = None
         self.rc = 0
+        self.setupPipeline(args)
+        self.fp = None
+        self.tarname = None
 
     def start(self):
         if self.debug:
@@ -193,6 +329,9 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         if self.debug:
             log.msg("path: %r" % self.path)
 
+        if self.pipeline:
+            return self._startStreaming()
+
         # Create temporary archive
         fd, self.tarname = tempfile.mkstemp()
         fileobj = os.fdopen(fd, 'w')
@@ -226,9 +365,76 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         d.addBoth(self.finished)
         return d
 
+    def _startStreaming(self):
+        """
+        Archive the directory in a thread, sending the blocks of the archive
+        while it is written, and unpack it once it is all written.
+        """
+        self.sendStatus({'header': "sending %s" % self.path})
+
+        d = threads.deferToThread(self._writeArchive)
+        def drain(res):
+            d1 = self.drainPipeline()
+            # keep the failure of the archive, if any
+            d1.addCallback(lambda _: res)
+            return d1
+        d.addBoth(drain)
+        def unpack(res):
+            if self.interrupted or self.rc:
+                # the archive is incomplete
+                return res
+            d1 = self.writer.callRemote("unpack")
+            def unpack_err(f):
+                self.rc = 1
+                return f
+            d1.addErrback(unpack_err)
+            d1.addCallback(lambda ignored: res)
+            return d1
+        d.addCallback(unpack)
+        def failed(f):
+            self.rc = 1
+            if self.interrupted or self.stderr:
+                # reported with rc and stderr
+                return None
+            return f
+        d.addErrback(failed)
+        d.addBoth(self.finished)
+        return d
+
+    def _writeArchive(self):
+        # in the thread
+        if self.compress in ('bz2', 'gz'):
+            mode = 'w|' + self.compress
+        else:
+            mode = 'w|'
+        stream = _ArchiveStream(self)
+        archive = tarfile.open(mode=mode, fileobj=stream)
+        archive.add(self.path, '')
+        archive.close()
+        stream.close()
+
+    def sendArchiveBlock(self, data):
+        """
+        Send a block of the archive, from the thread writing it
+
+        @returns: a Deferred firing once another block can be sent
+        """
+        if self.interrupted:
+            raise RuntimeError("directory upload interrupted")
+        if self.remaining is not None:
+            if len(data) > self.remaining:
+                self.stderr = ("Maximum filesize reached, truncating file '%s'"
+                               % self.path)
+                self.rc = 1
+                raise RuntimeError(self.stderr)
+            self.remaining -= len(data)
+        return self.sendBlock(data)
+
     def finished(self, res):
-        self.fp.close()
-        os.remove(self.tarname)
+        if self.fp is not None:
+            self.fp.close()
+        if self.tarname is not None:
+            os.remove(self.tarname)
         return TransferCommand.finished(self, res)
 
 
@@ -251,10 +457,11 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.filename = args['slavedest']
         self.reader = args['reader']
         self.bytes_remaining = args['maxsize']
-        self.blocksize = args['blocksize']
+        self.blocksize = self.initialBlocksize = args['blocksize']
         self.mode = args['mode']
         self.stderr = None
         self.rc = 0
+        self.setupPipeline(args)
 
     def start(self):
         if self.debug:
@@ -291,7 +498,10 @@ class SlaveFileDownloadCommand(TransferCommand):
                 log.msg("Cannot open file '%s' for download" % self.path)
 
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if self.pipeline:
+            self._reactor.callLater(0, self._pipelineLoop, d)
+        else:
+            self._reactor.callLater(0, self._loop, d)
         def _close(res):
             # close the file, but pass through any errors from _loop
             d1 = self.reader.callRemote('close')
@@ -314,6 +524,56 @@ class SlaveFileDownloadCommand(TransferCommand):
         d.addCallbacks(_done, _err)
         return None
 
+    def _pipelineLoop(self, fire_when_done):
+        d = self._readBlocks()
+        d.chainDeferred(fire_when_done)
+
+    @defer.inlineCallbacks
+    def _readBlocks(self):
+        """
+        Read the blocks of data from the remote reader with up to
+        self.pipeline reads in flight, and write them in order.
+        """
+        reads = []
+        # the bytes not asked for yet, within maxsize
+        unrequested = self.bytes_remaining
+        done = False
+        try:
+            while True:
+                while not done and len(reads) < self.pipeline:
+                    if self.interrupted or self.fp is None:
+                        done = True
+                        break
+                    length = self.blocksize
+                    if unrequested is not None:
+                        length = min(length, unrequested)
+                        if length <= 0:
+                            done = True
+                            break
+                        unrequested -= length
+                    reads.append((self.reader.callRemote('read', length),
+                                  util.now()))
+                if not reads:
+                    break
+                d, sent = reads.pop(0)
+                data = yield d
+                self.adaptBlocksize(util.now() - sent)
+                if self.interrupted or self.fp is None:
+                    done = True
+                elif self._writeData(data):
+                    # end of file
+                    done = True
+        except Exception:
+            for d, sent in reads:
+                d.addErrback(lambda _: None)
+            raise
+        # the loop stops at maxsize before it sees the end of the file
+        if (self.bytes_remaining is not None and self.bytes_remaining <= 0
+                and self.stderr is None and not self.interrupted):
+            self.stderr = "Maximum filesize reached, truncating file '%s'" \
+                            % self.path
+            self.rc = 1
+
     def _readBlock(self):
         """Read a block of data from the remote reader."""
 
@@ -25,6 +25,7 @@ import re
 import subprocess
 import traceback
 import stat
+import zlib
 from collections import deque
 from tempfile import NamedTemporaryFile
 
@@ -246,6 +247,9 @@ class RunProcess:
     BUFFER_SIZE = 64*1024
     BUFFER_TIMEOUT = 5
 
+    # zlib level of the output in the 'zlogs' updates (see _sendEntries)
+    COMPRESSION_LEVEL = 6
+
     # For sending elapsed time:
     startTime = None
     elapsedTime = None
@@ -647,6 +651,79 @@ class RunProcess:
         """
         Send all the content in our buffers.
         """
+        if self.builder.updateVersion >= 2:
+            self._sendBufferedEntries()
+        else:
+            self._sendBufferedMessages()
+        self.buflen = 0
+        if self.buftimer:
+            if self.buftimer.active():
+                self.buftimer.cancel()
+            self.buftimer = None
+
+    def _saveBufferedOutput(self, logname, data, time):
+        # exclude saving the output from custom logfiles/artifacts
+        is_custom_log = isinstance(logname, tuple) and 'log' in logname  # exclude custom configured files
+        if not self.logfiles or not is_custom_log:
+            self.builder.saveCommandOutputToLog(data, time)
+
+    def _sendEntries(self, entries):
+        """
+        Send entries, a list of [logname, list of chunks, time], to the
+        master as a 'logs' update, or as a 'zlogs' update when it asked for
+        compressed updates.  A 'zlogs' update is [compressed data, entries],
+        where the entries are [logname, length, time] of the successive
+        pieces of the decompressed data.
+        """
+        if not entries:
+            return
+        if self.builder.updateVersion < 3:
+            self.sendStatus({'logs': [[logname, "".join(chunks), time]
+                                      for logname, chunks, time in entries]})
+            return
+        datas = []
+        lengths = []
+        for logname, chunks, time in entries:
+            data = "".join(chunks)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            datas.append(data)
+            lengths.append([logname, len(data), time])
+        self.sendStatus({'zlogs': [zlib.compress("".join(datas),
+                                                 self.COMPRESSION_LEVEL),
+                                   lengths]})
+
+    def _sendBufferedEntries(self):
+        """
+        Send the buffers as 'logs' updates, which keep the order of the
+        output of all the logs, so that interleaved stdout and stderr do
+        not need one message each.
+        """
+        entries = []
+        msg_size = 0
+        while self.buffered:
+            logname, data, time = self.buffered.popleft()
+            self._saveBufferedOutput(logname, data, time)
+
+            for chunk in self._chunkForSend(data):
+                if len(chunk) == 0: continue
+                if entries and entries[-1][0] == logname and entries[-1][2] == time:
+                    entries[-1][1].append(chunk)
+                else:
+                    entries.append([logname, [chunk], time])
+                msg_size += len(chunk)
+                if msg_size >= self.CHUNK_LIMIT:
+                    # see _sendBufferedMessages
+                    self._sendEntries(entries)
+                    entries = []
+                    msg_size = 0
+        self._sendEntries(entries)
+
+    def _sendBufferedMessages(self):
+        """
+        Send the buffers as one update per log, for the masters which do not
+        ask for 'logs' updates.
+        """
         msg = {}
         msg_size = 0
         lastlog = None
@@ -654,19 +731,14 @@ class RunProcess:
         while self.buffered:
             # Grab the next bits from the buffer
             logname, data, time = self.buffered.popleft()
-
-            # exclude saving the output from custom logfiles/artifacts
-            is_custom_log = isinstance(logname, tuple) and 'log' in logname  # exclude custom configured files
-            if not self.logfiles or not is_custom_log:
-                self.builder.saveCommandOutputToLog(data, time)
+            self._saveBufferedOutput(logname, data, time)
 
             # If this log is different than the last one, then we have to send
             # out the message so far.  This is because the message is
             # transferred as a dictionary, which makes the ordering of keys
             # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
+            # different logs.  The 'logs' updates of _sendBufferedEntries do
+            # not have this problem.
             # On our first pass through this loop lastlog is None
             if lastlog is None:
                 lastlog = logname
@@ -692,13 +764,8 @@ class RunProcess:
                     msg = {}
                     logdata = msg.setdefault(logname, [])
                     msg_size = 0
-        self.buflen = 0
         if logdata:
             self._sendMessage(msg)
-        if self.buftimer:
-            if self.buftimer.active():
-                self.buftimer.cancel()
-            self.buftimer = None
 
     def _addToBuffers(self, logname, data):
         """
@@ -22,6 +22,7 @@ class FakeSlaveBuilder:
     showing the updates.  Set debug to True to show updates as they happen.
     """
     debug = False
+    updateVersion = 1
     def __init__(self, usePTY=False, basedir="/slavebuilder/basedir"):
         self.updates = []
         self.basedir = basedir
@@ -266,6 +266,31 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_startCommand_update_version(self):
+        st = FakeStep()
+
+        self.patch_runprocess(
+            Expect([ 'echo', 'hello' ], os.path.join(self.basedir, 'sb', 'workdir'))
+            + { 'rc' : 0 }
+            + 0,
+        )
+
+        d = defer.succeed(None)
+        def do_start(_):
+            return self.sb.callRemote("startCommand", FakeRemote(st),
+                                      "13", "shell", dict(
+                                                command=[ 'echo', 'hello' ],
+                                                workdir='workdir',
+                                                update_version=2,
+                                            ))
+        d.addCallback(do_start)
+        d.addCallback(lambda _ : st.wait_for_finish())
+        def check(_):
+            self.assertEqual(self.bot.builders['sb'].updateVersion, 2)
+            self.assertEqual(st.actions[-1], ['complete', None])
+        d.addCallback(check)
+        return d
+
     def test_startCommand_interruptCommand(self):
         # set up a fake step to receive updates
         st = FakeStep()
@@ -334,6 +359,81 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+class TestSlaveBuilderUpdateWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.sb = bot.SlaveBuilder('sb')
+        self.sb.running = True
+        self.sb.updateWindow = 2
+        self.calls = []
+        def callRemote(meth, *args):
+            d = defer.Deferred()
+            self.calls.append((meth, args, d))
+            return d
+        self.sb.remoteStep = mock.Mock()
+        self.sb.remoteStep.callRemote.side_effect = callRemote
+
+    def sentUpdates(self):
+        return [args[0][0][0] for meth, args, d in self.calls
+                if meth == 'update']
+
+    def ack(self, index):
+        self.calls[index][2].callback(None)
+
+    def test_sendUpdate_window(self):
+        for i in range(4):
+            self.sb.sendUpdate({'stdout': str(i)})
+        self.assertEqual(self.sentUpdates(), [{'stdout': '0'}, {'stdout': '1'}])
+
+        self.ack(0)
+        self.assertEqual(len(self.sentUpdates()), 3)
+        self.ack(1)
+        self.ack(2)
+        self.assertEqual(self.sentUpdates()[-1], {'stdout': '3'})
+        self.assertEqual(self.sb.unackedUpdates, 1)
+        self.assertEqual(self.sb.updateStats['queued_max'], 2)
+        self.assertEqual(self.sb.updateStats['acks'], 3)
+
+    def test_sendUpdate_no_window(self):
+        self.sb.updateWindow = 0
+        for i in range(4):
+            self.sb.sendUpdate({'stdout': str(i)})
+        self.assertEqual(len(self.sentUpdates()), 4)
+
+    def test_sendUpdate_ack_failed(self):
+        self.sb.updateWindow = 1
+        self.sb.sendUpdate({'stdout': '0'})
+        self.sb.sendUpdate({'stdout': '1'})
+        self.calls[0][2].errback(failure.Failure(RuntimeError('lost')))
+        self.assertEqual(len(self.sentUpdates()), 2)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+    def test_commandComplete_after_pending_updates(self):
+        self.sb.updateVersion = 3
+        self.sb.sendUpdate({'zlogs': ['xx', [['stdout', 10, 't']]]})
+        self.sb.sendUpdate({'zlogs': ['yyy', [['stdout', 20, 't']]]})
+        self.sb.sendUpdate({'rc': 0})
+        self.sb.commandComplete(None)
+        self.assertEqual([meth for meth, _, _ in self.calls],
+                         ['update', 'update'])
+
+        self.ack(0)
+        self.assertEqual([meth for meth, _, _ in self.calls],
+                         ['update', 'update', 'update', 'update', 'complete'])
+        stats = self.sentUpdates()[-1]['update_stats']
+        self.assertEqual((stats['updates'], stats['bytes'], stats['wire_bytes'],
+                          stats['acks']), (3, 30, 5, 1))
+        self.assertEqual(self.sb.remoteStep, None)
+
+    def test_lostRemoteStep_drops_pending_updates(self):
+        for i in range(3):
+            self.sb.sendUpdate({'stdout': str(i)})
+        self.sb.lostRemoteStep(self.sb.remoteStep)
+        self.ack(0)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(len(self.sb.pendingUpdates), 0)
+
+
 class TestBotFactory(unittest.TestCase):
 
     def setUp(self):
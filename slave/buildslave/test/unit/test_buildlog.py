@@ -0,0 +1,157 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import json
+import threading
+from StringIO import StringIO
+
+from twisted.python import log
+from twisted.trial import unittest
+
+from buildslave.buildlog import BuildLogWriter
+
+
+class TestBuildLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.output = self.file = StringIO()
+
+    def makeWriter(self, **kwargs):
+        writer = BuildLogWriter(lambda: self.file, **kwargs)
+        self.addCleanup(writer.stop)
+        return writer
+
+    def messages(self):
+        return [json.loads(line) for line in self.output.getvalue().splitlines()]
+
+    def test_add_not_started(self):
+        writer = self.makeWriter()
+        writer.add({'builder': 'b1', 'buildNumber': 3}, ' line 1\nline 2 \n',
+                   '2013-01-01T00:00:00')
+        self.assertEqual(self.messages(), [
+            {'builder': 'b1', 'buildNumber': 3,
+             'time': '2013-01-01T00:00:00', 'message': 'line 1'},
+            {'builder': 'b1', 'buildNumber': 3,
+             'time': '2013-01-01T00:00:00', 'message': 'line 2'},
+        ])
+
+    def test_add_started(self):
+        writer = self.makeWriter()
+        writer.start()
+        manifest = {'builder': 'b1'}
+        for i in range(100):
+            writer.add(manifest, 'line %d\n' % i, i)
+        writer.add({}, 'other\n', 100)
+        writer.stop()
+
+        messages = self.messages()
+        self.assertEqual(len(messages), 101)
+        self.assertEqual(messages[42], {'builder': 'b1', 'time': 42,
+                                        'message': 'line 42'})
+        self.assertEqual(messages[-1], {'time': 100, 'message': 'other'})
+        self.assertEqual(writer.stats['blocks'], 101)
+        self.assertEqual(writer.getQueueDepth(), (0, 0))
+
+    def test_manifest_fields_overridden(self):
+        self.assertEqual(BuildLogWriter.serializeManifest(
+            {'time': 1, 'message': 'x'}), '{')
+        self.assertEqual(BuildLogWriter.serializeManifest(None), '{')
+
+    def test_bad_line(self):
+        writer = self.makeWriter()
+        writer.add({}, 'good\n\xff\xfe\n', 0)
+        self.assertEqual(self.messages(), [{'time': 0, 'message': 'good'}])
+        self.assertEqual(len(self.flushLoggedErrors(UnicodeDecodeError)), 1)
+
+    def test_unknown_overflow(self):
+        self.assertRaises(ValueError, BuildLogWriter, lambda: self.file,
+                          overflow='explode')
+
+    def blockFile(self):
+        # a file which holds up the writer thread until released
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        class BlockingFile(object):
+            def write(subself, data):
+                self.writing.set()
+                self.release.wait()
+                self.output.write(data)
+            def flush(subself):
+                pass
+        self.file = BlockingFile()
+
+    def test_overflow_drop(self):
+        self.blockFile()
+        writer = self.makeWriter(maxQueuedBytes=10, overflow='drop')
+        writer.start()
+        writer.add({}, 'first\n', 0)
+        self.writing.wait()
+        writer.add({}, 'second\n', 1)
+        writer.add({}, 'third\n', 2)
+        self.assertEqual(writer.getQueueDepth(), (1, 7))
+        self.release.set()
+        writer.stop()
+
+        self.assertEqual([m['message'] for m in self.messages()],
+                         ['first', 'second'])
+        self.assertEqual(writer.stats['dropped_blocks'], 1)
+        self.assertEqual(writer.stats['dropped_bytes'], 6)
+
+    def test_overflow_block(self):
+        self.blockFile()
+        writer = self.makeWriter(maxQueuedBytes=10, overflow='block')
+        writer.start()
+        writer.add({}, 'first\n', 0)
+        self.writing.wait()
+        writer.add({}, 'second\n', 1)
+        # releases the writer once the next add waits for it
+        timer = threading.Timer(0.1, self.release.set)
+        timer.start()
+        writer.add({}, 'third\n', 2)
+        writer.stop()
+        timer.join()
+
+        self.assertEqual([m['message'] for m in self.messages()],
+                         ['first', 'second', 'third'])
+        self.assertEqual(writer.stats['dropped_blocks'], 0)
+
+    def test_reportQueueDepth(self):
+        reports = []
+        def observer(event):
+            message = ''.join(event['message'])
+            if message.startswith('BuildLogWriter queue:'):
+                reports.append(message)
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        self.blockFile()
+        writer = self.makeWriter()
+        writer.start()
+        writer.reportQueueDepth()
+        writer.add({}, 'first\n', 0)
+        self.writing.wait()
+        writer.add({}, 'second\n', 1)
+        writer.reportQueueDepth()
+        self.release.set()
+        writer.stop()
+        writer.reportQueueDepth()
+        writer.reportQueueDepth()
+
+        self.assertEqual(reports, [
+            'BuildLogWriter queue: 7 bytes in 1 blocks, at most 7 bytes '
+            'since the last report, 7 bytes at most overall',
+            'BuildLogWriter queue: 0 bytes in 0 blocks, at most 7 bytes '
+            'since the last report, 7 bytes at most overall',
+        ])
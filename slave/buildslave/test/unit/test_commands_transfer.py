@@ -273,6 +273,63 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_pipeline(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.delay_write = True
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=16,
+            keepstamp=False,
+            pipeline=4,
+            maxblocksize=64,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            updates = [u for u in self.get_updates()
+                       if not (isinstance(u, dict) and 'elapsed' in u)]
+            self.assertEqual(updates[0], {'header': 'sending %s' % self.datafile})
+            self.assertEqual(updates[-2:], ['close', {'rc': 0}])
+            # the blocks grow while the writes are acknowledged quickly
+            sizes = [int(u.split()[1]) for u in updates[1:-2]]
+            self.assertEqual(sum(sizes), 180)
+            self.assertEqual(sizes[:4], [16, 16, 16, 16])
+            self.assertEqual(max(sizes), 64)
+            self.assertEqual(self.fakemaster.data, "this is some data\n" * 10)
+        d.addCallback(check)
+        return d
+
+    def test_pipeline_out_of_space(self):
+        self.fakemaster.write_out_of_space_at = 70
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            pipeline=2,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, RuntimeError)
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write(s)', 'close',
+                    {'rc': 1}
+                ])
+        d.addCallback(check)
+        return d
+
 class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
     def setUp(self):
@@ -365,6 +422,66 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
         return d
 
+    def test_pipeline(self, compress=None):
+        self.fakemaster.keep_data = True
+        self.fakemaster.delay_write = True
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=compress,
+            pipeline=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datadir},
+                    'write(s)', 'unpack',
+                    {'rc': 0}
+                ])
+            # the archive is streamed, without a temporary file
+            self.assertEqual(self.cmd.tarname, None)
+            f = StringIO.StringIO(self.fakemaster.data)
+            a = tarfile.open(fileobj=f, mode='r|*')
+            contents = dict((m.name.lstrip('./'), a.extractfile(m).read())
+                            for m in a if m.isfile())
+            self.assertEqual(contents, {'aa': "lots of a" * 100,
+                                        'bb': "and a little b" * 17})
+        d.addCallback(check)
+        return d
+
+    def test_pipeline_gz(self):
+        return self.test_pipeline('gz')
+
+    def test_pipeline_too_big(self):
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=100,
+            blocksize=512,
+            compress=None,
+            pipeline=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # not unpacked
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datadir},
+                    {'rc': 1,
+                     'stderr': "Maximum filesize reached, truncating file '%s'"
+                                % self.datadir}
+                ])
+        d.addCallback(check)
+        return d
+
     # this is just a subclass of SlaveUpload, so the remaining permutations
     # are already tested
 
@@ -525,3 +642,59 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         dl.addCallback(check)
         return dl
 
+    def test_pipeline(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.delay_read = True
+        self.fakemaster.data = test_data = '1234' * 13
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=8,
+            mode=0777,
+            pipeline=2,
+            maxblocksize=16,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # two reads in flight, growing once the first is acknowledged;
+            # the last ones find the end of the file
+            self.assertUpdates([
+                    'read 8', 'read 8', 'read 16', 'read 16', 'read 16',
+                    'read 16', 'read 16', 'close', {'rc': 0}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_pipeline_truncated(self):
+        self.fakemaster.data = test_data = 'tenchars--' * 10
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=50,
+            blocksize=32,
+            mode=0777,
+            pipeline=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 1,
+                     'stderr': "Maximum filesize reached, truncating file '%s'"
+                                % os.path.join(self.basedir, '.', 'data')}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data[:50])
+        d.addCallback(check)
+        return d
@@ -18,6 +18,7 @@ import re
 import os
 import time
 import signal
+import zlib
 
 from twisted.trial import unittest
 from twisted.internet import task, defer, reactor
@@ -688,6 +689,58 @@ class TestLogging(BasedirMixin, unittest.TestCase):
         s._sendBuffers()
         self.failUnlessEqual(len(b.updates), 2)
 
+    def testSendBufferedEntries(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.updateVersion = 2
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._addToBuffers('stdout', 'hello ')
+        s._addToBuffers('stdout', 'big ')
+        s._addToBuffers('stderr', 'DIEEEEEEE')
+        s._addToBuffers(('log', 'test.log'), 'line')
+        s._addToBuffers('stdout', 'world')
+        s._sendBuffers()
+        self.assertEqual(len(b.updates), 1, b.show())
+        self.assertEqual([entry[:2] for entry in b.updates[0]['logs']], [
+            ['stdout', 'hello big '],
+            ['stderr', 'DIEEEEEEE'],
+            [('log', 'test.log'), 'line'],
+            ['stdout', 'world'],
+            ])
+
+    def testSendEntriesChunked(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.updateVersion = 2
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s.BUFFER_SIZE = runprocess.RunProcess.CHUNK_LIMIT * 2
+        data = "x" * (runprocess.RunProcess.CHUNK_LIMIT * 3 / 2)
+        s._addToBuffers('stdout', data)
+        s._addToBuffers('stderr', 'y')
+        s._sendBuffers()
+        self.assertEqual([[(logname, len(chunk)) for logname, chunk, _ in u['logs']]
+                          for u in b.updates], [
+            [('stdout', runprocess.RunProcess.CHUNK_LIMIT)],
+            [('stdout', runprocess.RunProcess.CHUNK_LIMIT / 2), ('stderr', 1)],
+            ])
+
+    def testSendCompressedEntries(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.updateVersion = 3
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._addToBuffers('stdout', 'hello ' * 100)
+        s._addToBuffers('stderr', u'\N{SNOWMAN}')
+        s._addToBuffers(('log', 'test.log'), 'line')
+        s._sendBuffers()
+        self.assertEqual(len(b.updates), 1, b.show())
+        compressed, entries = b.updates[0]['zlogs']
+        self.assertTrue(len(compressed) < 600)
+        self.assertEqual([entry[:2] for entry in entries], [
+            ['stdout', 600],
+            ['stderr', 3],
+            [('log', 'test.log'), 4],
+            ])
+        self.assertEqual(zlib.decompress(compressed),
+                         'hello ' * 100 + '\xe2\x98\x83line')
+
     def testSendNotimeout(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
@@ -7,7 +7,9 @@ define(function (require) {
         sock = null,
         realTimeFunctions = {},
         realtimeURLs = {},
-        realTimeLastUpdated = {};
+        realTimeLastUpdated = {},
+        // url -> {seq: data} of the versions received with a seq number
+        realtimeVersions = {};
 
     require('helpers');
     require('timeElements');
@@ -18,6 +20,9 @@ define(function (require) {
     var KRT_JSON_DATA = "krtJSONData";
     var KRT_URL_DROPPED = "krtURLDropped";
     var KRT_REGISTER_URL = "krtRegisterURL";
+    var KRT_JSON_PATCH = "krtJSONPatch";
+    var KRT_JSON_ACK = "krtJSONAck";
+    var KRT_JSON_RESYNC = "krtJSONResync";
 
     //Timeouts
     var iURLDroppedTimeout = 30000,
@@ -48,7 +53,8 @@ define(function (require) {
                         $.each(realtimeURLs, function (name, url) {
                             if (url !== undefined) {
                                 var data = {
-                                    url: url
+                                    url: url,
+                                    deltas: true
                                 };
 
                                 if (json !== undefined) {
@@ -128,8 +134,14 @@ define(function (require) {
         },
         parseRealtimeCommand: function (data) {
             if (data.cmd === KRT_JSON_DATA) {
+                if (data.data.seq !== undefined) {
+                    realtimePages.receiveVersion(data.data.url, data.data.seq, data.data.data);
+                }
                 realtimePages.updateRealTimeData(data.data, false);
             }
+            if (data.cmd === KRT_JSON_PATCH) {
+                realtimePages.receivePatch(data.data);
+            }
             if (data.cmd === KRT_URL_DROPPED) {
                 console.log("URL Dropped by server will retry in {0} seconds... ({1})".format((iURLDroppedTimeout / 1000), data.data));
                 setTimeout(function () {
@@ -163,6 +175,88 @@ define(function (require) {
                 realtimePages.updateSingleRealTimeData(name, json.data);
             }
         },
+        receiveVersion: function (url, seq, json) {
+            var versions = realtimeVersions[url] || {};
+            versions[seq] = json;
+            realtimeVersions[url] = versions;
+            realtimePages.sendCommand(KRT_JSON_ACK, {url: url, seq: seq});
+        },
+        receivePatch: function (data) {
+            var versions = realtimeVersions[data.url] || {},
+                base = versions[data.base],
+                json;
+
+            if (base === undefined) {
+                realtimePages.sendCommand(KRT_JSON_RESYNC, {url: data.url});
+                return;
+            }
+
+            try {
+                json = realtimePages.applyJSONPatch(base, data.patch);
+            } catch (e) {
+                console.log("Unable to patch {0}, resyncing: {1}".format(data.url, e));
+                realtimePages.sendCommand(KRT_JSON_RESYNC, {url: data.url});
+                return;
+            }
+
+            // the server patches from the versions we acknowledged, so the
+            // ones older than the base are not needed anymore
+            $.each(Object.keys(versions), function (i, seq) {
+                if (Number(seq) < data.base) {
+                    delete versions[seq];
+                }
+            });
+            realtimePages.receiveVersion(data.url, data.seq, json);
+            realtimePages.updateRealTimeData({url: data.url, data: json}, false);
+        },
+        applyJSONPatch: function (json, patch) {
+            // Applies the add, remove and replace operations of a JSON patch
+            // (RFC 6902), copying the objects and arrays along the paths so
+            // that json itself is left unchanged
+            $.each(patch, function (i, op) {
+                var keys = op.path.split("/").slice(1).map(function (key) {
+                        return key.replace(/~1/g, "/").replace(/~0/g, "~");
+                    }),
+                    copy = function (value) {
+                        return $.isArray(value) ? value.slice() : $.extend({}, value);
+                    },
+                    parent,
+                    key;
+
+                if (keys.length === 0) {
+                    json = op.value;
+                    return true;
+                }
+
+                json = copy(json);
+                parent = json;
+                $.each(keys.slice(0, -1), function (j, k) {
+                    if (parent[k] === undefined) {
+                        throw new Error("no such path " + op.path);
+                    }
+                    parent[k] = copy(parent[k]);
+                    parent = parent[k];
+                });
+
+                key = keys[keys.length - 1];
+                if ($.isArray(parent)) {
+                    key = Number(key);
+                    if (op.op === "add") {
+                        parent.splice(key, 0, op.value);
+                    } else if (op.op === "remove") {
+                        parent.splice(key, 1);
+                    } else {
+                        parent[key] = op.value;
+                    }
+                } else if (op.op === "remove") {
+                    delete parent[key];
+                } else {
+                    parent[key] = op.value;
+                }
+                return true;
+            });
+            return json;
+        },
         getRealtimeNameFromURL: function (url) {
             var name = "";
             $.each(realtimeURLs, function (n, u) {
@@ -187,6 +187,40 @@ define(["jquery", "realtimePages", "rtGlobal"], function ($, rt, rtGlobal) {
             expect(realtimeFunctions.test.calls.count()).toEqual(1);
         });
 
+        it("applies patches to the versions it acknowledged", function () {
+            spyOn(realtimeFunctions, 'test');
+
+            sock = rt.initRealtime(realtimeFunctions);
+            spyOn(sock, 'send');
+            rt.parseRealtimeCommand({"cmd": "krtJSONData", "data": {"url": "http://test.com", "seq": 1,
+                "data": {"builds": [{"number": 1}], "state": "idle"}}});
+            expect(sock.send).toHaveBeenCalledWith(JSON.stringify({cmd: "krtJSONAck", data: {url: "http://test.com", seq: 1}}));
+
+            rt.parseRealtimeCommand({"cmd": "krtJSONPatch", "data": {"url": "http://test.com", "seq": 2, "base": 1,
+                "patch": [{"op": "add", "path": "/builds/0", "value": {"number": 2}},
+                          {"op": "replace", "path": "/state", "value": "building"}]}});
+            expect(sock.send).toHaveBeenCalledWith(JSON.stringify({cmd: "krtJSONAck", data: {url: "http://test.com", seq: 2}}));
+            expect(realtimeFunctions.test).toHaveBeenCalledWith({"builds": [{"number": 2}, {"number": 1}], "state": "building"});
+        });
+
+        it("asks for the whole JSON when it cannot patch", function () {
+            sock = rt.initRealtime(realtimeFunctions);
+            spyOn(sock, 'send');
+            rt.parseRealtimeCommand({"cmd": "krtJSONPatch", "data": {"url": "http://test.com/other", "seq": 5, "base": 4,
+                "patch": []}});
+
+            expect(sock.send).toHaveBeenCalledWith(JSON.stringify({cmd: "krtJSONResync", data: {url: "http://test.com/other"}}));
+        });
+
+        it("leaves the patched JSON unchanged", function () {
+            var json = {"a": {"b": [1, 2]}, "c": 3},
+                patched = rt.applyJSONPatch(json, [{"op": "remove", "path": "/a/b/0"},
+                                                   {"op": "add", "path": "/d~1e", "value": true}]);
+
+            expect(patched).toEqual({"a": {"b": [2]}, "c": 3, "d/e": true});
+            expect(json).toEqual({"a": {"b": [1, 2]}, "c": 3});
+        });
+
         it("sends data to the realtime server", function () {
             sock = rt.initRealtime(realtimeFunctions);
             spyOn(sock, 'send');